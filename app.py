@@ -89,6 +89,30 @@ def add_security_headers(response):
 with app.app_context():
     import models
     db.create_all()
+
+    from services.log_partitions import ensure_log_partitions
+    ensure_log_partitions()
+
+    from services.playlist_snapshot import register_snapshot_listeners
+    register_snapshot_listeners()
+
+    from services.ad_targeting_index import register_ad_index_listeners
+    register_ad_index_listeners()
+
+    from services.broadcast_targets import register_broadcast_target_listeners
+    register_broadcast_target_listeners()
+
+    from services.dashboard_aggregates import register_dashboard_listeners
+    register_dashboard_listeners()
+
+    from services.availability_cache import register_availability_listeners
+    register_availability_listeners()
+
+    from services.play_counters import register_play_counter_listeners
+    register_play_counter_listeners()
+
+    from services.screen_events import init_screen_events
+    init_screen_events(app)
     
     if not INIT_DB_MODE:
         superadmin_email = os.environ.get("SUPERADMIN_EMAIL")
@@ -136,6 +160,9 @@ with app.app_context():
         from services.rate_limiter import init_limiter
         init_limiter(app)
         
+        from services.scheduler import init_scheduler
+        init_scheduler(app)
+        
         from services.translation_service import init_translations, set_locale, SUPPORTED_LANGUAGES
         init_translations(app)
         
@@ -175,6 +202,7 @@ def inject_csrf_token():
 CSRF_EXEMPT_ENDPOINTS = [
     'player.heartbeat',
     'player.log_play',
+    'player.log_plays',
     'player.stream_proxy',
     'player.stop_tv_stream',
     'player.change_channel',
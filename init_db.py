@@ -158,6 +158,14 @@ def init_database(drop_existing=False):
         else:
             logger.info("Toutes les colonnes sont à jour.")
         
+        logger.info("Partitionnement des journaux (stat_logs, heartbeat_logs)...")
+        from services.log_partitions import ensure_log_partitions
+        ensure_log_partitions(migrate=True)
+        
+        logger.info("Recalcul des cibles des diffusions...")
+        from services.broadcast_targets import rebuild_broadcast_targets
+        rebuild_broadcast_targets()
+        
         logger.info("Base de données initialisée avec succès!")
         
         # Récapitulatif dynamique
@@ -9,14 +9,15 @@ from models.content import Content
 from models.booking import Booking
 from models.filler import Filler
 from models.internal_content import InternalContent
-from models.stat_log import StatLog
-from models.heartbeat_log import HeartbeatLog
+from models.stat_log import StatLog, StatLogDaily
+from models.heartbeat_log import HeartbeatLog, ScreenStatusInterval
 from models.site_setting import SiteSetting
 from models.registration_request import RegistrationRequest
 from models.screen_overlay import ScreenOverlay
 from models.invoice import Invoice, PaymentProof
 from models.broadcast import Broadcast
 from models.ad_content import AdContent, AdContentInvoice, AdContentStat
+from models.aggregation_watermark import AggregationWatermark
 
 __all__ = [
     'db',
@@ -30,7 +31,9 @@ __all__ = [
     'Filler',
     'InternalContent',
     'StatLog',
+    'StatLogDaily',
     'HeartbeatLog',
+    'ScreenStatusInterval',
     'SiteSetting',
     'RegistrationRequest',
     'ScreenOverlay',
@@ -40,4 +43,5 @@ __all__ = [
     'AdContent',
     'AdContentInvoice',
     'AdContentStat',
+    'AggregationWatermark',
 ]
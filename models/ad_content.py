@@ -433,3 +433,72 @@ class AdContentStat(db.Model):
             ad_content.total_duration_played += duration
         
         return stat
+
+    @classmethod
+    def upsert_impressions(cls, rows):
+        """
+        Ajoute des impressions agrégées, avec leurs totaux sur AdContent.
+
+        Args:
+            rows: {(ad_content_id, screen_id, date): (organization_id, count, total_duration)}
+
+        Returns:
+            int: nombre de lignes écrites (annonces ou écrans supprimés ignorés)
+        """
+        from sqlalchemy import case, update
+        from models import Screen
+
+        ad_ids = {row[0] for row in db.session.query(AdContent.id).filter(
+            AdContent.id.in_({ad_id for ad_id, _, _ in rows}))}
+        screen_ids = {row[0] for row in db.session.query(Screen.id).filter(
+            Screen.id.in_({screen_id for _, screen_id, _ in rows}))}
+        rows = {key: value for key, value in rows.items() if key[0] in ad_ids and key[1] in screen_ids}
+        if not rows:
+            return 0
+
+        now = datetime.utcnow()
+        values = [{
+            'ad_content_id': ad_id,
+            'screen_id': screen_id,
+            'organization_id': organization_id,
+            'date': day,
+            'impressions': count,
+            'total_duration': duration,
+            'created_at': now,
+            'updated_at': now,
+        } for (ad_id, screen_id, day), (organization_id, count, duration) in rows.items()]
+
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise NotImplementedError(f"Upsert d'impressions non supporté pour {dialect}")
+
+        table = cls.__table__
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.ad_content_id, table.c.screen_id, table.c.date],
+            set_={
+                'impressions': table.c.impressions + stmt.excluded.impressions,
+                'total_duration': table.c.total_duration + stmt.excluded.total_duration,
+                'updated_at': stmt.excluded.updated_at,
+            }
+        )
+        db.session.execute(stmt, values)
+
+        totals = {}
+        for (ad_id, _, _), (_, count, duration) in rows.items():
+            total_count, total_duration = totals.get(ad_id, (0, 0.0))
+            totals[ad_id] = (total_count + count, total_duration + duration)
+        db.session.execute(
+            update(AdContent).where(AdContent.id.in_(list(totals))).values(
+                total_impressions=AdContent.total_impressions + case(
+                    {ad_id: count for ad_id, (count, _) in totals.items()}, value=AdContent.id, else_=0),
+                total_duration_played=AdContent.total_duration_played + case(
+                    {ad_id: duration for ad_id, (_, duration) in totals.items()}, value=AdContent.id, else_=0.0)
+            ),
+            execution_options={'synchronize_session': False}
+        )
+        return len(rows)
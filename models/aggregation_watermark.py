@@ -0,0 +1,35 @@
+from datetime import datetime
+from app import db
+
+
+class AggregationWatermark(db.Model):
+    """How far an incremental aggregation job has consumed its source table."""
+    __tablename__ = 'aggregation_watermarks'
+
+    name = db.Column(db.String(50), primary_key=True)
+    position = db.Column(db.DateTime)
+    # Highest source row id consumed, for jobs that follow an id sequence
+    last_id = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def get(cls, name):
+        watermark = db.session.get(cls, name)
+        return watermark.position if watermark else None
+
+    @classmethod
+    def get_last_id(cls, name):
+        watermark = db.session.get(cls, name)
+        return (watermark.last_id or 0) if watermark else 0
+
+    @classmethod
+    def advance(cls, name, position=None, last_id=None):
+        """Move the watermark forward. Does not commit."""
+        watermark = db.session.get(cls, name)
+        if watermark is None:
+            watermark = cls(name=name)
+            db.session.add(watermark)
+        if position is not None and (watermark.position is None or position > watermark.position):
+            watermark.position = position
+        if last_id is not None and (watermark.last_id is None or last_id > watermark.last_id):
+            watermark.last_id = last_id
@@ -1,6 +1,6 @@
 from app import db
 from datetime import datetime, timedelta
-from sqlalchemy import or_, and_, func
+from sqlalchemy import or_
 import zoneinfo
 
 
@@ -35,6 +35,16 @@ COMMON_TIMEZONES = [
 ]
 
 
+# Materialized targeting: one row per (broadcast, screen) whose organization
+# matches the broadcast's target and org type. Maintained by
+# services/broadcast_targets.py; time windows and is_active flags are still
+# checked at query time.
+broadcast_screen_targets = db.Table('broadcast_screen_targets',
+    db.Column('broadcast_id', db.Integer, db.ForeignKey('broadcasts.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('screen_id', db.Integer, db.ForeignKey('screens.id', ondelete='CASCADE'), primary_key=True, index=True)
+)
+
+
 class Broadcast(db.Model):
     __tablename__ = 'broadcasts'
     
@@ -180,94 +190,35 @@ class Broadcast(db.Model):
     def get_active_broadcasts_query(cls, screen, now=None):
         """
         Get a SQLAlchemy query for all active broadcasts that apply to a given screen.
-        This replaces the in-memory filtering of applies_to_screen for better performance.
+        Targeting is looked up in the precomputed broadcast_screen_targets mapping.
         """
         if not screen or not screen.is_active:
             return cls.query.filter(db.false())
 
-        org = screen.organization
         if now is None:
             now = datetime.utcnow()
 
-        # Base activity filters
-        query = cls.query.filter(
+        return cls.query.join(
+            broadcast_screen_targets, broadcast_screen_targets.c.broadcast_id == cls.id
+        ).filter(
+            broadcast_screen_targets.c.screen_id == screen.id,
             cls.is_active == True,
             or_(cls.start_datetime == None, cls.start_datetime <= now),
             or_(cls.end_datetime == None, cls.end_datetime >= now)
         )
 
-        # Organization type filters
-        if org:
-            if org.is_paid:
-                query = query.filter(cls.target_org_type.in_([cls.ORG_TYPE_ALL, cls.ORG_TYPE_PAID]))
-            else:
-                query = query.filter(cls.target_org_type.in_([cls.ORG_TYPE_ALL, cls.ORG_TYPE_FREE]))
-        else:
-            return cls.query.filter(db.false())
-
-        # Targeting filters
-        target_filters = [
-            and_(cls.target_type == cls.TARGET_SCREEN, cls.target_screen_id == screen.id),
-            and_(cls.target_type == cls.TARGET_ORGANIZATION, cls.target_organization_id == screen.organization_id)
-        ]
-
-        if org.country:
-            target_filters.append(and_(cls.target_type == cls.TARGET_COUNTRY, cls.target_country == org.country))
-
-            if org.city:
-                target_filters.append(and_(
-                    cls.target_type == cls.TARGET_CITY,
-                    cls.target_country == org.country,
-                    func.lower(cls.target_city) == org.city.lower()
-                ))
-
-        query = query.filter(or_(*target_filters))
-        return query
-    
-    def _apply_org_type_filter(self, query, Organization):
-        if self.target_org_type == self.ORG_TYPE_PAID:
-            return query.filter(Organization.is_paid == True)
-        elif self.target_org_type == self.ORG_TYPE_FREE:
-            return query.filter(Organization.is_paid == False)
-        return query
-    
     def get_target_screens(self):
-        from models import Screen, Organization
+        from models import Screen
         
         if not self.is_currently_active():
             return []
         
-        if self.target_type == self.TARGET_SCREEN:
-            screen = Screen.query.get(self.target_screen_id)
-            if screen and screen.is_active and self._matches_org_type(screen.organization):
-                return [screen]
-            return []
-        
-        if self.target_type == self.TARGET_ORGANIZATION:
-            org = Organization.query.get(self.target_organization_id)
-            if org and self._matches_org_type(org):
-                return Screen.query.filter_by(
-                    organization_id=self.target_organization_id,
-                    is_active=True
-                ).all()
-            return []
-        
-        if self.target_type == self.TARGET_CITY:
-            query = Screen.query.join(Organization).filter(
-                Organization.country == self.target_country,
-                Organization.city == self.target_city,
-                Screen.is_active == True
-            )
-            return self._apply_org_type_filter(query, Organization).all()
-        
-        if self.target_type == self.TARGET_COUNTRY:
-            query = Screen.query.join(Organization).filter(
-                Organization.country == self.target_country,
-                Screen.is_active == True
-            )
-            return self._apply_org_type_filter(query, Organization).all()
-        
-        return []
+        return Screen.query.join(
+            broadcast_screen_targets, broadcast_screen_targets.c.screen_id == Screen.id
+        ).filter(
+            broadcast_screen_targets.c.broadcast_id == self.id,
+            Screen.is_active == True
+        ).all()
     
     def get_org_type_display(self):
         if self.target_org_type == self.ORG_TYPE_PAID:
@@ -386,46 +337,19 @@ class Broadcast(db.Model):
         
         return self._check_recurrence_trigger(now)
     
+    @property
+    def recurrence_rule(self):
+        """Parsed recurrence (services.broadcast_recurrence.RecurrenceRule), cached per rule values."""
+        from services.broadcast_recurrence import RecurrenceRule
+        return RecurrenceRule.from_broadcast(self)
+    
     def _check_recurrence_trigger(self, now):
-        if not self.scheduled_datetime or not self.recurrence_time:
-            return False
-        
-        if self.recurrence_end_date and now.date() > self.recurrence_end_date:
-            return False
-        
-        if now.date() < self.scheduled_datetime.date():
-            return False
-        
-        current_time = now.time()
-        scheduled_time = self.recurrence_time
-        time_diff = abs(
-            (current_time.hour * 3600 + current_time.minute * 60 + current_time.second) -
-            (scheduled_time.hour * 3600 + scheduled_time.minute * 60 + scheduled_time.second)
-        )
-        
-        if time_diff > 2:
-            return False
-        
-        if self.recurrence_type == self.RECURRENCE_DAILY:
-            days_since_start = (now.date() - self.scheduled_datetime.date()).days
-            return days_since_start % self.recurrence_interval == 0
-        
-        elif self.recurrence_type == self.RECURRENCE_WEEKLY:
-            if self.recurrence_days_of_week:
-                days = [int(d) for d in self.recurrence_days_of_week.split(',') if d]
-                return now.weekday() in days
-            weeks_since_start = (now.date() - self.scheduled_datetime.date()).days // 7
-            return weeks_since_start % self.recurrence_interval == 0
-        
-        elif self.recurrence_type == self.RECURRENCE_MONTHLY:
-            months_diff = (now.year - self.scheduled_datetime.year) * 12 + (now.month - self.scheduled_datetime.month)
-            if months_diff % self.recurrence_interval != 0:
-                return False
-            return now.day == self.scheduled_datetime.day
-        
-        return False
+        rule = self.recurrence_rule
+        return bool(rule) and rule.triggers_at(now)
     
     def get_next_occurrence(self, from_datetime=None):
+        from services.broadcast_recurrence import LEGACY_HORIZON_DAYS
+        
         if from_datetime is None:
             from_datetime = datetime.utcnow()
         
@@ -440,45 +364,24 @@ class Broadcast(db.Model):
                 return self.scheduled_datetime
             return None
         
-        if self.recurrence_end_date and from_datetime.date() > self.recurrence_end_date:
-            return None
-        
-        base_time = self.recurrence_time or self.scheduled_datetime.time()
-        check_date = max(from_datetime.date(), self.scheduled_datetime.date())
+        rule = self.recurrence_rule
+        first_day = max(from_datetime.date(), rule.start_date)
+        horizon = datetime.combine(first_day + timedelta(days=LEGACY_HORIZON_DAYS), rule.time)
+        return rule.next_occurrence(from_datetime, until=horizon)
+    
+    def get_next_occurrences(self, count, from_datetime=None):
+        """Next `count` occurrences of a scheduled broadcast (no horizon limit)."""
+        if from_datetime is None:
+            from_datetime = datetime.utcnow()
         
-        for i in range(366):
-            candidate = datetime.combine(check_date + timedelta(days=i), base_time)
-            
-            if candidate <= from_datetime:
-                continue
-            
-            if self.recurrence_end_date and candidate.date() > self.recurrence_end_date:
-                return None
-            
-            if self._is_valid_recurrence_date(candidate):
-                return candidate
+        if self.schedule_mode != self.SCHEDULE_MODE_SCHEDULED or not self.scheduled_datetime:
+            return []
         
-        return None
+        rule = self.recurrence_rule
+        if rule is None:
+            return [self.scheduled_datetime] if self.scheduled_datetime > from_datetime and count > 0 else []
+        return list(rule.occurrences(from_datetime, count=count))
     
     def _is_valid_recurrence_date(self, dt):
-        if dt.date() < self.scheduled_datetime.date():
-            return False
-        
-        if self.recurrence_type == self.RECURRENCE_DAILY:
-            days_since_start = (dt.date() - self.scheduled_datetime.date()).days
-            return days_since_start % self.recurrence_interval == 0
-        
-        elif self.recurrence_type == self.RECURRENCE_WEEKLY:
-            if self.recurrence_days_of_week:
-                days = [int(d) for d in self.recurrence_days_of_week.split(',') if d]
-                return dt.weekday() in days
-            weeks_since_start = (dt.date() - self.scheduled_datetime.date()).days // 7
-            return weeks_since_start % self.recurrence_interval == 0
-        
-        elif self.recurrence_type == self.RECURRENCE_MONTHLY:
-            months_diff = (dt.year - self.scheduled_datetime.year) * 12 + (dt.month - self.scheduled_datetime.month)
-            if months_diff % self.recurrence_interval != 0:
-                return False
-            return dt.day == self.scheduled_datetime.day
-        
-        return True
+        rule = self.recurrence_rule
+        return bool(rule) and rule.occurs_on(dt.date())
@@ -1,11 +1,47 @@
 from datetime import datetime
 from app import db
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class HeartbeatLog(db.Model):
     __tablename__ = 'heartbeat_logs'
+    __table_args__ = (
+        db.Index('idx_heartbeat_logs_timestamp', 'timestamp'),
+        db.Index('idx_heartbeat_logs_screen_timestamp', 'screen_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     screen_id = db.Column(db.Integer, db.ForeignKey('screens.id'), nullable=False)
     status = db.Column(db.String(20), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def cleanup_old_logs(cls, days_to_keep=30):
+        """Delete HeartbeatLog entries older than specified days (default: 30 days)"""
+        from services.log_partitions import LogPartitions
+        deleted_count = LogPartitions.purge(cls.__tablename__, days_to_keep)
+        logger.info(f"Cleaned up {deleted_count} old HeartbeatLog entries (older than {days_to_keep} days)")
+        return deleted_count
+
+
+class ScreenStatusInterval(db.Model):
+    """Consecutive heartbeats of one screen with the same status, compacted."""
+    __tablename__ = 'screen_status_intervals'
+    __table_args__ = (
+        db.Index('idx_screen_status_intervals_screen_ended', 'screen_id', 'ended_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    screen_id = db.Column(db.Integer, db.ForeignKey('screens.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    ended_at = db.Column(db.DateTime, nullable=False)
+    beats = db.Column(db.Integer, default=0)
+
+    screen = db.relationship('Screen', back_populates='status_intervals')
+
+    @property
+    def duration_seconds(self):
+        return (self.ended_at - self.started_at).total_seconds()
@@ -45,6 +45,8 @@ class Screen(db.Model):
     fillers = db.relationship('Filler', back_populates='screen', cascade='all, delete-orphan')
     internal_contents = db.relationship('InternalContent', back_populates='screen', cascade='all, delete-orphan')
     stat_logs = db.relationship('StatLog', back_populates='screen', cascade='all, delete-orphan')
+    daily_stats = db.relationship('StatLogDaily', back_populates='screen', cascade='all, delete-orphan')
+    status_intervals = db.relationship('ScreenStatusInterval', back_populates='screen', cascade='all, delete-orphan')
     overlays = db.relationship('ScreenOverlay', back_populates='screen', cascade='all, delete-orphan')
     
     @staticmethod
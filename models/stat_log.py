@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from app import db
 import logging
 
@@ -25,13 +25,64 @@ class StatLog(db.Model):
     @classmethod
     def cleanup_old_logs(cls, days_to_keep=30):
         """Delete StatLog entries older than specified days (default: 30 days)"""
-        try:
-            cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
-            deleted_count = cls.query.filter(cls.played_at < cutoff_date).delete()
-            db.session.commit()
-            logger.info(f"Cleaned up {deleted_count} old StatLog entries (older than {days_to_keep} days)")
-            return deleted_count
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Error cleaning up StatLog: {e}")
+        from services.log_partitions import LogPartitions
+        deleted_count = LogPartitions.purge(cls.__tablename__, days_to_keep)
+        logger.info(f"Cleaned up {deleted_count} old StatLog entries (older than {days_to_keep} days)")
+        return deleted_count
+
+
+class StatLogDaily(db.Model):
+    """Plays per screen, day, category and content, rolled up from stat_logs."""
+    __tablename__ = 'stat_log_daily'
+    __table_args__ = (
+        db.UniqueConstraint('screen_id', 'date', 'category', 'content_id', name='unique_stat_log_daily'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    screen_id = db.Column(db.Integer, db.ForeignKey('screens.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    # '' and 0 stand for NULL so that the unique key can be upserted
+    category = db.Column(db.String(20), nullable=False, default='')
+    content_id = db.Column(db.Integer, nullable=False, default=0)
+    plays = db.Column(db.Integer, default=0)
+    total_duration = db.Column(db.Float, default=0)
+
+    screen = db.relationship('Screen', back_populates='daily_stats')
+
+    @classmethod
+    def add_plays(cls, rows):
+        """
+        Add play counts to the rollup.
+
+        Args:
+            rows: {(screen_id, date, category, content_id): (plays, total_duration)}
+        """
+        if not rows:
             return 0
+
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise NotImplementedError(f"Rollup upsert not supported for {dialect}")
+
+        table = cls.__table__
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.screen_id, table.c.date, table.c.category, table.c.content_id],
+            set_={
+                'plays': table.c.plays + stmt.excluded.plays,
+                'total_duration': table.c.total_duration + stmt.excluded.total_duration,
+            }
+        )
+        db.session.execute(stmt, [{
+            'screen_id': screen_id,
+            'date': day,
+            'category': category,
+            'content_id': content_id,
+            'plays': plays,
+            'total_duration': duration,
+        } for (screen_id, day, category, content_id), (plays, duration) in rows.items()])
+        return len(rows)
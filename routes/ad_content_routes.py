@@ -19,6 +19,7 @@ from utils.countries import get_all_countries
 from utils.currencies import get_currency_by_code
 from utils.world_data import WORLD_CITIES
 from services.availability_service import calculate_availability
+from services.ad_invoice_generation import generate_ad_invoices, generate_expired_ad_invoices
 from services.translation_service import t
 from sqlalchemy import func, or_
 from sqlalchemy.orm import joinedload
@@ -586,73 +587,38 @@ def generate_invoices(ad_id):
         flash(t('flash.invoices_active_expired_only'), 'error')
         return redirect(url_for('ad_content.view', ad_id=ad_id))
     
-    screens = ad.get_target_screens()
-    if not screens:
+    report = generate_ad_invoices([ad])
+    if not report['screens_by_ad'][ad.id]:
         flash(t('flash.no_screens_targeted'), 'error')
         return redirect(url_for('ad_content.view', ad_id=ad_id))
     
-    orgs = {}
-    for screen in screens:
-        if screen.organization_id not in orgs:
-            orgs[screen.organization_id] = {
-                'org': screen.organization,
-                'screens': [],
-                'impressions': 0,
-                'duration': 0
-            }
-        orgs[screen.organization_id]['screens'].append(screen)
-        
-        stats = AdContentStat.query.filter_by(
-            ad_content_id=ad_id,
-            screen_id=screen.id
-        ).all()
-        for stat in stats:
-            orgs[screen.organization_id]['impressions'] += stat.impressions
-            orgs[screen.organization_id]['duration'] += stat.total_duration
-    
-    total_screens = len(screens)
-    invoices_created = 0
-    
-    for org_id, data in orgs.items():
-        existing = AdContentInvoice.query.filter_by(
-            ad_content_id=ad_id,
-            organization_id=org_id
-        ).first()
-        if existing:
-            continue
-        
-        org_share = len(data['screens']) / total_screens if total_screens > 0 else 0
-        gross_amount = ad.total_price * org_share
-        commission_amount = gross_amount * (ad.commission_rate / 100)
-        
-        invoice = AdContentInvoice(
-            organization_id=org_id,
-            ad_content_id=ad_id,
-            period_start=ad.start_date.date() if ad.start_date else date.today(),
-            period_end=ad.end_date.date() if ad.end_date else date.today(),
-            screens_count=len(data['screens']),
-            total_impressions=data['impressions'],
-            total_duration=data['duration'],
-            gross_amount=gross_amount,
-            commission_rate=ad.commission_rate,
-            commission_amount=commission_amount,
-            currency=ad.currency
-        )
-        invoice.generate_invoice_number()
-        
-        db.session.add(invoice)
-        invoices_created += 1
-    
-    db.session.commit()
+    invoices_created = report['created']
     
     if invoices_created > 0:
-        flash(f'{invoices_created} facture(s) générée(s) avec succès.', 'success')
+        flash(t('flash.invoices_generated', count=invoices_created), 'success')
     else:
-        flash('Aucune nouvelle facture à générer.', 'info')
+        flash(t('flash.no_new_invoices'), 'info')
     
     return redirect(url_for('ad_content.view', ad_id=ad_id))
 
 
+@ad_content_bp.route('/ad-content/generate-expired-invoices', methods=['POST'])
+@login_required
+@superadmin_required
+def generate_expired_invoices():
+    dry_run = request.form.get('dry_run') == 'true'
+    report = generate_expired_ad_invoices(dry_run=dry_run)
+    
+    if dry_run:
+        flash(t('flash.expired_invoices_preview', count=report['created'], ads=report['ads']), 'info')
+    elif report['created'] > 0:
+        flash(t('flash.invoices_generated', count=report['created']), 'success')
+    else:
+        flash(t('flash.no_new_invoices'), 'info')
+    
+    return redirect(url_for('ad_content.invoices'))
+
+
 @ad_content_bp.route('/ad-content/settings', methods=['GET', 'POST'])
 @login_required
 @superadmin_required
@@ -91,264 +91,13 @@ def validate_video_file(file_storage):
 
 admin_bp = Blueprint('admin', __name__)
 
-# Simple in-memory cache for dashboard stats
-_dashboard_cache = {
-    'data': None,
-    'expires_at': 0
-}
-CACHE_DURATION = 300  # 5 minutes in seconds
-
 def get_dashboard_stats(force_refresh=False):
     """
-    Get dashboard statistics with caching and optimized queries.
+    Get dashboard statistics from the incrementally maintained aggregates.
     Returns a dictionary of statistics.
     """
-    import time
-    from sqlalchemy import case
-    from utils.currencies import get_currency_by_code, get_country_by_code
-    
-    global _dashboard_cache
-    
-    now = time.time()
-    if not force_refresh and _dashboard_cache['data'] and _dashboard_cache['expires_at'] > now:
-        return _dashboard_cache['data']
-
-    today = datetime.utcnow().date()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-    
-    # Combined count queries using conditional aggregation
-    # We can't easily combine Org and Screen counts in one query without a cross join or union which might be slower/complex
-    # So we keep them separate but efficient.
-    total_orgs = Organization.query.count()
-    active_orgs = Organization.query.filter_by(is_active=True).count()
-    total_screens = Screen.query.count()
-    online_screens = Screen.query.filter(Screen.status.in_(['online', 'playing'])).count()
-    
-    # Combined revenue queries
-    revenue_stats = db.session.query(
-        func.sum(Booking.total_price),
-        func.sum(case((Booking.created_at >= week_ago, Booking.total_price), else_=0)),
-        func.sum(case((Booking.created_at >= month_ago, Booking.total_price), else_=0))
-    ).filter(
-        Booking.payment_status == 'paid'
-    ).first()
-    
-    total_revenue = revenue_stats[0] or 0
-    weekly_revenue = revenue_stats[1] or 0
-    monthly_revenue = revenue_stats[2] or 0
-    
-    # Platform commission
-    # Calculate directly in DB
-    total_platform_commission = db.session.query(
-        func.sum(Booking.total_price * Organization.commission_rate / 100)
-    ).select_from(Organization).join(
-        Screen, Screen.organization_id == Organization.id
-    ).join(
-        Booking, Booking.screen_id == Screen.id
-    ).filter(
-        Booking.payment_status == 'paid'
-    ).scalar() or 0
-    
-    weekly_commission = db.session.query(
-        func.sum(Booking.total_price * Organization.commission_rate / 100)
-    ).select_from(Organization).join(
-        Screen, Screen.organization_id == Organization.id
-    ).join(
-        Booking, Booking.screen_id == Screen.id
-    ).filter(
-        Booking.payment_status == 'paid',
-        Booking.created_at >= week_ago
-    ).scalar() or 0
-    
-    # Revenue by currency
-    revenue_by_currency = db.session.query(
-        Organization.currency,
-        func.sum(Booking.total_price).label('total'),
-        func.sum(Booking.total_price * Organization.commission_rate / 100).label('commission')
-    ).select_from(Organization).join(
-        Screen, Screen.organization_id == Organization.id
-    ).join(
-        Booking, Booking.screen_id == Screen.id
-    ).filter(
-        Booking.payment_status == 'paid'
-    ).group_by(Organization.currency).all()
-    
-    currency_stats = []
-    for currency_code, total, commission in revenue_by_currency:
-        currency_info = get_currency_by_code(currency_code or 'EUR')
-        currency_stats.append({
-            'code': currency_code or 'EUR',
-            'name': currency_info.get('name', currency_code),
-            'flag': currency_info.get('flag', ''),
-            'symbol': currency_info.get('symbol', currency_code),
-            'total': total or 0,
-            'commission': commission or 0
-        })
-    
-    # Country stats
-    # Optimization: Combined query for org/screen counts per country could be complex.
-    # But revenue by country can be combined for time ranges.
-    
-    orgs_by_country = db.session.query(
-        Organization.country,
-        func.count(Organization.id).label('org_count')
-    ).group_by(Organization.country).all()
-    
-    screens_by_country = db.session.query(
-        Organization.country,
-        func.count(Screen.id).label('screen_count')
-    ).join(Screen, Screen.organization_id == Organization.id).group_by(Organization.country).all()
-    
-    orgs_count_map = {c: count for c, count in orgs_by_country}
-    screens_count_map = {c: count for c, count in screens_by_country}
-    
-    # Combined revenue by country query
-    # We group by country and currency
-    combined_revenue_by_country = db.session.query(
-        Organization.country,
-        Organization.currency,
-        func.sum(Booking.total_price).label('total'),
-        func.sum(Booking.total_price * Organization.commission_rate / 100).label('commission'),
-        func.sum(case((Booking.created_at >= today, Booking.total_price), else_=0)).label('daily_total'),
-        func.sum(case((Booking.created_at >= today, Booking.total_price * Organization.commission_rate / 100), else_=0)).label('daily_commission'),
-        func.sum(case((Booking.created_at >= week_ago, Booking.total_price), else_=0)).label('weekly_total'),
-        func.sum(case((Booking.created_at >= week_ago, Booking.total_price * Organization.commission_rate / 100), else_=0)).label('weekly_commission'),
-        func.sum(case((Booking.created_at >= month_ago, Booking.total_price), else_=0)).label('monthly_total'),
-        func.sum(case((Booking.created_at >= month_ago, Booking.total_price * Organization.commission_rate / 100), else_=0)).label('monthly_commission')
-    ).join(Screen, Screen.organization_id == Organization.id).join(
-        Booking, Booking.screen_id == Screen.id
-    ).filter(
-        Booking.payment_status == 'paid'
-    ).group_by(Organization.country, Organization.currency).all()
-
-    avg_commission_by_country = db.session.query(
-        Organization.country,
-        func.avg(Organization.commission_rate).label('avg_commission')
-    ).group_by(Organization.country).all()
-    avg_commission_map = {c: avg for c, avg in avg_commission_by_country}
-    
-    country_data = {}
-
-    for row in combined_revenue_by_country:
-        country_code = row.country
-        currency_code = row.currency
-
-        cc = country_code or 'FR'
-        if cc not in country_data:
-            country_info = get_country_by_code(cc)
-            country_data[cc] = {
-                'country_code': cc,
-                'country_name': country_info.get('name', cc),
-                'country_flag': country_info.get('flag', ''),
-                'org_count': orgs_count_map.get(cc, 0),
-                'screen_count': screens_count_map.get(cc, 0),
-                'avg_commission': avg_commission_map.get(cc, 0),
-                'currencies': []
-            }
-
-        currency_info = get_currency_by_code(currency_code or 'EUR')
-        curr_code = currency_code or 'EUR'
-
-        country_data[cc]['currencies'].append({
-            'currency_code': curr_code,
-            'currency_symbol': currency_info.get('symbol', currency_code),
-            'total': row.total or 0,
-            'commission': row.commission or 0,
-            'daily_total': row.daily_total or 0,
-            'daily_commission': row.daily_commission or 0,
-            'weekly_total': row.weekly_total or 0,
-            'weekly_commission': row.weekly_commission or 0,
-            'monthly_total': row.monthly_total or 0,
-            'monthly_commission': row.monthly_commission or 0
-        })
-
-    for cc in orgs_count_map:
-        if cc not in country_data:
-            country_info = get_country_by_code(cc)
-            country_data[cc] = {
-                'country_code': cc,
-                'country_name': country_info.get('name', cc),
-                'country_flag': country_info.get('flag', ''),
-                'org_count': orgs_count_map.get(cc, 0),
-                'screen_count': screens_count_map.get(cc, 0),
-                'avg_commission': avg_commission_map.get(cc, 0),
-                'currencies': []
-            }
-
-    country_stats = list(country_data.values())
-    
-    # Top Orgs - return serialized data
-    top_orgs_query = db.session.query(
-        Organization,
-        func.sum(Booking.total_price).label('revenue')
-    ).join(Screen, Screen.organization_id == Organization.id).join(
-        Booking, Booking.screen_id == Screen.id
-    ).filter(
-        Booking.payment_status == 'paid'
-    ).group_by(Organization.id).order_by(func.sum(Booking.total_price).desc()).limit(5).all()
-    
-    top_orgs_data = []
-    for org, revenue in top_orgs_query:
-        top_orgs_data.append({
-            'id': org.id,
-            'name': org.name,
-            'email': org.email,
-            'revenue': revenue,
-            'currency': org.currency,
-            'commission_rate': org.commission_rate,
-            'commission': org.calculate_platform_commission(revenue)
-        })
-
-    # Pre-calculate base currency conversions
-    # This requires knowing admin_base_currency which is a setting.
-    # We can fetch it here.
-    admin_base_currency = SiteSetting.get('admin_base_currency', 'EUR')
-    
-    revenues_by_currency = {}
-    commissions_by_currency = {}
-    weekly_rev_dict = {}
-    monthly_rev_dict = {}
-    
-    for row in revenue_by_currency:
-        code = row.currency or 'EUR'
-        revenues_by_currency[code] = row.total or 0
-        commissions_by_currency[code] = row.commission or 0
-
-    # We need weekly/monthly by currency again for global conversion
-    # But we can iterate over the combined_revenue_by_country to sum them up!
-    # Avoiding more queries.
-    for row in combined_revenue_by_country:
-        code = row.currency or 'EUR'
-        weekly_rev_dict[code] = weekly_rev_dict.get(code, 0) + (row.weekly_total or 0)
-        monthly_rev_dict[code] = monthly_rev_dict.get(code, 0) + (row.monthly_total or 0)
-
-    data = {
-        'total_orgs': total_orgs,
-        'active_orgs': active_orgs,
-        'total_screens': total_screens,
-        'online_screens': online_screens,
-        'total_revenue': total_revenue,
-        'weekly_revenue': weekly_revenue,
-        'monthly_revenue': monthly_revenue,
-        'total_platform_commission': total_platform_commission,
-        'weekly_commission': weekly_commission,
-        'currency_stats': currency_stats,
-        'country_stats': country_stats,
-        'top_orgs_data': top_orgs_data,
-        'admin_base_currency': admin_base_currency,
-        'revenues_by_currency': revenues_by_currency,
-        'commissions_by_currency': commissions_by_currency,
-        'weekly_rev_dict': weekly_rev_dict,
-        'monthly_rev_dict': monthly_rev_dict
-    }
-    
-    _dashboard_cache = {
-        'data': data,
-        'expires_at': now + CACHE_DURATION
-    }
-
-    return data
+    from services.dashboard_aggregates import DashboardAggregates
+    return DashboardAggregates.stats(force_refresh=force_refresh)
 
 
 def parse_float_safe(value, default=0.0):
@@ -977,14 +726,16 @@ def clean_database():
     import shutil
     from models import (
         Organization, Screen, TimeSlot, TimePeriod,
-        Content, Booking, Filler, InternalContent, StatLog, HeartbeatLog,
-        RegistrationRequest, ScreenOverlay, Invoice, PaymentProof,
+        Content, Booking, Filler, InternalContent, StatLog, StatLogDaily, HeartbeatLog,
+        ScreenStatusInterval, RegistrationRequest, ScreenOverlay, Invoice, PaymentProof,
         Broadcast
     )
     
     try:
         HeartbeatLog.query.delete()
+        ScreenStatusInterval.query.delete()
         StatLog.query.delete()
+        StatLogDaily.query.delete()
         PaymentProof.query.delete()
         Invoice.query.delete()
         Booking.query.delete()
@@ -1150,22 +901,13 @@ def reject_registration(request_id):
 @superadmin_required
 def billing():
     from utils.currencies import get_currency_by_code
-    from routes.billing_routes import should_generate_weekly_invoice, generate_invoice_for_week
-    
-    all_orgs = Organization.query.filter_by(is_active=True).all()
-    org_ids = [org.id for org in all_orgs]
+    from routes.billing_routes import should_generate_weekly_invoice
+    from services.invoice_generation import generate_weekly_invoices
     
     should_generate, week_start, week_end = should_generate_weekly_invoice()
     
     if should_generate:
-        for org_id in org_ids:
-            existing = Invoice.query.filter_by(
-                organization_id=org_id,
-                week_start_date=week_start,
-                week_end_date=week_end
-            ).first()
-            if not existing:
-                generate_invoice_for_week(org_id, week_start, week_end)
+        generate_weekly_invoices(week_start, week_end)
     
     status_filter = request.args.get('status', 'all')
     org_filter = request.args.get('org_id', '')
@@ -1317,8 +1059,10 @@ def broadcasts():
     all_broadcasts = Broadcast.query.order_by(Broadcast.created_at.desc()).all()
     active_count = Broadcast.query.filter_by(is_active=True).count()
     
+    from services.broadcast_targets import count_target_screens
+    counts = count_target_screens([b.id for b in all_broadcasts])
     for b in all_broadcasts:
-        b.target_screens_count = len(b.get_target_screens())
+        b.target_screens_count = counts.get(b.id, 0) if b.is_currently_active() else 0
     
     return render_template('admin/broadcasts/list.html',
         broadcasts=all_broadcasts,
@@ -1532,6 +1276,9 @@ def broadcast_new():
         db.session.add(broadcast)
         db.session.commit()
         
+        from services.overlay_service import request_overlay_reconcile
+        request_overlay_reconcile()
+        
         flash(f'Diffusion "{name}" créée avec succès!', 'success')
         return redirect(url_for('admin.broadcasts'))
     
@@ -1792,6 +1539,9 @@ def broadcast_edit(broadcast_id):
         
         db.session.commit()
         
+        from services.overlay_service import request_overlay_reconcile
+        request_overlay_reconcile()
+        
         flash(f'Diffusion "{name}" mise à jour!', 'success')
         return redirect(url_for('admin.broadcasts'))
     
@@ -1813,6 +1563,9 @@ def broadcast_toggle(broadcast_id):
     broadcast.is_active = not broadcast.is_active
     db.session.commit()
     
+    from services.overlay_service import request_overlay_reconcile
+    request_overlay_reconcile()
+    
     status = "activée" if broadcast.is_active else "désactivée"
     flash(f'Diffusion {status}.', 'success')
     return redirect(url_for('admin.broadcasts'))
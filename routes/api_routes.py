@@ -5,12 +5,20 @@
  * Fait par : Aisance KALONJI, www.aisancekalonji.com
  * Auditer par : La CyberConfiance, www.cyberconfiance.com
 """
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, url_for
 from flask_login import login_required, current_user
 from app import db
-from models import Screen, Content, Booking, StatLog
-from datetime import datetime, timedelta
+from models import Screen, Content, Booking
+from datetime import datetime, time, timedelta
 from sqlalchemy import func
+from services import stat_rollups, uptime_service
+from services.availability_search import (
+    search_availability, SEARCH_MAX_DAYS, SEARCH_MAX_RESULTS, SORT_CAPACITY, SORT_PRICE
+)
+from services.input_validator import (
+    ValidationError, validate_positive_integer, validate_date_string, validate_content_type,
+    handle_validation_errors
+)
 
 api_bp = Blueprint('api', __name__)
 
@@ -25,6 +33,48 @@ def get_cities_by_country(country_code):
     })
 
 
+@api_bp.route('/availability/search')
+@handle_validation_errors
+def availability_search():
+    """
+    Screens with free capacity over a date range, e.g. every screen in a city
+    with 500 free 15s image plays next week, ranked by capacity or price.
+    """
+    start = validate_date_string(request.args.get('start_date'), 'start_date')
+    end = validate_date_string(request.args.get('end_date'), 'end_date')
+    if not start or not end:
+        raise ValidationError('start_date', "start_date and end_date are required")
+    try:
+        start_date = datetime.strptime(start, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValidationError('start_date', "Invalid date")
+    if end_date < start_date:
+        raise ValidationError('end_date', "Must not be before start_date")
+    if (end_date - start_date).days + 1 > SEARCH_MAX_DAYS:
+        raise ValidationError('end_date', f"Range must not exceed {SEARCH_MAX_DAYS} days")
+
+    content_type = validate_content_type(request.args.get('content_type', 'image'))
+    slot_duration = validate_positive_integer(request.args.get('slot_duration', 15), 'slot_duration', min_val=1)
+    plays = validate_positive_integer(request.args.get('plays', 0), 'plays')
+    limit = validate_positive_integer(request.args.get('limit', 50), 'limit', min_val=1, max_val=SEARCH_MAX_RESULTS)
+    sort = request.args.get('sort', SORT_CAPACITY)
+    if sort not in (SORT_CAPACITY, SORT_PRICE):
+        raise ValidationError('sort', f"Must be '{SORT_CAPACITY}' or '{SORT_PRICE}'")
+    organization_id = request.args.get('organization_id')
+    if organization_id:
+        organization_id = validate_positive_integer(organization_id, 'organization_id', min_val=1)
+
+    report = search_availability(
+        start_date, end_date, content_type=content_type, slot_duration=slot_duration, plays=plays,
+        country=request.args.get('country') or None, city=request.args.get('city') or None,
+        organization_id=organization_id, sort=sort, limit=limit
+    )
+    for result in report['results']:
+        result['booking_url'] = url_for('booking.screen_booking', screen_code=result['unique_code'])
+    return jsonify(report)
+
+
 @api_bp.route('/screens/status')
 @login_required
 def screens_status():
@@ -63,30 +113,40 @@ def screen_stats(screen_id):
         ).first_or_404()
     
     today = datetime.utcnow().date()
-    week_ago = today - timedelta(days=7)
-    
-    daily_plays = db.session.query(
-        func.date(StatLog.played_at).label('date'),
-        func.count(StatLog.id).label('count')
-    ).filter(
-        StatLog.screen_id == screen_id,
-        StatLog.played_at >= week_ago
-    ).group_by(func.date(StatLog.played_at)).all()
+    week_ago = datetime.combine(today - timedelta(days=7), time.min)
     
-    category_stats = db.session.query(
-        StatLog.content_category,
-        func.count(StatLog.id).label('count')
-    ).filter(
-        StatLog.screen_id == screen_id,
-        StatLog.played_at >= week_ago
-    ).group_by(StatLog.content_category).all()
+    daily_plays, category_stats = stat_rollups.daily_and_category_plays([screen_id], week_ago)
     
     return jsonify({
-        'daily_plays': [{'date': str(d.date), 'count': d.count} for d in daily_plays],
-        'category_stats': [{'category': c.content_category, 'count': c.count} for c in category_stats]
+        'daily_plays': [{'date': str(day), 'count': count} for day, count in daily_plays],
+        'category_stats': [{'category': category, 'count': count} for category, count in category_stats]
     })
 
 
+@api_bp.route('/screen/<int:screen_id>/uptime')
+@login_required
+@handle_validation_errors
+def screen_uptime(screen_id):
+    """Availability per day or week and outages, from compacted heartbeat intervals."""
+    if current_user.is_superadmin():
+        screen = Screen.query.get_or_404(screen_id)
+    else:
+        screen = Screen.query.filter_by(
+            id=screen_id,
+            organization_id=current_user.organization_id
+        ).first_or_404()
+    
+    period = request.args.get('period', 'day')
+    if period not in ('day', 'week'):
+        raise ValidationError('period', "Must be 'day' or 'week'")
+    days = validate_positive_integer(request.args.get('days', 7), 'days', min_val=1, max_val=90)
+    
+    now = datetime.utcnow()
+    start = datetime.combine(now.date() - timedelta(days=days - 1), time.min)
+    
+    return jsonify(uptime_service.screen_uptime(screen, start, now, period=period, now=now))
+
+
 @api_bp.route('/dashboard/summary')
 @login_required
 def dashboard_summary():
@@ -206,16 +206,18 @@ def logout():
 @auth_bp.route('/catalog')
 def catalog():
     from models import Screen, SiteSetting
+    from sqlalchemy import or_
+    from sqlalchemy.orm import contains_eager
     from utils.currencies import get_country_by_code, get_country_choices
     
-    screens = Screen.query.filter_by(is_active=True).join(
+    listed = Screen.query.filter_by(is_active=True).join(
         Organization
-    ).filter(Organization.is_active == True).all()
+    ).filter(Organization.is_active == True)
     
-    all_countries = set()
-    for screen in screens:
-        country_code = screen.organization.country or 'FR'
-        all_countries.add(country_code)
+    all_countries = {
+        country_code or 'FR'
+        for (country_code,) in listed.with_entities(Organization.country).distinct()
+    }
     
     detected_country = detect_country_from_ip(request)
     
@@ -227,6 +229,14 @@ def catalog():
     else:
         country_filter = 'all'
     
+    # Only the screens shown, each with its organization in the same query
+    if country_filter == 'FR':
+        listed = listed.filter(or_(Organization.country == 'FR', Organization.country == None,
+                                   Organization.country == ''))
+    elif country_filter != 'all':
+        listed = listed.filter(Organization.country == country_filter)
+    screens = listed.options(contains_eager(Screen.organization)).all()
+    
     catalog_data = {}
     
     for screen in screens:
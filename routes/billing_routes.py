@@ -131,41 +131,25 @@ def should_generate_weekly_invoice():
     return True, last_week_start, last_week_end
 
 
-def run_scheduled_invoice_generation():
+def run_scheduled_invoice_generation(dry_run=False):
     """
     Generate invoices for all organizations for the previous week.
     This should be called by a scheduled task (cron) on Sundays at 23:59.
-    Returns the number of invoices generated.
+    Returns the number of invoices generated, a message and the run report.
     """
+    from services.invoice_generation import generate_weekly_invoices
+
     if not is_invoice_generation_time():
-        return 0, "Not invoice generation time"
+        return 0, "Not invoice generation time", None
     
     last_week_start, last_week_end = get_last_week()
-
-    # Eager load screens to avoid N+1 queries in generate_invoice_for_week
-    all_orgs = Organization.query.options(joinedload(Organization.screens)).filter_by(is_active=True).all()
-
-    # Bulk fetch existing invoices for the week to avoid N+1 queries
-    existing_invoices = db.session.query(Invoice.organization_id).filter_by(
-        week_start_date=last_week_start,
-        week_end_date=last_week_end
-    ).all()
-    existing_org_ids = {inv[0] for inv in existing_invoices}
+    report = generate_weekly_invoices(last_week_start, last_week_end, dry_run=dry_run)
+    generated_count = report['created']
     
-    generated_count = 0
-    for org in all_orgs:
-        if org.id not in existing_org_ids:
-            invoice = generate_invoice_for_week(
-                org.id,
-                last_week_start,
-                last_week_end,
-                org=org,
-                check_existing=False
-            )
-            if invoice:
-                generated_count += 1
-    
-    return generated_count, f"Generated {generated_count} invoices for week {last_week_start} to {last_week_end}"
+    message = f"Generated {generated_count} invoices for week {last_week_start} to {last_week_end}"
+    if dry_run:
+        message = f"Dry run: {generated_count} invoices would be generated for week {last_week_start} to {last_week_end}"
+    return generated_count, message, report
 
 
 def generate_invoice_for_week(organization_id, week_start, week_end, org=None, check_existing=True):
@@ -175,7 +159,7 @@ def generate_invoice_for_week(organization_id, week_start, week_end, org=None, c
     - One invoice per organization (all screens combined)
     - Updates existing invoice if not validated
     """
-    from models import SiteSetting
+    from services.invoice_generation import invoice_amounts, invoice_settings
     
     if org is None:
         org = Organization.query.options(joinedload(Organization.screens)).filter_by(id=organization_id).first()
@@ -197,48 +181,27 @@ def generate_invoice_for_week(organization_id, week_start, week_end, org=None, c
         gross_revenue = 0
         bookings_count = 0
     else:
-        gross_revenue = db.session.query(func.sum(Booking.total_price)).filter(
-            Booking.screen_id.in_(screen_ids),
-            Booking.payment_status == 'paid',
-            Booking.created_at >= datetime.combine(week_start, datetime.min.time()),
-            Booking.created_at <= datetime.combine(week_end, datetime.max.time())
-        ).scalar() or 0
-        
-        bookings_count = db.session.query(func.count(Booking.id)).filter(
+        gross_revenue, bookings_count = db.session.query(
+            func.sum(Booking.total_price), func.count(Booking.id)
+        ).filter(
             Booking.screen_id.in_(screen_ids),
             Booking.payment_status == 'paid',
             Booking.created_at >= datetime.combine(week_start, datetime.min.time()),
             Booking.created_at <= datetime.combine(week_end, datetime.max.time())
-        ).scalar() or 0
+        ).one()
+        gross_revenue = gross_revenue or 0
+        bookings_count = bookings_count or 0
     
     if gross_revenue <= 0 and not existing_invoice:
         return None
     
-    commission_rate = org.commission_rate or 10.0
-    commission_amount = round(gross_revenue * (commission_rate / 100), 2)
-    net_revenue = round(gross_revenue - commission_amount, 2)
-    
-    platform_vat_rate = SiteSetting.get('platform_vat_rate', 0) or 0
-    vat_amount = round(commission_amount * (platform_vat_rate / 100), 2) if platform_vat_rate > 0 else 0
-    commission_with_vat = round(commission_amount + vat_amount, 2)
-    
-    platform_business_name = SiteSetting.get('platform_business_name', '')
-    platform_vat_number = SiteSetting.get('platform_vat_number', '')
-    platform_registration_number = SiteSetting.get('platform_registration_number', '')
+    amounts = invoice_amounts(gross_revenue, org.commission_rate, invoice_settings())
     
     if existing_invoice:
         if existing_invoice.status not in [Invoice.STATUS_VALIDATED]:
-            existing_invoice.gross_revenue = gross_revenue
-            existing_invoice.commission_rate = commission_rate
-            existing_invoice.commission_amount = commission_amount
-            existing_invoice.net_revenue = net_revenue
+            for key, value in amounts.items():
+                setattr(existing_invoice, key, value)
             existing_invoice.bookings_count = bookings_count
-            existing_invoice.vat_rate = platform_vat_rate
-            existing_invoice.vat_amount = vat_amount
-            existing_invoice.commission_with_vat = commission_with_vat
-            existing_invoice.platform_business_name = platform_business_name
-            existing_invoice.platform_vat_number = platform_vat_number
-            existing_invoice.platform_registration_number = platform_registration_number
             existing_invoice.generated_at = datetime.utcnow()
             db.session.commit()
         return existing_invoice
@@ -247,18 +210,9 @@ def generate_invoice_for_week(organization_id, week_start, week_end, org=None, c
             organization_id=organization_id,
             week_start_date=week_start,
             week_end_date=week_end,
-            gross_revenue=gross_revenue,
-            commission_rate=commission_rate,
-            commission_amount=commission_amount,
-            net_revenue=net_revenue,
             currency=org.currency or 'EUR',
             bookings_count=bookings_count,
-            vat_rate=platform_vat_rate,
-            vat_amount=vat_amount,
-            commission_with_vat=commission_with_vat,
-            platform_business_name=platform_business_name,
-            platform_vat_number=platform_vat_number,
-            platform_registration_number=platform_registration_number
+            **amounts
         )
         invoice.generate_invoice_number()
         db.session.add(invoice)
@@ -497,10 +451,12 @@ def cron_generate_invoices():
     if not expected_secret or cron_secret != expected_secret:
         return {'error': 'Unauthorized'}, 401
     
-    count, message = run_scheduled_invoice_generation()
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+    count, message, report = run_scheduled_invoice_generation(dry_run=dry_run)
     
     return {
         'success': True,
         'invoices_generated': count,
-        'message': message
+        'message': message,
+        'report': report
     }, 200
@@ -5,7 +5,7 @@
  * Fait par : Aisance KALONJI, www.aisancekalonji.com
  * Auditer par : La CyberConfiance, www.cyberconfiance.com
 """
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file, abort
 from app import db
 from models import Screen, TimeSlot, TimePeriod, Content, Booking
 from services.translation_service import t
@@ -13,12 +13,11 @@ from datetime import datetime, date, time
 import os
 import secrets
 import base64
-import io
 from werkzeug.utils import secure_filename
 from utils.image_utils import validate_image
 from utils.video_utils import validate_video, get_video_duration
 from services.qr_service import generate_qr_base64
-from services.receipt_generator import generate_receipt_image
+from services.render_service import receipt_file, RenderBusyError, RenderTimeoutError
 from services.availability_service import calculate_availability, calculate_plays_for_dates, calculate_equitable_distribution
 from utils.currencies import get_currency_by_code
 
@@ -330,19 +329,17 @@ def booking_status(booking_id):
 def download_receipt(reservation_number):
     booking = Booking.query.filter_by(reservation_number=reservation_number).first_or_404()
     
-    booking_qr = generate_qr_base64(
-        url_for('booking.screen_booking', screen_code=booking.screen.unique_code, _external=True),
-        box_size=6, border=2
-    )
-    
-    img = generate_receipt_image(booking, booking.screen, booking.content, booking_qr)
-    
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
+    try:
+        path = receipt_file(
+            booking, 'png',
+            qr_url=url_for('booking.screen_booking', screen_code=booking.screen.unique_code, _external=True),
+            box_size=6, border=2
+        )
+    except (RenderBusyError, RenderTimeoutError):
+        abort(503)
     
     response = send_file(
-        buffer,
+        path,
         mimetype='image/png',
         as_attachment=True,
         download_name=f'recu_{reservation_number}.png'
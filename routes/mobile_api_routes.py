@@ -5,11 +5,10 @@
  * Fait par : Aisance KALONJI, www.aisancekalonji.com
  * Auditer par : La CyberConfiance, www.cyberconfiance.com
 """
-from flask import Blueprint, jsonify, request, g
+from flask import Blueprint, jsonify, request, g, Response
 from app import db
-from models import Screen, User, Content, Booking, StatLog, HeartbeatLog
-from models.ad_content import AdContent
-from datetime import datetime, timedelta
+from models import Screen, User, Content, Booking, StatLog
+from datetime import datetime, time, timedelta
 from sqlalchemy import func
 import logging
 
@@ -22,6 +21,14 @@ from services.jwt_service import (
     superadmin_required
 )
 from services.rate_limiter import limiter, get_rate_limit
+from services.playlist_engine import build_playlist_document
+from services.playlist_snapshot import PlaylistSnapshotStore, build_playlist_body
+from services.screen_events import event_stream
+from services.heartbeat_buffer import HeartbeatBuffer
+from services.play_ingestion import parse_play_batch, ingest_plays
+from services.play_counters import PlayCounters
+from services.impression_aggregator import ImpressionAggregator
+from services import stat_rollups
 from services.input_validator import (
     validate_json_request,
     handle_validation_errors,
@@ -180,196 +187,56 @@ def api_screen_mode():
 @limiter.limit(get_rate_limit("player", "playlist"))
 @screen_jwt_required
 def api_screen_playlist():
-    db.session.expire_all()
+    # Same compiled snapshot as the web player; `since=<version>` returns a delta.
+    snapshot = PlaylistSnapshotStore.get(g.screen_id, build_playlist_document)
     
-    screen = Screen.query.get(g.screen_id)
-    
-    if not screen:
+    if not snapshot:
         return jsonify({
             "error": "Screen not found",
             "code": "SCREEN_NOT_FOUND"
         }), 404
     
-    if screen.current_mode == "iptv" and screen.iptv_enabled and screen.current_iptv_channel:
-        from services.overlay_service import sync_broadcast_overlays, get_active_overlays_for_screen
-        
-        sync_broadcast_overlays(screen)
-        active_overlay_objects = get_active_overlays_for_screen(screen.id)
-        iptv_overlays = [o.to_dict() for o in active_overlay_objects]
-        iptv_overlays.sort(key=lambda x: x.get("priority", 50), reverse=True)
-        
-        return jsonify({
-            "screen": {
-                "id": screen.id,
-                "name": screen.name,
-                "resolution": f"{screen.resolution_width}x{screen.resolution_height}",
-                "orientation": screen.orientation
-            },
-            "mode": "iptv",
-            "iptv": {
-                "url": screen.get_iptv_url(),
-                "name": screen.current_iptv_channel_name
-            },
-            "playlist": [],
-            "overlays": iptv_overlays,
-            "timestamp": datetime.utcnow().isoformat()
-        })
-    
-    playlist = []
-    
-    current_hour = datetime.now().hour
-    current_period = None
-    for period in screen.time_periods:
-        if period.start_hour <= period.end_hour:
-            if period.start_hour <= current_hour < period.end_hour:
-                current_period = period
-                break
-        else:
-            if current_hour >= period.start_hour or current_hour < period.end_hour:
-                current_period = period
-                break
-    
-    paid_contents = Content.query.join(Booking).filter(
-        Content.screen_id == screen.id,
-        Content.status == "approved",
-        Content.in_playlist == True,
-        Booking.status == "active",
-        Booking.plays_completed < Booking.num_plays
-    ).all()
-    
-    for content in paid_contents:
-        if current_period and content.booking.time_period_id:
-            if content.booking.time_period_id != current_period.id:
-                continue
-        
-        duration = content.booking.slot_duration if content.booking else (content.duration_seconds or 10)
-        remaining = content.booking.num_plays - content.booking.plays_completed if content.booking else 0
-        
-        playlist.append({
-            "id": content.id,
-            "type": content.content_type,
-            "url": f"/{content.file_path}",
-            "duration": duration,
-            "priority": 100,
-            "category": "paid",
-            "booking_id": content.booking.id if content.booking else None,
-            "remaining_plays": remaining,
-            "name": content.original_filename or content.filename
-        })
-    
-    from models import InternalContent, Filler, Broadcast
-    
-    internal_contents = InternalContent.query.filter_by(
-        screen_id=screen.id,
-        is_active=True,
-        in_playlist=True
-    ).all()
-    
-    today = datetime.now().date()
-    for internal in internal_contents:
-        if internal.start_date and internal.start_date > today:
-            continue
-        if internal.end_date and internal.end_date < today:
-            continue
-        
-        playlist.append({
-            "id": internal.id,
-            "type": internal.content_type,
-            "url": f"/{internal.file_path}",
-            "duration": internal.duration_seconds or 10,
-            "priority": internal.priority,
-            "category": "internal",
-            "name": internal.name
-        })
-    
-    fillers = Filler.query.filter_by(
-        screen_id=screen.id,
-        is_active=True,
-        in_playlist=True
-    ).all()
-    
-    for filler in fillers:
-        playlist.append({
-            "id": filler.id,
-            "type": filler.content_type,
-            "url": f"/{filler.file_path}",
-            "duration": filler.duration_seconds or 10,
-            "priority": 20,
-            "category": "filler",
-            "name": filler.filename
-        })
-    
-    playlist.sort(key=lambda x: x["priority"], reverse=True)
-    
-    from services.overlay_service import sync_broadcast_overlays, get_active_overlays_for_screen
-    
-    sync_broadcast_overlays(screen)
-    active_overlay_objects = get_active_overlays_for_screen(screen.id)
-    active_overlays = [o.to_dict() for o in active_overlay_objects]
-    active_overlays.sort(key=lambda x: x.get("priority", 50), reverse=True)
-    
-    active_broadcasts = Broadcast.query.filter_by(is_active=True).all()
-    for broadcast in active_broadcasts:
-        if broadcast.applies_to_screen(screen):
-            if broadcast.broadcast_type == "content":
-                playlist.append(broadcast.to_content_dict())
-    
-    active_ad_contents = AdContent.query.filter(
-        AdContent.status.in_([AdContent.STATUS_ACTIVE, AdContent.STATUS_SCHEDULED])
-    ).all()
+    if snapshot.etag in request.if_none_match:
+        return Response(status=304)
     
-    for ad in active_ad_contents:
-        ad.update_status()
-        if ad.is_currently_active() and ad.applies_to_screen(screen):
-            ad_dict = ad.to_content_dict()
-            ad_dict["priority"] = 50
-            playlist.append(ad_dict)
+    response_data = build_playlist_body(snapshot, request.args.get("since", type=int))
+    response_data["timestamp"] = datetime.utcnow().isoformat()
     
-    db.session.commit()
-    
-    playlist.sort(key=lambda x: x["priority"], reverse=True)
-    
-    return jsonify({
-        "screen": {
-            "id": screen.id,
-            "name": screen.name,
-            "resolution": f"{screen.resolution_width}x{screen.resolution_height}",
-            "orientation": screen.orientation
-        },
-        "mode": "playlist",
-        "playlist": playlist,
-        "overlays": active_overlays,
-        "timestamp": datetime.utcnow().isoformat()
-    })
+    response = jsonify(response_data)
+    response.headers["ETag"] = f'"{snapshot.etag}"'
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@mobile_api_bp.route('/screen/events', methods=['GET'])
+@limiter.limit(get_rate_limit("player", "events"))
+@screen_jwt_required
+def api_screen_events():
+    screen_id = g.screen_id
+    response = Response(
+        event_stream(screen_id, lambda: PlaylistSnapshotStore.next_boundary(screen_id)),
+        mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
 @mobile_api_bp.route('/screen/heartbeat', methods=['POST'])
 @limiter.limit(get_rate_limit("player", "heartbeat"))
 @screen_jwt_required
 def api_screen_heartbeat():
-    screen = Screen.query.get(g.screen_id)
-    
-    if not screen:
-        return jsonify({
-            "error": "Screen not found",
-            "code": "SCREEN_NOT_FOUND"
-        }), 404
-    
     data = request.get_json() or {}
     status = data.get("status", "online")
     
     if status not in ["online", "playing", "offline"]:
         status = "online"
     
-    screen.last_heartbeat = datetime.utcnow()
-    screen.status = status
-    
-    log = HeartbeatLog(
-        screen_id=screen.id,
-        status=status
-    )
-    db.session.add(log)
-    db.session.commit()
+    if not HeartbeatBuffer.accept(g.screen_id, status):
+        return jsonify({
+            "error": "Screen not found",
+            "code": "SCREEN_NOT_FOUND"
+        }), 404
     
     return jsonify({
         "success": True,
@@ -407,32 +274,62 @@ def api_screen_log_play():
     )
     db.session.add(stat)
     
-    exhausted = False
+    exhausted = []
     if category == "paid" and booking_id:
-        booking = Booking.query.get(booking_id)
-        if booking:
-            booking.plays_completed += 1
-            if booking.plays_completed >= booking.num_plays:
-                booking.status = "completed"
-                exhausted = True
+        exhausted = PlayCounters.count(screen.id, {booking_id: 1})
     
+    impressions = None
     if category == "ad_content" and content_id:
-        from models.ad_content import AdContentStat
         ad_id_str = str(content_id)
         if ad_id_str.startswith("ad_"):
             ad_id = int(ad_id_str.replace("ad_", ""))
-            AdContentStat.record_impression(
-                ad_content_id=ad_id,
-                screen_id=screen.id,
-                organization_id=screen.organization_id,
-                duration=duration
-            )
+            impressions = {(ad_id, datetime.utcnow().date()): (1, duration)}
     
     db.session.commit()
     
+    if exhausted:
+        PlayCounters.reconcile(exhausted)
+    if impressions:
+        ImpressionAggregator.record(screen.id, screen.organization_id, impressions)
+    
     return jsonify({
         "success": True,
-        "exhausted": exhausted
+        "exhausted": bool(exhausted)
+    })
+
+
+@mobile_api_bp.route('/screen/log-plays', methods=['POST'])
+@limiter.limit(get_rate_limit("player", "log_plays"))
+@screen_jwt_required
+@validate_json_request("plays")
+@handle_validation_errors
+def api_screen_log_plays():
+    screen = db.session.query(Screen.id, Screen.organization_id).filter(Screen.id == g.screen_id).first()
+    
+    if not screen:
+        return jsonify({
+            "error": "Screen not found",
+            "code": "SCREEN_NOT_FOUND"
+        }), 404
+    
+    plays, rejected = parse_play_batch(request.get_json())
+    
+    try:
+        exhausted = ingest_plays(screen.id, screen.organization_id, plays)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error committing play batch: {str(e)}")
+        return jsonify({
+            "error": "Database error",
+            "code": "DATABASE_ERROR"
+        }), 500
+    
+    return jsonify({
+        "success": True,
+        "accepted": len(plays),
+        "rejected": rejected,
+        "exhausted": bool(exhausted),
+        "exhausted_booking_ids": exhausted
     })
 
 
@@ -502,30 +399,16 @@ def api_screen_stats(screen_id):
     days = validate_positive_integer(request.args.get("days", 7), "days", min_val=1, max_val=90)
     
     today = datetime.utcnow().date()
-    start_date = today - timedelta(days=days)
-    
-    daily_plays = db.session.query(
-        func.date(StatLog.played_at).label("date"),
-        func.count(StatLog.id).label("count")
-    ).filter(
-        StatLog.screen_id == screen_id,
-        StatLog.played_at >= start_date
-    ).group_by(func.date(StatLog.played_at)).all()
-    
-    category_stats = db.session.query(
-        StatLog.content_category,
-        func.count(StatLog.id).label("count")
-    ).filter(
-        StatLog.screen_id == screen_id,
-        StatLog.played_at >= start_date
-    ).group_by(StatLog.content_category).all()
+    start_date = datetime.combine(today - timedelta(days=days), time.min)
+    
+    daily_plays, category_stats = stat_rollups.daily_and_category_plays([screen_id], start_date)
     
     return jsonify({
         "screen_id": screen_id,
         "period_days": days,
-        "daily_plays": [{"date": str(d.date), "count": d.count} for d in daily_plays],
-        "category_stats": [{"category": c.content_category, "count": c.count} for c in category_stats],
-        "total_plays": sum(d.count for d in daily_plays)
+        "daily_plays": [{"date": str(day), "count": count} for day, count in daily_plays],
+        "category_stats": [{"category": category, "count": count} for category, count in category_stats],
+        "total_plays": sum(count for _, count in daily_plays)
     })
 
 
@@ -573,5 +456,6 @@ def api_health():
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "version": "1.0"
+        "version": "1.0",
+        "heartbeats": HeartbeatBuffer.stats()
     })
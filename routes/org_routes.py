@@ -9,9 +9,10 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 from functools import wraps
 from app import db
-from models import Screen, TimeSlot, TimePeriod, Content, Booking, Filler, InternalContent, StatLog, ScreenOverlay
+from models import Screen, TimeSlot, TimePeriod, Content, Booking, Filler, InternalContent, ScreenOverlay
 from services.translation_service import t
 from services.input_validator import is_safe_redirect_url
+from services import stat_rollups
 from datetime import datetime, timedelta
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload
@@ -428,9 +429,7 @@ def screen_detail(screen_id):
         Booking.created_at >= week_ago
     ).scalar() or 0
     
-    total_plays = db.session.query(func.count(StatLog.id)).filter(
-        StatLog.screen_id == screen_id
-    ).scalar() or 0
+    total_plays = stat_rollups.total_plays([screen_id])
     
     pending_count = Content.query.filter_by(
         screen_id=screen_id,
@@ -1263,22 +1262,24 @@ def stats():
         Booking.start_date,
         Booking.end_date,
         Booking.num_plays,
-        func.count(StatLog.id).label('play_count')
+        Content.screen_id
     ).select_from(Content).join(
         Screen, Content.screen_id == Screen.id
     ).outerjoin(
         Booking, Booking.content_id == Content.id
-    ).outerjoin(
-        StatLog, StatLog.content_id == Content.id
     ).filter(
         Screen.organization_id == org.id
-    ).group_by(
-        Content.id, Content.client_name, Content.original_filename, 
-        Content.content_type, Content.status, Content.created_at,
-        Screen.name, Booking.id, Booking.total_price, 
-        Booking.start_date, Booking.end_date, Booking.num_plays
     ).order_by(Content.created_at.desc()).all()
     
+    plays = stat_rollups.play_counts(
+        ('screen_id', 'content_id'),
+        [screen_id for screen_id, in db.session.query(Screen.id).filter(Screen.organization_id == org.id)]
+    )
+    ad_stats = [
+        dict(ad._asdict(), play_count=plays.get((ad.screen_id, ad.id), (0, 0.0))[0])
+        for ad in ad_stats
+    ]
+    
     return render_template('org/stats.html',
         daily_revenue=daily_revenue,
         screen_stats=screen_stats,
@@ -1529,43 +1530,19 @@ def add_internal_to_playlist(internal_id):
 @login_required
 @paid_org_required
 def download_receipt_image(booking_id):
-    from flask import send_file, Response
-    from services.receipt_generator import generate_receipt_image
-    from services.qr_service import generate_qr_base64
-    import io
-    
-    booking = Booking.query.join(Screen).filter(
-        Booking.id == booking_id,
-        Screen.organization_id == current_user.organization_id
-    ).first_or_404()
-    
-    screen = booking.screen
-    content = booking.content
-    
-    if not content:
-        flash('Contenu non trouvé.', 'error')
-        return redirect(url_for('org.booking_history'))
-    
-    booking_url = url_for('booking.screen_booking', screen_code=screen.unique_code, _external=True)
-    qr_base64 = generate_qr_base64(booking_url)
-    
-    img = generate_receipt_image(booking, screen, content, qr_base64)
-    
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    
-    filename = f"recu_{booking.reservation_number or booking_id}.png"
-    return send_file(buffer, mimetype='image/png', as_attachment=True, download_name=filename)
+    return _send_receipt(booking_id, 'png')
 
 
 @org_bp.route('/booking/<int:booking_id>/receipt/pdf')
 @login_required
 @paid_org_required
 def download_receipt_pdf(booking_id):
+    return _send_receipt(booking_id, 'pdf')
+
+
+def _send_receipt(booking_id, kind):
     from flask import send_file
-    from services.receipt_generator import generate_receipt_pdf
-    from services.qr_service import generate_qr_base64
+    from services.render_service import receipt_file, MIMETYPES, RenderBusyError, RenderTimeoutError
     
     booking = Booking.query.join(Screen).filter(
         Booking.id == booking_id,
@@ -1573,20 +1550,20 @@ def download_receipt_pdf(booking_id):
     ).first_or_404()
     
     screen = booking.screen
-    content = booking.content
     
-    if not content:
+    if not booking.content:
         flash('Contenu non trouvé.', 'error')
         return redirect(url_for('org.booking_history'))
     
     booking_url = url_for('booking.screen_booking', screen_code=screen.unique_code, _external=True)
-    qr_base64 = generate_qr_base64(booking_url)
-    
-    pdf_buffer = generate_receipt_pdf(booking, screen, content, qr_base64)
-    pdf_buffer.seek(0)
+    try:
+        path = receipt_file(booking, kind, qr_url=booking_url)
+    except (RenderBusyError, RenderTimeoutError):
+        flash('Le reçu est en cours de génération, veuillez réessayer dans un instant.', 'error')
+        return redirect(url_for('org.booking_history'))
     
-    filename = f"recu_{booking.reservation_number or booking_id}.pdf"
-    return send_file(pdf_buffer, mimetype='application/pdf', as_attachment=True, download_name=filename)
+    filename = f"recu_{booking.reservation_number or booking_id}.{kind}"
+    return send_file(path, mimetype=MIMETYPES[kind], as_attachment=True, download_name=filename)
 
 
 @org_bp.route('/screen/<int:screen_id>/availability')
@@ -8,14 +8,18 @@
 # pyright: reportArgumentType=false
 from flask import Blueprint, render_template, redirect, url_for, flash, request, session, jsonify, Response, make_response
 from app import db
-from models import Screen, Content, Booking, Filler, InternalContent, StatLog, HeartbeatLog, ScreenOverlay, Broadcast
-from models.ad_content import AdContent, AdContentStat
+from models import Screen, Content, StatLog, ScreenOverlay
 from services.translation_service import t
-from services.input_validator import is_safe_url
+from services.input_validator import is_safe_url, handle_validation_errors
 from services.rate_limiter import limiter, get_rate_limit
+from services.playlist_snapshot import PlaylistSnapshotStore, build_playlist_body
+from services.screen_events import ScreenEventBus, event_stream, EVENT_MODE, ALL_SCREENS
+from services.playlist_engine import build_playlist_document
+from services.heartbeat_buffer import HeartbeatBuffer
+from services.play_ingestion import parse_play_batch, ingest_plays
+from services.play_counters import PlayCounters
+from services.impression_aggregator import ImpressionAggregator
 from datetime import datetime
-from sqlalchemy.orm import joinedload
-from sqlalchemy import or_, and_, func
 import time
 import urllib.parse
 import urllib3
@@ -25,8 +29,6 @@ import socket
 import ipaddress
 import json
 import hashlib
-
-import os as _os
 import threading
 
 urllib3.disable_warnings()
@@ -34,17 +36,6 @@ urllib3.disable_warnings()
 logger = logging.getLogger(__name__)
 
 
-def safe_content_url(file_path):
-    """Sanitize file path for URL generation, preventing path traversal."""
-    if not file_path:
-        return '/static/img/placeholder.png'
-    # Normalize and remove any path traversal
-    clean = _os.path.normpath(file_path).replace('\\', '/')
-    if clean.startswith('/') or '..' in clean:
-        return '/static/img/placeholder.png'
-    return f'/{clean}'
-
-
 player_bp = Blueprint('player', __name__)
 
 # Channel change locks per screen to prevent concurrent channel switches
@@ -68,6 +59,17 @@ def invalidate_screen_mode_cache(screen_id):
     SCREEN_MODE_CACHE.pop(screen_id, None)
 
 
+def _on_screen_event(screen_id, event_name, data, remote):
+    if event_name == EVENT_MODE:
+        if screen_id == ALL_SCREENS:
+            SCREEN_MODE_CACHE.clear()
+        else:
+            invalidate_screen_mode_cache(screen_id)
+
+
+ScreenEventBus.add_listener(_on_screen_event)
+
+
 def validate_session_screen_id(session_ttl_minutes=30):
     """
     Validate session screen_id with TTL enforcement.
@@ -201,296 +203,22 @@ def get_screen_mode():
 def get_playlist():
     if 'screen_id' not in session:
         return jsonify({'error': t('flash.not_authenticated')}), 401
-    
-    # Optimization: Removed aggressive db.session.expire_all()
-    
-    screen = db.session.query(Screen).options(
-        joinedload(Screen.time_periods),
-        joinedload(Screen.organization)
-    ).filter_by(id=session['screen_id']).first()
-    if not screen:
-        return jsonify({'error': t('flash.screen_not_found')}), 404
-    
-    response_data = {}
-
-    try:
-        if screen.current_mode == 'iptv' and screen.iptv_enabled and screen.current_iptv_channel:
-            from services.overlay_service import sync_broadcast_overlays, get_active_overlays_for_screen
-
-            sync_broadcast_overlays(screen)
-
-            active_overlay_objects = get_active_overlays_for_screen(screen.id)
-            iptv_overlays = [o.to_dict() for o in active_overlay_objects]
-
-            iptv_overlays.sort(key=lambda x: x.get('priority', 50), reverse=True)
-
-            response_data = {
-                'screen': {
-                    'id': screen.id,
-                    'name': screen.name,
-                    'resolution': f'{screen.resolution_width}x{screen.resolution_height}',
-                    'orientation': screen.orientation
-                },
-                'mode': 'iptv',
-                'iptv': {
-                    'url': screen.get_iptv_url(),
-                    'name': screen.current_iptv_channel_name
-                },
-                'playlist': [],
-                'overlays': iptv_overlays
-            }
-        else:
-            playlist = []
-
-            current_hour = datetime.now().hour
-            current_period = None
-            for period in screen.time_periods:
-                if period.start_hour == period.end_hour:
-                    # 24-hour period (e.g., 6h-6h means all day)
-                    current_period = period
-                    break
-                elif period.start_hour < period.end_hour:
-                    # Normal daytime period (e.g., 9h-17h)
-                    if period.start_hour <= current_hour < period.end_hour:
-                        current_period = period
-                        break
-                else:
-                    # Overnight period (e.g., 22h-6h)
-                    if current_hour >= period.start_hour or current_hour < period.end_hour:
-                        current_period = period
-                        break
-
-            # Optimized query with joinedload
-            paid_contents = Content.query.options(joinedload(Content.booking)).join(Booking).filter(
-                Content.screen_id == screen.id,
-                Content.status == 'approved',
-                Content.in_playlist == True,
-                Booking.status == 'active',
-                Booking.plays_completed < Booking.num_plays
-            ).all()
-
-            for content in paid_contents:
-                if not content.booking:
-                    continue  # Skip orphaned content (booking deleted without cascade)
-
-                # Respect scheduled start_date/start_time - don't show before reservation period starts
-                if not content.booking.is_playable_now():
-                    continue
-
-                if current_period and content.booking.time_period_id:
-                    if content.booking.time_period_id != current_period.id:
-                        continue
-
-                duration = content.booking.slot_duration if content.booking.slot_duration and content.booking.slot_duration > 0 else (content.duration_seconds or 10)
-
-                # Calculate dynamic plays if validation was late
-                target_plays = content.booking.calculate_dynamic_plays()
-                remaining = target_plays - content.booking.plays_completed
-
-                playlist.append({
-                    'id': content.id,
-                    'type': content.content_type,
-                    'url': safe_content_url(content.file_path),
-                    'duration': duration,
-                    'priority': 100,
-                    'category': 'paid',
-                    'booking_id': content.booking.id,
-                    'remaining_plays': remaining,
-                    'name': content.original_filename or content.filename
-                })
-
-            internal_contents = InternalContent.query.filter_by(
-                screen_id=screen.id,
-                is_active=True,
-                in_playlist=True
-            ).all()
-
-            today = datetime.utcnow().date()
-            for internal in internal_contents:
-                if internal.start_date and internal.start_date > today:
-                    continue
-                # end_date is inclusive: content plays on end_date day, removed on end_date + 1
-                if internal.end_date and internal.end_date < today:
-                    continue
-
-                playlist.append({
-                    'id': internal.id,
-                    'type': internal.content_type,
-                    'url': safe_content_url(internal.file_path),
-                    'duration': internal.duration_seconds or 10,
-                    'priority': internal.priority,
-                    'category': 'internal',
-                    'name': internal.name
-                })
-
-            fillers = Filler.query.filter_by(
-                screen_id=screen.id,
-                is_active=True,
-                in_playlist=True
-            ).all()
-
-            for filler in fillers:
-                playlist.append({
-                    'id': filler.id,
-                    'type': filler.content_type,
-                    'url': safe_content_url(filler.file_path),
-                    'duration': filler.duration_seconds or 10,
-                    'priority': 20,
-                    'category': 'filler',
-                    'name': filler.filename
-                })
-
-            playlist.sort(key=lambda x: (-x['priority'], x.get('id', 0), x.get('name', '')))
-
-            from services.overlay_service import sync_broadcast_overlays, get_active_overlays_for_screen
-
-            sync_broadcast_overlays(screen)
-
-            active_overlay_objects = get_active_overlays_for_screen(screen.id)
-            active_overlays = [o.to_dict() for o in active_overlay_objects]
-
-            active_overlays.sort(key=lambda x: x.get('priority', 50), reverse=True)
-
-            active_broadcasts = Broadcast.get_active_broadcasts_query(screen, now=datetime.utcnow()).all()
-            for broadcast in active_broadcasts:
-                if broadcast.broadcast_type == 'content':
-                    playlist.append(broadcast.to_content_dict())
-
-            # Optimization: Efficiently fetch relevant ads
-            now = datetime.utcnow()
-            is_paid_org = screen.organization.is_paid if screen.organization else False
-            org_id = screen.organization_id
-            org_city = screen.organization.city.lower() if screen.organization and screen.organization.city else ''
-            org_country = screen.organization.country if screen.organization else ''
-
-            # Build filter conditions
-            status_filter = AdContent.status.in_([AdContent.STATUS_ACTIVE, AdContent.STATUS_SCHEDULED])
-
-            time_filter = or_(
-                AdContent.schedule_type == AdContent.SCHEDULE_IMMEDIATE,
-                and_(
-                    AdContent.schedule_type == AdContent.SCHEDULE_PERIOD,
-                    or_(AdContent.start_date == None, AdContent.start_date <= now),
-                    or_(AdContent.end_date == None, AdContent.end_date >= now)
-                )
-            )
-
-            org_type_filter = or_(
-                AdContent.target_org_type == AdContent.ORG_TYPE_ALL,
-                AdContent.target_org_type == (AdContent.ORG_TYPE_PAID if is_paid_org else AdContent.ORG_TYPE_FREE)
-            )
-
-            target_filter = or_(
-                and_(AdContent.target_type == AdContent.TARGET_SCREEN, AdContent.target_screen_id == screen.id),
-                and_(AdContent.target_type == AdContent.TARGET_ORGANIZATION, AdContent.target_organization_id == org_id),
-                and_(AdContent.target_type == AdContent.TARGET_CITY,
-                     func.lower(AdContent.target_city) == org_city,
-                     AdContent.target_country == org_country),
-                and_(AdContent.target_type == AdContent.TARGET_COUNTRY, AdContent.target_country == org_country),
-                and_(AdContent.target_type == AdContent.TARGET_SCREENS,
-                     AdContent.screens.any(id=screen.id)
-                )
-            )
-
-            active_ad_contents = AdContent.query.filter(
-                status_filter,
-                time_filter,
-                org_type_filter,
-                target_filter
-            ).all()
-
-            any_status_changed = False
-            for ad in active_ad_contents:
-                # Final check in Python (handles edge cases and logic not fully covered by SQL)
-                # We skip detailed targeting checks because the SQL query already filters by target.
-                # This avoids N+1 queries for TARGET_SCREENS.
-                if not ad.applies_to_screen(screen, check_targeting=False):
-                    continue
-
-                old_status = ad.status
-                ad.update_status()
-                if ad.status != old_status:
-                    any_status_changed = True
-
-                if ad.is_currently_active():
-                    ad_dict = ad.to_content_dict()
-                    ad_dict['priority'] = 50
-                    playlist.append(ad_dict)
-
-            # Always commit if any ad was processed, to ensure all in-memory
-            # changes (including the first status change) are persisted
-            if any_status_changed:
-                try:
-                    db.session.commit()
-                except Exception:
-                    db.session.rollback()
-
-            playlist.sort(key=lambda x: (-x['priority'], x.get('id', 0), x.get('name', '')))
-
-            response_data = {
-                'screen': {
-                    'id': screen.id,
-                    'name': screen.name,
-                    'resolution': f'{screen.resolution_width}x{screen.resolution_height}',
-                    'orientation': screen.orientation
-                },
-                'mode': 'playlist',
-                'playlist': playlist,
-                'overlays': active_overlays
-            }
-    except Exception as e:
-        logger.error(f"Error generating playlist for screen {screen.id}: {str(e)}")
-        # SEC/RESILIENCE: Never return a raw error or empty playlist. Ensure screen stays alive with Fillers.
-        db.session.rollback()
 
-        fallback_fillers = Filler.query.filter_by(
-            screen_id=screen.id,
-            is_active=True,
-            in_playlist=True
-        ).all()
-
-        fallback_playlist = []
-        for filler in fallback_fillers:
-            fallback_playlist.append({
-                'id': filler.id,
-                'type': filler.content_type,
-                'url': safe_content_url(filler.file_path),
-                'duration': filler.duration_seconds or 10,
-                'priority': 20,
-                'category': 'filler',
-                'name': filler.filename
-            })
-
-        # Try to fetch overlays even in fallback mode
-        fallback_overlays = []
-        try:
-            from services.overlay_service import get_active_overlays_for_screen
-            fallback_overlay_objects = get_active_overlays_for_screen(screen.id)
-            fallback_overlays = [o.to_dict() for o in fallback_overlay_objects]
-        except Exception:
-            pass  # Overlays are non-critical in fallback mode
-
-        response_data = {
-            'screen': {
-                'id': screen.id,
-                'name': screen.name,
-                'resolution': f'{screen.resolution_width}x{screen.resolution_height}',
-                'orientation': screen.orientation
-            },
-            'mode': 'playlist',
-            'playlist': fallback_playlist,
-            'overlays': fallback_overlays,
-            'error_recovered': True
-        }
+    # Served from the precompiled snapshot; the DB is only hit on rebuilds.
+    snapshot = PlaylistSnapshotStore.get(session['screen_id'], build_playlist_document)
+    if not snapshot:
+        return jsonify({'error': t('flash.screen_not_found')}), 404
 
-    # ETag generation (timestamp excluded from hash to ensure stable ETags)
-    content_str = json.dumps(response_data, sort_keys=True, default=str)
-    etag = hashlib.md5(content_str.encode('utf-8')).hexdigest()
+    # ETag comes from the snapshot version (bumped only when content changes)
+    etag = snapshot.etag
 
     if etag in request.if_none_match:
         return Response(status=304)
 
-    # Add timestamp AFTER ETag check (not part of the content hash)
+    # Only what changed since the client's version when it sends `since`
+    response_data = build_playlist_body(snapshot, request.args.get('since', type=int))
+
+    # Add timestamp AFTER ETag check (not part of the snapshot)
     response_data['server_time'] = datetime.utcnow().isoformat()
     
     response = make_response(jsonify(response_data))
@@ -499,28 +227,39 @@ def get_playlist():
     return response
 
 
+@player_bp.route('/api/events')
+@limiter.limit(get_rate_limit('player', 'events'))
+def screen_events():
+    """
+    Server-Sent Events stream telling the player when to refetch.
+    Events: 'playlist' (content changed), 'mode' (playlist/IPTV switch),
+    'broadcast' (override broadcast activated). Polling remains the fallback.
+    """
+    is_valid, screen, error = validate_session_screen_id()
+    if not is_valid:
+        return jsonify({'error': t('flash.not_authenticated')}), 401
+
+    screen_id = screen.id
+    response = Response(
+        event_stream(screen_id, lambda: PlaylistSnapshotStore.next_boundary(screen_id)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
+
 @player_bp.route('/api/heartbeat', methods=['POST'])
 @limiter.limit(get_rate_limit('player', 'heartbeat'))
 def heartbeat():
     if 'screen_id' not in session:
         return jsonify({'error': t('flash.not_authenticated')}), 401
     
-    screen = Screen.query.get(session['screen_id'])
-    if not screen:
-        return jsonify({'error': t('flash.screen_not_found')}), 404
-    
     data = request.get_json() or {}
     status = data.get('status', 'online')
     
-    screen.last_heartbeat = datetime.utcnow()
-    screen.status = status
-    
-    log = HeartbeatLog(
-        screen_id=screen.id,
-        status=status
-    )
-    db.session.add(log)
-    db.session.commit()
+    if not HeartbeatBuffer.accept(session['screen_id'], status):
+        return jsonify({'error': t('flash.screen_not_found')}), 404
     
     return jsonify({
         'success': True,
@@ -554,35 +293,17 @@ def log_play():
     )
     db.session.add(stat)
     
-    exhausted = False
+    exhausted = []
+    impressions = None
     if category == 'paid' and booking_id:
-        # Atomic increment to prevent race conditions with concurrent screens
-        rows_updated = db.session.query(Booking).filter(
-            Booking.id == booking_id,
-            Booking.status == 'active'
-        ).update(
-            {
-                Booking.plays_completed: Booking.plays_completed + 1
-            },
-            synchronize_session='fetch'
-        )
-        if rows_updated > 0:
-            # Check if booking should be marked completed
-            booking = Booking.query.get(booking_id)
-            if booking and booking.plays_completed >= booking.num_plays:
-                booking.status = 'completed'
-                exhausted = True
+        # Counted outside the bookings row, capped at the booking's play limit
+        exhausted = PlayCounters.count(screen.id, {booking_id: 1})
     
     if category == 'ad_content' and content_id:
         ad_id_str = str(content_id)
         if ad_id_str.startswith('ad_'):
             ad_id = int(ad_id_str.replace('ad_', ''))
-            AdContentStat.record_impression(
-                ad_content_id=ad_id,
-                screen_id=screen.id,
-                organization_id=screen.organization_id,
-                duration=duration or 0
-            )
+            impressions = {(ad_id, datetime.utcnow().date()): (1, duration or 0)}
 
     try:
         db.session.commit()
@@ -591,7 +312,41 @@ def log_play():
         logger.error(f"Error committing play log: {str(e)}")
         return jsonify({'success': False, 'error': 'Database error'}), 500
 
-    return jsonify({'success': True, 'exhausted': exhausted})
+    if exhausted:
+        PlayCounters.reconcile(exhausted)
+    if impressions:
+        ImpressionAggregator.record(screen.id, screen.organization_id, impressions)
+
+    return jsonify({'success': True, 'exhausted': bool(exhausted)})
+
+
+@player_bp.route('/api/log-plays', methods=['POST'])
+@limiter.limit(get_rate_limit('player', 'log_plays'))
+@handle_validation_errors
+def log_plays():
+    if 'screen_id' not in session:
+        return jsonify({'error': t('flash.not_authenticated')}), 401
+    
+    screen = db.session.query(Screen.id, Screen.organization_id).filter(Screen.id == session['screen_id']).first()
+    if not screen:
+        return jsonify({'error': t('flash.screen_not_found')}), 404
+    
+    plays, rejected = parse_play_batch(request.get_json(silent=True))
+    
+    try:
+        exhausted = ingest_plays(screen.id, screen.organization_id, plays)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error committing play batch: {str(e)}")
+        return jsonify({'success': False, 'error': 'Database error'}), 500
+    
+    return jsonify({
+        'success': True,
+        'accepted': len(plays),
+        'rejected': rejected,
+        'exhausted': bool(exhausted),
+        'exhausted_booking_ids': exhausted
+    })
 
 
 @player_bp.route('/api/stream-proxy')
@@ -836,30 +591,18 @@ def tv_stream(screen_code):
     
     current_url = HLSConverter.get_current_url(screen_code)
     if current_url and current_url != source_url:
-        logger.info(f'[{screen_code}] CHANNEL CHANGED! Stopping old stream...')
-        HLSConverter.stop_existing_process(screen_code)
-        time.sleep(0.3)
+        logger.info(f'[{screen_code}] CHANNEL CHANGED! Leaving old stream...')
     
     try:
-        if not HLSConverter.is_running(screen_code):
+        # Subscribing (again) renews the screen's place on the channel's shared encoder
+        if current_url != source_url:
             logger.info(f'[{screen_code}] Starting new HLS conversion for: {channel_name}')
-            HLSConverter.start_conversion(source_url, screen_code, wait_for_manifest=False)
-
-        manifest_path = HLSConverter.get_manifest_path(screen_code)
+        HLSConverter.start_conversion(source_url, screen_code, wait_for_manifest=False)
 
-        # Poll with exponential backoff for up to 15 seconds
-        start_time = time.time()
-        poll_interval = 0.1
         max_wait = 15
+        manifest_ready = HLSConverter.wait_for_manifest(source_url, max_wait)
 
-        while time.time() - start_time < max_wait:
-            if manifest_path.exists():
-                break
-            time.sleep(poll_interval)
-            # Exponential backoff but cap at 0.5s
-            poll_interval = min(0.5, poll_interval * 1.2)
-
-        if not manifest_path.exists():
+        if not manifest_ready:
             # Watchdog: Check if FFmpeg process crashed
             if not HLSConverter.is_running(screen_code):
                 logger.error(f'[{screen_code}] FFmpeg process crashed or failed to start. Falling back to Fillers.')
@@ -881,7 +624,7 @@ def tv_stream(screen_code):
             logger.warning(f'[{screen_code}] Manifest not ready after {max_wait}s (still processing)')
             return jsonify({'status': 'processing', 'message': 'Stream conversion in progress'}), 202
 
-        manifest_content = HLSConverter.get_fresh_manifest(screen_code)
+        manifest_content = HLSConverter.get_fresh_manifest(source_url)
 
         if not manifest_content:
             logger.warning(f'[{screen_code}] Manifest exists but is empty')
@@ -916,7 +659,10 @@ def tv_segment(screen_code, segment_name):
     if not screen or screen.id != session['screen_id']:
         return jsonify({'error': t('flash.not_authenticated')}), 403
     
-    segment_path = HLSConverter.get_segment_path(screen_code, segment_name)
+    # Screens on the same channel share its segments
+    segment_path = None
+    if screen.current_iptv_channel:
+        segment_path = HLSConverter.get_segment_path(screen.current_iptv_channel, segment_name)
     
     if not segment_path:
         logger.warning(f'[{screen_code}] Segment not found: {segment_name}')
@@ -999,10 +745,7 @@ def change_channel(screen_code):
         
         logger.info(f'[{screen_code}] Channel change request: {channel_name}')
         
-        logger.info(f'[{screen_code}] Stopping old FFmpeg process...')
-        HLSConverter.stop_existing_process(screen_code)
-        time.sleep(0.5)
-        
+        # The screen leaves its old channel, stopped unless other screens watch it
         logger.info(f'[{screen_code}] Starting new FFmpeg process...')
         try:
             manifest_path = HLSConverter.convert_mpegts_to_hls_file(
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark calculate_availability over a 365-day range with many bookings.
+
+Compares the reference per-cell computation (get_reserved_seconds_for_period
+for every day x period, each rescanning the booking list) with the engine
+calculate_availability now uses, and checks both give the same reserved
+seconds. Uses in-memory objects; no database rows are written.
+Run from project root: python scripts/bench_availability.py [N ...]
+"""
+import sys
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# Never run against the configured database
+_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_db_file.close()
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_file.name}'
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-jwt-secret')
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app  # noqa: F401  (initializes models before the services import them)
+from services.availability_service import calculate_availability, get_reserved_seconds_for_period
+
+DAYS = 365
+START = date.today() + timedelta(days=7)
+REPEATS = 3
+
+
+def make_screen():
+    periods = [SimpleNamespace(id=i + 1, name=f"P{i + 1}", start_hour=h, end_hour=h + 4, price_multiplier=1.0)
+               for i, h in enumerate((6, 10, 14, 18))]
+    slots = [SimpleNamespace(content_type='image', duration_seconds=15)]
+    return SimpleNamespace(id=1, time_periods=periods, time_slots=slots, security_buffer_minutes=30)
+
+
+def make_bookings(count, rng):
+    bookings = []
+    for _ in range(count):
+        start = START + timedelta(days=rng.randint(-30, DAYS))
+        bookings.append(SimpleNamespace(
+            start_date=start, end_date=start + timedelta(days=rng.randint(0, 60)),
+            num_plays=rng.randint(10, 500), slot_duration=15, status='active',
+            time_period_id=rng.choice([None, 1, 2, 3, 4])))
+    return bookings
+
+
+def reference(screen, bookings):
+    return [[get_reserved_seconds_for_period(screen.id, p.id, START + timedelta(days=d), screen.time_periods, bookings)
+             for p in screen.time_periods] for d in range(DAYS)]
+
+
+def timed(func):
+    best = None
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main(sizes):
+    rng = random.Random(42)
+    screen = make_screen()
+    end = START + timedelta(days=DAYS - 1)
+
+    print(f"{DAYS}-day range, {len(screen.time_periods)} periods")
+    print(f"{'bookings':>9} {'reference ms':>13} {'engine ms':>10} {'speedup':>8}")
+    for size in sorted(sizes):
+        bookings = make_bookings(size, rng)
+        expected, reference_ms = timed(lambda: reference(screen, bookings))
+        result, engine_ms = timed(lambda: calculate_availability(screen, START, end, preloaded_bookings=bookings))
+        actual = [[cell['reserved_seconds'] for cell in day['periods']] for day in result['daily_breakdown']]
+        if actual != expected:
+            raise RuntimeError(f"Engine differs from the reference for {size} bookings")
+        print(f"{size:>9} {reference_ms:>13.1f} {engine_ms:>10.1f} {reference_ms / engine_ms:>7.0f}x")
+
+
+if __name__ == '__main__':
+    try:
+        main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000])
+    finally:
+        os.unlink(_db_file.name)
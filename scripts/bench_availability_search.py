@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark search_availability over thousands of screens.
+
+Seeds a temporary SQLite database with N screens (three periods, one image
+slot and a few bookings each), then times a one-week search against the
+per-screen loop it replaces (calculate_availability for every screen, with
+the bookings preloaded in one query) and checks both find the same plays.
+Run from project root: python scripts/bench_availability_search.py [N ...]
+"""
+import sys
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# Never run against the configured database
+_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_db_file.close()
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_file.name}'
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-jwt-secret')
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import delete, insert, or_
+
+from app import app, db
+from models import Booking, Content, Organization, Screen, TimePeriod, TimeSlot
+from services.availability_search import search_availability
+from services.availability_service import calculate_availability
+
+START = date.today() + timedelta(days=7)
+END = START + timedelta(days=6)
+REPEATS = 3
+
+
+def seed(count, rng):
+    for model in (Booking, Content, TimeSlot, TimePeriod, Screen, Organization):
+        db.session.execute(delete(model))
+    db.session.execute(insert(Organization.__table__), [
+        {'id': 1, 'name': 'Bench Org', 'email': 'bench@org.com', 'country': 'CD', 'city': 'Kinshasa',
+         'currency': 'CDF', 'is_active': True}
+    ])
+    db.session.execute(insert(Screen.__table__), [
+        {'id': i, 'name': f'Screen {i}', 'unique_code': f'{i:06d}', 'organization_id': 1, 'is_active': True,
+         'accepts_images': True, 'accepts_videos': True, 'security_buffer_minutes': 30}
+        for i in range(1, count + 1)
+    ])
+    db.session.execute(insert(TimePeriod.__table__), [
+        {'id': (i - 1) * 3 + n + 1, 'screen_id': i, 'name': f'P{n}', 'start_hour': h, 'end_hour': h + 5,
+         'price_multiplier': 1.0}
+        for i in range(1, count + 1) for n, h in enumerate((7, 12, 17))
+    ])
+    db.session.execute(insert(TimeSlot.__table__), [
+        {'screen_id': i, 'content_type': 'image', 'duration_seconds': 15,
+         'price_per_play': round(rng.uniform(0.2, 2.0), 2), 'is_active': True}
+        for i in range(1, count + 1)
+    ])
+    db.session.execute(insert(Content.__table__), [
+        {'id': 1, 'filename': 'ad.png', 'original_filename': 'ad.png', 'content_type': 'image',
+         'file_path': '/tmp/ad.png', 'screen_id': 1}
+    ])
+    bookings = []
+    for i in range(1, count + 1):
+        for _ in range(rng.randint(0, 8)):
+            start = START + timedelta(days=rng.randint(-20, 10))
+            bookings.append({
+                'screen_id': i, 'content_id': 1, 'slot_duration': 15, 'num_plays': rng.randint(100, 20000),
+                'price_per_play': 1.0, 'total_price': 1.0, 'status': rng.choice(['pending', 'active']),
+                'payment_status': 'pending', 'start_date': start,
+                'end_date': start + timedelta(days=rng.randint(0, 30)),
+                'time_period_id': rng.choice([None, (i - 1) * 3 + 1, (i - 1) * 3 + 2, (i - 1) * 3 + 3]),
+            })
+    if bookings:
+        db.session.execute(insert(Booking.__table__), bookings)
+    db.session.commit()
+    return len(bookings)
+
+
+def per_screen_loop():
+    """What a catalog-wide search costs with calculate_availability per screen."""
+    screens = Screen.query.filter_by(is_active=True).all()
+    bookings = {}
+    for booking in Booking.query.filter(
+        Booking.status.in_(['pending', 'active']),
+        Booking.start_date <= END,
+        or_(Booking.end_date >= START, Booking.end_date == None)
+    ):
+        bookings.setdefault(booking.screen_id, []).append(booking)
+    return {
+        screen.id: calculate_availability(screen, START, END, None, 15, 'image',
+                                          preloaded_bookings=bookings.get(screen.id, []))['available_plays']
+        for screen in screens
+    }
+
+
+def timed(func):
+    best = None
+    for _ in range(REPEATS):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main(sizes):
+    rng = random.Random(42)
+    print("One-week search, 3 periods per screen")
+    print(f"{'screens':>8} {'bookings':>9} {'per-screen ms':>14} {'search ms':>10} {'speedup':>8}")
+    with app.app_context():
+        db.create_all()
+        for size in sorted(sizes):
+            booking_count = seed(size, rng)
+            expected, loop_ms = timed(per_screen_loop)
+            report, search_ms = timed(lambda: search_availability(START, END, limit=size))
+            found = {r['screen_id']: r['available_plays'] for r in report['results']}
+            if found != {screen_id: plays for screen_id, plays in expected.items() if plays > 0}:
+                raise RuntimeError(f"Search differs from calculate_availability for {size} screens")
+            print(f"{size:>8} {booking_count:>9} {loop_ms:>14.1f} {search_ms:>10.1f} {loop_ms / search_ms:>7.0f}x")
+
+
+if __name__ == '__main__':
+    try:
+        main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000])
+    finally:
+        os.unlink(_db_file.name)
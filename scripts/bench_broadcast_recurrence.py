@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark broadcast recurrence lookups: closed-form engine vs the old day-by-day scan.
+
+Builds N in-memory scheduled broadcasts with mixed daily/weekly/monthly rules
+and times get_next_occurrence() for both implementations, plus the bulk
+expand_calendar() over a one-week window. No database rows are written.
+Run from project root: python scripts/bench_broadcast_recurrence.py [N ...]
+"""
+import sys
+import os
+import random
+import time
+from datetime import datetime, timedelta, time as dt_time
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-jwt-secret')
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app
+from models import Broadcast
+from services.broadcast_recurrence import expand_calendar
+
+
+def legacy_next_occurrence(broadcast, from_datetime):
+    """Pre-engine Broadcast.get_next_occurrence(): scans up to 366 days."""
+    if broadcast.recurrence_end_date and from_datetime.date() > broadcast.recurrence_end_date:
+        return None
+
+    start = broadcast.scheduled_datetime.date()
+    base_time = broadcast.recurrence_time or broadcast.scheduled_datetime.time()
+    check_date = max(from_datetime.date(), start)
+
+    for i in range(366):
+        candidate = datetime.combine(check_date + timedelta(days=i), base_time)
+        if candidate <= from_datetime:
+            continue
+        if broadcast.recurrence_end_date and candidate.date() > broadcast.recurrence_end_date:
+            return None
+
+        d = candidate.date()
+        if broadcast.recurrence_type == Broadcast.RECURRENCE_DAILY:
+            valid = (d - start).days % broadcast.recurrence_interval == 0
+        elif broadcast.recurrence_type == Broadcast.RECURRENCE_WEEKLY:
+            if broadcast.recurrence_days_of_week:
+                valid = d.weekday() in [int(x) for x in broadcast.recurrence_days_of_week.split(',') if x]
+            else:
+                valid = ((d - start).days // 7) % broadcast.recurrence_interval == 0
+        elif broadcast.recurrence_type == Broadcast.RECURRENCE_MONTHLY:
+            months = (d.year - start.year) * 12 + (d.month - start.month)
+            valid = months % broadcast.recurrence_interval == 0 and d.day == start.day
+        else:
+            valid = True
+        if valid:
+            return candidate
+    return None
+
+
+def build_broadcasts(count, rng):
+    types = [Broadcast.RECURRENCE_DAILY, Broadcast.RECURRENCE_WEEKLY, Broadcast.RECURRENCE_MONTHLY]
+    broadcasts = []
+    for i in range(count):
+        recurrence_type = rng.choice(types)
+        days = None
+        if recurrence_type == Broadcast.RECURRENCE_WEEKLY and rng.random() < 0.7:
+            days = ','.join(str(d) for d in sorted(rng.sample(range(7), rng.randint(1, 3))))
+        broadcast = Broadcast(
+            name=f'bench-{i}',
+            schedule_mode=Broadcast.SCHEDULE_MODE_SCHEDULED,
+            scheduled_datetime=datetime(2025, 1, 1) + timedelta(days=rng.randint(0, 365), hours=rng.randint(0, 23)),
+            recurrence_type=recurrence_type,
+            recurrence_interval=rng.randint(1, 6),
+            recurrence_days_of_week=days,
+            recurrence_time=dt_time(rng.randint(0, 23), 0),
+            schedule_priority=rng.randint(1, 300)
+        )
+        broadcast.id = i + 1
+        broadcasts.append(broadcast)
+    return broadcasts
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main(sizes):
+    rng = random.Random(42)
+    now = datetime(2026, 3, 15, 10, 0)
+
+    with app.app_context():
+        print(f"{'broadcasts':>10} {'scan ms':>9} {'engine ms':>10} {'speedup':>8} {'calendar ms':>12} {'entries':>8}")
+        for size in sizes:
+            broadcasts = build_broadcasts(size, rng)
+
+            legacy, legacy_ms = timed(lambda: [legacy_next_occurrence(b, now) for b in broadcasts])
+            engine, engine_ms = timed(lambda: [b.get_next_occurrence(now) for b in broadcasts])
+            if legacy != engine:
+                raise SystemExit("Mismatch between the scan and the recurrence engine")
+
+            entries, calendar_ms = timed(lambda: expand_calendar(broadcasts, now, now + timedelta(days=7)))
+            speedup = legacy_ms / engine_ms if engine_ms else float('inf')
+            print(f"{size:>10} {legacy_ms:>9.1f} {engine_ms:>10.1f} {speedup:>7.1f}x {calendar_ms:>12.1f} {len(entries):>8}")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Load test for heartbeat ingestion: buffered batch flush vs one commit per beat.
+
+Seeds a throwaway SQLite database with S screens, then for D seconds producer
+threads push beats into HeartbeatBuffer at a target rate while a flusher
+thread drains it every HEARTBEAT_FLUSH_INTERVAL seconds (as the scheduler
+does). Reports sustained beats/s accepted and written, drops, flush lag and
+flush latency, and the beats/s of the previous per-request
+UPDATE+INSERT+commit. 2000 beats/s is a fleet of 60000 screens beating
+every 30 seconds.
+Run from project root: python scripts/bench_heartbeat_buffer.py [SECONDS] [SCREENS] [BEATS_PER_SECOND]
+"""
+import sys
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# Never run against the configured database: this script inserts fake rows
+_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_db_file.close()
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_file.name}'
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-jwt-secret')
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, HeartbeatLog
+from services.heartbeat_buffer import HeartbeatBuffer, HEARTBEAT_FLUSH_INTERVAL
+from services.scheduler import Scheduler
+
+PRODUCERS = 4
+PACE_TICK = 0.05
+LEGACY_BEATS = 500
+
+
+def seed_screens(count):
+    org = Organization(name="Bench Org", email="bench@org.com", country="FR", city="Paris")
+    db.session.add(org)
+    db.session.commit()
+    screens = [Screen(name=f"Screen {i}", unique_code=f"HB{i:06d}", organization_id=org.id, password_hash='x')
+               for i in range(count)]
+    db.session.add_all(screens)
+    db.session.commit()
+    return [s.id for s in screens]
+
+
+def legacy_rate(screen_ids):
+    """Beats/s of the pre-buffer endpoint body: get + UPDATE + INSERT + commit."""
+    started = time.perf_counter()
+    for i in range(LEGACY_BEATS):
+        screen = db.session.get(Screen, screen_ids[i % len(screen_ids)])
+        screen.last_heartbeat = datetime.utcnow()
+        screen.status = 'online'
+        db.session.add(HeartbeatLog(screen_id=screen.id, status='online'))
+        db.session.commit()
+    return LEGACY_BEATS / (time.perf_counter() - started)
+
+
+def produce(screen_ids, offset, rate, stop):
+    per_tick = max(int(rate * PACE_TICK / PRODUCERS), 1)
+    with app.app_context():
+        i = offset
+        deadline = time.perf_counter()
+        while not stop.is_set():
+            for _ in range(per_tick):
+                HeartbeatBuffer.accept(screen_ids[i % len(screen_ids)], 'online')
+                i += PRODUCERS
+            deadline += PACE_TICK
+            time.sleep(max(deadline - time.perf_counter(), 0))
+
+
+def drain(stop, samples):
+    with app.app_context():
+        while not stop.wait(HEARTBEAT_FLUSH_INTERVAL):
+            HeartbeatBuffer.flush()
+            stats = HeartbeatBuffer.stats()
+            samples.append((stats['last_flush_ms'], stats['last_flush_lag_seconds']))
+        HeartbeatBuffer.flush()
+
+
+def main(seconds, screen_count, rate):
+    with app.app_context():
+        db.create_all()
+        screen_ids = seed_screens(screen_count)
+        legacy = legacy_rate(screen_ids)
+        HeartbeatLog.query.delete()
+        db.session.commit()
+
+    stop = threading.Event()
+    samples = []
+    with mock.patch.object(Scheduler, 'is_running', return_value=True):
+        threads = [threading.Thread(target=produce, args=(screen_ids, n, rate, stop)) for n in range(PRODUCERS)]
+        flusher = threading.Thread(target=drain, args=(stop, samples))
+        started = time.perf_counter()
+        for thread in threads + [flusher]:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        flusher.join()
+        elapsed = time.perf_counter() - started
+
+    stats = HeartbeatBuffer.stats()
+    with app.app_context():
+        written = HeartbeatLog.query.count()
+
+    flush_ms = [ms for ms, _ in samples if ms is not None]
+    lags = [lag for _, lag in samples if lag is not None]
+    print(f"screens={screen_count} target={rate} beats/s duration={elapsed:.1f}s "
+          f"flush every {HEARTBEAT_FLUSH_INTERVAL}s")
+    print(f"legacy commit per beat: {legacy:>10.0f} beats/s")
+    print(f"buffer accepted:        {stats['accepted'] / elapsed:>10.0f} beats/s")
+    print(f"buffer written:         {written / elapsed:>10.0f} beats/s ({written} rows)")
+    print(f"dropped: {stats['dropped']}  flushes: {stats['flushes']}  errors: {stats['flush_errors']}")
+    if flush_ms:
+        print(f"flush ms avg/max: {sum(flush_ms) / len(flush_ms):.1f}/{max(flush_ms):.1f}  "
+              f"lag s max: {max(lags):.2f}")
+    os.unlink(_db_file.name)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(args[0] if args else 15, args[1] if len(args) > 1 else 5000, args[2] if len(args) > 2 else 2000)
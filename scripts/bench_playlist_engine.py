@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark the mobile playlist endpoint against a growing ad/broadcast catalogue.
+
+Seeds a throwaway SQLite database with one screen plus N ads and N broadcasts
+targeting other organizations, then reports SQL statements and latency per
+request. With the shared playlist engine both columns stay flat as N grows.
+Run from project root: python scripts/bench_playlist_engine.py [N ...]
+"""
+import sys
+import os
+import tempfile
+import time
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# Never run against the configured database: this script inserts fake rows
+_db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_db_file.close()
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_file.name}'
+os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-jwt-secret')
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization, Filler, Broadcast
+from models.ad_content import AdContent
+from services.jwt_service import generate_tokens
+from services.playlist_snapshot import PlaylistSnapshotStore
+
+REQUESTS_PER_SIZE = 20
+
+
+def seed_screen():
+    org = Organization(name="Bench Org", email="bench@org.com", country="FR", city="Paris")
+    other_org = Organization(name="Other Org", email="other@org.com", country="MA", city="Rabat")
+    db.session.add_all([org, other_org])
+    db.session.commit()
+
+    screen = Screen(name="Bench Screen", unique_code="BENCH01", organization_id=org.id, is_active=True)
+    screen.set_password("password")
+    db.session.add(screen)
+    db.session.commit()
+
+    db.session.add(Filler(filename="filler.jpg", content_type="image", file_path="static/filler.jpg",
+                          screen_id=screen.id))
+    db.session.commit()
+    return screen.id, other_org.id
+
+
+def grow_catalogue(other_org_id, start, stop):
+    for i in range(start, stop):
+        db.session.add(AdContent(name=f"Ad {i}", reference=f"BENCH{i}", file_path="ad.jpg",
+                                 status=AdContent.STATUS_ACTIVE,
+                                 target_type=AdContent.TARGET_ORGANIZATION,
+                                 target_organization_id=other_org_id))
+        db.session.add(Broadcast(name=f"Broadcast {i}", broadcast_type=Broadcast.BROADCAST_TYPE_CONTENT,
+                                 target_type=Broadcast.TARGET_COUNTRY, target_country='MA',
+                                 content_type='image', content_file_path='static/b.jpg', is_active=True))
+    db.session.commit()
+
+
+def measure(client, headers):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        started = time.perf_counter()
+        for _ in range(REQUESTS_PER_SIZE):
+            PlaylistSnapshotStore.clear()  # measure compilation, not snapshot hits
+            response = client.get('/mobile/api/v1/screen/playlist', headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"Unexpected status {response.status_code}")
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    return len(statements) / REQUESTS_PER_SIZE, elapsed * 1000 / REQUESTS_PER_SIZE
+
+
+def main(sizes):
+    app.config['TESTING'] = True
+    client = app.test_client()
+
+    with app.app_context():
+        db.create_all()
+        screen_id, other_org_id = seed_screen()
+        headers = {'Authorization': f'Bearer {generate_tokens(screen_id=screen_id)["access_token"]}'}
+
+    client.get('/mobile/api/v1/screen/playlist', headers=headers)  # warm-up
+
+    print(f"{'catalogue':>10} {'queries/req':>12} {'ms/req':>8}")
+    seeded = 0
+    for size in sorted(sizes):
+        with app.app_context():
+            grow_catalogue(other_org_id, seeded, size)
+        seeded = size
+        queries, ms = measure(client, headers)
+        print(f"{size:>10} {queries:>12.1f} {ms:>8.2f}")
+
+
+if __name__ == '__main__':
+    try:
+        main([int(arg) for arg in sys.argv[1:]] or [0, 100, 1000, 5000])
+    finally:
+        os.unlink(_db_file.name)
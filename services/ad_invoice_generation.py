@@ -0,0 +1,193 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Grouped settlement of AdContent campaigns into organization invoices
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import time
+from datetime import date
+
+from sqlalchemy import func, insert, or_, select
+
+from app import db
+from models import Organization, Screen
+from models.ad_content import AdContent, AdContentInvoice, AdContentStat, ad_screen_association
+from services.invoice_generation import INVOICE_WRITE_BATCH
+
+logger = logging.getLogger(__name__)
+
+
+def _org_type_clause(ad):
+    if ad.target_org_type == AdContent.ORG_TYPE_PAID:
+        return Organization.is_paid == True
+    if ad.target_org_type == AdContent.ORG_TYPE_FREE:
+        return Organization.is_paid == False
+    return None
+
+
+def target_screens_select(ad):
+    """
+    SELECT of (screen id, organization id) targeted by an ad.
+
+    Same rules as AdContent.get_target_screens(), without the time window
+    check, so campaigns can be settled after they expire. Returns None when
+    the ad targets nothing.
+    """
+    query = select(Screen.id.label('screen_id'), Screen.organization_id.label('organization_id')).where(
+        Screen.is_active == True
+    )
+
+    if ad.target_type == AdContent.TARGET_SCREENS:
+        return query.join(ad_screen_association, ad_screen_association.c.screen_id == Screen.id).where(
+            ad_screen_association.c.ad_content_id == ad.id
+        )
+
+    query = query.join(Organization, Organization.id == Screen.organization_id)
+
+    if ad.target_type in (AdContent.TARGET_SCREEN, AdContent.TARGET_ORGANIZATION):
+        if ad.target_type == AdContent.TARGET_SCREEN:
+            query = query.where(Screen.id == ad.target_screen_id)
+        else:
+            query = query.where(Screen.organization_id == ad.target_organization_id)
+        org_type = _org_type_clause(ad)
+        if org_type is not None:
+            query = query.where(org_type)
+        return query.where(or_(Organization.allow_ad_content.is_(None), Organization.allow_ad_content != False))
+
+    if ad.target_type == AdContent.TARGET_CITY:
+        return query.where(
+            Organization.country == ad.target_country,
+            Organization.city == ad.target_city,
+            Organization.allow_ad_content != False
+        )
+
+    if ad.target_type == AdContent.TARGET_COUNTRY:
+        return query.where(
+            Organization.country == ad.target_country,
+            Organization.allow_ad_content != False
+        )
+
+    return None
+
+
+def ad_settlement(ad):
+    """
+    Targeted screens, impressions and duration of an ad per organization,
+    in one grouped query.
+
+    Returns:
+        dict: {organization_id: (screens_count, impressions, duration)}
+    """
+    targets = target_screens_select(ad)
+    if targets is None:
+        return {}
+    targets = targets.subquery()
+
+    stats = select(
+        AdContentStat.screen_id,
+        func.sum(AdContentStat.impressions).label('impressions'),
+        func.sum(AdContentStat.total_duration).label('duration')
+    ).where(AdContentStat.ad_content_id == ad.id).group_by(AdContentStat.screen_id).subquery()
+
+    rows = db.session.execute(
+        select(
+            targets.c.organization_id,
+            func.count(targets.c.screen_id),
+            func.sum(func.coalesce(stats.c.impressions, 0)),
+            func.sum(func.coalesce(stats.c.duration, 0))
+        ).select_from(targets).outerjoin(stats, stats.c.screen_id == targets.c.screen_id)
+        .group_by(targets.c.organization_id)
+    )
+    return {org_id: (screens or 0, int(impressions or 0), float(duration or 0))
+            for org_id, screens, impressions, duration in rows}
+
+
+def generate_ad_invoices(ads, dry_run=False):
+    """
+    Settle ads into one AdContentInvoice per (ad, organization).
+
+    Each ad is settled with one grouped query; invoices that already exist are
+    found with a single query over all the ads and skipped. New invoices are
+    written with batched INSERTs in one transaction.
+
+    Args:
+        ads: AdContent rows to settle
+        dry_run: compute everything but write nothing
+
+    Returns:
+        dict: report with per-ad targeted screens, counts, invoices and timings in ms
+    """
+    started = time.perf_counter()
+    ads = list(ads)
+    existing = set()
+    if ads:
+        existing = set(db.session.query(AdContentInvoice.ad_content_id, AdContentInvoice.organization_id).filter(
+            AdContentInvoice.ad_content_id.in_([ad.id for ad in ads])
+        ))
+
+    to_insert, skipped, screens_by_ad = [], 0, {}
+    for ad in ads:
+        settlement = ad_settlement(ad)
+        total_screens = sum(screens for screens, _, _ in settlement.values())
+        screens_by_ad[ad.id] = total_screens
+
+        for org_id, (screens_count, impressions, duration) in settlement.items():
+            if (ad.id, org_id) in existing:
+                skipped += 1
+                continue
+            gross_amount = ad.total_price * (screens_count / total_screens) if total_screens > 0 else 0
+            invoice = AdContentInvoice()
+            to_insert.append({
+                'invoice_number': invoice.generate_invoice_number(),
+                'organization_id': org_id,
+                'ad_content_id': ad.id,
+                'period_start': ad.start_date.date() if ad.start_date else date.today(),
+                'period_end': ad.end_date.date() if ad.end_date else date.today(),
+                'screens_count': screens_count,
+                'total_impressions': impressions,
+                'total_duration': duration,
+                'gross_amount': gross_amount,
+                'commission_rate': ad.commission_rate,
+                'commission_amount': gross_amount * (ad.commission_rate / 100),
+                'currency': ad.currency,
+                'status': AdContentInvoice.STATUS_PENDING,
+            })
+    compute_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    step = time.perf_counter()
+    if not dry_run and to_insert:
+        try:
+            for i in range(0, len(to_insert), INVOICE_WRITE_BATCH):
+                db.session.execute(insert(AdContentInvoice.__table__), to_insert[i:i + INVOICE_WRITE_BATCH])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    report = {
+        'dry_run': dry_run,
+        'ads': len(ads),
+        'screens_by_ad': screens_by_ad,
+        'created': len(to_insert),
+        'skipped_existing': skipped,
+        'invoices': [
+            {key: row[key] for key in ('ad_content_id', 'organization_id', 'invoice_number', 'screens_count',
+                                       'total_impressions', 'gross_amount', 'commission_amount', 'currency')}
+            for row in to_insert
+        ],
+        'timings': {
+            'compute_ms': compute_ms,
+            'write_ms': round((time.perf_counter() - step) * 1000, 2),
+            'total_ms': round((time.perf_counter() - started) * 1000, 2),
+        },
+    }
+    logger.info(f"Ad invoices: {len(to_insert)} created, {skipped} skipped for {len(ads)} ads "
+                f"in {report['timings']['total_ms']}ms{' (dry run)' if dry_run else ''}")
+    return report
+
+
+def generate_expired_ad_invoices(dry_run=False):
+    """Settle every expired ad that still has organizations left to invoice."""
+    return generate_ad_invoices(AdContent.query.filter_by(status=AdContent.STATUS_EXPIRED).all(), dry_run=dry_run)
@@ -0,0 +1,262 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : In-memory targeting index of active and scheduled AdContent
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from models.ad_content import AdContent, ad_screen_association
+from services.playlist_snapshot import PlaylistSnapshotStore, is_relevant_change
+from services.screen_events import ScreenEventBus, WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Full reload interval, bounding staleness from writes the ORM hooks cannot
+# see (raw SQL, other workers without a Redis backplane).
+AD_INDEX_MAX_AGE = int(os.environ.get('AD_INDEX_MAX_AGE', 300))
+
+EVENT_AD_INDEX = 'ad_index'
+
+INDEXED_STATUSES = (AdContent.STATUS_ACTIVE, AdContent.STATUS_SCHEDULED)
+
+
+class AdEntry:
+    """Targeting-relevant snapshot of one AdContent row."""
+
+    def __init__(self, ad, screen_ids):
+        self.id = ad.id
+        self.status = ad.status
+        self.schedule_type = ad.schedule_type
+        self.start_date = ad.start_date
+        self.end_date = ad.end_date
+        self.target_org_type = ad.target_org_type
+        self.content = ad.to_content_dict()
+        self.keys = self._target_keys(ad, screen_ids)
+
+    @staticmethod
+    def _target_keys(ad, screen_ids):
+        if ad.target_type == AdContent.TARGET_SCREEN:
+            return [('screen', ad.target_screen_id)] if ad.target_screen_id else []
+        if ad.target_type == AdContent.TARGET_SCREENS:
+            return [('screen', screen_id) for screen_id in screen_ids]
+        if ad.target_type == AdContent.TARGET_ORGANIZATION:
+            return [('org', ad.target_organization_id)] if ad.target_organization_id else []
+        if ad.target_type == AdContent.TARGET_CITY:
+            if ad.target_country and ad.target_city:
+                return [('city', ad.target_country, ad.target_city.lower())]
+            return []
+        if ad.target_type == AdContent.TARGET_COUNTRY:
+            return [('country', ad.target_country)] if ad.target_country else []
+        return []
+
+    def effective_status(self, now):
+        """Status AdContent.update_status() would set at `now`."""
+        if self.schedule_type == AdContent.SCHEDULE_PERIOD:
+            if self.end_date and now > self.end_date:
+                return AdContent.STATUS_EXPIRED
+            if self.start_date and now >= self.start_date:
+                return AdContent.STATUS_ACTIVE
+            if self.start_date and now < self.start_date:
+                return AdContent.STATUS_SCHEDULED
+        return self.status
+
+    def is_active_at(self, now):
+        """Mirror of AdContent.is_currently_active() after update_status()."""
+        status = self.effective_status(now)
+        if status not in INDEXED_STATUSES:
+            return False
+        if self.schedule_type == AdContent.SCHEDULE_IMMEDIATE:
+            return status == AdContent.STATUS_ACTIVE
+        if self.start_date and now < self.start_date:
+            return False
+        if self.end_date and now > self.end_date:
+            return False
+        return True
+
+    def matches_org(self, org):
+        """Mirror of AdContent._matches_org_type() plus the org opt-out."""
+        if not org or getattr(org, 'allow_ad_content', True) is False:
+            return False
+        if self.target_org_type == AdContent.ORG_TYPE_PAID:
+            return bool(org.is_paid)
+        if self.target_org_type == AdContent.ORG_TYPE_FREE:
+            return not org.is_paid
+        return True
+
+
+class AdTargetingIndex:
+    """
+    Inverted index of active/scheduled ads keyed by screen id, organization id,
+    (country, lowercased city) and country.
+
+    Loaded lazily on first use, then kept current incrementally: committed
+    AdContent changes mark their ids dirty (locally and, through the screen
+    event bus, in other workers) and only those rows are reloaded on the next
+    lookup. Resolving a screen's ads is a handful of dict lookups.
+    """
+    _entries = {}
+    _by_key = {}
+    _dirty_ids = set()
+    _loaded_at = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def resolve(cls, screen):
+        """
+        Ads whose targeting matches a screen, whatever their time window.
+
+        Returns:
+            list of AdEntry (callers check is_active_at() and matches_org())
+        """
+        org = screen.organization
+        keys = [('screen', screen.id), ('org', screen.organization_id)]
+        if org and org.country:
+            keys.append(('country', org.country))
+            if org.city:
+                keys.append(('city', org.country, org.city.lower()))
+
+        with cls._lock:
+            cls._refresh()
+            ad_ids = set()
+            for key in keys:
+                ad_ids.update(cls._by_key.get(key, ()))
+            return [cls._entries[ad_id] for ad_id in sorted(ad_ids)]
+
+    @classmethod
+    def mark_dirty(cls, ad_ids):
+        with cls._lock:
+            cls._dirty_ids.update(ad_ids)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries = {}
+            cls._by_key = {}
+            cls._dirty_ids = set()
+            cls._loaded_at = None
+
+    @classmethod
+    def _refresh(cls):
+        if cls._loaded_at is None or time.time() - cls._loaded_at > AD_INDEX_MAX_AGE:
+            cls._load_all()
+        elif cls._dirty_ids:
+            dirty, cls._dirty_ids = cls._dirty_ids, set()
+            cls._load(dirty)
+
+    @classmethod
+    def _screen_ids_by_ad(cls, *criteria):
+        """Multi-screen targets (ad_screen_association) of the ads matching criteria."""
+        rows = db.session.query(
+            ad_screen_association.c.ad_content_id,
+            ad_screen_association.c.screen_id
+        ).join(AdContent, AdContent.id == ad_screen_association.c.ad_content_id).filter(*criteria).all()
+        screen_ids = {}
+        for ad_id, screen_id in rows:
+            screen_ids.setdefault(ad_id, []).append(screen_id)
+        return screen_ids
+
+    @classmethod
+    def _load_all(cls):
+        criteria = (AdContent.status.in_(INDEXED_STATUSES),)
+        ads = AdContent.query.filter(*criteria).all()
+        screen_ids = cls._screen_ids_by_ad(*criteria) if ads else {}
+        cls._entries = {}
+        cls._by_key = {}
+        cls._dirty_ids = set()
+        for ad in ads:
+            cls._add(AdEntry(ad, screen_ids.get(ad.id, [])))
+        cls._loaded_at = time.time()
+        logger.info(f"Ad targeting index loaded: {len(cls._entries)} ads")
+
+    @classmethod
+    def _load(cls, ad_ids):
+        criteria = (AdContent.id.in_(ad_ids), AdContent.status.in_(INDEXED_STATUSES))
+        ads = AdContent.query.filter(*criteria).all()
+        screen_ids = cls._screen_ids_by_ad(*criteria) if ads else {}
+        for ad_id in ad_ids:
+            cls._remove(ad_id)
+        for ad in ads:
+            cls._add(AdEntry(ad, screen_ids.get(ad.id, [])))
+
+    @classmethod
+    def _add(cls, entry):
+        cls._entries[entry.id] = entry
+        for key in entry.keys:
+            cls._by_key.setdefault(key, set()).add(entry.id)
+
+    @classmethod
+    def _remove(cls, ad_id):
+        entry = cls._entries.pop(ad_id, None)
+        if not entry:
+            return
+        for key in entry.keys:
+            ids = cls._by_key.get(key)
+            if ids is not None:
+                ids.discard(ad_id)
+                if not ids:
+                    del cls._by_key[key]
+
+
+def _on_after_flush(session, flush_context):
+    changed = session.info.setdefault('ad_index_changes', set())
+    try:
+        for collection, check_history in (
+            (session.new, False),
+            (session.deleted, False),
+            (session.dirty, True),
+        ):
+            for obj in collection:
+                if not isinstance(obj, AdContent) or obj.id is None:
+                    continue
+                if check_history and not is_relevant_change(obj, 'AdContent'):
+                    continue
+                changed.add(obj.id)
+    except Exception as e:
+        # Never break a write because of cache bookkeeping; reload everything instead.
+        logger.error(f"Ad targeting index tracking failed: {e}")
+        AdTargetingIndex.clear()
+
+
+def _on_after_commit(session):
+    changed = session.info.pop('ad_index_changes', None)
+    if not changed:
+        return
+    AdTargetingIndex.mark_dirty(changed)
+    ScreenEventBus.publish(WORKERS, EVENT_AD_INDEX, {'ad_ids': sorted(changed)})
+
+
+def _on_after_rollback(session):
+    session.info.pop('ad_index_changes', None)
+
+
+def _on_screen_event(screen_id, event_name, data, remote):
+    if remote and event_name == EVENT_AD_INDEX:
+        AdTargetingIndex.mark_dirty((data or {}).get('ad_ids', []))
+        # The relayed playlist event may have been handled first; rebuild again
+        # now that the index knows which ads changed.
+        PlaylistSnapshotStore.invalidate_all()
+
+
+_listeners_registered = False
+
+
+def register_ad_index_listeners():
+    """Attach the index maintenance hooks to every SQLAlchemy session (idempotent)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(Session, 'after_flush', _on_after_flush)
+    event.listen(Session, 'after_commit', _on_after_commit)
+    event.listen(Session, 'after_rollback', _on_after_rollback)
+    ScreenEventBus.add_listener(_on_screen_event)
+    _listeners_registered = True
+    logger.info("Ad targeting index listeners registered")
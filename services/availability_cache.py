@@ -0,0 +1,255 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Per-screen cache of daily reserved seconds, invalidated by booking changes
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import Session
+
+from models import Booking, Screen
+from services.availability_service import reserved_seconds_matrix
+from services.screen_events import ScreenEventBus, WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Screens whose reserved seconds are kept, least recently used dropped first.
+AVAILABILITY_CACHE_MAX_SCREENS = int(os.environ.get('AVAILABILITY_CACHE_MAX_SCREENS', 512))
+
+# Cached days per screen; past this the screen starts over with the days requested.
+AVAILABILITY_CACHE_MAX_DAYS = int(os.environ.get('AVAILABILITY_CACHE_MAX_DAYS', 1500))
+
+# Seconds a screen's cache is trusted. Bookings written outside the ORM (raw
+# SQL, another application) are picked up after at most this long.
+AVAILABILITY_CACHE_MAX_AGE = int(os.environ.get('AVAILABILITY_CACHE_MAX_AGE', 600))
+
+# Booking columns that change the seconds a booking reserves.
+RESERVATION_ATTRIBUTES = ('screen_id', 'status', 'start_date', 'end_date', 'num_plays', 'slot_duration',
+                          'time_period_id')
+
+RESERVING_STATUSES = ('pending', 'active')
+
+EVENT_AVAILABILITY = 'availability_invalidate'
+
+
+def _period_signature(periods):
+    return tuple((p.id, p.start_hour, p.end_hour) for p in periods)
+
+
+class AvailabilityCache:
+    """
+    Reserved seconds per (day, time period) of each screen, as
+    reserved_seconds_matrix computes them over every period of the screen.
+
+    Days are filled on demand with one bookings query covering the missing
+    ones, so a repeated date-picker request is served without reading the
+    bookings. Committed booking changes evict only the days they cover, in
+    this worker and, through the screen event bus, in the others; a change
+    to the screen's periods starts the screen over.
+    """
+    _lock = threading.RLock()
+    _entries = OrderedDict()
+
+    @classmethod
+    def reserved_rows(cls, screen, start_date, num_days):
+        """
+        Reserved seconds of a screen for num_days days from start_date.
+
+        Returns:
+            list: one row per day, one value per period of screen.time_periods
+        """
+        all_periods = list(screen.time_periods)
+        signature = _period_signature(all_periods)
+        days = [start_date + timedelta(days=i) for i in range(num_days)]
+
+        with cls._lock:
+            entry = cls._entry(screen.id, signature)
+            cached = entry['days']
+            missing = [day for day in days if day not in cached]
+            if not missing:
+                return [list(cached[day]) for day in days]
+            version = entry['version']
+
+        first, last = missing[0], missing[-1]
+        bookings = Booking.query.filter(
+            Booking.screen_id == screen.id,
+            Booking.status.in_(RESERVING_STATUSES),
+            Booking.start_date <= last,
+            or_(Booking.end_date >= first, Booking.end_date == None)
+        ).order_by(Booking.id).all()
+        span = (last - first).days + 1
+        matrix = reserved_seconds_matrix(bookings, first, span, all_periods, all_periods)
+        computed = {first + timedelta(days=i): tuple(row) for i, row in enumerate(matrix)}
+
+        with cls._lock:
+            # Skip the store if a booking change landed while we were reading
+            if cls._entries.get(screen.id) is entry and entry['version'] == version:
+                if len(entry['days']) + len(missing) > AVAILABILITY_CACHE_MAX_DAYS:
+                    entry['days'] = {}
+                for day in missing:
+                    entry['days'][day] = computed[day]
+            cached = entry['days']
+            return [list(cached[day] if day in cached else computed[day]) for day in days]
+
+    @classmethod
+    def _entry(cls, screen_id, signature):
+        """Caller holds _lock."""
+        entry = cls._entries.get(screen_id)
+        now = time.monotonic()
+        if entry is None or entry['signature'] != signature or now - entry['created_at'] >= AVAILABILITY_CACHE_MAX_AGE:
+            entry = {'signature': signature, 'days': {}, 'version': 0, 'created_at': now}
+            cls._entries[screen_id] = entry
+            while len(cls._entries) > AVAILABILITY_CACHE_MAX_SCREENS:
+                cls._entries.popitem(last=False)
+        cls._entries.move_to_end(screen_id)
+        return entry
+
+    @classmethod
+    def invalidate(cls, screen_id, first=None, last=None):
+        """
+        Evict a screen's days from first to last (inclusive); None bounds
+        are open, so invalidate(screen_id) drops the whole screen.
+        """
+        with cls._lock:
+            entry = cls._entries.get(screen_id)
+            if entry is None:
+                return
+            entry['version'] += 1
+            if first is None and last is None:
+                del cls._entries[screen_id]
+                return
+            entry['days'] = {
+                day: row for day, row in entry['days'].items()
+                if (first is not None and day < first) or (last is not None and day > last)
+            }
+
+    @classmethod
+    def apply(cls, ranges):
+        """Apply invalidations: [(screen_id, first, last)]."""
+        for screen_id, first, last in ranges:
+            cls.invalidate(screen_id, first, last)
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            return {
+                'screens': len(cls._entries),
+                'days': sum(len(entry['days']) for entry in cls._entries.values()),
+            }
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+
+
+def _committed(state, attribute):
+    history = state.attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(state.obj(), attribute)
+
+
+def _reservation_range(screen_id, status, start_date, end_date):
+    """Days a booking in this state reserves: (screen_id, first, last), or None."""
+    if screen_id is None or status not in RESERVING_STATUSES or start_date is None:
+        return None
+    return screen_id, start_date, end_date
+
+
+def _booking_ranges(obj, change):
+    """Cached days a flushed booking change affects: [(screen_id, first, last)]."""
+    state = inspect(obj)
+    current = _reservation_range(obj.screen_id, obj.status, obj.start_date, obj.end_date)
+    if change == 'new':
+        return [current] if current else []
+
+    previous = _reservation_range(*(_committed(state, attr) for attr in
+                                    ('screen_id', 'status', 'start_date', 'end_date')))
+    if change == 'deleted':
+        return [previous] if previous else []
+
+    if not any(state.attrs[attr].history.has_changes() for attr in RESERVATION_ATTRIBUTES):
+        return []
+    return [r for r in (previous, current) if r]
+
+
+def _collect_ranges(session):
+    ranges = session.info.setdefault('availability_invalidations', [])
+    for change, objects in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Booking):
+                ranges.extend(_booking_ranges(obj, change))
+            elif isinstance(obj, Screen) and change != 'dirty' and obj.id is not None:
+                # Recreated IDs (e.g. after a reset) must not inherit cached days
+                ranges.append((obj.id, None, None))
+            elif type(obj).__name__ == 'TimePeriod' and getattr(obj, 'screen_id', None) is not None:
+                ranges.append((obj.screen_id, None, None))
+
+
+def _on_after_flush(session, flush_context):
+    try:
+        _collect_ranges(session)
+    except Exception as e:
+        # Never break a write because of cache bookkeeping; start over
+        logger.error(f"Availability cache invalidation tracking failed: {e}")
+        AvailabilityCache.clear()
+
+
+def _publish(ranges):
+    try:
+        ScreenEventBus.publish(WORKERS, EVENT_AVAILABILITY, {
+            'ranges': [[screen_id, first.isoformat() if first else None, last.isoformat() if last else None]
+                       for screen_id, first, last in ranges]
+        })
+    except Exception as e:
+        logger.error(f"Availability cache invalidation relay failed: {e}")
+
+
+def _on_after_commit(session):
+    ranges = session.info.pop('availability_invalidations', None)
+    if not ranges:
+        return
+    ranges = list(dict.fromkeys(ranges))
+    AvailabilityCache.apply(ranges)
+    _publish(ranges)
+
+
+def _on_after_rollback(session):
+    # Days filled from the flushed, now rolled back, state must go too
+    ranges = session.info.pop('availability_invalidations', None)
+    if ranges:
+        AvailabilityCache.apply(ranges)
+
+
+def _on_screen_event(screen_id, event_name, data, remote):
+    if remote and screen_id == WORKERS and event_name == EVENT_AVAILABILITY:
+        AvailabilityCache.apply([
+            (range_screen, date.fromisoformat(first) if first else None, date.fromisoformat(last) if last else None)
+            for range_screen, first, last in (data or {}).get('ranges', [])
+        ])
+
+
+_listeners_registered = False
+
+
+def register_availability_listeners():
+    """Evict cached days on committed booking changes in every SQLAlchemy session (idempotent)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(Session, 'after_flush', _on_after_flush)
+    event.listen(Session, 'after_commit', _on_after_commit)
+    event.listen(Session, 'after_rollback', _on_after_rollback)
+    ScreenEventBus.add_listener(_on_screen_event)
+    _listeners_registered = True
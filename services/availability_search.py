@@ -0,0 +1,244 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Availability search across many screens in one pass
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select
+
+from app import db
+from models import Booking, Organization, Screen, TimePeriod, TimeSlot
+from services.availability_service import _booking_daily_seconds, get_bookable_seconds, get_period_duration_seconds
+
+logger = logging.getLogger(__name__)
+
+# Longest date range a search may cover.
+SEARCH_MAX_DAYS = 92
+
+# Most results a search returns.
+SEARCH_MAX_RESULTS = 200
+
+SORT_CAPACITY = 'capacity'
+SORT_PRICE = 'price'
+
+
+def _candidate_screens(content_type, country=None, city=None, organization_id=None):
+    """SELECT of the bookable screens matching the filters, with their organization."""
+    query = select(
+        Screen.id, Screen.name, Screen.unique_code, Screen.location, Screen.security_buffer_minutes,
+        Organization.id.label('organization_id'), Organization.name.label('organization_name'),
+        Organization.city, Organization.country, Organization.currency
+    ).join(Organization, Organization.id == Screen.organization_id).where(
+        Screen.is_active == True,
+        Organization.is_active == True
+    )
+    if content_type == 'image':
+        query = query.where(Screen.accepts_images == True)
+    elif content_type == 'video':
+        query = query.where(Screen.accepts_videos == True)
+    if country:
+        query = query.where(Organization.country == country)
+    if city:
+        query = query.where(Organization.city == city)
+    if organization_id:
+        query = query.where(Organization.id == organization_id)
+    return query
+
+
+def search_availability(start_date, end_date, content_type='image', slot_duration=15, plays=0, country=None,
+                        city=None, organization_id=None, sort=SORT_CAPACITY, limit=50):
+    """
+    Free capacity of every matching screen over a date range, ranked.
+
+    Candidate screens, their periods, slot prices and overlapping bookings are
+    each read with one query. Reserved seconds are then laid out in a
+    (day x screen period) matrix, one column per period of every screen, and
+    bookings are added to it as range additions; the free
+    seconds of each screen are summed from the clipped matrix. Capacity
+    follows calculate_availability: no period filter, security buffer on
+    today, nothing before.
+
+    Args:
+        start_date, end_date: date range (dates, inclusive)
+        content_type: 'image' or 'video'
+        slot_duration: seconds per play; screens without such a slot are skipped
+        plays: only keep screens with at least this many free plays
+        country, city, organization_id: optional filters
+        sort: SORT_CAPACITY (most free plays first, then cheapest) or
+              SORT_PRICE (cheapest first, then most free plays)
+        limit: results returned
+
+    Returns:
+        dict: ranked results, match counts and timings in ms
+    """
+    started = time.perf_counter()
+    num_days = max((end_date - start_date).days + 1, 0)
+    candidates = _candidate_screens(content_type, country, city, organization_id)
+    candidate_ids = candidates.with_only_columns(Screen.id).scalar_subquery()
+
+    screens = {row.id: row for row in db.session.execute(candidates)}
+
+    prices = {}
+    for screen_id, price in db.session.execute(
+        select(TimeSlot.screen_id, TimeSlot.price_per_play).where(
+            TimeSlot.screen_id.in_(candidate_ids),
+            TimeSlot.content_type == content_type,
+            TimeSlot.duration_seconds == slot_duration
+        ).order_by(TimeSlot.id)
+    ):
+        prices.setdefault(screen_id, price)
+
+    periods = {}
+    for period in db.session.execute(
+        select(TimePeriod.screen_id, TimePeriod.id, TimePeriod.start_hour, TimePeriod.end_hour).where(
+            TimePeriod.screen_id.in_(candidate_ids)
+        ).order_by(TimePeriod.screen_id, TimePeriod.id)
+    ):
+        if period.screen_id in prices:
+            periods.setdefault(period.screen_id, []).append((period, get_period_duration_seconds(period)))
+
+    bookings = db.session.execute(
+        select(Booking.screen_id, Booking.time_period_id, Booking.start_date, Booking.end_date,
+               Booking.num_plays, Booking.slot_duration).where(
+            Booking.screen_id.in_(candidate_ids),
+            Booking.status.in_(['pending', 'active']),
+            Booking.start_date <= end_date,
+            or_(Booking.end_date >= start_date, Booking.end_date == None)
+        ).order_by(Booking.id)
+    ).all() if periods and num_days else []
+    load_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    step = time.perf_counter()
+    screen_ids = list(periods)
+    free_seconds = _free_seconds(screen_ids, periods, screens, bookings, start_date, num_days)
+    compute_ms = round((time.perf_counter() - step) * 1000, 2)
+
+    results = []
+    for screen_id, seconds in zip(screen_ids, free_seconds):
+        available_plays = int(seconds / slot_duration)
+        if available_plays <= 0 or available_plays < plays:
+            continue
+        screen = screens[screen_id]
+        price = prices[screen_id]
+        results.append({
+            'screen_id': screen_id,
+            'name': screen.name,
+            'unique_code': screen.unique_code,
+            'location': screen.location or '',
+            'organization_id': screen.organization_id,
+            'organization_name': screen.organization_name,
+            'city': screen.city,
+            'country': screen.country,
+            'currency': screen.currency or 'EUR',
+            'available_seconds': seconds,
+            'available_plays': available_plays,
+            'price_per_play': price,
+            'estimated_price': round(price * plays, 2) if plays else None,
+        })
+
+    if sort == SORT_PRICE:
+        results.sort(key=lambda r: (r['price_per_play'], -r['available_plays'], r['screen_id']))
+    else:
+        results.sort(key=lambda r: (-r['available_plays'], r['price_per_play'], r['screen_id']))
+
+    report = {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'content_type': content_type,
+        'slot_duration': slot_duration,
+        'plays': plays,
+        'screens_evaluated': len(screen_ids),
+        'matches': len(results),
+        'results': results[:limit],
+        'timings': {
+            'load_ms': load_ms,
+            'compute_ms': compute_ms,
+            'total_ms': round((time.perf_counter() - started) * 1000, 2),
+        },
+    }
+    logger.debug(f"Availability search: {len(results)}/{len(screen_ids)} screens in {report['timings']['total_ms']}ms")
+    return report
+
+
+def _free_seconds(screen_ids, periods, screens, bookings, start_date, num_days):
+    """Free seconds over the range for each screen of screen_ids, in order."""
+    # Columns: the periods of every screen, screen by screen
+    column_of = {}
+    screen_columns = {}
+    durations, ratios, column_periods = [], [], []
+    for screen_id in screen_ids:
+        screen_periods = periods[screen_id]
+        first = len(durations)
+        total_day_seconds = sum(duration for _, duration in screen_periods)
+        for period, duration in screen_periods:
+            column_of[period.id] = len(durations)
+            durations.append(duration)
+            ratios.append(duration / total_day_seconds if total_day_seconds > 0 else None)
+            column_periods.append(period)
+        screen_columns[screen_id] = (first, len(durations))
+
+    # Period bookings, then bookings without a period, each in booking order:
+    # the order calculate_availability adds them in
+    period_ranges, shared_ranges = [], []
+    for booking in bookings:
+        screen_id, period_id, booking_start, booking_end = booking[:4]
+        columns = screen_columns.get(screen_id)
+        if columns is None:
+            continue
+        if period_id is None:
+            if ratios[columns[0]] is None:
+                continue
+            target = shared_ranges
+        elif period_id in column_of:
+            target = period_ranges
+        else:
+            continue
+        daily = _booking_daily_seconds(booking)
+        if daily is None:
+            continue
+        first = max((booking_start - start_date).days, 0)
+        last = num_days if booking_end is None else min((booking_end - start_date).days + 1, num_days)
+        if first < last:
+            target.append((first, last, column_of.get(period_id), columns, daily))
+
+    # Days the security buffer can reach have a reduced capacity
+    now_dt = datetime.now()
+    partial = {}
+    for screen_id in screen_ids:
+        min_start_dt = now_dt + timedelta(minutes=screens[screen_id].security_buffer_minutes or 30)
+        first, last = screen_columns[screen_id]
+        for day in range(min(max((min_start_dt.date() - start_date).days + 1, 0), num_days)):
+            current_date = start_date + timedelta(days=day)
+            for column in range(first, last):
+                partial[(day, column)] = get_bookable_seconds(column_periods[column], current_date, now_dt,
+                                                              min_start_dt)
+
+    # Free seconds are summed per day over the screen's periods, then over
+    # the days, as calculate_availability does, so totals match it exactly
+    bounds = [screen_columns[screen_id] for screen_id in screen_ids]
+    reserved = [[0.0] * len(durations) for _ in range(num_days)]
+    for first, last, column, _, daily in period_ranges:
+        for day in range(first, last):
+            reserved[day][column] += daily
+    for first, last, _, (c0, c1), daily in shared_ranges:
+        shares = [(c, daily * ratios[c]) for c in range(c0, c1)]
+        for day in range(first, last):
+            row = reserved[day]
+            for c, share in shares:
+                row[c] += share
+
+    totals = []
+    for first, last in bounds:
+        total = 0
+        for day, row in enumerate(reserved):
+            day_total = 0
+            for column in range(first, last):
+                day_total += max(0, partial.get((day, column), durations[column]) - row[column])
+            total += day_total
+        totals.append(total)
+    return totals
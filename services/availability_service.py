@@ -12,6 +12,39 @@ def get_period_duration_seconds(period):
     return hours * 3600
 
 
+def get_bookable_seconds(period, current_date, now_dt, min_start_dt):
+    """
+    Seconds of a period on a date that can still be booked: the whole period,
+    what is left of it after the security buffer today, or 0 once past.
+
+    Args:
+        period: the time period (start_hour, end_hour)
+        current_date: the day of the period
+        now_dt: current local time
+        min_start_dt: now_dt plus the screen's security buffer
+    """
+    period_start_dt = datetime.combine(current_date, datetime.min.time().replace(hour=period.start_hour))
+    if period_start_dt >= min_start_dt:
+        return get_period_duration_seconds(period)
+
+    # If period is completely in the past (before buffer), it's not available
+    if current_date != now_dt.date():
+        return 0
+
+    # Calculate how much of the period is left after min_start_dt
+    period_end_hour = period.end_hour if period.end_hour > period.start_hour else 24
+    period_end_dt = datetime.combine(current_date, datetime.min.time().replace(hour=period_end_hour % 24))
+    if period_end_hour == 24:
+        period_end_dt += timedelta(days=1)
+
+    if min_start_dt >= period_end_dt:
+        # Period is completely before security buffer
+        return 0
+    # Period is partially after security buffer
+    effective_start = max(period_start_dt, min_start_dt)
+    return (period_end_dt - effective_start).total_seconds()
+
+
 def get_reserved_seconds_for_period(screen_id, period_id, target_date, all_periods=None, preloaded_bookings=None):
     """
     Calculate total reserved seconds for a specific period on a specific date.
@@ -85,6 +118,95 @@ def get_reserved_seconds_for_period(screen_id, period_id, target_date, all_perio
     return total_reserved_seconds
 
 
+def _booking_daily_seconds(booking):
+    """
+    Seconds a booking reserves on each day it covers, as
+    get_reserved_seconds_for_period adds them, or None if it adds nothing.
+    """
+    if booking.start_date and booking.end_date:
+        booking_days = (booking.end_date - booking.start_date).days + 1
+        if booking_days > 0:
+            plays_per_day = booking.num_plays / booking_days
+            return plays_per_day * booking.slot_duration
+        return None
+    return booking.num_plays * booking.slot_duration
+
+
+def reserved_seconds_matrix(bookings, start_date, num_days, periods, all_periods):
+    """
+    Reserved seconds for every (day, period) cell of a date range, in one pass
+    over the bookings.
+
+    Each booking adds its daily seconds to the range of days it covers (its
+    own period's column, or every column prorated by period duration for
+    bookings without a period). Additions are applied to each cell in the
+    order get_reserved_seconds_for_period sums them, so values are
+    bit-for-bit identical.
+
+    Args:
+        bookings: bookings of the screen (pending/active, any dates)
+        start_date: first day of the range
+        num_days: number of days
+        periods: periods to return, one column each
+        all_periods: every period of the screen (prorating reference)
+
+    Returns:
+        list: num_days rows of len(periods) reserved seconds, typed as the
+        reference sum would be (int 0 for cells no booking adds to)
+    """
+    columns = {period.id: index for index, period in enumerate(periods)}
+    ratios = None
+    if all_periods:
+        total_day_seconds = sum(get_period_duration_seconds(p) for p in all_periods)
+        if total_day_seconds > 0:
+            period_ids = {p.id for p in all_periods}
+            ratios = [get_period_duration_seconds(p) / total_day_seconds if p.id in period_ids else None
+                      for p in periods]
+
+    period_ranges = []
+    shared_ranges = []
+    for booking in bookings:
+        if booking.time_period_id is None:
+            if ratios is None:
+                continue
+            target = shared_ranges
+        elif booking.time_period_id in columns:
+            target = period_ranges
+        else:
+            continue
+        daily = _booking_daily_seconds(booking)
+        if daily is None:
+            continue
+        first = max((booking.start_date - start_date).days, 0)
+        last = num_days if booking.end_date is None else min((booking.end_date - start_date).days + 1, num_days)
+        if first < last:
+            target.append((first, last, columns.get(booking.time_period_id), daily))
+
+    shared_columns = [index for index, ratio in enumerate(ratios or []) if ratio is not None]
+
+    # Cell kinds: 0 untouched (int 0), 1 int additions only, 2 float
+    reserved = [[0.0] * len(periods) for _ in range(num_days)]
+    kinds = [[0] * len(periods) for _ in range(num_days)]
+    for first, last, column, daily in period_ranges:
+        kind = 2 if isinstance(daily, float) else 1
+        for day in range(first, last):
+            reserved[day][column] += daily
+            if kinds[day][column] < kind:
+                kinds[day][column] = kind
+    for first, last, _, daily in shared_ranges:
+        shares = [(index, daily * ratios[index]) for index in shared_columns]
+        for day in range(first, last):
+            row, row_kinds = reserved[day], kinds[day]
+            for index, share in shares:
+                row[index] += share
+                row_kinds[index] = 2
+
+    return [
+        [value if kind == 2 else int(value) if kind else 0 for value, kind in zip(row, row_kinds)]
+        for row, row_kinds in zip(reserved, kinds)
+    ]
+
+
 def calculate_availability(screen, start_date, end_date, period_id=None, slot_duration=None, content_type='image', preloaded_bookings=None):
     """
     Calculate available slots for a screen during a date range.
@@ -128,7 +250,8 @@ def calculate_availability(screen, start_date, end_date, period_id=None, slot_du
     
     target_slot_duration = slot_duration if slot_duration else (slots[0].duration_seconds if slots else 15)
     
-    # Pre-fetch all relevant bookings for the entire date range
+    num_days = max((end_date - start_date).days + 1, 0)
+
     if preloaded_bookings is not None:
         # Filter preloaded bookings to ensure they match date range and status
         # Note: Caller is responsible for passing bookings for this screen
@@ -138,67 +261,41 @@ def calculate_availability(screen, start_date, end_date, period_id=None, slot_du
                b.start_date <= end_date and
                (b.end_date is None or b.end_date >= start_date)
         ]
+        reserved_matrix = reserved_seconds_matrix(
+            all_bookings, start_date, num_days, periods, screen.time_periods
+        )
     else:
-        all_bookings = Booking.query.filter(
-            Booking.screen_id == screen.id,
-            Booking.status.in_(['pending', 'active']),
-            Booking.start_date <= end_date,
-            or_(Booking.end_date >= start_date, Booking.end_date == None)
-        ).all()
+        # Cached per screen over all its periods; keep the requested columns
+        from services.availability_cache import AvailabilityCache
+        columns = {p.id: index for index, p in enumerate(screen.time_periods)}
+        reserved_matrix = [
+            [row[columns[p.id]] for p in periods]
+            for row in AvailabilityCache.reserved_rows(screen, start_date, num_days)
+        ]
 
     total_available_seconds = 0
     daily_breakdown = []
     period_summary = {}
     
-    current_date = start_date
     now_dt = datetime.now()
     buffer_delta = timedelta(minutes=screen.security_buffer_minutes or 30)
     min_start_dt = now_dt + buffer_delta
     
-    while current_date <= end_date:
+    for day_index in range(num_days):
+        current_date = start_date + timedelta(days=day_index)
         day_info = {
             'date': current_date.isoformat(),
             'periods': [],
             'total_available_seconds': 0
         }
         
-        all_screen_periods = screen.time_periods
-        
-        for period in periods:
-            # Check if period is in the past considering security buffer
-            period_start_dt = datetime.combine(current_date, datetime.min.time().replace(hour=period.start_hour))
+        for column, period in enumerate(periods):
+            reserved = reserved_matrix[day_index][column]
+
             period_duration = get_period_duration_seconds(period)
+            bookable = get_bookable_seconds(period, current_date, now_dt, min_start_dt)
+            available = max(0, bookable - reserved) if bookable else 0
 
-            if period_start_dt < min_start_dt:
-                # If period is completely in the past (before buffer), it's not available
-                # If it's partially in the past, we could be more precise, but for now we skip or adjust
-                # Let's adjust available time if it's today and overlaps with buffer
-                if current_date == now_dt.date():
-                    # Calculate how much of the period is left after min_start_dt
-                    period_end_hour = period.end_hour if period.end_hour > period.start_hour else 24
-                    period_end_dt = datetime.combine(current_date, datetime.min.time().replace(hour=period_end_hour % 24))
-                    if period_end_hour == 24:
-                        period_end_dt += timedelta(days=1)
-                    
-                    if min_start_dt >= period_end_dt:
-                        # Period is completely before security buffer
-                        available = 0
-                    else:
-                        # Period is partially after security buffer
-                        effective_start = max(period_start_dt, min_start_dt)
-                        available_duration = (period_end_dt - effective_start).total_seconds()
-                        reserved = get_reserved_seconds_for_period(
-                            screen.id, period.id, current_date, all_screen_periods, all_bookings
-                        )
-                        available = max(0, available_duration - reserved)
-                else:
-                    available = 0
-            else:
-                reserved = get_reserved_seconds_for_period(
-                    screen.id, period.id, current_date, all_screen_periods, all_bookings
-                )
-                available = max(0, period_duration - reserved)
-            
             available_plays = int(available / target_slot_duration)
             
             day_info['periods'].append({
@@ -228,7 +325,6 @@ def calculate_availability(screen, start_date, end_date, period_id=None, slot_du
         
         total_available_seconds += day_info['total_available_seconds']
         daily_breakdown.append(day_info)
-        current_date += timedelta(days=1)
     
     total_available_plays = int(total_available_seconds / target_slot_duration) if target_slot_duration else 0
     
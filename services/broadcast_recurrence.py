@@ -0,0 +1,229 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Closed-form recurrence engine for scheduled broadcasts
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import calendar
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+RECURRENCE_DAILY = 'daily'
+RECURRENCE_WEEKLY = 'weekly'
+RECURRENCE_MONTHLY = 'monthly'
+
+# Seconds of tolerance around recurrence_time for should_trigger_now().
+TRIGGER_TOLERANCE = 2
+
+# Upper bound on month steps when looking for a monthly occurrence (a rule on
+# the 29th of February only fires in leap years).
+MAX_MONTH_STEPS = 1000
+
+# get_next_occurrence() historically scanned 366 candidate days; occurrences
+# beyond that horizon are still reported as "none".
+LEGACY_HORIZON_DAYS = 365
+
+
+def _add_months(year, month, months):
+    index = year * 12 + (month - 1) + months
+    return index // 12, index % 12 + 1
+
+
+class RecurrenceRule:
+    """
+    Parsed, immutable recurrence of a scheduled broadcast.
+
+    Every lookup is arithmetic on the rule (day offsets modulo the interval,
+    weekday sets, month steps) instead of a day-by-day scan. Semantics match
+    the original Broadcast implementation:
+
+    - daily: every `interval` days from the start date
+    - weekly with days: every listed weekday (interval not applied)
+    - weekly without days: every day of every `interval`-th week from the start
+    - monthly: the start day-of-month every `interval` months (months without
+      that day are skipped)
+    - any other type (custom): every day
+    """
+
+    def __init__(self, recurrence_type, start_date, time, interval=1, days_of_week=None,
+                 end_date=None, explicit_time=True):
+        self.recurrence_type = recurrence_type
+        self.start_date = start_date
+        self.time = time
+        self.interval = max(interval or 1, 1)
+        self.days_of_week = days_of_week
+        self.end_date = end_date
+        self.explicit_time = explicit_time
+
+    @classmethod
+    def from_broadcast(cls, broadcast):
+        """Cached rule for a broadcast; None when it does not recur."""
+        if broadcast.recurrence_type == broadcast.RECURRENCE_NONE or not broadcast.scheduled_datetime:
+            return None
+        return _parse_rule(
+            broadcast.recurrence_type,
+            broadcast.scheduled_datetime,
+            broadcast.recurrence_interval,
+            broadcast.recurrence_days_of_week,
+            broadcast.recurrence_end_date,
+            broadcast.recurrence_time
+        )
+
+    def occurs_on(self, d):
+        """True if the rule fires on date d (ignores the end date)."""
+        if d < self.start_date:
+            return False
+        offset = (d - self.start_date).days
+
+        if self.recurrence_type == RECURRENCE_DAILY:
+            return offset % self.interval == 0
+
+        if self.recurrence_type == RECURRENCE_WEEKLY:
+            if self.days_of_week is not None:
+                return d.weekday() in self.days_of_week
+            return (offset // 7) % self.interval == 0
+
+        if self.recurrence_type == RECURRENCE_MONTHLY:
+            months = (d.year - self.start_date.year) * 12 + (d.month - self.start_date.month)
+            return months % self.interval == 0 and d.day == self.start_date.day
+
+        return True
+
+    def next_date(self, d, limit=None):
+        """First date >= d on which the rule fires, or None past `limit`."""
+        d = max(d, self.start_date)
+        offset = (d - self.start_date).days
+
+        if self.recurrence_type == RECURRENCE_DAILY:
+            result = d + timedelta(days=-offset % self.interval)
+
+        elif self.recurrence_type == RECURRENCE_WEEKLY:
+            if self.days_of_week is not None:
+                if not self.days_of_week:
+                    return None
+                weekday = d.weekday()
+                result = d + timedelta(days=min((day - weekday) % 7 for day in self.days_of_week))
+            else:
+                week = offset // 7
+                if week % self.interval == 0:
+                    result = d
+                else:
+                    next_week = week + (-week % self.interval)
+                    result = self.start_date + timedelta(days=next_week * 7)
+
+        elif self.recurrence_type == RECURRENCE_MONTHLY:
+            result = self._next_monthly_date(d, limit)
+
+        else:
+            result = d
+
+        if result is None or (limit is not None and result > limit):
+            return None
+        return result
+
+    def _next_monthly_date(self, d, limit):
+        start = self.start_date
+        months = (d.year - start.year) * 12 + (d.month - start.month)
+        months += -months % self.interval
+        for _ in range(MAX_MONTH_STEPS):
+            year, month = _add_months(start.year, start.month, months)
+            if limit is not None and (year, month) > (limit.year, limit.month):
+                return None
+            if start.day <= calendar.monthrange(year, month)[1]:
+                candidate = d.replace(year=year, month=month, day=start.day)
+                if candidate >= d:
+                    return candidate
+            months += self.interval
+        return None
+
+    def next_occurrence(self, after, until=None):
+        """First occurrence strictly after `after` (datetime), bounded by end date and `until`."""
+        limit = self.end_date
+        if until is not None:
+            limit = min(limit, until.date()) if limit else until.date()
+
+        d = max(after.date(), self.start_date)
+        if datetime.combine(d, self.time) <= after:
+            d += timedelta(days=1)
+
+        d = self.next_date(d, limit)
+        if d is None:
+            return None
+        occurrence = datetime.combine(d, self.time)
+        if until is not None and occurrence > until:
+            return None
+        return occurrence
+
+    def occurrences(self, after, count=None, until=None):
+        """Yield successive occurrences after `after`, up to `count` and/or `until`."""
+        produced = 0
+        while count is None or produced < count:
+            occurrence = self.next_occurrence(after, until)
+            if occurrence is None:
+                return
+            yield occurrence
+            produced += 1
+            after = occurrence
+
+    def triggers_at(self, now, tolerance=TRIGGER_TOLERANCE):
+        """True if `now` is within `tolerance` seconds of an occurrence (same day)."""
+        if not self.explicit_time:
+            return False
+        if self.recurrence_type not in (RECURRENCE_DAILY, RECURRENCE_WEEKLY, RECURRENCE_MONTHLY):
+            return False
+        if self.end_date and now.date() > self.end_date:
+            return False
+
+        now_seconds = now.hour * 3600 + now.minute * 60 + now.second
+        rule_seconds = self.time.hour * 3600 + self.time.minute * 60 + self.time.second
+        if abs(now_seconds - rule_seconds) > tolerance:
+            return False
+        return self.occurs_on(now.date())
+
+
+@lru_cache(maxsize=4096)
+def _parse_rule(recurrence_type, scheduled_datetime, interval, days_of_week, end_date, recurrence_time):
+    days = None
+    if days_of_week:
+        days = frozenset(int(day) for day in days_of_week.split(',') if day.strip().isdigit())
+    return RecurrenceRule(
+        recurrence_type,
+        scheduled_datetime.date(),
+        recurrence_time or scheduled_datetime.time(),
+        interval=interval,
+        days_of_week=days,
+        end_date=end_date,
+        explicit_time=recurrence_time is not None
+    )
+
+
+def expand_calendar(broadcasts, window_start, window_end):
+    """
+    Expand scheduled broadcasts into their occurrences within a time window.
+
+    Args:
+        broadcasts: Broadcast instances (immediate ones are ignored)
+        window_start: Start of the window (inclusive)
+        window_end: End of the window (inclusive)
+
+    Returns:
+        list: (occurrence datetime, broadcast) tuples sorted by time, then
+              by descending schedule priority
+    """
+    calendar_entries = []
+    for broadcast in broadcasts:
+        if broadcast.schedule_mode != broadcast.SCHEDULE_MODE_SCHEDULED or not broadcast.scheduled_datetime:
+            continue
+
+        rule = broadcast.recurrence_rule
+        if rule is None:
+            if window_start <= broadcast.scheduled_datetime <= window_end:
+                calendar_entries.append((broadcast.scheduled_datetime, broadcast))
+            continue
+
+        for occurrence in rule.occurrences(window_start - timedelta(microseconds=1), until=window_end):
+            calendar_entries.append((occurrence, broadcast))
+
+    calendar_entries.sort(key=lambda entry: (entry[0], -(entry[1].schedule_priority or 0), entry[1].id or 0))
+    return calendar_entries
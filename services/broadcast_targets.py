@@ -0,0 +1,169 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Materialized broadcast -> screen targeting (broadcast_screen_targets)
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+
+from sqlalchemy import and_, or_, func, select, delete, insert, event, inspect
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Screen, Organization
+from models.broadcast import Broadcast, broadcast_screen_targets
+
+logger = logging.getLogger(__name__)
+
+# Attributes that decide which screens a broadcast reaches. Changes to anything
+# else (schedule, overlay styling, is_active...) leave the mapping untouched.
+TARGETING_ATTRIBUTES = {
+    'Broadcast': {'target_type', 'target_country', 'target_city', 'target_organization_id',
+                  'target_screen_id', 'target_org_type'},
+    'Screen': {'organization_id'},
+    'Organization': {'country', 'city', 'is_paid'},
+}
+
+
+def _target_clause():
+    """SQL mirror of Broadcast.applies_to_screen() targeting and org-type checks."""
+    matches_target = or_(
+        and_(Broadcast.target_type == Broadcast.TARGET_SCREEN,
+             Broadcast.target_screen_id == Screen.id),
+        and_(Broadcast.target_type == Broadcast.TARGET_ORGANIZATION,
+             Broadcast.target_organization_id == Screen.organization_id),
+        and_(Broadcast.target_type == Broadcast.TARGET_COUNTRY,
+             Broadcast.target_country == Organization.country),
+        and_(Broadcast.target_type == Broadcast.TARGET_CITY,
+             Broadcast.target_country == Organization.country,
+             func.lower(Broadcast.target_city) == func.lower(Organization.city)),
+    )
+    matches_org_type = or_(
+        Broadcast.target_org_type.is_(None),
+        Broadcast.target_org_type.notin_([Broadcast.ORG_TYPE_PAID, Broadcast.ORG_TYPE_FREE]),
+        and_(Broadcast.target_org_type == Broadcast.ORG_TYPE_PAID, Organization.is_paid == True),
+        and_(Broadcast.target_org_type == Broadcast.ORG_TYPE_FREE, Organization.is_paid == False),
+    )
+    return and_(matches_target, matches_org_type)
+
+
+def _matching_pairs(*criteria):
+    return select(Broadcast.id, Screen.id).select_from(Screen).join(
+        Organization, Organization.id == Screen.organization_id
+    ).join(Broadcast, _target_clause()).where(*criteria)
+
+
+def refresh_broadcast_targets(connection, broadcast_ids=(), screen_ids=(), organization_ids=()):
+    """
+    Recompute the mapping rows of the given broadcasts, screens and
+    organizations (all screens of each organization) in two statements.
+    """
+    screen_ids = set(screen_ids)
+    if organization_ids:
+        screen_ids.update(connection.execute(
+            select(Screen.id).where(Screen.organization_id.in_(organization_ids))
+        ).scalars())
+
+    scope = []
+    if broadcast_ids:
+        scope.append(broadcast_screen_targets.c.broadcast_id.in_(broadcast_ids))
+    if screen_ids:
+        scope.append(broadcast_screen_targets.c.screen_id.in_(screen_ids))
+    if not scope:
+        return
+
+    connection.execute(delete(broadcast_screen_targets).where(or_(*scope)))
+
+    criteria = []
+    if broadcast_ids:
+        criteria.append(Broadcast.id.in_(broadcast_ids))
+    if screen_ids:
+        criteria.append(Screen.id.in_(screen_ids))
+    connection.execute(insert(broadcast_screen_targets).from_select(
+        ['broadcast_id', 'screen_id'], _matching_pairs(or_(*criteria))
+    ))
+
+
+def rebuild_broadcast_targets():
+    """Recompute the whole mapping (initial backfill, or repair after raw SQL writes)."""
+    connection = db.session.connection()
+    connection.execute(delete(broadcast_screen_targets))
+    connection.execute(insert(broadcast_screen_targets).from_select(
+        ['broadcast_id', 'screen_id'], _matching_pairs()
+    ))
+    db.session.commit()
+    count = db.session.query(func.count()).select_from(broadcast_screen_targets).scalar()
+    logger.info(f"Broadcast targets rebuilt: {count} broadcast/screen pairs")
+    return count
+
+
+def count_target_screens(broadcast_ids):
+    """Number of active target screens per broadcast ID, in one query."""
+    if not broadcast_ids:
+        return {}
+    rows = db.session.query(
+        broadcast_screen_targets.c.broadcast_id, func.count()
+    ).join(Screen, Screen.id == broadcast_screen_targets.c.screen_id).filter(
+        broadcast_screen_targets.c.broadcast_id.in_(broadcast_ids),
+        Screen.is_active == True
+    ).group_by(broadcast_screen_targets.c.broadcast_id).all()
+    return dict(rows)
+
+
+def _targeting_changed(obj, model_name):
+    state = inspect(obj)
+    return any(state.attrs[key].history.has_changes() for key in TARGETING_ATTRIBUTES[model_name])
+
+
+def _on_after_flush(session, flush_context):
+    changed = {'Broadcast': set(), 'Screen': set(), 'Organization': set()}
+    removed = {'Broadcast': set(), 'Screen': set()}
+
+    for collection, check_history in ((session.new, False), (session.dirty, True)):
+        for obj in collection:
+            model_name = type(obj).__name__
+            if model_name not in changed or obj.id is None:
+                continue
+            if check_history and not _targeting_changed(obj, model_name):
+                continue
+            changed[model_name].add(obj.id)
+
+    for obj in session.deleted:
+        model_name = type(obj).__name__
+        if model_name in removed and obj.id is not None:
+            removed[model_name].add(obj.id)
+
+    if not any(changed.values()) and not any(removed.values()):
+        return
+
+    # Runs inside the flush's transaction: a failure here rolls the write back
+    # rather than leaving screens with a stale broadcast mapping.
+    connection = session.connection()
+    if removed['Broadcast']:
+        connection.execute(delete(broadcast_screen_targets).where(
+            broadcast_screen_targets.c.broadcast_id.in_(removed['Broadcast'])
+        ))
+    if removed['Screen']:
+        connection.execute(delete(broadcast_screen_targets).where(
+            broadcast_screen_targets.c.screen_id.in_(removed['Screen'])
+        ))
+    refresh_broadcast_targets(
+        connection,
+        broadcast_ids=changed['Broadcast'],
+        screen_ids=changed['Screen'],
+        organization_ids=changed['Organization']
+    )
+
+
+_listeners_registered = False
+
+
+def register_broadcast_target_listeners():
+    """Keep broadcast_screen_targets in sync with every flush (idempotent)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(Session, 'after_flush', _on_after_flush)
+    _listeners_registered = True
+    logger.info("Broadcast target listeners registered")
@@ -0,0 +1,474 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Superadmin dashboard aggregates, cached and updated incrementally
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Organization, Screen, Booking, SiteSetting
+from services.screen_events import ScreenEventBus, WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reloads of organizations, screens and online screen counts.
+DASHBOARD_DIRECTORY_TTL = int(os.environ.get('DASHBOARD_DIRECTORY_TTL', 60))
+
+# Seconds between full recounts of paid booking revenue. In between, revenue
+# is kept up to date from committed booking changes.
+DASHBOARD_REVENUE_TTL = int(os.environ.get('DASHBOARD_REVENUE_TTL', 900))
+
+# A worker whose dashboard has not been read for this long stops refreshing.
+DASHBOARD_IDLE_AFTER = 3600
+
+# Daily revenue is kept for this many days (monthly window).
+REVENUE_WINDOW_DAYS = 30
+
+EVENT_DASHBOARD_DELTA = 'dashboard_delta'
+
+
+class DashboardAggregates:
+    """
+    Superadmin dashboard metrics computed from a small in-memory state.
+
+    The state holds paid revenue per organization (all time and per day for
+    the last REVENUE_WINDOW_DAYS days) and a directory of organizations and
+    screens. Rendering derives every metric from it in time proportional to
+    the number of organizations, whatever the number of bookings.
+
+    Committed inserts, payments, price changes and deletions of bookings are
+    applied as deltas, in this worker and, through the screen event bus, in
+    the others. Staleness bounds: the directory is at most
+    DASHBOARD_DIRECTORY_TTL old and revenue is recounted from the bookings
+    every DASHBOARD_REVENUE_TTL seconds by a per-worker scheduler job; a read
+    recomputes synchronously only when a bound is exceeded twice over (no
+    scheduler, idle worker).
+
+    Deltas committed while a recount runs are replayed on top of it, except
+    (on PostgreSQL) those whose transaction is visible in the recount's
+    snapshot: the recount already includes them.
+    """
+    _lock = threading.RLock()
+    _revenue = None
+    _revenue_at = 0
+    _directory = None
+    _directory_at = 0
+    _pending = []
+    _recounting = None
+    _version = 0
+    _derived = None
+    _last_read = 0
+
+    @classmethod
+    def stats(cls, force_refresh=False):
+        cls._last_read = time.monotonic()
+        if force_refresh:
+            cls.refresh(force=True)
+        else:
+            cls._ensure_within_bounds()
+
+        with cls._lock:
+            key = (cls._version, datetime.utcnow().date())
+            if cls._derived is None or cls._derived[0] != key:
+                cls._derived = (key, cls._derive(key[1]))
+            return cls._derived[1]
+
+    @classmethod
+    def refresh(cls, force=False):
+        """Reload what is older than its refresh interval (everything with force)."""
+        now = time.monotonic()
+        if force or now - cls._directory_at >= DASHBOARD_DIRECTORY_TTL:
+            cls._load_directory()
+        if force or now - cls._revenue_at >= DASHBOARD_REVENUE_TTL:
+            cls._recount_revenue()
+
+    @classmethod
+    def refresh_if_read(cls):
+        """Background refresh, skipped by workers nobody reads the dashboard from."""
+        if cls._last_read and time.monotonic() - cls._last_read < DASHBOARD_IDLE_AFTER:
+            cls.refresh()
+
+    @classmethod
+    def _ensure_within_bounds(cls):
+        now = time.monotonic()
+        if cls._directory is None or now - cls._directory_at >= 2 * DASHBOARD_DIRECTORY_TTL:
+            cls._load_directory()
+        if cls._revenue is None or now - cls._revenue_at >= 2 * DASHBOARD_REVENUE_TTL:
+            cls._recount_revenue()
+
+    @classmethod
+    def apply(cls, deltas, xid=None):
+        """Apply committed booking deltas: [(screen_id, day, amount)], from transaction xid."""
+        if not deltas:
+            return
+        with cls._lock:
+            if cls._recounting is not None:
+                # Replayed on top of the recount in progress
+                cls._recounting.append((xid, deltas))
+            if cls._revenue is None:
+                return
+            cls._fold(deltas)
+
+    @classmethod
+    def _fold(cls, deltas):
+        """Caller holds _lock."""
+        screen_orgs = cls._directory['screen_orgs'] if cls._directory else {}
+        totals, daily = cls._revenue['totals'], cls._revenue['daily']
+        for screen_id, day, amount in deltas:
+            org_id = screen_orgs.get(screen_id)
+            if org_id is None:
+                # Screen created after the directory was loaded
+                cls._pending.append((screen_id, day, amount))
+                cls._directory_at = 0
+                continue
+            totals[org_id] = totals.get(org_id, 0) + amount
+            if day >= cls._revenue['window_start']:
+                daily[(org_id, day)] = daily.get((org_id, day), 0) + amount
+        cls._version += 1
+
+    @classmethod
+    def _load_directory(cls):
+        orgs = {row.id: row for row in db.session.query(
+            Organization.id, Organization.name, Organization.email, Organization.country,
+            Organization.currency, Organization.commission_rate, Organization.is_active
+        )}
+        screen_orgs = dict(db.session.query(Screen.id, Screen.organization_id))
+        online_screens = Screen.query.filter(Screen.status.in_(['online', 'playing'])).count()
+
+        with cls._lock:
+            cls._directory = {'orgs': orgs, 'screen_orgs': screen_orgs, 'online_screens': online_screens}
+            cls._directory_at = time.monotonic()
+            pending, cls._pending = cls._pending, []
+            if cls._revenue is not None and pending:
+                cls._fold(pending)
+            cls._version += 1
+
+    @classmethod
+    def _recount_revenue(cls):
+        # Capture starts before the snapshot is taken, so no delta is missed
+        with cls._lock:
+            cls._recounting = []
+        try:
+            window_start = datetime.utcnow().date() - timedelta(days=REVENUE_WINDOW_DAYS)
+            totals, daily, snapshot = _read_revenue(window_start)
+        except Exception:
+            with cls._lock:
+                cls._recounting = None
+            raise
+
+        with cls._lock:
+            cls._revenue = {
+                'totals': {org_id: amount or 0 for org_id, amount in totals.items()},
+                'daily': daily,
+                'window_start': window_start,
+                'computed_at': datetime.utcnow(),
+            }
+            cls._revenue_at = time.monotonic()
+            captured, cls._recounting = cls._recounting, None
+            replay = [delta for xid, deltas in captured
+                      if not _visible_in_snapshot(xid, snapshot) for delta in deltas]
+            if replay:
+                cls._fold(replay)
+            cls._version += 1
+
+    @classmethod
+    def _derive(cls, today):
+        """Dashboard metrics from the state. Caller holds _lock."""
+        from utils.currencies import get_currency_by_code, get_country_by_code
+
+        orgs = cls._directory['orgs']
+        totals, daily = cls._revenue['totals'], cls._revenue['daily']
+        week_ago = today - timedelta(days=7)
+        month_ago = today - timedelta(days=30)
+
+        windows = {}
+        for (org_id, day), amount in daily.items():
+            org_windows = windows.setdefault(org_id, {'daily': 0, 'weekly': 0, 'monthly': 0})
+            if day >= today:
+                org_windows['daily'] += amount
+            if day >= week_ago:
+                org_windows['weekly'] += amount
+            if day >= month_ago:
+                org_windows['monthly'] += amount
+
+        def rate(org_id):
+            return (orgs[org_id].commission_rate or 0) / 100
+
+        revenue_orgs = [org_id for org_id in totals if org_id in orgs]
+        empty_window = {'daily': 0, 'weekly': 0, 'monthly': 0}
+
+        by_currency = {}
+        by_country = {}
+        for org_id in revenue_orgs:
+            org = orgs[org_id]
+            total = totals[org_id]
+            org_windows = windows.get(org_id, empty_window)
+
+            currency = by_currency.setdefault(org.currency, {'total': 0, 'commission': 0, 'weekly': 0, 'monthly': 0})
+            currency['total'] += total
+            currency['commission'] += total * rate(org_id)
+            currency['weekly'] += org_windows['weekly']
+            currency['monthly'] += org_windows['monthly']
+
+            row = by_country.setdefault((org.country, org.currency), dict.fromkeys((
+                'total', 'commission', 'daily_total', 'daily_commission', 'weekly_total',
+                'weekly_commission', 'monthly_total', 'monthly_commission'), 0))
+            row['total'] += total
+            row['commission'] += total * rate(org_id)
+            for window in ('daily', 'weekly', 'monthly'):
+                row[f'{window}_total'] += org_windows[window]
+                row[f'{window}_commission'] += org_windows[window] * rate(org_id)
+
+        currency_stats = []
+        for currency_code in sorted(by_currency, key=lambda code: code or ''):
+            values = by_currency[currency_code]
+            currency_info = get_currency_by_code(currency_code or 'EUR')
+            currency_stats.append({
+                'code': currency_code or 'EUR',
+                'name': currency_info.get('name', currency_code),
+                'flag': currency_info.get('flag', ''),
+                'symbol': currency_info.get('symbol', currency_code),
+                'total': values['total'],
+                'commission': values['commission']
+            })
+
+        orgs_count_map, screens_count_map, commission_sums = {}, {}, {}
+        for org in orgs.values():
+            orgs_count_map[org.country] = orgs_count_map.get(org.country, 0) + 1
+            commission_sums[org.country] = commission_sums.get(org.country, 0) + (org.commission_rate or 0)
+        for org_id in cls._directory['screen_orgs'].values():
+            if org_id in orgs:
+                country = orgs[org_id].country
+                screens_count_map[country] = screens_count_map.get(country, 0) + 1
+        avg_commission_map = {c: commission_sums[c] / orgs_count_map[c] for c in orgs_count_map}
+
+        def country_entry(cc):
+            country_info = get_country_by_code(cc)
+            return {
+                'country_code': cc,
+                'country_name': country_info.get('name', cc),
+                'country_flag': country_info.get('flag', ''),
+                'org_count': orgs_count_map.get(cc, 0),
+                'screen_count': screens_count_map.get(cc, 0),
+                'avg_commission': avg_commission_map.get(cc, 0),
+                'currencies': []
+            }
+
+        country_data = {}
+        for (country_code, currency_code), row in by_country.items():
+            cc = country_code or 'FR'
+            if cc not in country_data:
+                country_data[cc] = country_entry(cc)
+            currency_info = get_currency_by_code(currency_code or 'EUR')
+            country_data[cc]['currencies'].append(dict(
+                row,
+                currency_code=currency_code or 'EUR',
+                currency_symbol=currency_info.get('symbol', currency_code)
+            ))
+        for cc in orgs_count_map:
+            if cc not in country_data:
+                country_data[cc] = country_entry(cc)
+
+        top_orgs_data = []
+        for org_id in sorted(revenue_orgs, key=lambda org_id: totals[org_id], reverse=True)[:5]:
+            org = orgs[org_id]
+            top_orgs_data.append({
+                'id': org.id,
+                'name': org.name,
+                'email': org.email,
+                'revenue': totals[org_id],
+                'currency': org.currency,
+                'commission_rate': org.commission_rate,
+                'commission': round(totals[org_id] * rate(org_id), 2)
+            })
+
+        return {
+            'total_orgs': len(orgs),
+            'active_orgs': sum(1 for org in orgs.values() if org.is_active),
+            'total_screens': len(cls._directory['screen_orgs']),
+            'online_screens': cls._directory['online_screens'],
+            'total_revenue': sum(totals[org_id] for org_id in revenue_orgs),
+            'weekly_revenue': sum(windows.get(org_id, empty_window)['weekly'] for org_id in revenue_orgs),
+            'monthly_revenue': sum(windows.get(org_id, empty_window)['monthly'] for org_id in revenue_orgs),
+            'total_platform_commission': sum(totals[org_id] * rate(org_id) for org_id in revenue_orgs),
+            'weekly_commission': sum(
+                windows.get(org_id, empty_window)['weekly'] * rate(org_id) for org_id in revenue_orgs),
+            'currency_stats': currency_stats,
+            'country_stats': list(country_data.values()),
+            'top_orgs_data': top_orgs_data,
+            'admin_base_currency': SiteSetting.get('admin_base_currency', 'EUR'),
+            'revenues_by_currency': {code or 'EUR': v['total'] for code, v in by_currency.items()},
+            'commissions_by_currency': {code or 'EUR': v['commission'] for code, v in by_currency.items()},
+            'weekly_rev_dict': {code or 'EUR': v['weekly'] for code, v in by_currency.items()},
+            'monthly_rev_dict': {code or 'EUR': v['monthly'] for code, v in by_currency.items()},
+            'revenue_computed_at': cls._revenue['computed_at'],
+        }
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._revenue = None
+            cls._revenue_at = 0
+            cls._directory = None
+            cls._directory_at = 0
+            cls._pending = []
+            cls._recounting = None
+            cls._derived = None
+            cls._last_read = 0
+            cls._version += 1
+
+
+def _read_revenue(window_start):
+    """
+    Paid revenue per organization and per (organization, day) since
+    window_start, and the snapshot it was read in (PostgreSQL) or None.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return _revenue_queries(db.session.execute, window_start) + (None,)
+    # Both queries in one snapshot, whose first statement reports it
+    with db.engine.connect() as conn:
+        conn.execution_options(isolation_level='REPEATABLE READ')
+        snapshot = _parse_snapshot(conn.execute(text('SELECT txid_current_snapshot()')).scalar())
+        return _revenue_queries(conn.execute, window_start) + (snapshot,)
+
+
+def _revenue_queries(execute, window_start):
+    totals = {org_id: amount or 0 for org_id, amount in execute(
+        select(Screen.organization_id, func.sum(Booking.total_price))
+        .join(Booking, Booking.screen_id == Screen.id)
+        .where(Booking.payment_status == 'paid')
+        .group_by(Screen.organization_id)
+    )}
+
+    daily = {}
+    for org_id, day, amount in execute(
+        select(Screen.organization_id, func.date(Booking.created_at), func.sum(Booking.total_price))
+        .join(Booking, Booking.screen_id == Screen.id)
+        .where(Booking.payment_status == 'paid', Booking.created_at >= window_start)
+        .group_by(Screen.organization_id, func.date(Booking.created_at))
+    ):
+        # SQLite returns DATE() as text
+        daily[(org_id, date.fromisoformat(day) if isinstance(day, str) else day)] = amount or 0
+    return totals, daily
+
+
+def _parse_snapshot(value):
+    """txid_current_snapshot() text 'xmin:xmax:xip,...' -> (xmin, xmax, {in progress xids})."""
+    xmin, xmax, xip = str(value).split(':')
+    return int(xmin), int(xmax), {int(xid) for xid in xip.split(',') if xid}
+
+
+def _visible_in_snapshot(xid, snapshot):
+    """True if transaction xid had committed when snapshot was taken (unknown: False)."""
+    if xid is None or snapshot is None:
+        return False
+    xmin, xmax, in_progress = snapshot
+    return xid < xmin or (xid < xmax and xid not in in_progress)
+
+
+def _transaction_id(session):
+    """Id of the session's current transaction (PostgreSQL), or None."""
+    if session.get_bind().dialect.name != 'postgresql':
+        return None
+    return session.connection().execute(text('SELECT txid_current()')).scalar()
+
+
+def _committed(state, attribute):
+    history = state.attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(state.obj(), attribute)
+
+
+def _booking_deltas(obj, change):
+    """Revenue changes of a flushed booking: [(screen_id, day, amount)]."""
+    state = inspect(obj)
+    created = (obj.created_at or datetime.utcnow()).date()
+    if change == 'deleted':
+        if _committed(state, 'payment_status') != 'paid':
+            return []
+        return [(_committed(state, 'screen_id'), created, -(_committed(state, 'total_price') or 0))]
+
+    amount = (obj.total_price or 0) if obj.payment_status == 'paid' else 0
+    if change == 'new':
+        return [(obj.screen_id, created, amount)] if amount else []
+
+    was_paid = _committed(state, 'payment_status') == 'paid'
+    previous = (_committed(state, 'total_price') or 0) if was_paid else 0
+    old_screen = _committed(state, 'screen_id')
+    if old_screen != obj.screen_id:
+        return [(old_screen, created, -previous), (obj.screen_id, created, amount)]
+    return [(obj.screen_id, created, amount - previous)] if amount != previous else []
+
+
+def _on_after_flush(session, flush_context):
+    try:
+        deltas = session.info.setdefault('dashboard_deltas', [])
+        for change, objects in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+            for obj in objects:
+                if isinstance(obj, Booking):
+                    deltas.extend(_booking_deltas(obj, change))
+        if deltas and 'dashboard_xid' not in session.info:
+            session.info['dashboard_xid'] = _transaction_id(session)
+    except Exception as e:
+        # Never break a write because of dashboard bookkeeping; recount soon
+        logger.error(f"Dashboard delta tracking failed: {e}")
+        DashboardAggregates._revenue_at = 0
+
+
+def _on_after_commit(session):
+    deltas = session.info.pop('dashboard_deltas', None)
+    xid = session.info.pop('dashboard_xid', None)
+    if not deltas:
+        return
+    DashboardAggregates.apply(deltas, xid)
+    try:
+        ScreenEventBus.publish(WORKERS, EVENT_DASHBOARD_DELTA, {
+            'deltas': [[screen_id, day.isoformat(), amount] for screen_id, day, amount in deltas],
+            'xid': xid,
+        })
+    except Exception as e:
+        logger.error(f"Dashboard delta relay failed: {e}")
+
+
+def _on_after_rollback(session):
+    session.info.pop('dashboard_deltas', None)
+    session.info.pop('dashboard_xid', None)
+
+
+def _on_screen_event(screen_id, event_name, data, remote):
+    if remote and screen_id == WORKERS and event_name == EVENT_DASHBOARD_DELTA:
+        DashboardAggregates.apply([
+            (delta_screen, date.fromisoformat(day), amount)
+            for delta_screen, day, amount in (data or {}).get('deltas', [])
+        ], (data or {}).get('xid'))
+
+
+_listeners_registered = False
+
+
+def register_dashboard_listeners():
+    """Track committed booking changes in every SQLAlchemy session (idempotent)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(Session, 'after_flush', _on_after_flush)
+    event.listen(Session, 'after_commit', _on_after_commit)
+    event.listen(Session, 'after_rollback', _on_after_rollback)
+    ScreenEventBus.add_listener(_on_screen_event)
+    _listeners_registered = True
+
+
+def refresh_dashboard_aggregates():
+    DashboardAggregates.refresh_if_read()
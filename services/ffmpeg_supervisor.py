@@ -0,0 +1,770 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Supervisor process owning every FFmpeg HLS encoder, driven over a Unix socket
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+
+Run it next to gunicorn (systemd unit, supervisord, container entrypoint):
+
+    python -m services.ffmpeg_supervisor
+
+Web workers start it on demand when FFMPEG_SUPERVISOR_AUTOSTART is on and
+nothing listens on the socket; a lock file keeps a single instance per host.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, nor Unix sockets
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Encoder outputs: one directory per job with stream.m3u8 and its segments.
+HLS_ROOT = Path(os.environ.get('HLS_TEMP_DIR', os.path.join(tempfile.gettempdir(), 'adscreen_hls')))
+
+FFMPEG_SUPERVISOR_SOCKET = os.environ.get('FFMPEG_SUPERVISOR_SOCKET', str(HLS_ROOT / 'supervisor.sock'))
+
+# Workers spawn the supervisor when it is not running (disable when it is
+# managed by the process manager).
+FFMPEG_SUPERVISOR_AUTOSTART = os.environ.get('FFMPEG_SUPERVISOR_AUTOSTART', 'true').lower() == 'true'
+
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+
+# Encoders (distinct channels) running at once on the host; starts past this are refused.
+FFMPEG_MAX_JOBS = int(os.environ.get('FFMPEG_MAX_JOBS', 8))
+
+# Crashed encoders are restarted after 1, 2, 4... seconds, at most this long.
+FFMPEG_RESTART_BACKOFF_MAX = int(os.environ.get('FFMPEG_RESTART_BACKOFF_MAX', 60))
+
+# Consecutive crashes before a job is given up (a later start retries it).
+FFMPEG_MAX_RESTARTS = int(os.environ.get('FFMPEG_MAX_RESTARTS', 10))
+
+# An encoder running this long is considered healthy: its backoff resets.
+FFMPEG_STABLE_AFTER = 60
+
+# Seconds a stopped encoder gets after SIGTERM, then after SIGKILL.
+FFMPEG_STOP_GRACE = 2
+
+# Encoders are recycled after this many seconds, for 24/7 stability.
+FFMPEG_MAX_RUNTIME = int(os.environ.get('FFMPEG_MAX_RUNTIME', 1800))
+
+# A screen's subscription lapses when it has not asked for its channel for
+# this long (players reload the playlist every few seconds); a channel
+# without subscribers is stopped.
+FFMPEG_SUBSCRIPTION_TTL = int(os.environ.get('FFMPEG_SUBSCRIPTION_TTL', 120))
+
+# Seconds between checks of the encoders (exits, manifests, restarts).
+SUPERVISOR_TICK = 0.2
+
+# Seconds a worker waits for a spawned supervisor to listen.
+SUPERVISOR_START_TIMEOUT = 5
+
+# Seconds a worker waits for an answer (waits for a manifest add their own timeout).
+SUPERVISOR_REQUEST_TIMEOUT = 10
+
+# Events queued for an event subscriber; one that falls this far behind, or
+# whose socket stays full for SUPERVISOR_REQUEST_TIMEOUT, is disconnected.
+SUPERVISOR_EVENT_BACKLOG = 256
+
+ALLOWED_PROTOCOLS = ('http', 'https', 'udp', 'rtp', 'rtmp', 'rtsp', 'tcp')
+JOB_KEY_PATTERN = re.compile(r'^[a-zA-Z0-9_-]{1,64}$')
+
+STATE_STARTING = 'starting'
+STATE_READY = 'ready'
+STATE_BACKOFF = 'backoff'
+STATE_FAILED = 'failed'
+
+
+class SupervisorUnavailable(Exception):
+    """The supervisor could not be reached (nor started)."""
+
+
+class SupervisorError(Exception):
+    """The supervisor refused a request (invalid, busy)."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def build_command(source_url, output_dir, ffmpeg_bin=None):
+    """FFmpeg arguments converting a live MPEG-TS source to a rolling HLS playlist."""
+    return [
+        ffmpeg_bin or FFMPEG_BIN,
+        '-y',
+        '-hide_banner',
+        '-loglevel', 'warning',
+        # SEC: Removed 'file' to prevent Local File Inclusion (LFI/SSRF)
+        # SEC: Explicitly whitelist allowed protocols
+        '-protocol_whitelist', 'http,https,tcp,udp,rtp,rtmp,rtsp',
+        '-reconnect', '1',
+        '-reconnect_streamed', '1',
+        '-reconnect_delay_max', '5',
+        '-fflags', '+genpts+discardcorrupt',
+        '-user_agent', 'VLC/3.0.18 LibVLC/3.0.18',
+        '-i', source_url,
+        '-c:v', 'copy',
+        '-c:a', 'aac',
+        '-b:a', '96k',
+        '-f', 'hls',
+        '-hls_time', '2',
+        '-hls_list_size', '3',
+        '-hls_flags', 'delete_segments+independent_segments',
+        '-hls_segment_filename', str(output_dir / 'segment%03d.ts'),
+        str(output_dir / 'stream.m3u8')
+    ]
+
+
+def channel_key(source_url):
+    """Job key of a source: every screen watching it shares its encoder and output."""
+    return 'ch-' + hashlib.sha256(source_url.encode('utf-8')).hexdigest()[:24]
+
+
+def manifest_is_ready(manifest_path):
+    try:
+        with open(manifest_path, 'r') as f:
+            content = f.read()
+    except OSError:
+        return False
+    return '.ts' in content and '#EXTINF' in content
+
+
+class EncoderJob:
+    """One FFmpeg process and its restart bookkeeping."""
+
+    def __init__(self, key, source_url, output_dir):
+        self.key = key
+        self.source_url = source_url
+        self.output_dir = output_dir
+        self.process = None
+        self.state = STATE_STARTING
+        self.started_at = None
+        self.next_start = 0
+        self.failures = 0
+        self.restarts = 0
+        self.last_exit = None
+        # Subscribed screen code -> monotonic time it last asked for the channel
+        self.subscribers = {}
+
+    @property
+    def manifest_path(self):
+        return self.output_dir / 'stream.m3u8'
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'source_url': self.source_url,
+            'state': self.state,
+            'pid': self.process.pid if self.process and self.process.poll() is None else None,
+            'ready': self.state == STATE_READY,
+            'restarts': self.restarts,
+            'failures': self.failures,
+            'last_exit': self.last_exit,
+            'uptime': round(time.monotonic() - self.started_at, 1) if self.started_at and self.process else None,
+            'manifest': str(self.manifest_path),
+            'subscribers': sorted(self.subscribers),
+        }
+
+
+class FFmpegSupervisor:
+    """
+    Owns the FFmpeg encoders of the host and answers workers on a Unix socket.
+
+    Requests and answers are JSON lines. Operations: start (idempotent for
+    the same source, replaces the encoder on a new one), stop, status, wait
+    (until the job's manifest lists segments) and events (a stream of
+    started / ready / exited / restarting / failed / stopped events).
+    Encoders that exit are restarted with exponential backoff; at most
+    max_jobs run at once.
+
+    Screens use subscribe / unsubscribe: jobs are then keyed by source
+    (channel_key), so one encoder serves every screen on a channel, and it
+    is stopped when its last screen leaves or stops renewing.
+    """
+
+    def __init__(self, socket_path=None, root=None, ffmpeg_bin=None, max_jobs=None):
+        self.socket_path = socket_path or FFMPEG_SUPERVISOR_SOCKET
+        self.root = Path(root or HLS_ROOT)
+        self.ffmpeg_bin = ffmpeg_bin or FFMPEG_BIN
+        self.max_jobs = max_jobs or FFMPEG_MAX_JOBS
+        self.jobs = {}
+        # Screen code -> key of the channel job it watches
+        self.subscriptions = {}
+        self._cond = threading.Condition(threading.RLock())
+        # Event subscriber connection -> queue of its pending events
+        self._subscribers = {}
+        # Job key -> signalled encoder still writing to that key's directory;
+        # the key's next encoder is launched once it has exited
+        self._draining = {}
+        self._reapers = []
+        self._server = None
+        self._stopping = threading.Event()
+        self._lock_file = None
+
+    # Lifecycle
+
+    def acquire_instance_lock(self):
+        """True if this is the only supervisor for the socket on this host."""
+        if fcntl is None:
+            return True
+        self._lock_file = open(self.socket_path + '.lock', 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+        return True
+
+    def serve_forever(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Outputs a previous supervisor moved aside but did not get to delete
+        for path in self.root.glob('.old-*'):
+            shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self._server.listen(64)
+        self._server.settimeout(0.5)
+        threading.Thread(target=self._monitor, name='ffmpeg-monitor', daemon=True).start()
+        logger.info(f"FFmpeg supervisor listening on {self.socket_path} (max {self.max_jobs} encoders)")
+
+        while not self._stopping.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def stop_serving(self):
+        """Make serve_forever return (safe from signal handlers)."""
+        self._stopping.set()
+
+    def shutdown(self):
+        """Stop every encoder and close the socket."""
+        self._stopping.set()
+        with self._cond:
+            for key in list(self.jobs):
+                self._stop_job(key)
+            self._cond.notify_all()
+            reapers = list(self._reapers)
+        for reaper in reapers:
+            reaper.join(timeout=FFMPEG_STOP_GRACE * 2 + 1)
+        if self._server is not None:
+            self._server.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        logger.info("FFmpeg supervisor stopped")
+
+    # Requests
+
+    def _handle(self, conn):
+        reader = conn.makefile('r', encoding='utf-8')
+        try:
+            for line in reader:
+                try:
+                    request = json.loads(line)
+                    op = request.get('op')
+                    if op == 'events':
+                        self._subscribe(conn)
+                        return
+                    response = self.dispatch(op, request)
+                except SupervisorError as e:
+                    response = {'ok': False, 'error': e.code, 'message': str(e)}
+                except Exception as e:
+                    logger.error(f"Supervisor request failed: {e}")
+                    response = {'ok': False, 'error': 'internal', 'message': str(e)}
+                conn.sendall((json.dumps(response) + '\n').encode('utf-8'))
+        except OSError:
+            pass
+        finally:
+            reader.close()
+            conn.close()
+
+    def dispatch(self, op, request):
+        if op == 'start':
+            return {'ok': True, **self.start(request.get('key'), request.get('source_url'))}
+        if op == 'stop':
+            return {'ok': True, 'stopped': self.stop(request.get('key'))}
+        if op == 'subscribe':
+            return {'ok': True, **self.subscribe(request.get('screen'), request.get('source_url'))}
+        if op == 'unsubscribe':
+            return {'ok': True, **self.unsubscribe(request.get('screen'))}
+        if op == 'status':
+            return {'ok': True, **self.status(request.get('key'), request.get('screen'))}
+        if op == 'wait':
+            return {'ok': True, **self.wait(request.get('key'), float(request.get('timeout', 15)))}
+        raise SupervisorError('unknown_op', f"Unknown operation: {op}")
+
+    def start(self, key, source_url):
+        _validate_key(key)
+        _validate_source(source_url)
+        with self._cond:
+            previous = self.jobs.get(key)
+            if previous is not None and previous.source_url == source_url and previous.state != STATE_FAILED:
+                return {'job': previous.to_dict(), 'reused': True}
+            if previous is not None:
+                self._stop_job(key)
+            elif sum(1 for j in self.jobs.values() if j.state != STATE_FAILED) >= self.max_jobs:
+                raise SupervisorError('busy', f"Encoder limit reached ({self.max_jobs})")
+
+            job = EncoderJob(key, source_url, self.root / key)
+            if previous is not None:
+                job.subscribers = previous.subscribers
+            self.jobs[key] = job
+            self._launch(job)
+            return {'job': job.to_dict(), 'reused': False}
+
+    def stop(self, key):
+        _validate_key(key)
+        with self._cond:
+            job = self.jobs.get(key)
+            if job is not None:
+                for screen in job.subscribers:
+                    self.subscriptions.pop(screen, None)
+            stopped = self._stop_job(key)
+            self._cond.notify_all()
+        return stopped
+
+    def subscribe(self, screen, source_url):
+        """
+        Point a screen at the shared encoder of source_url, starting it if
+        no other screen watches that channel. Leaves the screen's previous
+        channel; calling it again renews the subscription.
+        """
+        _validate_key(screen)
+        _validate_source(source_url)
+        key = channel_key(source_url)
+        with self._cond:
+            if self.subscriptions.get(screen) not in (None, key):
+                self._unsubscribe(screen)
+            response = self.start(key, source_url)
+            job = self.jobs[key]
+            if screen not in job.subscribers:
+                logger.info(f"[{key}] {screen} subscribed ({len(job.subscribers) + 1} screens)")
+            job.subscribers[screen] = time.monotonic()
+            self.subscriptions[screen] = key
+            return {'key': key, 'reused': response['reused'], 'job': job.to_dict()}
+
+    def unsubscribe(self, screen):
+        _validate_key(screen)
+        with self._cond:
+            result = self._unsubscribe(screen)
+            self._cond.notify_all()
+        return result
+
+    def _unsubscribe(self, screen):
+        """Caller holds _cond. Stops the channel's encoder after its last screen."""
+        key = self.subscriptions.pop(screen, None)
+        job = self.jobs.get(key) if key else None
+        if job is None:
+            return {'unsubscribed': key is not None, 'stopped': False}
+        job.subscribers.pop(screen, None)
+        logger.info(f"[{key}] {screen} unsubscribed ({len(job.subscribers)} screens left)")
+        stopped = not job.subscribers and self._stop_job(key)
+        return {'unsubscribed': True, 'stopped': stopped}
+
+    def status(self, key=None, screen=None):
+        with self._cond:
+            if screen is not None:
+                key = self.subscriptions.get(screen)
+                job = self.jobs.get(key) if key else None
+                return {'job': job.to_dict() if job else None}
+            if key is not None:
+                job = self.jobs.get(key)
+                return {'job': job.to_dict() if job else None}
+            return {
+                'jobs': [job.to_dict() for job in self.jobs.values()],
+                'screens': len(self.subscriptions),
+                'max_jobs': self.max_jobs,
+                'pid': os.getpid(),
+            }
+
+    def wait(self, key, timeout):
+        """Block until the job's manifest is ready, it fails or timeout expires."""
+        deadline = time.monotonic() + max(0.0, min(timeout, 120))
+        with self._cond:
+            while True:
+                job = self.jobs.get(key)
+                if job is None or job.state in (STATE_READY, STATE_FAILED):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return {'ready': bool(job and job.state == STATE_READY), 'job': job.to_dict() if job else None}
+
+    def _subscribe(self, conn):
+        """
+        Write the subscriber's events until it goes away or is dropped.
+
+        Events are sent from this connection's thread, outside _cond, so a
+        subscriber that stops reading only stalls its own sends.
+        """
+        events = queue.Queue(maxsize=SUPERVISOR_EVENT_BACKLOG)
+        with self._cond:
+            self._subscribers[conn] = events
+        conn.settimeout(SUPERVISOR_REQUEST_TIMEOUT)
+        try:
+            while not self._stopping.is_set():
+                try:
+                    message = events.get(timeout=0.5)
+                except queue.Empty:
+                    message = None
+                with self._cond:
+                    if self._subscribers.get(conn) is not events:
+                        break
+                if message is not None:
+                    conn.sendall(message)
+        except socket.timeout:
+            logger.warning("Event subscriber stopped reading, disconnected")
+        except OSError:
+            pass
+        finally:
+            with self._cond:
+                if self._subscribers.get(conn) is events:
+                    del self._subscribers[conn]
+
+    def _emit(self, event, job, **data):
+        """Caller holds _cond. Queues the event for every subscriber, never blocks."""
+        message = (json.dumps({'event': event, 'key': job.key, 'source_url': job.source_url, **data}) + '\n')
+        message = message.encode('utf-8')
+        for conn, events in list(self._subscribers.items()):
+            try:
+                events.put_nowait(message)
+            except queue.Full:
+                logger.warning(f"Event subscriber {SUPERVISOR_EVENT_BACKLOG} events behind, disconnected")
+                del self._subscribers[conn]
+        self._cond.notify_all()
+
+    # Encoders
+
+    def _launch(self, job):
+        """Caller holds _cond. Waits (in tick) while the key's previous encoder exits."""
+        if job.key in self._draining:
+            job.process = None
+            job.state = STATE_STARTING
+            return
+        self._discard_output(job.output_dir)
+        job.output_dir.mkdir(parents=True, exist_ok=True)
+        log = open(job.output_dir / 'ffmpeg.log', 'wb')
+        try:
+            job.process = subprocess.Popen(
+                build_command(job.source_url, job.output_dir, self.ffmpeg_bin),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=log,
+                start_new_session=True
+            )
+        except OSError as e:
+            job.process = None
+            job.last_exit = str(e)
+            self._schedule_restart(job)
+            return
+        finally:
+            log.close()
+        job.state = STATE_STARTING
+        job.started_at = time.monotonic()
+        logger.info(f"[{job.key}] FFmpeg started (PID {job.process.pid})")
+        self._emit('started', job, pid=job.process.pid)
+
+    def _stop_job(self, key):
+        """Caller holds _cond."""
+        job = self.jobs.pop(key, None)
+        if job is None:
+            return False
+        self._retire(job)
+        self._discard_output(job.output_dir)
+        logger.info(f"[{key}] FFmpeg stopped")
+        self._emit('stopped', job)
+        return True
+
+    def _retire(self, job):
+        """
+        Caller holds _cond. SIGTERM the job's encoder; a reaper thread waits
+        for it (and SIGKILLs it if it lingers) without holding the lock.
+        """
+        process, job.process = job.process, None
+        if process is None or process.poll() is not None:
+            return
+        _signal(process, signal.SIGTERM)
+        self._draining[job.key] = process
+        reaper = threading.Thread(target=self._reap, args=(job.key, process), daemon=True)
+        self._reapers.append(reaper)
+        reaper.start()
+
+    def _reap(self, key, process):
+        try:
+            process.wait(timeout=FFMPEG_STOP_GRACE)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"[{key}] FFmpeg ignored SIGTERM, killing it")
+            _signal(process, signal.SIGKILL)
+            try:
+                process.wait(timeout=FFMPEG_STOP_GRACE)
+            except subprocess.TimeoutExpired:
+                pass
+        with self._cond:
+            if self._draining.get(key) is process:
+                del self._draining[key]
+            self._reapers.remove(threading.current_thread())
+            self._cond.notify_all()
+
+    def _discard_output(self, output_dir):
+        """Caller holds _cond. Moves the directory aside at once and deletes it in the background."""
+        discarded = self.root / f'.old-{output_dir.name}-{uuid.uuid4().hex[:8]}'
+        try:
+            output_dir.rename(discarded)
+        except OSError:
+            return
+        threading.Thread(target=shutil.rmtree, args=(discarded,), kwargs={'ignore_errors': True},
+                         daemon=True).start()
+
+    def _schedule_restart(self, job):
+        """Caller holds _cond."""
+        job.failures += 1
+        if job.failures > FFMPEG_MAX_RESTARTS:
+            job.state = STATE_FAILED
+            logger.error(f"[{job.key}] FFmpeg failed {job.failures} times in a row, giving up")
+            self._emit('failed', job, last_exit=job.last_exit)
+            return
+        delay = min(2 ** (job.failures - 1), FFMPEG_RESTART_BACKOFF_MAX)
+        job.state = STATE_BACKOFF
+        job.next_start = time.monotonic() + delay
+        self._emit('restarting', job, delay=delay)
+
+    def _monitor(self):
+        while not self._stopping.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Supervisor monitor error: {e}")
+            self._stopping.wait(SUPERVISOR_TICK)
+
+    def tick(self):
+        now = time.monotonic()
+        with self._cond:
+            for job in list(self.jobs.values()):
+                lapsed = [screen for screen, seen in job.subscribers.items()
+                          if now - seen > FFMPEG_SUBSCRIPTION_TTL]
+                for screen in lapsed:
+                    logger.info(f"[{job.key}] {screen} stopped renewing its subscription")
+                    self._unsubscribe(screen)
+                if job.key not in self.jobs:
+                    continue
+
+                if job.state == STATE_BACKOFF:
+                    if now >= job.next_start:
+                        job.restarts += 1
+                        self._launch(job)
+                    continue
+                if job.state == STATE_STARTING and job.process is None:
+                    if job.key not in self._draining:
+                        self._launch(job)
+                    continue
+                if job.state == STATE_FAILED or job.process is None:
+                    continue
+
+                code = job.process.poll()
+                if code is not None:
+                    job.last_exit = code
+                    logger.warning(f"[{job.key}] FFmpeg exited (code {code}): {_log_tail(job)}")
+                    self._emit('exited', job, code=code)
+                    self._schedule_restart(job)
+                    continue
+
+                uptime = now - job.started_at
+                if uptime >= FFMPEG_STABLE_AFTER:
+                    job.failures = 0
+                if uptime >= FFMPEG_MAX_RUNTIME:
+                    logger.info(f"[{job.key}] FFmpeg recycled after {int(uptime)}s")
+                    self._retire(job)
+                    job.restarts += 1
+                    self._launch(job)
+                    continue
+                if job.state == STATE_STARTING and manifest_is_ready(job.manifest_path):
+                    job.state = STATE_READY
+                    logger.info(f"[{job.key}] Manifest ready in {uptime:.1f}s")
+                    self._emit('ready', job)
+
+
+def _validate_key(key):
+    if not isinstance(key, str) or not JOB_KEY_PATTERN.match(key):
+        raise SupervisorError('invalid', "Invalid job key")
+
+
+def _validate_source(source_url):
+    # Full SSRF checks happen in the web worker; this guards the command line
+    if not isinstance(source_url, str) or source_url.startswith('-') or \
+            source_url.split('://', 1)[0].lower() not in ALLOWED_PROTOCOLS:
+        raise SupervisorError('invalid', "Invalid source URL")
+
+
+def _signal(process, signum):
+    """Signal the encoder's process group."""
+    try:
+        os.killpg(process.pid, signum)
+    except OSError:
+        pass
+
+
+def _log_tail(job, size=500):
+    try:
+        with open(job.output_dir / 'ffmpeg.log', 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - size, 0))
+            return f.read().decode('utf-8', errors='ignore').strip()
+    except OSError:
+        return ''
+
+
+class SupervisorClient:
+    """Worker side of the supervisor socket."""
+
+    def __init__(self, socket_path=None, autostart=None, root=None):
+        self.socket_path = socket_path or FFMPEG_SUPERVISOR_SOCKET
+        self.autostart = FFMPEG_SUPERVISOR_AUTOSTART if autostart is None else autostart
+        self.root = Path(root or HLS_ROOT)
+
+    def request(self, op, socket_timeout=SUPERVISOR_REQUEST_TIMEOUT, **params):
+        """Send one request; raises SupervisorError on refusal."""
+        try:
+            sock = self._connect()
+        except OSError:
+            if not self.autostart:
+                raise SupervisorUnavailable(f"No FFmpeg supervisor on {self.socket_path}")
+            sock = self._spawn_and_connect()
+
+        try:
+            sock.settimeout(socket_timeout)
+            sock.sendall((json.dumps({'op': op, **params}) + '\n').encode('utf-8'))
+            with sock.makefile('r', encoding='utf-8') as reader:
+                line = reader.readline()
+        except OSError as e:
+            raise SupervisorUnavailable(f"FFmpeg supervisor did not answer: {e}")
+        finally:
+            sock.close()
+        if not line:
+            raise SupervisorUnavailable("FFmpeg supervisor closed the connection")
+
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise SupervisorError(response.get('error', 'error'), response.get('message', ''))
+        return response
+
+    def start(self, key, source_url):
+        return self.request('start', key=key, source_url=source_url)
+
+    def stop(self, key):
+        return self.request('stop', key=key)['stopped']
+
+    def subscribe(self, screen, source_url):
+        return self.request('subscribe', screen=screen, source_url=source_url)
+
+    def unsubscribe(self, screen):
+        """{'unsubscribed': bool, 'stopped': bool} (stopped: it was the channel's last screen)."""
+        response = self.request('unsubscribe', screen=screen)
+        return {'unsubscribed': response['unsubscribed'], 'stopped': response['stopped']}
+
+    def status(self, key=None, screen=None):
+        """The job of key or of the screen's channel, or every job when neither is given."""
+        response = self.request('status', key=key, screen=screen)
+        return response['job'] if key is not None or screen is not None else response
+
+    def wait(self, key, timeout=15):
+        """{'ready': bool, 'job': ...} once the manifest is ready, the job failed or timeout expired."""
+        return self.request('wait', socket_timeout=timeout + SUPERVISOR_REQUEST_TIMEOUT, key=key, timeout=timeout)
+
+    def events(self):
+        """Yield supervisor events (dicts) until the connection closes."""
+        sock = self._connect()
+        try:
+            sock.sendall(b'{"op": "events"}\n')
+            with sock.makefile('r', encoding='utf-8') as reader:
+                for line in reader:
+                    yield json.loads(line)
+        finally:
+            sock.close()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(SUPERVISOR_REQUEST_TIMEOUT)
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _spawn_and_connect(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with open(self.root / 'supervisor.log', 'ab') as log:
+            # Its own session: the supervisor outlives worker restarts
+            subprocess.Popen(
+                [sys.executable, '-m', 'services.ffmpeg_supervisor', '--socket', self.socket_path,
+                 '--root', str(self.root)],
+                cwd=project_root, stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True
+            )
+        logger.info(f"FFmpeg supervisor spawned on {self.socket_path}")
+
+        deadline = time.monotonic() + SUPERVISOR_START_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                return self._connect()
+            except OSError:
+                time.sleep(0.1)
+        raise SupervisorUnavailable(f"FFmpeg supervisor did not start on {self.socket_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Supervisor of the FFmpeg HLS encoders')
+    parser.add_argument('--socket', default=FFMPEG_SUPERVISOR_SOCKET)
+    parser.add_argument('--root', default=str(HLS_ROOT))
+    parser.add_argument('--max-jobs', type=int, default=FFMPEG_MAX_JOBS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s')
+    Path(args.root).mkdir(parents=True, exist_ok=True)
+    supervisor = FFmpegSupervisor(args.socket, args.root, max_jobs=args.max_jobs)
+    if not supervisor.acquire_instance_lock():
+        logger.info(f"FFmpeg supervisor already running on {args.socket}")
+        return 0
+
+    def handle_signal(signum, frame):
+        supervisor.stop_serving()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    try:
+        supervisor.serve_forever()
+    finally:
+        supervisor.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
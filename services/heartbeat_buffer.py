@@ -0,0 +1,191 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Bounded heartbeat ingestion buffer with batched database flush
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, update
+
+from app import db
+from models import Screen, HeartbeatLog
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes; screens beat every 30s, so last_heartbeat lags by
+# at most this much.
+HEARTBEAT_FLUSH_INTERVAL = int(os.environ.get('HEARTBEAT_FLUSH_INTERVAL', 5))
+
+# Beats held per worker before new ones are dropped (and counted).
+HEARTBEAT_BUFFER_SIZE = int(os.environ.get('HEARTBEAT_BUFFER_SIZE', 50000))
+
+HEARTBEAT_STATUS_MAX_LENGTH = 20
+
+
+class HeartbeatBuffer:
+    """
+    Per-worker buffer of screen heartbeats.
+
+    Heartbeat endpoints only append (screen_id, status, timestamp) here; a
+    scheduler job in every worker flushes the buffer with one bulk INSERT
+    into heartbeat_logs and one bulk UPDATE of screens.last_heartbeat/status
+    (latest beat per screen). When the scheduler is not running (tests, CLI,
+    SCHEDULER_ENABLED=false) beats are written through immediately.
+    """
+    _beats = []
+    _known_screens = set()
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _counters = {
+        'accepted': 0,
+        'dropped': 0,
+        'flushed': 0,
+        'flushes': 0,
+        'flush_errors': 0,
+    }
+    _last_flush_at = None
+    _last_flush_ms = None
+    _last_flush_lag = None
+
+    @classmethod
+    def accept(cls, screen_id, status):
+        """
+        Buffer a heartbeat.
+
+        Returns:
+            bool: False if the screen does not exist
+        """
+        if not cls._screen_exists(screen_id):
+            return False
+
+        beat = (screen_id, str(status)[:HEARTBEAT_STATUS_MAX_LENGTH], datetime.utcnow())
+        with cls._lock:
+            if len(cls._beats) >= HEARTBEAT_BUFFER_SIZE:
+                cls._counters['dropped'] += 1
+            else:
+                cls._beats.append(beat)
+                cls._counters['accepted'] += 1
+
+        from services.scheduler import Scheduler
+        if not Scheduler.is_running():
+            cls.flush()
+        return True
+
+    @classmethod
+    def _screen_exists(cls, screen_id):
+        if screen_id in cls._known_screens:
+            return True
+        if db.session.query(Screen.id).filter(Screen.id == screen_id).scalar() is None:
+            return False
+        cls._known_screens.add(screen_id)
+        return True
+
+    @classmethod
+    def pending(cls):
+        with cls._lock:
+            return len(cls._beats)
+
+    @classmethod
+    def flush(cls):
+        """
+        Write every buffered beat. Returns the number of beats written.
+        """
+        with cls._flush_lock:
+            with cls._lock:
+                beats, cls._beats = cls._beats, []
+            if not beats:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                written = cls._write(beats)
+            except Exception as e:
+                db.session.rollback()
+                cls._requeue(beats)
+                with cls._lock:
+                    cls._counters['flush_errors'] += 1
+                logger.error(f"Heartbeat flush failed ({len(beats)} beat(s)): {e}")
+                return 0
+
+            with cls._lock:
+                cls._counters['flushed'] += written
+                cls._counters['flushes'] += 1
+            cls._last_flush_at = datetime.utcnow()
+            cls._last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            cls._last_flush_lag = round((cls._last_flush_at - beats[0][2]).total_seconds(), 3)
+            return written
+
+    @classmethod
+    def _write(cls, beats):
+        screen_ids = {screen_id for screen_id, _, _ in beats}
+        existing = {row[0] for row in db.session.query(Screen.id).filter(Screen.id.in_(screen_ids))}
+        # Screens deleted since their beat was accepted
+        cls._known_screens.difference_update(screen_ids - existing)
+
+        logs = []
+        latest = {}
+        for screen_id, status, timestamp in beats:
+            if screen_id not in existing:
+                continue
+            logs.append({'screen_id': screen_id, 'status': status, 'timestamp': timestamp})
+            latest[screen_id] = {'id': screen_id, 'last_heartbeat': timestamp, 'status': status}
+
+        if logs:
+            db.session.execute(insert(HeartbeatLog), logs)
+            db.session.execute(update(Screen), list(latest.values()))
+            db.session.commit()
+        return len(logs)
+
+    @classmethod
+    def _requeue(cls, beats):
+        with cls._lock:
+            room = max(HEARTBEAT_BUFFER_SIZE - len(cls._beats), 0)
+            cls._counters['dropped'] += max(len(beats) - room, 0)
+            cls._beats = beats[:room] + cls._beats
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            buffered = len(cls._beats)
+            oldest = cls._beats[0][2] if cls._beats else None
+            counters = dict(cls._counters)
+
+        return dict(
+            counters,
+            buffered=buffered,
+            capacity=HEARTBEAT_BUFFER_SIZE,
+            lag_seconds=round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0,
+            last_flush_at=cls._last_flush_at.isoformat() if cls._last_flush_at else None,
+            last_flush_ms=cls._last_flush_ms,
+            last_flush_lag_seconds=cls._last_flush_lag
+        )
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._beats = []
+            cls._known_screens = set()
+            cls._counters = dict.fromkeys(cls._counters, 0)
+            cls._last_flush_at = None
+            cls._last_flush_ms = None
+            cls._last_flush_lag = None
+
+
+def flush_heartbeats():
+    HeartbeatBuffer.flush()
+
+
+def _flush_on_exit():
+    from services.scheduler import Scheduler
+    if HeartbeatBuffer.pending():
+        Scheduler.run_now('flush_heartbeats')
+
+
+atexit.register(_flush_on_exit)
@@ -5,159 +5,90 @@
  * Fait par : Aisance KALONJI, www.aisancekalonji.com
  * Auditer par : La CyberConfiance, www.cyberconfiance.com
 """
-import subprocess
-import os
-import signal
-import tempfile
 import logging
-import threading
-import time
-import shutil
-from pathlib import Path
 import re
-from collections import OrderedDict
+import threading
+
+from services.ffmpeg_supervisor import (
+    HLS_ROOT, STATE_FAILED, SupervisorClient, SupervisorError, SupervisorUnavailable, channel_key
+)
 from services.input_validator import is_safe_url
 
 logger = logging.getLogger(__name__)
 
 
-class LRUCache:
-    """Simple LRU cache to prevent memory leaks from old stream URIs"""
-    def __init__(self, max_size=100):
-        self.max_size = max_size
-        self.cache = OrderedDict()
-        self.lock = threading.Lock()
-
-    def get(self, key):
-        with self.lock:
-            if key in self.cache:
-                self.cache.move_to_end(key)
-                return self.cache[key]
-            return None
-
-    def set(self, key, value):
-        with self.lock:
-            if key in self.cache:
-                self.cache.move_to_end(key)
-            self.cache[key] = value
-            if len(self.cache) > self.max_size:
-                self.cache.popitem(last=False)  # Remove oldest
-
-    def delete(self, key):
-        with self.lock:
-            self.cache.pop(key, None)
-
-    def clear(self):
-        with self.lock:
-            self.cache.clear()
-
-
 class HLSConverter:
-    HLS_TEMP_DIR = Path(tempfile.gettempdir()) / 'adscreen_hls'
-    _current_urls = LRUCache(max_size=100)  # LRU cache: prevent memory leak from old URIs
+    """
+    HLS outputs of the screens' IPTV channels.
+
+    The FFmpeg processes belong to the FFmpeg supervisor (one per host), so
+    every worker sees the same encoders, sources and readiness; this class
+    validates requests and maps screens to the supervisor's jobs.
+
+    Outputs are keyed by source URL: screens subscribe to a channel and
+    share its encoder and its segments, so encoders and upstream
+    connections scale with distinct channels, not with screens. Paths take
+    the source URL; subscriptions and status take the screen code.
+    """
+    SEGMENT_PATTERN = re.compile(r'^segment\d+\.ts$')
+    HLS_TEMP_DIR = HLS_ROOT
+    _client = None
     _lock = threading.Lock()
     
-    def __init__(self):
-        self.HLS_TEMP_DIR.mkdir(parents=True, exist_ok=True)
-    
     @classmethod
     def init(cls):
         cls.HLS_TEMP_DIR.mkdir(parents=True, exist_ok=True)
     
     @classmethod
-    def get_output_dir(cls, screen_code):
-        return cls.HLS_TEMP_DIR / screen_code
+    def client(cls):
+        with cls._lock:
+            if cls._client is None:
+                cls._client = SupervisorClient()
+            return cls._client
     
     @classmethod
-    def get_manifest_path(cls, screen_code):
-        return cls.get_output_dir(screen_code) / 'stream.m3u8'
+    def get_output_dir(cls, source_url):
+        return cls.HLS_TEMP_DIR / channel_key(source_url)
     
     @classmethod
-    def get_pid_file(cls, screen_code):
-        return cls.get_output_dir(screen_code) / 'ffmpeg.pid'
-
-    @classmethod
-    def _save_pid(cls, screen_code, pid):
-        try:
-            pid_file = cls.get_pid_file(screen_code)
-            pid_file.parent.mkdir(parents=True, exist_ok=True)
-            with open(pid_file, 'w') as f:
-                f.write(str(pid))
-        except Exception as e:
-            logger.error(f"[{screen_code}] Failed to save PID: {e}")
-
+    def get_manifest_path(cls, source_url):
+        return cls.get_output_dir(source_url) / 'stream.m3u8'
+    
     @classmethod
-    def _get_pid(cls, screen_code):
+    def get_status(cls, screen_code):
+        """Supervisor job of the screen's channel (dict) or None."""
         try:
-            pid_file = cls.get_pid_file(screen_code)
-            if pid_file.exists():
-                with open(pid_file, 'r') as f:
-                    return int(f.read().strip())
-        except Exception:
-            pass
-        return None
-
+            return cls.client().status(screen=screen_code)
+        except (SupervisorError, SupervisorUnavailable) as e:
+            logger.error(f'[{screen_code}] FFmpeg supervisor status failed: {e}')
+            return None
+    
     @classmethod
     def get_current_url(cls, screen_code):
-        # Note: In multi-worker setup, this cache might be local to worker.
-        # Ideally this should be in DB or Redis. For now we keep it as is,
-        # but rely on is_running() for process status.
-        with cls._lock:
-            return cls._current_urls.get(screen_code)
+        job = cls.get_status(screen_code)
+        return job['source_url'] if job else None
     
     @classmethod
     def is_running(cls, screen_code):
-        pid = cls._get_pid(screen_code)
-        if pid:
-            try:
-                os.kill(pid, 0)
-                return True
-            except OSError:
-                # Process not found
-                return False
-        return False
+        """True while the screen's channel has an encoder running or about to restart."""
+        job = cls.get_status(screen_code)
+        return bool(job) and job['state'] != STATE_FAILED
     
     @staticmethod
     def stop_existing_process(screen_code):
-        """Arrête et tue complètement le processus FFmpeg + nettoie les fichiers"""
-        
-        with HLSConverter._lock:
-            pid = HLSConverter._get_pid(screen_code)
-            if pid:
-                try:
-                    logger.info(f'[{screen_code}] Killing FFmpeg process (PID: {pid})')
-                    os.kill(pid, signal.SIGTERM)
-                    
-                    # Wait a bit
-                    for _ in range(20):
-                        try:
-                            os.kill(pid, 0)
-                            time.sleep(0.1)
-                        except OSError:
-                            break
-                    else:
-                         logger.warning(f'[{screen_code}] Force killing process')
-                         try:
-                             os.kill(pid, signal.SIGKILL)
-                         except OSError:
-                             pass
-                    
-                    logger.info(f'[{screen_code}] Process killed')
-                except OSError as e:
-                    logger.error(f'[{screen_code}] Error killing process: {e}')
-                except Exception as e:
-                    logger.error(f'[{screen_code}] Unexpected error killing process: {e}')
-            
-            HLSConverter._current_urls.delete(screen_code)
-        
-        output_dir = HLSConverter.HLS_TEMP_DIR / screen_code
-        if output_dir.exists():
-            try:
-                logger.info(f'[{screen_code}] Cleaning up files in {output_dir}')
-                shutil.rmtree(output_dir)
-                output_dir.mkdir(parents=True, exist_ok=True)
-            except Exception as e:
-                logger.error(f'[{screen_code}] Error cleaning files: {e}')
+        """
+        Arrête le processus FFmpeg de l'écran et supprime ses fichiers
+
+        The screen leaves its channel; the encoder only stops with its last screen.
+        """
+        try:
+            result = HLSConverter.client().unsubscribe(screen_code)
+            if result['stopped']:
+                logger.info(f'[{screen_code}] FFmpeg process stopped')
+            elif result['unsubscribed']:
+                logger.info(f'[{screen_code}] Left its channel, still watched by other screens')
+        except (SupervisorError, SupervisorUnavailable) as e:
+            logger.error(f'[{screen_code}] Error stopping FFmpeg: {e}')
     
     @classmethod
     def stop_stream(cls, screen_code):
@@ -169,11 +100,25 @@ class HLSConverter:
         """Alias pour stop_existing_process"""
         cls.stop_existing_process(screen_code)
     
+    @classmethod
+    def wait_for_manifest(cls, source_url, timeout=15):
+        """True once the channel's manifest lists segments, False on timeout or failure."""
+        key = channel_key(source_url)
+        try:
+            return cls.client().wait(key, timeout)['ready']
+        except (SupervisorError, SupervisorUnavailable) as e:
+            logger.error(f'[{key}] FFmpeg supervisor wait failed: {e}')
+            return False
+    
     @staticmethod
     def convert_mpegts_to_hls_file(source_url, screen_code, wait_for_manifest=True):
         """
         Convertit MPEG-TS en HLS
         wait_for_manifest: Attend que le manifeste soit prêt avant de retourner
+
+        Subscribes the screen to the channel: reuses the encoder another
+        screen (or this one) already runs for source_url, and leaves the
+        screen's previous channel when it changed.
         """
         # Validate inputs
         if not source_url or source_url.startswith('-'):
@@ -186,121 +131,30 @@ class HLSConverter:
         if not re.match(r'^[a-zA-Z0-9_-]+$', screen_code):
             raise ValueError("Invalid screen code")
 
-        HLSConverter.init()
-        
-        output_dir = HLSConverter.HLS_TEMP_DIR / screen_code
-        output_dir.mkdir(parents=True, exist_ok=True)
-        
-        manifest_path = output_dir / 'stream.m3u8'
-        segment_pattern = str(output_dir / 'segment%03d.ts')
-        
-        cmd = [
-            'ffmpeg',
-            '-y',
-            '-hide_banner',
-            '-loglevel', 'warning',
-            # SEC: Removed 'file' to prevent Local File Inclusion (LFI/SSRF)
-            # SEC: Explicitly whitelist allowed protocols
-            '-protocol_whitelist', 'http,https,tcp,udp,rtp,rtmp,rtsp',
-            '-reconnect', '1',
-            '-reconnect_streamed', '1',
-            '-reconnect_delay_max', '5',
-            '-fflags', '+genpts+discardcorrupt',
-            '-user_agent', 'VLC/3.0.18 LibVLC/3.0.18',
-            '-i', source_url,
-            '-c:v', 'copy',
-            '-c:a', 'aac',
-            '-b:a', '96k',
-            '-f', 'hls',
-            '-hls_time', '2',
-            '-hls_list_size', '3',
-            '-hls_flags', 'delete_segments+independent_segments',
-            '-hls_segment_filename', segment_pattern,
-            str(manifest_path)
-        ]
+        manifest_path = HLSConverter.get_manifest_path(source_url)
         
-        # Check if another process is already running for this screen
-        if HLSConverter.is_running(screen_code):
-            logger.info(f'[{screen_code}] FFmpeg already running, reusing existing process')
-            return str(manifest_path)
-
         try:
-            logger.info(f'[{screen_code}] Starting FFmpeg conversion')
-            # Mask URL in logs if needed, but logging source is usually fine if not containing credentials
-            logger.info(f'[{screen_code}] Source: {source_url[:60]}...')
-
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid
-            )
-            
-            with HLSConverter._lock:
-                HLSConverter._save_pid(screen_code, process.pid)
-                HLSConverter._current_urls.set(screen_code, source_url)
-            
-            logger.info(f'[{screen_code}] FFmpeg PID: {process.pid}')
-            
-            def monitor_process():
-                try:
-                    stdout, stderr = process.communicate(timeout=1800)  # 30min max per stream for 24/7 stability
-                    if process.returncode != 0 and process.returncode != -15 and process.returncode != -9:
-                        stderr_text = stderr.decode('utf-8', errors='ignore')[:500]
-                        logger.error(f'[{screen_code}] FFmpeg error (code {process.returncode}): {stderr_text}')
-                except subprocess.TimeoutExpired:
-                    logger.warning(f'[{screen_code}] FFmpeg timeout after 30min, killing process')
-                    try:
-                        process.kill()
-                        process.communicate(timeout=5)
-                    except Exception:
-                        pass
-                except Exception as e:
-                    logger.error(f'[{screen_code}] Process error: {e}')
-                finally:
-                    logger.info(f'[{screen_code}] Process ended')
-            
-            thread = threading.Thread(target=monitor_process, daemon=True)
-            thread.start()
+            response = HLSConverter.client().subscribe(screen_code, source_url)
+            if response['reused']:
+                logger.info(f'[{screen_code}] FFmpeg already running, reusing existing process '
+                            f'({len(response["job"]["subscribers"])} screens on this channel)')
+            else:
+                # Mask URL in logs if needed, but logging source is usually fine if not containing credentials
+                logger.info(f'[{screen_code}] FFmpeg started for: {source_url[:60]}...')
             
             if wait_for_manifest:
                 logger.info(f'[{screen_code}] Waiting for manifest...')
-
                 max_wait = 15
-                start_time = time.time()
-                manifest_ready = False
-                poll_interval = 0.1  # Start at 100ms
-
-                while time.time() - start_time < max_wait:
-                    if manifest_path.exists():
-                        try:
-                            with open(manifest_path, 'r') as f:
-                                content = f.read()
-
-                            if '.ts' in content and '#EXTINF' in content:
-                                logger.info(f'[{screen_code}] Manifest ready with segments')
-                                manifest_ready = True
-                                break
-                        except:
-                            pass
-
-                    # Exponential backoff: 100ms → 200ms → 400ms → 800ms (max)
-                    time.sleep(poll_interval)
-                    poll_interval = min(0.8, poll_interval * 2)
-                
-                if not manifest_ready:
-                    elapsed = time.time() - start_time
-                    logger.error(f'[{screen_code}] Manifest not ready after {elapsed:.1f}s')
+                if not HLSConverter.wait_for_manifest(source_url, max_wait):
+                    logger.error(f'[{screen_code}] Manifest not ready after {max_wait}s')
                     HLSConverter.stop_existing_process(screen_code)
-                    raise Exception(f'Manifest creation timeout after {elapsed:.1f}s')
-                
-                logger.info(f'[{screen_code}] Conversion ready in {time.time() - start_time:.1f}s')
+                    raise Exception(f'Manifest creation timeout after {max_wait}s')
+                logger.info(f'[{screen_code}] Manifest ready with segments')
             
             return str(manifest_path)
         
         except Exception as e:
             logger.error(f'[{screen_code}] Conversion error: {e}')
-            HLSConverter.stop_existing_process(screen_code)
             raise
     
     @classmethod
@@ -309,8 +163,8 @@ class HLSConverter:
         return cls.convert_mpegts_to_hls_file(source_url, screen_code, wait_for_manifest=wait_for_manifest)
     
     @classmethod
-    def get_fresh_manifest(cls, screen_code):
-        manifest_path = cls.get_manifest_path(screen_code)
+    def get_fresh_manifest(cls, source_url):
+        manifest_path = cls.get_manifest_path(source_url)
         if not manifest_path.exists():
             return None
         try:
@@ -320,13 +174,15 @@ class HLSConverter:
             return None
     
     @classmethod
-    def get_segment_path(cls, screen_code, segment_name):
-        segment_path = cls.get_output_dir(screen_code) / segment_name
+    def get_segment_path(cls, source_url, segment_name):
+        if not cls.SEGMENT_PATTERN.match(segment_name):
+            return None
+        segment_path = cls.get_output_dir(source_url) / segment_name
         return segment_path if segment_path.exists() else None
     
     @classmethod
     def rewrite_manifest(cls, manifest_content, screen_code):
-        import re
+        """Segment URLs stay per screen (authenticated), the files are the channel's."""
         rewritten = re.sub(
             r'(segment\d+\.ts)',
             f'/player/tv-segment/{screen_code}/\\1',
@@ -335,8 +191,8 @@ class HLSConverter:
         return rewritten
     
     @classmethod
-    def list_available_segments(cls, screen_code):
-        output_dir = cls.get_output_dir(screen_code)
+    def list_available_segments(cls, source_url):
+        output_dir = cls.get_output_dir(source_url)
         if not output_dir.exists():
             return []
         return [f.name for f in sorted(output_dir.glob('segment*.ts'))]
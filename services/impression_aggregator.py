@@ -0,0 +1,238 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Write-behind AdContentStat aggregation with a local crash spool
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import date
+
+from app import db
+from models.ad_content import AdContentStat
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes of the aggregated impressions.
+IMPRESSION_FLUSH_INTERVAL = int(os.environ.get('IMPRESSION_FLUSH_INTERVAL', 10))
+
+# Impressions not yet flushed are appended here so a crashed worker's counts
+# are replayed by the next process. Point it at persistent storage.
+IMPRESSION_SPOOL_DIR = os.environ.get('IMPRESSION_SPOOL_DIR',
+                                      os.path.join(tempfile.gettempdir(), 'adscreen-impressions'))
+
+SPOOL_SUFFIX = '.spool'
+FLUSHING_SUFFIX = '.flushing'
+
+
+class ImpressionAggregator:
+    """
+    Counts ad impressions in memory per (ad, screen, day).
+
+    record() adds to the in-memory totals and appends the same counts to this
+    process's spool file. A scheduler job in every worker flushes: one
+    INSERT ... ON CONFLICT DO UPDATE into ad_content_stats plus one grouped
+    UPDATE of the AdContent totals, then the flushed spool is deleted. At
+    start-up, spool files left by dead processes are replayed. When the
+    scheduler is not running, impressions are written through immediately.
+
+    Delivery is at-least-once: a crash between the commit and the spool
+    deletion replays that flush.
+    """
+    _rows = {}
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _spool_fd = None
+    _spool_path = None
+    _claimed = []
+    _sequence = 0
+    _started_pid = None
+
+    @classmethod
+    def record(cls, screen_id, organization_id, impressions):
+        """
+        Args:
+            impressions: {(ad_content_id, date): (count, total_duration)}
+        """
+        if not impressions:
+            return
+        rows = {(ad_id, screen_id, day): (organization_id, count, duration)
+                for (ad_id, day), (count, duration) in impressions.items()}
+
+        cls._ensure_started()
+        with cls._lock:
+            cls._spool(rows)
+            _merge(cls._rows, rows)
+
+        from services.scheduler import Scheduler
+        if not Scheduler.is_running():
+            cls.flush()
+
+    @classmethod
+    def flush(cls):
+        """Write every aggregated impression. Returns the number of rows written."""
+        cls._ensure_started()
+        with cls._flush_lock:
+            with cls._lock:
+                rows, cls._rows = cls._rows, {}
+                files = cls._claimed + cls._rotate()
+                cls._claimed = []
+            if not rows:
+                _unlink(files)
+                return 0
+
+            try:
+                written = AdContentStat.upsert_impressions(rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                # Back into memory and the live spool; the batch files can go
+                with cls._lock:
+                    cls._spool(rows)
+                    _merge(cls._rows, rows)
+                _unlink(files)
+                logger.error(f"Impression flush failed ({len(rows)} row(s)): {e}")
+                return 0
+
+            _unlink(files)
+            return written
+
+    @classmethod
+    def pending(cls):
+        with cls._lock:
+            return len(cls._rows)
+
+    @classmethod
+    def _spool(cls, rows):
+        """Append rows to this process's spool. Caller holds _lock."""
+        if cls._spool_fd is None:
+            os.makedirs(IMPRESSION_SPOOL_DIR, exist_ok=True)
+            cls._spool_path = os.path.join(IMPRESSION_SPOOL_DIR, f'{os.getpid()}{SPOOL_SUFFIX}')
+            cls._spool_fd = os.open(cls._spool_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        lines = ''.join(
+            json.dumps([ad_id, screen_id, organization_id, day.isoformat(), count, duration]) + '\n'
+            for (ad_id, screen_id, day), (organization_id, count, duration) in rows.items()
+        )
+        # One write per call: a crash never leaves half a batch behind
+        os.write(cls._spool_fd, lines.encode())
+
+    @classmethod
+    def _rotate(cls):
+        """Close the live spool and return it renamed for flushing. Caller holds _lock."""
+        if cls._spool_fd is None:
+            return []
+        os.close(cls._spool_fd)
+        cls._spool_fd = None
+        cls._sequence += 1
+        flushing = os.path.join(IMPRESSION_SPOOL_DIR, f'{os.getpid()}-{cls._sequence}{FLUSHING_SUFFIX}')
+        os.replace(cls._spool_path, flushing)
+        return [flushing]
+
+    @classmethod
+    def _ensure_started(cls):
+        """Replay spools of dead processes, once per process (and after a fork)."""
+        pid = os.getpid()
+        if cls._started_pid == pid:
+            return
+        with cls._lock:
+            if cls._started_pid == pid:
+                return
+            if cls._started_pid is not None:
+                # Forked child: the parent's buffer and spool are not ours
+                cls._rows = {}
+                cls._spool_fd = None
+                cls._claimed = []
+            cls._started_pid = pid
+            cls._recover(pid)
+
+    @classmethod
+    def _recover(cls, pid):
+        pattern = os.path.join(IMPRESSION_SPOOL_DIR, '*')
+        for path in sorted(glob.glob(pattern)):
+            name = os.path.basename(path)
+            if not name.endswith((SPOOL_SUFFIX, FLUSHING_SUFFIX)):
+                continue
+            owner = name.split('-', 1)[0].split('.', 1)[0]
+            if not owner.isdigit() or (int(owner) != pid and _is_alive(int(owner))):
+                continue
+            cls._sequence += 1
+            claimed = os.path.join(IMPRESSION_SPOOL_DIR, f'{pid}-r{cls._sequence}{FLUSHING_SUFFIX}')
+            try:
+                # Atomic: another worker recovering at the same time loses the race
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            rows = _read_spool(claimed)
+            _merge(cls._rows, rows)
+            cls._claimed.append(claimed)
+            logger.info(f"Recovered {len(rows)} impression row(s) from {name}")
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._rows = {}
+            if cls._spool_fd is not None:
+                os.close(cls._spool_fd)
+                _unlink([cls._spool_path])
+            cls._spool_fd = None
+            _unlink(cls._claimed)
+            cls._claimed = []
+            cls._started_pid = None
+
+
+def _merge(target, rows):
+    for key, (organization_id, count, duration) in rows.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = (organization_id, count, duration)
+        else:
+            target[key] = (current[0], current[1] + count, current[2] + duration)
+
+
+def _read_spool(path):
+    rows = {}
+    with open(path) as handle:
+        for line in handle:
+            try:
+                ad_id, screen_id, organization_id, day, count, duration = json.loads(line)
+                _merge(rows, {(ad_id, screen_id, date.fromisoformat(day)): (organization_id, count, duration)})
+            except (ValueError, TypeError):
+                continue  # torn last line of a crashed process
+    return rows
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _unlink(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def flush_impressions():
+    ImpressionAggregator.flush()
+
+
+def _flush_on_exit():
+    from services.scheduler import Scheduler
+    if ImpressionAggregator.pending():
+        Scheduler.run_now('flush_impressions')
+
+
+atexit.register(_flush_on_exit)
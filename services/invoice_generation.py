@@ -0,0 +1,171 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Bulk weekly invoice generation for all organizations
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import func, insert, update
+
+from app import db
+from models import Booking, Organization, Screen, Invoice, SiteSetting
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT / UPDATE executemany.
+INVOICE_WRITE_BATCH = 1000
+
+
+def invoice_settings():
+    """Platform settings copied onto every invoice, read once per run."""
+    return {
+        'vat_rate': SiteSetting.get('platform_vat_rate', 0) or 0,
+        'platform_business_name': SiteSetting.get('platform_business_name', ''),
+        'platform_vat_number': SiteSetting.get('platform_vat_number', ''),
+        'platform_registration_number': SiteSetting.get('platform_registration_number', ''),
+    }
+
+
+def invoice_amounts(gross_revenue, commission_rate, settings):
+    """Invoice columns derived from a week's revenue, as generate_invoice_for_week computes them."""
+    commission_rate = commission_rate or 10.0
+    commission_amount = round(gross_revenue * (commission_rate / 100), 2)
+    vat_rate = settings['vat_rate']
+    vat_amount = round(commission_amount * (vat_rate / 100), 2) if vat_rate > 0 else 0
+    return {
+        'gross_revenue': gross_revenue,
+        'commission_rate': commission_rate,
+        'commission_amount': commission_amount,
+        'net_revenue': round(gross_revenue - commission_amount, 2),
+        'vat_rate': vat_rate,
+        'vat_amount': vat_amount,
+        'commission_with_vat': round(commission_amount + vat_amount, 2),
+        'platform_business_name': settings['platform_business_name'],
+        'platform_vat_number': settings['platform_vat_number'],
+        'platform_registration_number': settings['platform_registration_number'],
+    }
+
+
+def weekly_revenue_by_organization(week_start, week_end):
+    """
+    Paid revenue of every active organization for a week, in one grouped query.
+
+    Returns:
+        dict: {organization_id: (gross_revenue, bookings_count, commission_rate, currency)}
+    """
+    rows = db.session.query(
+        Organization.id, func.sum(Booking.total_price), func.count(Booking.id),
+        Organization.commission_rate, Organization.currency
+    ).join(Screen, Screen.organization_id == Organization.id).join(
+        Booking, Booking.screen_id == Screen.id
+    ).filter(
+        Organization.is_active == True,
+        Booking.payment_status == 'paid',
+        Booking.created_at >= datetime.combine(week_start, datetime.min.time()),
+        Booking.created_at <= datetime.combine(week_end, datetime.max.time())
+    ).group_by(Organization.id, Organization.commission_rate, Organization.currency)
+
+    return {org_id: (revenue or 0, count or 0, rate, currency)
+            for org_id, revenue, count, rate, currency in rows}
+
+
+def generate_weekly_invoices(week_start, week_end, dry_run=False, refresh_existing=False):
+    """
+    Invoice every active organization for a week in a single pass.
+
+    Revenue and booking counts come from one grouped query, invoices are built
+    in memory and written with batched INSERT / UPDATE statements in one
+    transaction. Organizations without paid revenue get no invoice, and
+    validated invoices are never modified.
+
+    Args:
+        week_start, week_end: dates of the invoiced week
+        dry_run: compute everything but write nothing
+        refresh_existing: recompute the amounts of existing, non-validated
+            invoices for the week (otherwise they are left untouched)
+
+    Returns:
+        dict: report with counts, the computed invoices and timings in ms
+    """
+    started = time.perf_counter()
+    timings = {}
+
+    revenue = weekly_revenue_by_organization(week_start, week_end)
+    existing = {
+        org_id: (invoice_id, status)
+        for invoice_id, org_id, status in db.session.query(
+            Invoice.id, Invoice.organization_id, Invoice.status
+        ).filter_by(week_start_date=week_start, week_end_date=week_end)
+    }
+    settings = invoice_settings()
+    timings['aggregate_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    step = time.perf_counter()
+    now = datetime.utcnow()
+    to_insert, to_update, skipped = [], [], 0
+    for org_id, (gross_revenue, bookings_count, commission_rate, currency) in revenue.items():
+        if gross_revenue <= 0:
+            continue
+        row = invoice_amounts(gross_revenue, commission_rate, settings)
+        row.update(bookings_count=bookings_count, generated_at=now)
+
+        if org_id in existing:
+            invoice_id, status = existing[org_id]
+            if not refresh_existing or status == Invoice.STATUS_VALIDATED:
+                skipped += 1
+                continue
+            to_update.append(dict(row, id=invoice_id))
+            continue
+
+        invoice = Invoice()
+        row.update(
+            invoice_number=invoice.generate_invoice_number(),
+            organization_id=org_id,
+            week_start_date=week_start,
+            week_end_date=week_end,
+            currency=currency or 'EUR',
+            status=Invoice.STATUS_PENDING,
+        )
+        to_insert.append(row)
+    timings['build_ms'] = round((time.perf_counter() - step) * 1000, 2)
+
+    step = time.perf_counter()
+    if not dry_run and (to_insert or to_update):
+        try:
+            for i in range(0, len(to_insert), INVOICE_WRITE_BATCH):
+                db.session.execute(insert(Invoice.__table__), to_insert[i:i + INVOICE_WRITE_BATCH])
+            for i in range(0, len(to_update), INVOICE_WRITE_BATCH):
+                db.session.execute(update(Invoice), to_update[i:i + INVOICE_WRITE_BATCH])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    timings['write_ms'] = round((time.perf_counter() - step) * 1000, 2)
+    timings['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    report = {
+        'week_start': week_start.isoformat(),
+        'week_end': week_end.isoformat(),
+        'dry_run': dry_run,
+        'organizations_with_revenue': len(revenue),
+        'created': len(to_insert),
+        'updated': len(to_update),
+        'skipped_existing': skipped,
+        'invoices': [
+            {key: row[key] for key in ('organization_id', 'invoice_number', 'gross_revenue', 'bookings_count',
+                                       'commission_amount', 'commission_with_vat', 'currency')}
+            for row in to_insert
+        ] + [
+            {'id': row['id'], 'gross_revenue': row['gross_revenue'], 'bookings_count': row['bookings_count'],
+             'commission_amount': row['commission_amount'], 'commission_with_vat': row['commission_with_vat']}
+            for row in to_update
+        ],
+        'timings': timings,
+    }
+    logger.info(f"Weekly invoices {week_start} to {week_end}: {len(to_insert)} created, {len(to_update)} updated, "
+                f"{skipped} skipped in {timings['total_ms']}ms{' (dry run)' if dry_run else ''}")
+    return report
@@ -0,0 +1,313 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Time partitioning and retention of the stat and heartbeat logs
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.schema import CreateIndex
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# 'month' or 'day' partitions; heartbeats are far more numerous than plays.
+STAT_LOG_PARTITION_INTERVAL = os.environ.get('STAT_LOG_PARTITION_INTERVAL', 'month').lower()
+HEARTBEAT_LOG_PARTITION_INTERVAL = os.environ.get('HEARTBEAT_LOG_PARTITION_INTERVAL', 'day').lower()
+
+# Raw plays are kept forever unless set: no automatic purge of stat_logs by default.
+STAT_LOG_RETENTION_DAYS = (int(os.environ['STAT_LOG_RETENTION_DAYS'])
+                           if os.environ.get('STAT_LOG_RETENTION_DAYS') else None)
+# Raw heartbeats are only kept until compacted into status intervals (uptime_service).
+HEARTBEAT_LOG_RETENTION_DAYS = int(os.environ.get('HEARTBEAT_LOG_RETENTION_DAYS', 7))
+
+# Partitions created ahead of the current one.
+LOG_PARTITION_PREMAKE = int(os.environ.get('LOG_PARTITION_PREMAKE', 3))
+
+# Seconds between partition maintenance runs (creation ahead, retention).
+LOG_PARTITION_MAINTENANCE_INTERVAL = int(os.environ.get('LOG_PARTITION_MAINTENANCE_INTERVAL', 3600))
+
+# Rows per DELETE when purging an unpartitioned table.
+LOG_PURGE_BATCH = 10000
+
+# pg_advisory_xact_lock key serializing partition DDL across workers.
+PARTITION_LOCK_KEY = 7412031
+
+DEFAULT_SUFFIX = '_default'
+
+
+class LogTable:
+    """A log table partitioned by range on one timestamp column."""
+
+    def __init__(self, name, column, interval, retention_days, horizon=None):
+        self.name = name
+        self.column = column
+        self.interval = interval if interval in ('day', 'month') else 'month'
+        # None: rows are only purged on explicit request (days_to_keep)
+        self.retention_days = retention_days
+        # Callable returning the oldest timestamp still needed by a consumer
+        self.horizon = horizon
+
+    @property
+    def table(self):
+        return db.metadata.tables[self.name]
+
+    def period_start(self, moment):
+        if self.interval == 'day':
+            return datetime(moment.year, moment.month, moment.day)
+        return datetime(moment.year, moment.month, 1)
+
+    def next_period(self, start):
+        if self.interval == 'day':
+            return start + timedelta(days=1)
+        return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+    def partition_name(self, start):
+        return f"{self.name}_p{start.strftime('%Y_%m_%d' if self.interval == 'day' else '%Y_%m')}"
+
+    def partition_start(self, partition_name):
+        """Start of a partition from its name, or None for the default partition."""
+        prefix = f'{self.name}_p'
+        if not partition_name.startswith(prefix):
+            return None
+        try:
+            return datetime.strptime(partition_name[len(prefix):],
+                                     '%Y_%m_%d' if self.interval == 'day' else '%Y_%m')
+        except ValueError:
+            return None
+
+    def retention_start(self, days_to_keep=None, now=None):
+        """Oldest timestamp kept: the start of the oldest retained partition (None: keep everything)."""
+        days = self.retention_days if days_to_keep is None else days_to_keep
+        if days is None:
+            return None
+        cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+        if self.horizon is not None:
+            cutoff = min(cutoff, self.horizon())
+        return self.period_start(cutoff)
+
+
+def _heartbeat_horizon():
+    from services.uptime_service import compaction_horizon
+    return compaction_horizon()
+
+
+def _stat_log_horizon():
+    from services.stat_rollups import rollup_horizon
+    return rollup_horizon()
+
+
+LOG_TABLES = {
+    'stat_logs': LogTable('stat_logs', 'played_at', STAT_LOG_PARTITION_INTERVAL, STAT_LOG_RETENTION_DAYS,
+                          horizon=_stat_log_horizon),
+    'heartbeat_logs': LogTable('heartbeat_logs', 'timestamp', HEARTBEAT_LOG_PARTITION_INTERVAL,
+                               HEARTBEAT_LOG_RETENTION_DAYS, horizon=_heartbeat_horizon),
+}
+
+
+class LogPartitions:
+    """
+    Range partitioning of stat_logs and heartbeat_logs on PostgreSQL.
+
+    ensure() turns the tables into partitioned tables (primary key
+    (id, timestamp), same sequence, same indexes) and creates the partitions
+    from the current one to LOG_PARTITION_PREMAKE ahead, plus a default
+    partition. Retention drops whole partitions once they are entirely older
+    than the retention window, so rows are kept up to one interval longer.
+
+    On other databases (SQLite in development) the tables stay unpartitioned
+    and retention deletes expired rows in batches of LOG_PURGE_BATCH.
+    """
+
+    @classmethod
+    def is_supported(cls):
+        return db.engine.dialect.name == 'postgresql'
+
+    @classmethod
+    def retention_start(cls, name, days_to_keep=None):
+        return LOG_TABLES[name].retention_start(days_to_keep)
+
+    @classmethod
+    def ensure(cls, migrate=False, now=None):
+        """
+        Partition the log tables and create upcoming partitions.
+
+        Args:
+            migrate: also convert tables that already hold rows (the rows are
+                copied; run from init_db.py). Empty tables are always converted.
+        """
+        now = now or datetime.utcnow()
+        for log in LOG_TABLES.values():
+            try:
+                if cls.is_supported():
+                    cls._ensure_postgresql(log, migrate, now)
+                else:
+                    for index in log.table.indexes:
+                        index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Partition maintenance of {log.name} failed: {e}")
+
+    @classmethod
+    def purge(cls, name, days_to_keep=None, now=None):
+        """
+        Remove rows older than the retention window. Returns the number of
+        rows removed (planner estimate for dropped partitions).
+        """
+        log = LOG_TABLES[name]
+        cutoff = log.retention_start(days_to_keep, now)
+        if cutoff is None:
+            return 0
+        if cls.is_supported() and cls._is_partitioned(log):
+            return cls._drop_partitions(log, cutoff)
+        return cls._delete_rows(log, cutoff)
+
+    @classmethod
+    def maintain(cls):
+        cls.ensure()
+        for name in LOG_TABLES:
+            cls.purge(name)
+
+    @classmethod
+    def partitions(cls, name):
+        """Names of the partitions of a table, oldest first ([] if unpartitioned)."""
+        if not cls.is_supported():
+            return []
+        rows = db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name) ORDER BY c.relname"
+        ), {'name': name})
+        return [row[0] for row in rows]
+
+    @classmethod
+    def _is_partitioned(cls, log):
+        return db.session.execute(text(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"
+        ), {'name': log.name}).first() is not None
+
+    @classmethod
+    def _ensure_postgresql(cls, log, migrate, now):
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': PARTITION_LOCK_KEY})
+        if not cls._is_partitioned(log):
+            has_rows = db.session.execute(text(f'SELECT 1 FROM "{log.name}" LIMIT 1')).first() is not None
+            if has_rows and not migrate:
+                db.session.rollback()
+                logger.warning(f"{log.name} is not partitioned; run init_db.py to convert it")
+                return
+            cls._convert(log, now)
+
+        start = log.period_start(now)
+        for _ in range(LOG_PARTITION_PREMAKE + 1):
+            cls._create_partition(log, start)
+            start = log.next_period(start)
+        db.session.commit()
+
+    @classmethod
+    def _convert(cls, log, now):
+        """Swap an unpartitioned table for a partitioned copy. Caller commits."""
+        name, column = log.name, log.column
+        legacy = f'{name}_unpartitioned'
+        sequence = db.session.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {'name': name}).scalar()
+        oldest = db.session.execute(text(f'SELECT MIN("{column}") FROM "{name}"')).scalar()
+
+        db.session.execute(text(f'LOCK TABLE "{name}" IN ACCESS EXCLUSIVE MODE'))
+        db.session.execute(text(f'ALTER TABLE "{name}" RENAME TO "{legacy}"'))
+        # Index names are per schema: free them for the new table
+        db.session.execute(text(f'ALTER INDEX IF EXISTS "{name}_pkey" RENAME TO "{legacy}_pkey"'))
+        for index in log.table.indexes:
+            db.session.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+
+        db.session.execute(text(
+            f'CREATE TABLE "{name}" (LIKE "{legacy}" INCLUDING DEFAULTS) PARTITION BY RANGE ("{column}")'
+        ))
+        db.session.execute(text(f'ALTER TABLE "{name}" ALTER COLUMN "{column}" SET NOT NULL'))
+        # The partition key must be part of the primary key
+        db.session.execute(text(f'ALTER TABLE "{name}" ADD PRIMARY KEY (id, "{column}")'))
+        for fk in log.table.foreign_key_constraints:
+            columns = ', '.join(f'"{c.name}"' for c in fk.columns)
+            referred = ', '.join(f'"{e.column.name}"' for e in fk.elements)
+            db.session.execute(text(
+                f'ALTER TABLE "{name}" ADD FOREIGN KEY ({columns}) REFERENCES "{fk.referred_table.name}" ({referred})'
+            ))
+        if sequence:
+            db.session.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY "{name}".id'))
+        for index in log.table.indexes:
+            db.session.execute(CreateIndex(index))
+
+        start = log.period_start(min(oldest, now) if oldest else now)
+        while start <= now:
+            cls._create_partition(log, start)
+            start = log.next_period(start)
+        db.session.execute(text(f'CREATE TABLE "{name}{DEFAULT_SUFFIX}" PARTITION OF "{name}" DEFAULT'))
+
+        columns = [f'"{c.name}"' for c in log.table.columns]
+        selected = [f"COALESCE({c}, now() AT TIME ZONE 'utc')" if c == f'"{column}"' else c for c in columns]
+        db.session.execute(text(
+            f'INSERT INTO "{name}" ({", ".join(columns)}) SELECT {", ".join(selected)} FROM "{legacy}"'
+        ))
+        db.session.execute(text(f'DROP TABLE "{legacy}"'))
+        logger.info(f"{name} converted to {log.interval}ly partitions on {column}")
+
+    @classmethod
+    def _create_partition(cls, log, start):
+        end = log.next_period(start)
+        db.session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{log.partition_name(start)}" PARTITION OF "{log.name}" '
+            f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+        ))
+
+    @classmethod
+    def _drop_partitions(cls, log, cutoff):
+        removed = 0
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': PARTITION_LOCK_KEY})
+        try:
+            for partition in cls.partitions(log.name):
+                start = log.partition_start(partition)
+                if start is None or log.next_period(start) > cutoff:
+                    continue
+                estimate = db.session.execute(text(
+                    "SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = to_regclass(:name)"
+                ), {'name': partition}).scalar() or 0
+                db.session.execute(text(f'DROP TABLE "{partition}"'))
+                removed += estimate
+                logger.info(f"Dropped expired partition {partition}")
+            # Stragglers that missed their partition
+            removed += db.session.execute(text(
+                f'DELETE FROM "{log.name}{DEFAULT_SUFFIX}" WHERE "{log.column}" < :cutoff'
+            ), {'cutoff': cutoff}).rowcount
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Retention of {log.name} failed: {e}")
+            return 0
+        return removed
+
+    @classmethod
+    def _delete_rows(cls, log, cutoff):
+        table = log.table
+        expired = select(table.c.id).where(table.c[log.column] < cutoff).limit(LOG_PURGE_BATCH)
+        removed = 0
+        try:
+            while True:
+                deleted = db.session.execute(delete(table).where(table.c.id.in_(expired.scalar_subquery()))).rowcount
+                db.session.commit()
+                removed += deleted
+                if deleted < LOG_PURGE_BATCH:
+                    break
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Retention of {log.name} failed: {e}")
+        return removed
+
+
+def ensure_log_partitions(migrate=False):
+    LogPartitions.ensure(migrate=migrate)
+
+
+def maintain_log_partitions():
+    LogPartitions.maintain()
@@ -2,13 +2,18 @@
 Service de gestion des overlays avec priorité
 """
 from datetime import datetime
+from sqlalchemy import or_
 from app import db
 from models.screen_overlay import ScreenOverlay
 from models.broadcast import Broadcast
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Intervalle (secondes) du rapprochement des overlays broadcast par le planificateur
+OVERLAY_RECONCILE_INTERVAL = int(os.environ.get('OVERLAY_RECONCILE_INTERVAL', 30))
+
 
 PRIORITY_BROADCAST = 200
 PRIORITY_LOCAL_HIGH = 100
@@ -16,6 +21,36 @@ PRIORITY_LOCAL_NORMAL = 50
 PRIORITY_LOCAL_LOW = 20
 
 
+def build_overlay_from_broadcast(broadcast, screen_id):
+    """
+    Construit (sans l'ajouter à la session) l'overlay local d'une diffusion broadcast.
+    """
+    return ScreenOverlay(
+        screen_id=screen_id,
+        overlay_type=broadcast.overlay_type,
+        message=broadcast.overlay_message,
+        image_path=broadcast.overlay_image_path,
+        position=broadcast.overlay_position,
+        corner_position=broadcast.overlay_corner_position,
+        background_color=broadcast.overlay_background_color,
+        text_color=broadcast.overlay_text_color,
+        font_size=broadcast.overlay_font_size,
+        scroll_speed=broadcast.overlay_scroll_speed,
+        corner_size=broadcast.overlay_corner_size,
+        position_mode=broadcast.overlay_position_mode,
+        image_width_percent=broadcast.overlay_image_width_percent,
+        image_pos_x=broadcast.overlay_image_pos_x,
+        image_pos_y=broadcast.overlay_image_pos_y,
+        image_opacity=broadcast.overlay_image_opacity,
+        priority=PRIORITY_BROADCAST,
+        source=ScreenOverlay.SOURCE_BROADCAST,
+        source_broadcast_id=broadcast.id,
+        start_time=broadcast.start_datetime,
+        end_time=broadcast.end_datetime,
+        is_active=True
+    )
+
+
 def create_overlay_from_broadcast(broadcast, screen):
     """
     Crée un overlay local à partir d'une diffusion broadcast.
@@ -36,30 +71,7 @@ def create_overlay_from_broadcast(broadcast, screen):
             except Exception as e:
                 logger.error(f"Erreur lors de la mise en pause de l'overlay {overlay.id}: {e}")
 
-        new_overlay = ScreenOverlay(
-            screen_id=screen.id,
-            overlay_type=broadcast.overlay_type,
-            message=broadcast.overlay_message,
-            image_path=broadcast.overlay_image_path,
-            position=broadcast.overlay_position,
-            corner_position=broadcast.overlay_corner_position,
-            background_color=broadcast.overlay_background_color,
-            text_color=broadcast.overlay_text_color,
-            font_size=broadcast.overlay_font_size,
-            scroll_speed=broadcast.overlay_scroll_speed,
-            corner_size=broadcast.overlay_corner_size,
-            position_mode=broadcast.overlay_position_mode,
-            image_width_percent=broadcast.overlay_image_width_percent,
-            image_pos_x=broadcast.overlay_image_pos_x,
-            image_pos_y=broadcast.overlay_image_pos_y,
-            image_opacity=broadcast.overlay_image_opacity,
-            priority=PRIORITY_BROADCAST,
-            source=ScreenOverlay.SOURCE_BROADCAST,
-            source_broadcast_id=broadcast.id,
-            start_time=broadcast.start_datetime,
-            end_time=broadcast.end_datetime,
-            is_active=True
-        )
+        new_overlay = build_overlay_from_broadcast(broadcast, screen.id)
 
         db.session.add(new_overlay)
         db.session.commit()
@@ -209,55 +221,160 @@ def delete_overlay(overlay_id):
     return False
 
 
-def cleanup_expired_broadcast_overlays():
+def _expire_broadcast_overlays(now):
     """
-    Nettoie les overlays de broadcast expirés et reprend les overlays en pause.
+    Désactive en lot les overlays broadcast expirés et reprend les overlays
+    qu'ils avaient mis en pause (sans commit).
     """
-    now = datetime.utcnow()
-    
+    # Les overlays déjà désactivés ont été traités lors d'un passage précédent
     expired_overlays = ScreenOverlay.query.filter(
         ScreenOverlay.source == ScreenOverlay.SOURCE_BROADCAST,
+        ScreenOverlay.is_active == True,
         ScreenOverlay.end_time < now
     ).all()
     
-    for overlay in expired_overlays:
-        paused_overlays = ScreenOverlay.query.filter_by(
-            screen_id=overlay.screen_id,
-            position=overlay.position,
-            paused_by_broadcast_id=overlay.source_broadcast_id,
-            is_paused=True
-        ).all()
-        
-        for paused in paused_overlays:
+    if not expired_overlays:
+        return 0
+    
+    expired_keys = {(o.screen_id, o.position, o.source_broadcast_id) for o in expired_overlays}
+    paused_overlays = ScreenOverlay.query.filter(
+        ScreenOverlay.is_paused == True,
+        ScreenOverlay.screen_id.in_({o.screen_id for o in expired_overlays}),
+        ScreenOverlay.paused_by_broadcast_id.in_({o.source_broadcast_id for o in expired_overlays})
+    ).all()
+    
+    for paused in paused_overlays:
+        if (paused.screen_id, paused.position, paused.paused_by_broadcast_id) in expired_keys:
             paused.resume()
-            logger.info(f"Overlay {paused.id} repris après expiration du broadcast {overlay.source_broadcast_id}")
-        
+            logger.info(f"Overlay {paused.id} repris après expiration du broadcast {paused.paused_by_broadcast_id}")
+    
+    for overlay in expired_overlays:
         overlay.is_active = False
         logger.info(f"Overlay broadcast {overlay.id} désactivé (expiré)")
     
-    db.session.commit()
     return len(expired_overlays)
 
 
-def sync_broadcast_overlays(screen):
+def cleanup_expired_broadcast_overlays():
+    """
+    Nettoie les overlays de broadcast expirés et reprend les overlays en pause.
+    """
+    expired = _expire_broadcast_overlays(datetime.utcnow())
+    db.session.commit()
+    return expired
+
+
+def reconcile_broadcast_overlays(now=None):
+    """
+    Rapproche les overlays broadcast de toute la flotte en une passe :
+    crée les overlays des diffusions actives sur tous leurs écrans cibles
+    (en mettant en pause les overlays de même position), puis expire les
+    overlays de diffusions terminées. Exécuté par le planificateur
+    (services.scheduler), jamais pendant une requête du player.
+    
+    Returns:
+        tuple: (overlays créés, overlays expirés)
+    """
+    from models import Screen
+    from models.broadcast import broadcast_screen_targets
+    
+    if now is None:
+        now = datetime.utcnow()
+    
+    try:
+        broadcasts = {b.id: b for b in Broadcast.query.filter(
+            Broadcast.broadcast_type == Broadcast.BROADCAST_TYPE_OVERLAY,
+            Broadcast.is_active == True,
+            or_(Broadcast.start_datetime == None, Broadcast.start_datetime <= now),
+            or_(Broadcast.end_datetime == None, Broadcast.end_datetime >= now)
+        )}
+        
+        missing = []
+        if broadcasts:
+            targets = db.session.query(
+                broadcast_screen_targets.c.broadcast_id, broadcast_screen_targets.c.screen_id
+            ).join(Screen, Screen.id == broadcast_screen_targets.c.screen_id).filter(
+                broadcast_screen_targets.c.broadcast_id.in_(broadcasts.keys()),
+                Screen.is_active == True
+            ).all()
+            
+            existing = set(db.session.query(ScreenOverlay.source_broadcast_id, ScreenOverlay.screen_id).filter(
+                ScreenOverlay.source == ScreenOverlay.SOURCE_BROADCAST,
+                ScreenOverlay.source_broadcast_id.in_(broadcasts.keys())
+            ).all())
+            
+            missing = sorted(tuple(pair) for pair in targets if tuple(pair) not in existing)
+        
+        if missing:
+            # Overlays visibles des écrans concernés, par (écran, position)
+            visible = {}
+            for overlay in ScreenOverlay.query.filter(
+                ScreenOverlay.screen_id.in_({screen_id for _, screen_id in missing}),
+                ScreenOverlay.is_active == True,
+                ScreenOverlay.is_paused == False
+            ):
+                visible.setdefault((overlay.screen_id, overlay.position), []).append(overlay)
+            
+            for broadcast_id, screen_id in missing:
+                broadcast = broadcasts[broadcast_id]
+                key = (screen_id, broadcast.overlay_position)
+                for overlay in visible.get(key, []):
+                    overlay.pause(by_broadcast_id=broadcast.id)
+                new_overlay = build_overlay_from_broadcast(broadcast, screen_id)
+                db.session.add(new_overlay)
+                visible[key] = [new_overlay]
+        
+        expired = _expire_broadcast_overlays(now)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erreur lors du rapprochement des overlays broadcast: {e}")
+        raise
+    
+    if missing or expired:
+        logger.info(f"Overlays broadcast rapprochés: {len(missing)} créé(s), {expired} expiré(s)")
+    return len(missing), expired
+
+
+def request_overlay_reconcile():
+    """
+    Demande un rapprochement immédiat (après création ou modification d'une diffusion).
+    """
+    from services.scheduler import Scheduler
+    Scheduler.request('reconcile_broadcast_overlays')
+
+
+def sync_broadcast_overlays(screen, active_broadcasts=None):
     """
     Synchronise les overlays broadcast pour un écran.
     Crée de nouveaux overlays locaux si nécessaire.
+    
+    Le player n'appelle plus cette fonction : reconcile_broadcast_overlays()
+    traite toute la flotte en arrière-plan.
+    
+    Args:
+        screen: Screen model instance
+        active_broadcasts: Broadcasts overlay actifs déjà chargés pour cet écran (optionnel)
     """
     from models.broadcast import Broadcast
     
-    active_broadcasts = Broadcast.get_active_broadcasts_query(screen).filter_by(
-        broadcast_type=Broadcast.BROADCAST_TYPE_OVERLAY
-    ).all()
+    if active_broadcasts is None:
+        active_broadcasts = Broadcast.get_active_broadcasts_query(screen).filter_by(
+            broadcast_type=Broadcast.BROADCAST_TYPE_OVERLAY
+        ).all()
     
-    for broadcast in active_broadcasts:
-        existing = ScreenOverlay.query.filter_by(
-            screen_id=screen.id,
-            source=ScreenOverlay.SOURCE_BROADCAST,
-            source_broadcast_id=broadcast.id
-        ).first()
-
-        if not existing:
-            create_overlay_from_broadcast(broadcast, screen)
+    if active_broadcasts:
+        # Une seule requête pour les overlays déjà créés sur cet écran
+        existing_ids = {
+            row.source_broadcast_id for row in db.session.query(ScreenOverlay.source_broadcast_id).filter(
+                ScreenOverlay.screen_id == screen.id,
+                ScreenOverlay.source == ScreenOverlay.SOURCE_BROADCAST,
+                ScreenOverlay.source_broadcast_id.in_([b.id for b in active_broadcasts])
+            )
+        }
+
+        for broadcast in active_broadcasts:
+            if broadcast.id not in existing_ids:
+                create_overlay_from_broadcast(broadcast, screen)
     
     cleanup_expired_broadcast_overlays()
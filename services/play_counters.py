@@ -0,0 +1,412 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Booking play counters kept off the bookings row, reconciled in batches
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+import threading
+from collections import Counter
+
+from sqlalchemy import case, event, update
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Booking
+from services.screen_events import ScreenEventBus
+
+logger = logging.getLogger(__name__)
+
+# auto: Redis when the screen event backplane has one, otherwise count in the
+# database. memory: in-process counters (single-process deployments, tests).
+PLAY_COUNTER_BACKEND = os.environ.get('PLAY_COUNTER_BACKEND', 'auto').lower()
+
+# Seconds between reconciliations of counted plays into bookings.plays_completed.
+PLAY_COUNTER_RECONCILE_INTERVAL = int(os.environ.get('PLAY_COUNTER_RECONCILE_INTERVAL', 10))
+
+# Idle counters are dropped after this long and re-seeded from the database.
+PLAY_COUNTER_TTL = 86400
+
+# Lock stripes of the in-process backend.
+PLAY_COUNTER_SHARDS = 16
+
+REDIS_KEY_PREFIX = 'adscreen:plays:'
+REDIS_DIRTY_KEY = 'adscreen:plays:dirty'
+
+# Grants min(n, limit - count) plays, so a booking is never counted past its limit.
+_CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return {-1, 0} end
+if redis.call('HGET', KEYS[1], 'screen_id') ~= ARGV[2] then return {-2, 0} end
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit'))
+local count = tonumber(redis.call('HGET', KEYS[1], 'count'))
+local granted = math.min(tonumber(ARGV[1]), math.max(limit - count, 0))
+if granted > 0 then
+    redis.call('HINCRBY', KEYS[1], 'count', granted)
+    redis.call('HINCRBY', KEYS[1], 'pending', granted)
+    redis.call('SADD', KEYS[2], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return {granted, limit - count - granted}
+"""
+
+_SEED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], 'screen_id', ARGV[1], 'count', ARGV[2], 'limit', ARGV[3], 'pending', 0)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# Pending may be negative: plays released after an earlier take wrote them.
+_TAKE_SCRIPT = """
+local pending = tonumber(redis.call('HGET', KEYS[1], 'pending') or '0')
+if pending ~= 0 then redis.call('HINCRBY', KEYS[1], 'pending', -pending) end
+redis.call('SREM', KEYS[2], ARGV[1])
+return pending
+"""
+
+
+class MemoryCounterBackend:
+    """In-process stand-in for the Redis backend, striped over PLAY_COUNTER_SHARDS locks."""
+
+    def __init__(self, shards=PLAY_COUNTER_SHARDS):
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+
+    def _shard(self, booking_id):
+        return self._shards[booking_id % len(self._shards)]
+
+    def seed(self, booking_id, screen_id, count, limit):
+        counters, lock = self._shard(booking_id)
+        with lock:
+            counters.setdefault(booking_id, {'screen_id': screen_id, 'count': count, 'limit': limit, 'pending': 0})
+
+    def claim(self, booking_id, screen_id, n):
+        """Returns (granted, remaining), or None if the booking is not seeded or not this screen's."""
+        counters, lock = self._shard(booking_id)
+        with lock:
+            state = counters.get(booking_id)
+            if state is None or state['screen_id'] != screen_id:
+                return None
+            granted = min(n, max(state['limit'] - state['count'], 0))
+            state['count'] += granted
+            state['pending'] += granted
+            remaining = state['limit'] - state['count']
+        if granted:
+            with self._dirty_lock:
+                self._dirty.add(booking_id)
+        return granted, remaining
+
+    def release(self, booking_id, n):
+        """Give back n claimed plays (their transaction rolled back)."""
+        counters, lock = self._shard(booking_id)
+        with lock:
+            state = counters.get(booking_id)
+            if state is None:
+                return
+            state['count'] -= n
+            state['pending'] -= n
+        with self._dirty_lock:
+            self._dirty.add(booking_id)
+
+    def take_pending(self, booking_ids=None):
+        with self._dirty_lock:
+            ids = set(self._dirty) if booking_ids is None else self._dirty & set(booking_ids)
+            self._dirty -= ids
+        taken = {}
+        for booking_id in ids:
+            counters, lock = self._shard(booking_id)
+            with lock:
+                state = counters.get(booking_id)
+                if state and state['pending']:
+                    taken[booking_id] = state['pending']
+                    state['pending'] = 0
+        return taken
+
+    def restore_pending(self, pending):
+        for booking_id, n in pending.items():
+            counters, lock = self._shard(booking_id)
+            with lock:
+                if booking_id in counters:
+                    counters[booking_id]['pending'] += n
+        with self._dirty_lock:
+            self._dirty.update(pending)
+
+    def set_limit(self, booking_id, limit):
+        counters, lock = self._shard(booking_id)
+        with lock:
+            if booking_id in counters:
+                counters[booking_id]['limit'] = limit
+
+    def get(self, booking_id):
+        counters, lock = self._shard(booking_id)
+        with lock:
+            state = counters.get(booking_id)
+            return dict(state) if state else None
+
+
+class RedisCounterBackend:
+    """Counters shared by every worker; each booking is one Redis hash."""
+
+    def __init__(self, client):
+        self._client = client
+        self._claim = client.register_script(_CLAIM_SCRIPT)
+        self._seed = client.register_script(_SEED_SCRIPT)
+        self._take = client.register_script(_TAKE_SCRIPT)
+
+    @staticmethod
+    def _key(booking_id):
+        return f'{REDIS_KEY_PREFIX}{booking_id}'
+
+    def seed(self, booking_id, screen_id, count, limit):
+        self._seed(keys=[self._key(booking_id)], args=[screen_id, count, limit, PLAY_COUNTER_TTL])
+
+    def claim(self, booking_id, screen_id, n):
+        granted, remaining = self._claim(
+            keys=[self._key(booking_id), REDIS_DIRTY_KEY],
+            args=[n, screen_id, booking_id, PLAY_COUNTER_TTL]
+        )
+        if granted < 0:
+            return None
+        return int(granted), int(remaining)
+
+    def release(self, booking_id, n):
+        key = self._key(booking_id)
+        if not self._client.exists(key):
+            return
+        pipe = self._client.pipeline()
+        pipe.hincrby(key, 'count', -n)
+        pipe.hincrby(key, 'pending', -n)
+        pipe.sadd(REDIS_DIRTY_KEY, booking_id)
+        pipe.execute()
+
+    def take_pending(self, booking_ids=None):
+        if booking_ids is None:
+            booking_ids = [int(member) for member in self._client.smembers(REDIS_DIRTY_KEY)]
+        taken = {}
+        for booking_id in booking_ids:
+            pending = int(self._take(keys=[self._key(booking_id), REDIS_DIRTY_KEY], args=[booking_id]))
+            if pending:
+                taken[booking_id] = pending
+        return taken
+
+    def restore_pending(self, pending):
+        pipe = self._client.pipeline()
+        for booking_id, n in pending.items():
+            pipe.hincrby(self._key(booking_id), 'pending', n)
+            pipe.sadd(REDIS_DIRTY_KEY, booking_id)
+        pipe.execute()
+
+    def set_limit(self, booking_id, limit):
+        key = self._key(booking_id)
+        if self._client.exists(key):
+            self._client.hset(key, 'limit', limit)
+
+    def get(self, booking_id):
+        state = self._client.hgetall(self._key(booking_id))
+        if not state:
+            return None
+        return {k.decode(): int(v) for k, v in state.items()}
+
+
+class PlayCounters:
+    """
+    Counts paid plays per booking outside the bookings table.
+
+    Plays are claimed against the booking's calculate_dynamic_plays() limit
+    atomically in the backend, so exhaustion is detected without a database
+    round trip and a booking is never counted past its limit. Counted plays
+    are added to bookings.plays_completed by reconcile() in one grouped UPDATE;
+    a booking that reaches its limit is reconciled (and completed) right away.
+    Without a counter backend, plays are counted directly in the database.
+
+    Claims belong to the caller's transaction: they are released if it rolls
+    back, so a player retrying a failed batch is not counted twice.
+    """
+    _backend = None
+    _resolved = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def backend(cls):
+        with cls._lock:
+            if not cls._resolved:
+                cls._backend = _resolve_backend()
+                cls._resolved = True
+            return cls._backend
+
+    @classmethod
+    def use_backend(cls, backend):
+        with cls._lock:
+            cls._backend = backend
+            cls._resolved = True
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._backend = None
+            cls._resolved = False
+
+    @classmethod
+    def count(cls, screen_id, counts):
+        """
+        Count {booking_id: plays} played by one screen. Does not commit.
+
+        Returns:
+            list: IDs of the bookings that have no play left; pass them to
+            reconcile() once the caller's transaction is committed
+        """
+        counts = {_booking_key(booking_id): n for booking_id, n in counts.items() if n > 0}
+        counts.pop(None, None)
+        if not counts:
+            return []
+
+        backend = cls.backend()
+        if backend is None:
+            return _count_in_database(screen_id, counts)
+
+        exhausted = []
+        claims = db.session.info.setdefault('play_claims', Counter())
+        for booking_id, n in counts.items():
+            result = backend.claim(booking_id, screen_id, n)
+            if result is None and _seed(backend, booking_id):
+                result = backend.claim(booking_id, screen_id, n)
+            if result is None:
+                continue
+            if result[0]:
+                claims[booking_id] += result[0]
+            if result[1] <= 0:
+                exhausted.append(booking_id)
+        return sorted(exhausted)
+
+    @classmethod
+    def release(cls, claims):
+        """Give back {booking_id: plays} claimed by a transaction that rolled back."""
+        backend = cls.backend()
+        if backend is None:
+            return
+        for booking_id, n in claims.items():
+            try:
+                backend.release(booking_id, n)
+            except Exception as e:
+                logger.error(f"Play counter release failed for booking {booking_id}: {e}")
+
+    @classmethod
+    def reconcile(cls, booking_ids=None):
+        """
+        Add counted plays to bookings.plays_completed and complete exhausted
+        bookings. Returns the number of plays written.
+        """
+        backend = cls.backend()
+        if backend is None:
+            return 0
+
+        pending = backend.take_pending(booking_ids)
+        if not pending:
+            return 0
+
+        try:
+            db.session.execute(
+                update(Booking)
+                .where(Booking.id.in_(list(pending)))
+                .values(plays_completed=Booking.plays_completed + case(pending, value=Booking.id, else_=0)),
+                execution_options={'synchronize_session': False}
+            )
+            # Status flips go through the ORM so playlist snapshots are invalidated.
+            bookings = Booking.query.filter(Booking.id.in_(list(pending))).populate_existing().all()
+            for booking in bookings:
+                limit = booking.calculate_dynamic_plays()
+                backend.set_limit(booking.id, limit)
+                if booking.status == 'active' and booking.plays_completed >= limit:
+                    booking.status = 'completed'
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            backend.restore_pending(pending)
+            logger.error(f"Play counter reconciliation failed ({len(pending)} booking(s)): {e}")
+            return 0
+
+        return sum(pending.values())
+
+
+def _booking_key(booking_id):
+    try:
+        return int(booking_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _resolve_backend():
+    if PLAY_COUNTER_BACKEND == 'memory':
+        return MemoryCounterBackend()
+    if PLAY_COUNTER_BACKEND in ('auto', 'redis'):
+        client = ScreenEventBus.backplane_client()
+        if client is not None:
+            try:
+                return RedisCounterBackend(client)
+            except Exception as e:
+                logger.warning(f"Redis play counters unavailable, counting in the database: {e}")
+    return None
+
+
+def _seed(backend, booking_id):
+    booking = Booking.query.filter(Booking.id == booking_id, Booking.status == 'active').first()
+    if booking is None:
+        return False
+    backend.seed(booking.id, booking.screen_id, booking.plays_completed or 0, booking.calculate_dynamic_plays())
+    return True
+
+
+def _count_in_database(screen_id, counts):
+    booking_ids = list(counts)
+    db.session.execute(
+        update(Booking)
+        .where(Booking.id.in_(booking_ids), Booking.screen_id == screen_id, Booking.status == 'active')
+        .values(plays_completed=Booking.plays_completed + case(counts, value=Booking.id, else_=0)),
+        execution_options={'synchronize_session': False}
+    )
+
+    exhausted = []
+    bookings = Booking.query.filter(
+        Booking.id.in_(booking_ids),
+        Booking.screen_id == screen_id,
+        Booking.status == 'active'
+    ).populate_existing().all()
+    for booking in bookings:
+        limit = booking.calculate_dynamic_plays()
+        if booking.plays_completed >= limit:
+            # The row is locked by the UPDATE above: cap plays at the limit
+            booking.plays_completed = limit
+            booking.status = 'completed'
+            exhausted.append(booking.id)
+    return sorted(exhausted)
+
+
+def reconcile_play_counters():
+    PlayCounters.reconcile()
+
+
+def _on_after_commit(session):
+    session.info.pop('play_claims', None)
+
+
+def _on_after_rollback(session):
+    claims = session.info.pop('play_claims', None)
+    if claims:
+        logger.warning(f"Releasing {sum(claims.values())} play(s) claimed by a rolled back transaction")
+        PlayCounters.release(claims)
+
+
+_listeners_registered = False
+
+
+def register_play_counter_listeners():
+    """Tie play claims to the outcome of their session's transaction (idempotent)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(Session, 'after_commit', _on_after_commit)
+    event.listen(Session, 'after_rollback', _on_after_rollback)
+    _listeners_registered = True
@@ -0,0 +1,154 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Batched proof-of-play ingestion (StatLog, Booking, AdContentStat)
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import db
+from models import StatLog
+from services.input_validator import ValidationError, sanitize_string
+from services.play_counters import PlayCounters
+from services.impression_aggregator import ImpressionAggregator
+
+logger = logging.getLogger(__name__)
+
+# Largest batch accepted by /log-plays; players split bigger queues.
+PLAY_BATCH_MAX = int(os.environ.get('PLAY_BATCH_MAX', 200))
+
+# Queued plays older than this are recorded at the oldest allowed time.
+PLAY_BACKDATE_MAX = timedelta(days=7)
+
+MAX_PLAY_DURATION = 86400
+
+AD_CONTENT_PREFIX = 'ad_'
+
+
+def parse_play_batch(data):
+    """
+    Validate a /log-plays body.
+
+    Returns:
+        tuple: (normalized plays, number of rejected plays)
+    """
+    plays = (data or {}).get('plays')
+    if not isinstance(plays, list) or not plays:
+        raise ValidationError('plays', 'Must be a non-empty list')
+    if len(plays) > PLAY_BATCH_MAX:
+        raise ValidationError('plays', f'Must not exceed {PLAY_BATCH_MAX} plays')
+
+    now = datetime.utcnow()
+    normalized = []
+    for raw in plays:
+        play = normalize_play(raw, now)
+        if play is not None:
+            normalized.append(play)
+    return normalized, len(plays) - len(normalized)
+
+
+def normalize_play(raw, now=None):
+    """One queued play as sent by the player, or None if it is unusable."""
+    if not isinstance(raw, dict):
+        return None
+    now = now or datetime.utcnow()
+
+    content_type = sanitize_string(raw.get('content_type'), max_length=20)
+    if not content_type:
+        return None
+    category = sanitize_string(raw.get('category'), max_length=20)
+
+    content_id, ad_id = _parse_content_id(raw.get('content_id'))
+
+    try:
+        duration = float(raw['duration']) if raw.get('duration') is not None else None
+        booking_id = int(raw['booking_id']) if raw.get('booking_id') else None
+    except (TypeError, ValueError):
+        return None
+    if duration is not None and not 0 <= duration <= MAX_PLAY_DURATION:
+        return None
+
+    return {
+        'content_type': content_type,
+        'content_id': content_id,
+        'category': category,
+        'duration': duration,
+        'booking_id': booking_id,
+        'ad_id': ad_id if category == 'ad_content' else None,
+        'played_at': _parse_played_at(raw.get('played_at'), now),
+    }
+
+
+def _parse_content_id(value):
+    """Returns (StatLog content_id, AdContent id) from 12 or 'ad_12'."""
+    if isinstance(value, str) and value.startswith(AD_CONTENT_PREFIX):
+        try:
+            ad_id = int(value[len(AD_CONTENT_PREFIX):])
+        except ValueError:
+            return None, None
+        return ad_id, ad_id
+    try:
+        return int(value), None
+    except (TypeError, ValueError):
+        return None, None
+
+
+def _parse_played_at(value, now):
+    if not value:
+        return now
+    try:
+        played_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return now
+    if played_at.tzinfo is not None:
+        played_at = (played_at - played_at.utcoffset()).replace(tzinfo=None)
+    return min(max(played_at, now - PLAY_BACKDATE_MAX), now)
+
+
+def ingest_plays(screen_id, organization_id, plays):
+    """
+    Record a batch of plays for one screen in a single transaction.
+
+    StatLog rows are bulk inserted, paid plays are counted per booking by
+    PlayCounters, and ad impressions are grouped per (ad, day) and handed to
+    the ImpressionAggregator.
+
+    Returns:
+        list: IDs of the bookings exhausted by this batch
+    """
+    if not plays:
+        return []
+
+    # Core insert: one executemany whatever the mix of NULL columns
+    db.session.execute(insert(StatLog.__table__), [{
+        'screen_id': screen_id,
+        'content_type': play['content_type'],
+        'content_id': play['content_id'],
+        'content_category': play['category'],
+        'duration_seconds': play['duration'],
+        'played_at': play['played_at'],
+    } for play in plays])
+
+    exhausted = PlayCounters.count(screen_id, Counter(
+        play['booking_id'] for play in plays if play['category'] == 'paid' and play['booking_id']
+    ))
+
+    impressions = {}
+    for play in plays:
+        if play['ad_id'] is None:
+            continue
+        key = (play['ad_id'], play['played_at'].date())
+        count, duration = impressions.get(key, (0, 0.0))
+        impressions[key] = (count + 1, duration + (play['duration'] or 0))
+
+    db.session.commit()
+    ImpressionAggregator.record(screen_id, organization_id, impressions)
+    if exhausted:
+        PlayCounters.reconcile(exhausted)
+    return exhausted
@@ -0,0 +1,79 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Playlist delta protocol (diff between two compiled playlist versions)
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+
+# Lists of the playlist document that are diffed item by item; every other
+# key (screen, mode, iptv...) is small and always sent as is.
+COLLECTIONS = ('playlist', 'overlays')
+
+
+def item_key(item):
+    """Stable identity of a playlist/overlay item across versions."""
+    category = item.get('category')
+    if category:
+        return f"{category}:{item.get('id')}"
+    return str(item.get('id'))
+
+
+def share_unchanged_items(previous, data):
+    """
+    Replace items of `data` equal to an item of `previous` by that same object,
+    so that successive versions kept for deltas only cost their changed items.
+    """
+    if not previous:
+        return data
+    for name in COLLECTIONS:
+        old_by_key = {item_key(item): item for item in previous.get(name) or []}
+        items = data.get(name)
+        if not items or not old_by_key:
+            continue
+        for index, item in enumerate(items):
+            old = old_by_key.get(item_key(item))
+            if old is not None and old == item:
+                items[index] = old
+    return data
+
+
+def diff_collection(old_items, new_items):
+    old_by_key = {item_key(item): item for item in old_items}
+    order = []
+    changed = []
+    for item in new_items:
+        key = item_key(item)
+        order.append(key)
+        if old_by_key.get(key) != item:
+            changed.append(item)
+    new_keys = set(order)
+    removed = [key for key in old_by_key if key not in new_keys]
+    return {'order': order, 'changed': changed, 'removed': removed}
+
+
+def compute_delta(base, data):
+    """
+    Delta turning the `base` document into `data`.
+
+    Each collection becomes {'order': [keys], 'changed': [items], 'removed': [keys]};
+    clients rebuild the list by looking up `order` in their previous items
+    updated with `changed`.
+
+    Returns:
+        dict or None when the delta would not be smaller than the full document
+    """
+    delta = {key: value for key, value in data.items() if key not in COLLECTIONS}
+    total_items = 0
+    sent_items = 0
+    for name in COLLECTIONS:
+        new_items = data.get(name) or []
+        diff = diff_collection(base.get(name) or [], new_items)
+        delta[name] = diff
+        total_items += len(new_items)
+        sent_items += len(diff['changed'])
+
+    if total_items and sent_items >= total_items:
+        return None
+    delta['delta'] = True
+    return delta
@@ -0,0 +1,377 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Shared playlist compilation engine (web player, mobile API, playlist service)
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import Screen, Content, Booking, Filler, InternalContent, ScreenOverlay, Broadcast
+from models.ad_content import AdContent
+from models.broadcast import broadcast_screen_targets
+from services.playlist_snapshot import next_time_boundary, next_period_boundary, day_start, day_after
+from services.ad_targeting_index import AdTargetingIndex
+from services.overlay_service import PRIORITY_BROADCAST
+
+logger = logging.getLogger(__name__)
+
+
+PRIORITY_PAID = 100
+PRIORITY_AD = 50
+PRIORITY_FILLER = 20
+
+
+def safe_content_url(file_path):
+    """Sanitize file path for URL generation, preventing path traversal."""
+    if not file_path:
+        return '/static/img/placeholder.png'
+    # Normalize and remove any path traversal
+    clean = os.path.normpath(file_path).replace('\\', '/')
+    if clean.startswith('/') or '..' in clean:
+        return '/static/img/placeholder.png'
+    return f'/{clean}'
+
+
+def get_current_period(time_periods, current_hour=None):
+    """
+    Get the time period matching the current hour (local server time).
+
+    Args:
+        time_periods: TimePeriod instances of a screen
+        current_hour: Hour to check (defaults to the current local hour)
+
+    Returns:
+        TimePeriod instance or None
+    """
+    if current_hour is None:
+        current_hour = datetime.now().hour
+
+    for period in time_periods:
+        if period.start_hour == period.end_hour:
+            # 24-hour period (e.g., 6h-6h means all day)
+            return period
+        elif period.start_hour < period.end_hour:
+            # Normal daytime period (e.g., 9h-17h)
+            if period.start_hour <= current_hour < period.end_hour:
+                return period
+        else:
+            # Overnight period (e.g., 22h-6h)
+            if current_hour >= period.start_hour or current_hour < period.end_hour:
+                return period
+
+    return None
+
+
+def is_iptv_mode(screen):
+    return screen.current_mode == 'iptv' and screen.iptv_enabled and screen.current_iptv_channel
+
+
+def screen_info(screen):
+    return {
+        'id': screen.id,
+        'name': screen.name,
+        'resolution': f'{screen.resolution_width}x{screen.resolution_height}',
+        'orientation': screen.orientation
+    }
+
+
+def load_screen(screen_id):
+    """Load a screen with the relationships the engine reads (one query)."""
+    return db.session.query(Screen).options(
+        joinedload(Screen.time_periods),
+        joinedload(Screen.organization)
+    ).filter_by(id=screen_id).first()
+
+
+class PlaylistInputs:
+    """Rows needed to compile one screen's playlist, loaded up front."""
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.paid_contents = []
+        self.internal_contents = []
+        self.fillers = []
+        self.overlays = []
+        self.pending_overlay_broadcasts = []
+        self.broadcasts = []
+        self.ads = []
+        self.upcoming = []
+
+
+def _upcoming_boundaries(screen, now):
+    """Earliest future start of broadcasts and overlays not yet in the playlist."""
+    next_broadcast_start = db.session.query(func.min(Broadcast.start_datetime)).join(
+        broadcast_screen_targets, broadcast_screen_targets.c.broadcast_id == Broadcast.id
+    ).filter(
+        broadcast_screen_targets.c.screen_id == screen.id,
+        Broadcast.is_active == True,
+        Broadcast.start_datetime > now
+    ).scalar()
+    next_overlay_start = db.session.query(func.min(ScreenOverlay.start_time)).filter(
+        ScreenOverlay.screen_id == screen.id,
+        ScreenOverlay.is_active == True,
+        ScreenOverlay.start_time > now
+    ).scalar()
+    return [next_broadcast_start, next_overlay_start]
+
+
+def load_playlist_inputs(screen, now=None):
+    """
+    Load everything a screen's playlist depends on.
+
+    Issues a fixed number of queries regardless of how many bookings, ads or
+    broadcasts exist platform-wide: broadcasts come from the precomputed
+    broadcast_screen_targets mapping (one query for overlays and content) and
+    ads from the in-memory targeting index.
+
+    Read-only: broadcast overlays are materialized by the background
+    reconciler (overlay_service.reconcile_broadcast_overlays).
+    """
+    from services.overlay_service import get_active_overlays_for_screen
+
+    now = now or datetime.utcnow()
+    inputs = PlaylistInputs(screen)
+
+    broadcasts = Broadcast.get_active_broadcasts_query(screen, now=now).all()
+    inputs.overlays = get_active_overlays_for_screen(screen.id)
+
+    overlay_broadcasts = [b for b in broadcasts if b.broadcast_type == Broadcast.BROADCAST_TYPE_OVERLAY]
+    if overlay_broadcasts:
+        materialized = {
+            row.source_broadcast_id for row in db.session.query(ScreenOverlay.source_broadcast_id).filter(
+                ScreenOverlay.screen_id == screen.id,
+                ScreenOverlay.source == ScreenOverlay.SOURCE_BROADCAST,
+                ScreenOverlay.source_broadcast_id.in_([b.id for b in overlay_broadcasts])
+            )
+        }
+        # Shown straight from the broadcast until the reconciler creates the row
+        inputs.pending_overlay_broadcasts = [b for b in overlay_broadcasts if b.id not in materialized]
+
+    if not is_iptv_mode(screen):
+        inputs.paid_contents = Content.query.options(joinedload(Content.booking)).join(Booking).filter(
+            Content.screen_id == screen.id,
+            Content.status == 'approved',
+            Content.in_playlist == True,
+            Booking.status == 'active'
+        ).all()
+
+        inputs.internal_contents = InternalContent.query.filter_by(
+            screen_id=screen.id,
+            is_active=True,
+            in_playlist=True
+        ).all()
+
+        inputs.fillers = Filler.query.filter_by(
+            screen_id=screen.id,
+            is_active=True,
+            in_playlist=True
+        ).all()
+
+        inputs.broadcasts = [
+            b for b in broadcasts if b.broadcast_type == Broadcast.BROADCAST_TYPE_CONTENT
+        ]
+
+        inputs.ads = AdTargetingIndex.resolve(screen)
+
+    inputs.upcoming = _upcoming_boundaries(screen, now)
+    return inputs
+
+
+def filler_item(filler):
+    return {
+        'id': filler.id,
+        'type': filler.content_type,
+        'url': safe_content_url(filler.file_path),
+        'duration': filler.duration_seconds or 10,
+        'priority': PRIORITY_FILLER,
+        'category': 'filler',
+        'name': filler.filename
+    }
+
+
+def _sort_key(item):
+    # Paid/internal/filler ids are integers, ad and broadcast ids are strings
+    # ('ad_12'); keep them in separate groups so equal priorities still compare.
+    item_id = item.get('id', 0)
+    return (-item['priority'], isinstance(item_id, str), item_id, item.get('name') or '')
+
+
+def compile_playlist(inputs, now=None):
+    """
+    Compile a playlist document from preloaded inputs. Performs no queries.
+
+    Returns:
+        tuple: (document, valid_until) where valid_until is the next UTC time
+               at which the compiled content changes on its own (or None)
+    """
+    now = now or datetime.utcnow()
+    screen = inputs.screen
+    boundaries = list(inputs.upcoming)
+
+    overlays = [o.to_dict() for o in inputs.overlays]
+    for broadcast in inputs.pending_overlay_broadcasts:
+        overlays.append(dict(broadcast.to_overlay_dict(), priority=PRIORITY_BROADCAST, source='broadcast'))
+        boundaries.append(broadcast.end_datetime)
+    overlays.sort(key=lambda x: x.get('priority', 50), reverse=True)
+    boundaries.extend(o.end_time for o in inputs.overlays)
+
+    if is_iptv_mode(screen):
+        document = {
+            'screen': screen_info(screen),
+            'mode': 'iptv',
+            'iptv': {
+                'url': screen.get_iptv_url(),
+                'name': screen.current_iptv_channel_name
+            },
+            'playlist': [],
+            'overlays': overlays
+        }
+        return document, next_time_boundary(boundaries, now)
+
+    playlist = []
+    current_period = get_current_period(screen.time_periods)
+    boundaries.append(next_period_boundary(screen.time_periods))
+
+    for content in inputs.paid_contents:
+        booking = content.booking
+        if not booking:
+            continue  # Skip orphaned content (booking deleted without cascade)
+
+        if booking.start_date:
+            boundaries.append(datetime.combine(booking.start_date, booking.start_time or datetime.min.time()))
+        boundaries.append(day_after(booking.end_date))
+
+        # Respect scheduled start_date/start_time - don't show before reservation period starts
+        if not booking.is_playable_now():
+            continue
+
+        if current_period and booking.time_period_id and booking.time_period_id != current_period.id:
+            continue
+
+        duration = booking.slot_duration if booking.slot_duration and booking.slot_duration > 0 else (content.duration_seconds or 10)
+
+        # Calculate dynamic plays if validation was late.
+        # Compile-time value: refreshed whenever the playlist is rebuilt.
+        remaining = booking.calculate_dynamic_plays() - booking.plays_completed
+        if remaining <= 0:
+            continue
+
+        playlist.append({
+            'id': content.id,
+            'type': content.content_type,
+            'url': safe_content_url(content.file_path),
+            'duration': duration,
+            'priority': PRIORITY_PAID,
+            'category': 'paid',
+            'booking_id': booking.id,
+            'remaining_plays': remaining,
+            'name': content.original_filename or content.filename
+        })
+
+    today = now.date()
+    for internal in inputs.internal_contents:
+        boundaries.append(day_start(internal.start_date))
+        boundaries.append(day_after(internal.end_date))
+        if internal.start_date and internal.start_date > today:
+            continue
+        # end_date is inclusive: content plays on end_date day, removed on end_date + 1
+        if internal.end_date and internal.end_date < today:
+            continue
+
+        playlist.append({
+            'id': internal.id,
+            'type': internal.content_type,
+            'url': safe_content_url(internal.file_path),
+            'duration': internal.duration_seconds or 10,
+            'priority': internal.priority,
+            'category': 'internal',
+            'name': internal.name
+        })
+
+    playlist.extend(filler_item(filler) for filler in inputs.fillers)
+
+    for broadcast in inputs.broadcasts:
+        boundaries.append(broadcast.end_datetime)
+        playlist.append(broadcast.to_content_dict())
+
+    for entry in inputs.ads if screen.is_active else ():
+        # Targeting was resolved by the index; only time window and org checks remain.
+        if not entry.matches_org(screen.organization):
+            continue
+        if entry.schedule_type == AdContent.SCHEDULE_PERIOD:
+            boundaries.append(entry.start_date)
+            boundaries.append(entry.end_date)
+        if not entry.is_active_at(now):
+            continue
+        ad_dict = dict(entry.content)
+        ad_dict['priority'] = PRIORITY_AD
+        playlist.append(ad_dict)
+
+    playlist.sort(key=_sort_key)
+
+    document = {
+        'screen': screen_info(screen),
+        'mode': 'playlist',
+        'playlist': playlist,
+        'overlays': overlays
+    }
+    return document, next_time_boundary(boundaries, now)
+
+
+def fallback_document(screen):
+    """Filler-only playlist used when compilation fails, so the screen stays alive."""
+    fillers = Filler.query.filter_by(
+        screen_id=screen.id,
+        is_active=True,
+        in_playlist=True
+    ).all()
+
+    # Try to fetch overlays even in fallback mode
+    overlays = []
+    try:
+        from services.overlay_service import get_active_overlays_for_screen
+        overlays = [o.to_dict() for o in get_active_overlays_for_screen(screen.id)]
+    except Exception:
+        pass  # Overlays are non-critical in fallback mode
+
+    return {
+        'screen': screen_info(screen),
+        'mode': 'playlist',
+        'playlist': [filler_item(f) for f in fillers],
+        'overlays': overlays,
+        'error_recovered': True
+    }
+
+
+def build_playlist_document(screen_id, now=None):
+    """
+    Load, compile and return a screen's playlist document.
+
+    This is the single entry point shared by the web player (through the
+    snapshot store), the mobile API and services.playlist_service.
+
+    Returns:
+        tuple: (document, valid_until, error_recovered), or None if the screen
+               does not exist
+    """
+    screen = load_screen(screen_id)
+    if not screen:
+        return None
+
+    try:
+        now = now or datetime.utcnow()
+        inputs = load_playlist_inputs(screen, now)
+        document, valid_until = compile_playlist(inputs, now)
+        return document, valid_until, False
+    except Exception as e:
+        logger.error(f"Error generating playlist for screen {screen_id}: {str(e)}")
+        # SEC/RESILIENCE: Never return a raw error or empty playlist. Ensure screen stays alive with Fillers.
+        db.session.rollback()
+        return fallback_document(screen), None, True
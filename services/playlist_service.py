@@ -1,4 +1,5 @@
-from models import Screen, Content, Booking, Filler, InternalContent, Broadcast
+from models import Screen, Broadcast
+from services import playlist_engine
 from datetime import datetime, timedelta
 
 
@@ -12,31 +13,18 @@ def get_current_period(screen):
     Returns:
         TimePeriod instance or None
     """
-    current_hour = datetime.now().hour
-
-    for period in screen.time_periods:
-        if period.start_hour == period.end_hour:
-            # 24-hour period (e.g., 6h-6h means all day)
-            return period
-        elif period.start_hour < period.end_hour:
-            # Normal daytime period (e.g., 9h-17h)
-            if period.start_hour <= current_hour < period.end_hour:
-                return period
-        else:
-            # Overnight period (e.g., 22h-6h)
-            if current_hour >= period.start_hour or current_hour < period.end_hour:
-                return period
-
-    return None
+    return playlist_engine.get_current_period(screen.time_periods)
 
 
 def build_playlist(screen_id):
     """
     Build the playlist for a screen.
     
-    The playlist is built with the following priority:
+    Delegates to the shared playlist engine so this service, the web player
+    and the mobile API always produce the same items:
     - Paid content (priority 100)
     - Internal content (priority based on settings, default 80)
+    - Advertiser content (priority 50)
     - Filler content (priority 20)
     
     Args:
@@ -45,76 +33,12 @@ def build_playlist(screen_id):
     Returns:
         list: List of playlist items sorted by priority
     """
-    screen = Screen.query.get(screen_id)
-    if not screen:
+    result = playlist_engine.build_playlist_document(screen_id)
+    if result is None:
         return []
     
-    current_period = get_current_period(screen)
-    playlist = []
-    
-    paid_contents = Content.query.join(Booking).filter(
-        Content.screen_id == screen_id,
-        Content.status == 'approved',
-        Booking.status == 'active',
-        Booking.plays_completed < Booking.num_plays
-    ).all()
-    
-    for content in paid_contents:
-        if current_period and content.booking.time_period_id:
-            if content.booking.time_period_id != current_period.id:
-                continue
-        
-        playlist.append({
-            'id': content.id,
-            'type': content.content_type,
-            'url': f'/{content.file_path}',
-            'duration': content.duration_seconds or 10,
-            'priority': 100,
-            'category': 'paid',
-            'booking_id': content.booking.id,
-            'remaining_plays': content.booking.num_plays - content.booking.plays_completed
-        })
-    
-    internal_contents = InternalContent.query.filter_by(
-        screen_id=screen_id,
-        is_active=True
-    ).all()
-    
-    today = datetime.utcnow().date()
-    for internal in internal_contents:
-        if internal.start_date and internal.start_date > today:
-            continue
-        if internal.end_date and internal.end_date < today:
-            continue
-        
-        playlist.append({
-            'id': internal.id,
-            'type': internal.content_type,
-            'url': f'/{internal.file_path}',
-            'duration': internal.duration_seconds or 10,
-            'priority': internal.priority,
-            'category': 'internal',
-            'name': internal.name
-        })
-    
-    fillers = Filler.query.filter_by(
-        screen_id=screen_id,
-        is_active=True
-    ).all()
-    
-    for filler in fillers:
-        playlist.append({
-            'id': filler.id,
-            'type': filler.content_type,
-            'url': f'/{filler.file_path}',
-            'duration': filler.duration_seconds or 10,
-            'priority': 20,
-            'category': 'filler'
-        })
-    
-    playlist.sort(key=lambda x: x['priority'], reverse=True)
-    
-    return playlist
+    document, _, _ = result
+    return document['playlist']
 
 
 def get_playlist_duration(playlist):
@@ -0,0 +1,408 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Per-screen precompiled playlist snapshots with event-driven invalidation
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from services.screen_events import ScreenEventBus, EVENT_PLAYLIST, EVENT_MODE, EVENT_BROADCAST
+from services.playlist_delta import share_unchanged_items, compute_delta
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on how long a snapshot may be served without a rebuild, even if
+# no change event was seen. Covers writes made by other gunicorn workers when
+# no Redis backplane relays their change events (see services.screen_events).
+SNAPSHOT_MAX_AGE = int(os.environ.get('PLAYLIST_SNAPSHOT_MAX_AGE', 60))
+
+# Fallback (error_recovered) playlists are retried quickly.
+SNAPSHOT_ERROR_MAX_AGE = 5
+
+# Number of past versions kept per screen to answer `since=` delta requests.
+# Older clients get a full resync.
+DELTA_HISTORY = int(os.environ.get('PLAYLIST_DELTA_HISTORY', 8))
+
+# Attributes whose changes never alter a compiled playlist. Heartbeats, play
+# counters and impression counters would otherwise invalidate on every call.
+IGNORED_ATTRIBUTES = {
+    'Screen': {'last_heartbeat', 'status'},
+    'Booking': {'plays_completed'},
+    'AdContent': {'total_impressions', 'total_duration_played', 'updated_at'},
+    'ScreenOverlay': {'current_passage_count', 'last_passage_reset', 'updated_at'},
+    'Broadcast': {'updated_at'},
+}
+
+# Models whose rows belong to exactly one screen (via screen_id).
+SCREEN_SCOPED_MODELS = {'Content', 'Booking', 'Filler', 'InternalContent', 'ScreenOverlay', 'TimePeriod'}
+
+# Models whose rows can affect any number of screens.
+GLOBAL_MODELS = {'Broadcast', 'AdContent', 'Organization'}
+
+# Screen attributes whose changes switch the player between playlist and IPTV.
+MODE_ATTRIBUTES = {'current_mode', 'iptv_enabled', 'current_iptv_channel', 'current_iptv_channel_name'}
+
+ALL_SCREENS = '*'
+
+
+class PlaylistSnapshot:
+    """A compiled playlist document for one screen, with its version."""
+
+    def __init__(self, screen_id, version, digest, data, expires_at, generation, valid_until=None):
+        self.screen_id = screen_id
+        self.version = version
+        self.digest = digest
+        self.data = data
+        self.built_at = time.time()
+        self.expires_at = expires_at
+        self.generation = generation
+        # Epoch time at which the content changes by itself (schedule boundary)
+        self.valid_until = valid_until
+
+    @property
+    def etag(self):
+        return f'v{self.version}'
+
+    def is_fresh(self, generation, now=None):
+        now = now if now is not None else time.time()
+        return self.generation == generation and now < self.expires_at
+
+
+class PlaylistSnapshotStore:
+    """
+    In-process store of compiled playlists, one per screen.
+
+    A snapshot is served until either a relevant row changes (SQLAlchemy
+    events bump the screen generation), its next time boundary passes
+    (booking start, ad end, period change...), or SNAPSHOT_MAX_AGE elapses.
+    The version is derived from the compiled content, so identical playlists
+    get the same version (and ETag) across rebuilds and on every worker.
+    """
+    _snapshots = {}
+    _history = {}
+    _generations = {}
+    _global_generation = 0
+    _lock = threading.Lock()
+    _build_locks = {}
+
+    @classmethod
+    def _generation(cls, screen_id):
+        return (cls._global_generation, cls._generations.get(screen_id, 0))
+
+    @staticmethod
+    def version_of(digest):
+        # 52 bits of the content digest: the same on every worker, and still
+        # an exact integer for JavaScript players
+        return int(digest[:13], 16)
+
+    @classmethod
+    def _get_build_lock(cls, screen_id):
+        with cls._lock:
+            if screen_id not in cls._build_locks:
+                cls._build_locks[screen_id] = threading.Lock()
+            return cls._build_locks[screen_id]
+
+    @classmethod
+    def peek(cls, screen_id):
+        """Return the current snapshot if it is still fresh, else None."""
+        with cls._lock:
+            snapshot = cls._snapshots.get(screen_id)
+            if snapshot and snapshot.is_fresh(cls._generation(screen_id)):
+                return snapshot
+        return None
+
+    @classmethod
+    def get(cls, screen_id, builder):
+        """
+        Return a fresh snapshot for a screen, rebuilding it if needed.
+
+        Args:
+            screen_id: The screen ID
+            builder: Callable(screen_id) -> (data, valid_until, recovered) or None
+                     when the screen does not exist. valid_until is a UTC
+                     datetime (or None) at which the content changes by itself.
+
+        Returns:
+            PlaylistSnapshot or None if the screen does not exist
+        """
+        snapshot = cls.peek(screen_id)
+        if snapshot:
+            return snapshot
+
+        # One build per screen at a time; concurrent pollers wait and reuse it.
+        with cls._get_build_lock(screen_id):
+            snapshot = cls.peek(screen_id)
+            if snapshot:
+                return snapshot
+            return cls._build(screen_id, builder)
+
+    @classmethod
+    def _build(cls, screen_id, builder):
+        with cls._lock:
+            generation = cls._generation(screen_id)
+
+        result = builder(screen_id)
+        if result is None:
+            cls.discard(screen_id)
+            return None
+
+        data, valid_until, recovered = result
+        content_str = json.dumps(data, sort_keys=True, default=str)
+        digest = hashlib.md5(content_str.encode('utf-8')).hexdigest()
+
+        now = time.time()
+        max_age = SNAPSHOT_ERROR_MAX_AGE if recovered else SNAPSHOT_MAX_AGE
+        expires_at = now + max_age
+        boundary = None
+        if valid_until is not None:
+            seconds_left = (valid_until - datetime.utcnow()).total_seconds()
+            boundary = now + max(seconds_left, 1)
+            expires_at = min(expires_at, boundary)
+
+        with cls._lock:
+            previous = cls._snapshots.get(screen_id)
+            if previous and previous.digest == digest:
+                version = previous.version
+                data = previous.data
+            else:
+                version = cls.version_of(digest)
+                share_unchanged_items(previous.data if previous else None, data)
+                history = cls._history.setdefault(screen_id, OrderedDict())
+                history[version] = data
+                history.move_to_end(version)
+                while len(history) > DELTA_HISTORY:
+                    history.popitem(last=False)
+            snapshot = PlaylistSnapshot(screen_id, version, digest, data, expires_at, generation, boundary)
+            cls._snapshots[screen_id] = snapshot
+        return snapshot
+
+    @classmethod
+    def get_version(cls, screen_id, version):
+        """Document of a past version still kept for deltas, or None."""
+        with cls._lock:
+            return cls._history.get(screen_id, {}).get(version)
+
+    @classmethod
+    def next_boundary(cls, screen_id):
+        """Epoch time of the current snapshot's next schedule boundary, or None."""
+        with cls._lock:
+            snapshot = cls._snapshots.get(screen_id)
+            return snapshot.valid_until if snapshot else None
+
+    @classmethod
+    def invalidate(cls, screen_id):
+        with cls._lock:
+            cls._generations[screen_id] = cls._generations.get(screen_id, 0) + 1
+
+    @classmethod
+    def invalidate_all(cls):
+        with cls._lock:
+            cls._global_generation += 1
+
+    @classmethod
+    def discard(cls, screen_id):
+        with cls._lock:
+            cls._snapshots.pop(screen_id, None)
+            cls._history.pop(screen_id, None)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._snapshots.clear()
+            cls._history.clear()
+            cls._generations.clear()
+            cls._build_locks.clear()
+            cls._global_generation += 1
+
+
+def build_playlist_body(snapshot, since=None):
+    """
+    Response body for a snapshot: a delta against version `since` when that
+    version is still known and the delta is smaller, otherwise the full document.
+    """
+    body = None
+    if since is not None:
+        base = PlaylistSnapshotStore.get_version(snapshot.screen_id, since)
+        if base is not None:
+            body = compute_delta(base, snapshot.data)
+            if body is not None:
+                body['base_version'] = since
+    if body is None:
+        body = dict(snapshot.data)
+    body['version'] = snapshot.version
+    return body
+
+
+def next_time_boundary(candidates, now=None):
+    """
+    Return the earliest candidate datetime strictly after now (UTC), or None.
+    None entries are ignored.
+    """
+    now = now or datetime.utcnow()
+    future = [c for c in candidates if c is not None and c > now]
+    return min(future) if future else None
+
+
+def next_period_boundary(time_periods, now_local=None):
+    """
+    Return the UTC datetime of the next hour at which a time period starts or
+    ends, based on local server time (as used for current period selection).
+    """
+    if not time_periods:
+        return None
+    now_local = now_local or datetime.now()
+    hours = set()
+    for period in time_periods:
+        if period.start_hour == period.end_hour:
+            continue
+        hours.add(period.start_hour % 24)
+        hours.add(period.end_hour % 24)
+    if not hours:
+        return None
+
+    candidates = []
+    base = now_local.replace(minute=0, second=0, microsecond=0)
+    for hour in hours:
+        candidate = base.replace(hour=hour)
+        if candidate <= now_local:
+            candidate += timedelta(days=1)
+        candidates.append(candidate)
+
+    local_boundary = min(candidates)
+    return datetime.utcnow() + (local_boundary - now_local)
+
+
+def day_start(d):
+    """Midnight (UTC) of a date, or None."""
+    return datetime.combine(d, datetime.min.time()) if d else None
+
+
+def day_after(d):
+    """Midnight (UTC) following an inclusive end date, or None."""
+    return datetime.combine(d, datetime.min.time()) + timedelta(days=1) if d else None
+
+
+def _changed_attributes(obj):
+    state = inspect(obj)
+    return {attr.key for attr in state.attrs if attr.history.has_changes()}
+
+
+def is_relevant_change(obj, model_name):
+    ignored = IGNORED_ATTRIBUTES.get(model_name)
+    if not ignored:
+        return True
+    changed = _changed_attributes(obj)
+    return bool(changed - ignored)
+
+
+def _collect_targets(session):
+    targets = session.info.setdefault('playlist_invalidations', set())
+    mode_changes = session.info.setdefault('screen_mode_changes', set())
+    overrides = session.info.setdefault('override_broadcasts', set())
+
+    for collection, check_history in (
+        (session.new, False),
+        (session.deleted, False),
+        (session.dirty, True),
+    ):
+        for obj in collection:
+            model_name = type(obj).__name__
+            if model_name not in SCREEN_SCOPED_MODELS and model_name not in GLOBAL_MODELS and model_name != 'Screen':
+                continue
+            if check_history and not is_relevant_change(obj, model_name):
+                continue
+
+            if model_name in GLOBAL_MODELS:
+                targets.add(ALL_SCREENS)
+                if model_name == 'Broadcast' and obj.override_playlist and obj.is_active and obj.id is not None:
+                    overrides.add(obj.id)
+            elif model_name == 'Screen':
+                if obj.id is not None:
+                    targets.add(obj.id)
+                    if check_history and _changed_attributes(obj) & MODE_ATTRIBUTES:
+                        mode_changes.add(obj.id)
+            elif getattr(obj, 'screen_id', None) is not None:
+                targets.add(obj.screen_id)
+
+
+def _on_after_flush(session, flush_context):
+    try:
+        _collect_targets(session)
+    except Exception as e:
+        # Never break a write because of cache bookkeeping; fall back to a full flush.
+        logger.error(f"Playlist snapshot invalidation tracking failed: {e}")
+        session.info.setdefault('playlist_invalidations', set()).add(ALL_SCREENS)
+
+
+def _on_after_commit(session):
+    targets = session.info.pop('playlist_invalidations', None)
+    mode_changes = session.info.pop('screen_mode_changes', None)
+    overrides = session.info.pop('override_broadcasts', None)
+    if not targets:
+        return
+    apply_invalidations(targets)
+    _publish_changes(targets, mode_changes or (), overrides or ())
+
+
+def _on_after_rollback(session):
+    session.info.pop('playlist_invalidations', None)
+    session.info.pop('screen_mode_changes', None)
+    session.info.pop('override_broadcasts', None)
+
+
+def _publish_changes(targets, mode_changes, overrides):
+    """Notify connected players (and, through the backplane, other workers)."""
+    try:
+        if ALL_SCREENS in targets:
+            ScreenEventBus.publish(ALL_SCREENS, EVENT_PLAYLIST)
+        else:
+            for screen_id in targets:
+                ScreenEventBus.publish(screen_id, EVENT_PLAYLIST)
+        for screen_id in mode_changes:
+            ScreenEventBus.publish(screen_id, EVENT_MODE)
+        for broadcast_id in overrides:
+            ScreenEventBus.publish(ALL_SCREENS, EVENT_BROADCAST, {'broadcast_id': broadcast_id})
+    except Exception as e:
+        logger.error(f"Playlist change notification failed: {e}")
+
+
+def _on_screen_event(screen_id, event_name, data, remote):
+    # Another worker committed a change: drop our copy of the snapshot too.
+    if remote and event_name == EVENT_PLAYLIST:
+        apply_invalidations({screen_id})
+
+
+def apply_invalidations(targets):
+    """Invalidate snapshots for a set of screen IDs (or ALL_SCREENS)."""
+    if ALL_SCREENS in targets:
+        PlaylistSnapshotStore.invalidate_all()
+        return
+    for screen_id in targets:
+        PlaylistSnapshotStore.invalidate(screen_id)
+
+
+_listeners_registered = False
+
+
+def register_snapshot_listeners():
+    """Attach the invalidation hooks to every SQLAlchemy session (idempotent)."""
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    event.listen(Session, 'after_flush', _on_after_flush)
+    event.listen(Session, 'after_commit', _on_after_commit)
+    event.listen(Session, 'after_rollback', _on_after_rollback)
+    ScreenEventBus.add_listener(_on_screen_event)
+    _listeners_registered = True
+    logger.info("Playlist snapshot invalidation listeners registered")
@@ -58,7 +58,9 @@ RATE_LIMITS = {
     "player": {
         "heartbeat": "300 per minute",
         "playlist": "300 per minute",
-        "log_play": "300 per minute"
+        "log_play": "300 per minute",
+        "log_plays": "60 per minute",
+        "events": "30 per minute"
     },
     "public": {
         "default": "30 per minute"
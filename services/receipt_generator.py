@@ -77,10 +77,13 @@ def _truncate(text, max_len):
 
 def generate_receipt_image(booking, screen, content, qr_base64=None):
     """Generate thermal-style receipt image matching the print design."""
+    return render_receipt_image(_get_receipt_data(booking, screen, content), qr_base64)
+
+
+def render_receipt_image(data, qr_base64=None):
+    """Draw the receipt image from _get_receipt_data() output (no database access)."""
     width = 400
     
-    data = _get_receipt_data(booking, screen, content)
-    
     font_title = _get_font(24, bold=True)
     font_subtitle = _get_font(14)
     font_section = _get_font(12, bold=True)
@@ -318,6 +321,11 @@ def generate_receipt_image(booking, screen, content, qr_base64=None):
 
 def generate_receipt_pdf(booking, screen, content, qr_base64=None):
     """Generate PDF receipt with thermal style design."""
+    return render_receipt_pdf(_get_receipt_data(booking, screen, content), qr_base64)
+
+
+def render_receipt_pdf(data, qr_base64=None):
+    """Draw the receipt PDF from _get_receipt_data() output (no database access)."""
     buffer = io.BytesIO()
     
     pdf_width = 200
@@ -325,8 +333,6 @@ def generate_receipt_pdf(booking, screen, content, qr_base64=None):
     
     c = canvas.Canvas(buffer, pagesize=(pdf_width, pdf_height))
     
-    data = _get_receipt_data(booking, screen, content)
-    
     y = pdf_height - 20
     
     c.setFont("Courier-Bold", 10)
@@ -470,6 +476,15 @@ def generate_receipt_pdf(booking, screen, content, qr_base64=None):
     return buffer
 
 
+def render_receipt_bytes(kind, data, qr_base64=None):
+    """PNG or PDF receipt as bytes; picklable entry point for render worker processes."""
+    if kind == 'pdf':
+        return render_receipt_pdf(data, qr_base64).getvalue()
+    buffer = io.BytesIO()
+    render_receipt_image(data, qr_base64).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
 def save_receipt_pdf(booking, screen, content, qr_base64=None):
     pdf_buffer = generate_receipt_pdf(booking, screen, content, qr_base64)
     
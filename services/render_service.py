@@ -0,0 +1,218 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Process-pool rendering of receipts with a content-addressed file cache
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Render processes. 0 renders inline in the calling worker (development, tests).
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+
+# Renders queued or running at once per web worker; callers past this wait up
+# to RENDER_QUEUE_TIMEOUT seconds for a slot, then get RenderBusyError.
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', max(RENDER_WORKERS, 1) * 4))
+RENDER_QUEUE_TIMEOUT = 10
+
+# Seconds a single render may take before its process pool is recycled.
+RENDER_TIMEOUT = int(os.environ.get('RENDER_TIMEOUT', 30))
+
+RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'adscreen_renders'))
+
+# Cached files unused for this many days are pruned.
+RENDER_CACHE_MAX_AGE_DAYS = int(os.environ.get('RENDER_CACHE_MAX_AGE_DAYS', 30))
+RENDER_CACHE_PRUNE_INTERVAL = 86400
+
+# Bump when the receipt layout changes, so cached renders are not reused.
+RENDER_VERSION = 1
+
+MIMETYPES = {'pdf': 'application/pdf', 'png': 'image/png'}
+
+
+class RenderBusyError(Exception):
+    """Render queue full."""
+
+
+class RenderTimeoutError(Exception):
+    """Render did not finish within RENDER_TIMEOUT."""
+
+
+def _render_job(kind, data, qr):
+    """Runs in a render process: QR code, then the receipt, as bytes."""
+    from services.receipt_generator import render_receipt_bytes
+
+    qr_base64 = None
+    if qr:
+        from services.qr_service import generate_qr_base64
+        url, box_size, border = qr
+        qr_base64 = generate_qr_base64(url, box_size=box_size, border=border)
+    return render_receipt_bytes(kind, data, qr_base64)
+
+
+class RenderService:
+    """
+    Renders receipts in a pool of processes so reportlab and Pillow never hold
+    a gevent worker, and keeps every render on disk under a hash of its
+    inputs: a repeat download is a file send. Renders are deterministic in
+    their inputs, so the cache needs no invalidation.
+    """
+    _pool = None
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(RENDER_QUEUE_SIZE)
+
+    @staticmethod
+    def cache_key(kind, data, qr=None):
+        payload = json.dumps([RENDER_VERSION, kind, data, qr], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def cache_path(key, kind):
+        return os.path.join(RENDER_CACHE_DIR, key[:2], f'{key}.{kind}')
+
+    @classmethod
+    def render(cls, kind, data, qr=None):
+        """
+        Path of the rendered file, rendering it on a cache miss.
+
+        Args:
+            kind: 'pdf' or 'png'
+            data: receipt data (receipt_generator._get_receipt_data output)
+            qr: optional (url, box_size, border) for the QR code
+        """
+        return cls.render_many([(kind, data, qr)])[0]
+
+    @classmethod
+    def render_many(cls, jobs):
+        """Paths for [(kind, data, qr)], cache misses rendered in parallel."""
+        paths = []
+        missing = {}
+        for kind, data, qr in jobs:
+            path = cls.cache_path(cls.cache_key(kind, data, qr), kind)
+            paths.append(path)
+            if os.path.exists(path):
+                os.utime(path)
+            elif path not in missing:
+                missing[path] = (kind, data, qr)
+
+        if missing:
+            if RENDER_WORKERS <= 0:
+                for path, job in missing.items():
+                    _write(path, _render_job(*job))
+            else:
+                cls._render_in_pool(missing)
+        return paths
+
+    @classmethod
+    def _render_in_pool(cls, missing):
+        items = list(missing.items())
+        for i in range(0, len(items), RENDER_QUEUE_SIZE):
+            cls._render_chunk(items[i:i + RENDER_QUEUE_SIZE])
+
+    @classmethod
+    def _render_chunk(cls, items):
+        acquired = 0
+        try:
+            for _ in items:
+                if not cls._slots.acquire(timeout=RENDER_QUEUE_TIMEOUT):
+                    raise RenderBusyError(f"Render queue full ({RENDER_QUEUE_SIZE})")
+                acquired += 1
+
+            pool = cls._get_pool()
+            futures = {path: pool.submit(_render_job, *job) for path, job in items}
+            rounds = -(-len(items) // RENDER_WORKERS)
+            deadline = time.monotonic() + RENDER_TIMEOUT * rounds
+            for path, future in futures.items():
+                try:
+                    content = future.result(timeout=max(deadline - time.monotonic(), 0))
+                except FutureTimeoutError:
+                    cls._recycle_pool(pool)
+                    raise RenderTimeoutError(f"Render exceeded {RENDER_TIMEOUT}s")
+                _write(path, content)
+        finally:
+            for _ in range(acquired):
+                cls._slots.release()
+
+    @classmethod
+    def _get_pool(cls):
+        with cls._lock:
+            if cls._pool is None:
+                # spawn: forking a gevent-patched worker is unsafe
+                cls._pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+            return cls._pool
+
+    @classmethod
+    def _recycle_pool(cls, pool):
+        """Drop a pool with a stuck render, killing its processes."""
+        with cls._lock:
+            if cls._pool is pool:
+                cls._pool = None
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.error("Render timed out, process pool recycled")
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            pool, cls._pool = cls._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def receipt_job(booking, kind, qr_url=None, box_size=10, border=4):
+    """Render job of a booking receipt; reads the database, so call it in the web worker."""
+    from services.receipt_generator import _get_receipt_data
+
+    data = _get_receipt_data(booking, booking.screen, booking.content)
+    # Render time, not shown on the receipt
+    data.pop('date_time', None)
+    return kind, data, ([qr_url, box_size, border] if qr_url else None)
+
+
+def receipt_file(booking, kind, qr_url=None, box_size=10, border=4):
+    """Path of a booking's rendered receipt ('pdf' or 'png')."""
+    return RenderService.render(*receipt_job(booking, kind, qr_url, box_size, border))
+
+
+def receipt_files(bookings, kind, qr_url_for=None):
+    """Paths of many receipts, rendered on all render processes (e.g. a month of bookings)."""
+    return RenderService.render_many([
+        receipt_job(booking, kind, qr_url_for(booking) if qr_url_for else None)
+        for booking in bookings
+    ])
+
+
+def prune_render_cache(max_age_days=None):
+    """Delete cached renders not used for max_age_days. Returns the number removed."""
+    cutoff = time.time() - (max_age_days or RENDER_CACHE_MAX_AGE_DAYS) * 86400
+    removed = 0
+    for root, _, files in os.walk(RENDER_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
@@ -0,0 +1,252 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : In-process periodic job scheduler with single-leader jobs
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from services.screen_events import ScreenEventBus, WORKERS
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, a single dev server process is the leader
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+
+# Seconds between scheduler wake-ups when no job is triggered.
+SCHEDULER_TICK = 1
+
+# Leadership lease for singleton jobs when a Redis backplane is available.
+LEADER_TTL = 30
+REDIS_LEADER_KEY = 'adscreen:scheduler:leader'
+
+# Without Redis, the worker holding this flock is the leader (same host only).
+LEADER_LOCK_FILE = os.environ.get('SCHEDULER_LOCK_FILE',
+                                  os.path.join(tempfile.gettempdir(), 'adscreen-scheduler.lock'))
+
+EVENT_RUN_JOB = 'run_job'
+
+
+class ScheduledJob:
+    """A function run every `interval` seconds inside an app context."""
+
+    def __init__(self, name, func, interval, singleton=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        # Singleton jobs run in one process of the fleet (the leader); the
+        # others (per-worker buffers, caches) run in every worker.
+        self.singleton = singleton
+        self.next_run = 0
+        self.last_run = None
+        self.last_error = None
+
+
+class Scheduler:
+    """
+    Background thread running registered jobs on their interval.
+
+    Started lazily on the first request so that, with gunicorn --preload,
+    each worker starts its own thread after the fork. Jobs can be triggered
+    early with request(); the request is relayed to every worker through the
+    screen event bus so that the leader picks it up.
+    """
+    _jobs = {}
+    _lock = threading.Lock()
+    _wakeup = threading.Event()
+    _thread = None
+    _app = None
+    # Leader lease value, created in start() so each forked worker has its own
+    _origin = None
+    _leader_file = None
+
+    @classmethod
+    def register(cls, name, func, interval, singleton=True):
+        with cls._lock:
+            cls._jobs[name] = ScheduledJob(name, func, interval, singleton)
+
+    @classmethod
+    def jobs(cls):
+        with cls._lock:
+            return list(cls._jobs.values())
+
+    @classmethod
+    def is_running(cls):
+        return cls._thread is not None
+
+    @classmethod
+    def trigger(cls, name):
+        """Run a job at the next wake-up of this process's scheduler."""
+        with cls._lock:
+            job = cls._jobs.get(name)
+            if job is None:
+                return False
+            job.next_run = 0
+        cls._wakeup.set()
+        return True
+
+    @classmethod
+    def request(cls, name):
+        """Ask whichever worker runs `name` to run it now."""
+        try:
+            ScreenEventBus.publish(WORKERS, EVENT_RUN_JOB, {'name': name})
+        except Exception as e:
+            logger.warning(f"Job request {name} failed: {e}")
+
+    @classmethod
+    def start(cls, app):
+        with cls._lock:
+            if cls._thread is not None:
+                return
+            cls._app = app
+            cls._origin = f'{uuid.uuid4().hex}-{os.getpid()}'
+            cls._thread = threading.Thread(target=cls._loop, daemon=True)
+        ScreenEventBus.add_listener(_on_screen_event)
+        cls._thread.start()
+        logger.info(f"Scheduler started with {len(cls._jobs)} job(s)")
+
+    @classmethod
+    def _loop(cls):
+        while True:
+            cls._wakeup.wait(SCHEDULER_TICK)
+            cls._wakeup.clear()
+            now = time.time()
+            for job in cls.jobs():
+                if job.next_run > now:
+                    continue
+                job.next_run = now + job.interval
+                if job.singleton and not cls.is_leader():
+                    continue
+                cls.run_job(job)
+
+    @classmethod
+    def run_now(cls, name):
+        """Run a job synchronously in the calling thread (e.g. at exit)."""
+        with cls._lock:
+            job = cls._jobs.get(name)
+        if job is None or cls._app is None:
+            return False
+        cls.run_job(job)
+        return True
+
+    @classmethod
+    def run_job(cls, job):
+        from app import db
+
+        started = time.time()
+        try:
+            with cls._app.app_context():
+                try:
+                    job.func()
+                    job.last_error = None
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            job.last_error = str(e)
+            logger.error(f"Scheduled job {job.name} failed: {e}")
+        job.last_run = started
+
+    @classmethod
+    def is_leader(cls):
+        """True if this process should run singleton jobs right now."""
+        redis_client = ScreenEventBus.backplane_client()
+        if redis_client is not None:
+            try:
+                if redis_client.set(REDIS_LEADER_KEY, cls._origin, nx=True, ex=LEADER_TTL):
+                    return True
+                holder = redis_client.get(REDIS_LEADER_KEY)
+                if holder is not None and holder.decode() == cls._origin:
+                    redis_client.expire(REDIS_LEADER_KEY, LEADER_TTL)
+                    return True
+                return False
+            except Exception as e:
+                logger.warning(f"Scheduler leader lease failed, using local lock: {e}")
+        return cls._holds_file_lock()
+
+    @classmethod
+    def _holds_file_lock(cls):
+        if cls._leader_file is not None:
+            return True
+        if fcntl is None:
+            return True
+        handle = open(LEADER_LOCK_FILE, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        # Kept open for the life of the process; the OS releases it on exit.
+        cls._leader_file = handle
+        logger.info("Scheduler leadership acquired (file lock)")
+        return True
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._jobs = {}
+
+
+def _on_screen_event(screen_id, event_name, data, remote):
+    if screen_id == WORKERS and event_name == EVENT_RUN_JOB:
+        Scheduler.trigger((data or {}).get('name'))
+
+
+def _register_jobs():
+    from services.overlay_service import reconcile_broadcast_overlays, OVERLAY_RECONCILE_INTERVAL
+    from services.status_sweeper import sweep_status_transitions, register_status_sweeper_listeners, SWEEP_RESOLUTION
+    from services.heartbeat_buffer import flush_heartbeats, HEARTBEAT_FLUSH_INTERVAL
+    from services.play_counters import reconcile_play_counters, PLAY_COUNTER_RECONCILE_INTERVAL
+    from services.impression_aggregator import flush_impressions, IMPRESSION_FLUSH_INTERVAL
+    from services.log_partitions import maintain_log_partitions, LOG_PARTITION_MAINTENANCE_INTERVAL
+    from services.uptime_service import compact_heartbeats, HEARTBEAT_COMPACTION_INTERVAL
+    from services.stat_rollups import refresh_stat_rollups, STAT_ROLLUP_INTERVAL
+    from services.dashboard_aggregates import refresh_dashboard_aggregates, DASHBOARD_DIRECTORY_TTL
+    from services.render_service import prune_render_cache, RENDER_CACHE_PRUNE_INTERVAL
+
+    Scheduler.register('reconcile_broadcast_overlays', reconcile_broadcast_overlays, OVERLAY_RECONCILE_INTERVAL)
+    Scheduler.register('sweep_status_transitions', sweep_status_transitions, SWEEP_RESOLUTION)
+    Scheduler.register('flush_heartbeats', flush_heartbeats, HEARTBEAT_FLUSH_INTERVAL, singleton=False)
+    Scheduler.register('reconcile_play_counters', reconcile_play_counters, PLAY_COUNTER_RECONCILE_INTERVAL)
+    Scheduler.register('flush_impressions', flush_impressions, IMPRESSION_FLUSH_INTERVAL, singleton=False)
+    Scheduler.register('maintain_log_partitions', maintain_log_partitions, LOG_PARTITION_MAINTENANCE_INTERVAL)
+    Scheduler.register('compact_heartbeats', compact_heartbeats, HEARTBEAT_COMPACTION_INTERVAL)
+    Scheduler.register('refresh_stat_rollups', refresh_stat_rollups, STAT_ROLLUP_INTERVAL)
+    Scheduler.register('refresh_dashboard_aggregates', refresh_dashboard_aggregates, DASHBOARD_DIRECTORY_TTL,
+                       singleton=False)
+    Scheduler.register('prune_render_cache', prune_render_cache, RENDER_CACHE_PRUNE_INTERVAL, singleton=False)
+    register_status_sweeper_listeners()
+
+
+def _uses_memory_database(app):
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    return uri.startswith('sqlite') and ':memory:' in uri
+
+
+def init_scheduler(app):
+    """
+    Register background jobs and start the scheduler on the first request.
+
+    Disabled with SCHEDULER_ENABLED=false, under TESTING, and on in-memory
+    SQLite databases (a background thread would not see the same database).
+    """
+    if not SCHEDULER_ENABLED:
+        logger.info("Scheduler disabled (SCHEDULER_ENABLED=false)")
+        return
+
+    _register_jobs()
+
+    @app.before_request
+    def _start_scheduler():
+        if Scheduler.is_running() or app.config.get('TESTING') or _uses_memory_database(app):
+            return
+        Scheduler.start(app)
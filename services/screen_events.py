@@ -0,0 +1,289 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Per-screen push events (local pub/sub bus, optional Redis backplane, SSE stream)
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+EVENT_PLAYLIST = 'playlist'
+EVENT_MODE = 'mode'
+EVENT_BROADCAST = 'broadcast'
+
+ALL_SCREENS = '*'
+
+# Target for events meant for worker-side listeners only (cache maintenance);
+# no SSE client ever subscribes to it.
+WORKERS = '#workers'
+
+# Seconds between keep-alive comments; also how fast dead clients are detected.
+SSE_KEEPALIVE = int(os.environ.get('SSE_KEEPALIVE', 15))
+
+# Streams are recycled after this many seconds; EventSource reconnects by itself.
+SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', 1800))
+
+# Reconnection delay suggested to clients (milliseconds).
+SSE_RETRY_MS = 5000
+
+SUBSCRIPTION_QUEUE_SIZE = 32
+
+REDIS_CHANNEL = 'adscreen:screen-events'
+
+
+class ScreenSubscription:
+    """Queue of pending events for one connected client."""
+
+    def __init__(self, screen_id):
+        self.screen_id = screen_id
+        self._queue = queue.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+
+    def push(self, event, data):
+        try:
+            self._queue.put_nowait((event, data))
+        except queue.Full:
+            pass  # Client is lagging; any later event makes it refetch everything anyway
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ScreenEventBus:
+    """
+    In-process publish/subscribe bus keyed by screen ID.
+
+    Events published in one worker are delivered to that worker's SSE clients
+    and, when a Redis backplane is started, relayed to every other worker.
+    Listeners registered with add_listener() see both local and relayed events
+    (e.g. to drop per-worker caches when another worker changed a screen).
+
+    The origin ID and the backplane belong to a process: they are created on
+    its first use of the bus, so with gunicorn --preload every forked worker
+    gets its own ID and its own listener thread.
+    """
+    _subscribers = {}
+    _listeners = []
+    _lock = threading.Lock()
+    _pid = None
+    _origin = None
+    _redis_url = None
+    _redis = None
+    _backplane_thread = None
+
+    @classmethod
+    def origin(cls):
+        """ID of this process on the backplane."""
+        cls._ensure_started()
+        return cls._origin
+
+    @classmethod
+    def _ensure_started(cls):
+        """Create the origin and start the backplane, once per process (and after a fork)."""
+        pid = os.getpid()
+        if cls._pid == pid:
+            return
+        with cls._lock:
+            if cls._pid == pid:
+                return
+            # Forked child: the parent's origin and listener thread are not ours
+            cls._origin = f'{uuid.uuid4().hex}-{pid}'
+            cls._redis = None
+            cls._backplane_thread = None
+            cls._pid = pid
+        if cls._redis_url:
+            cls._start_backplane()
+
+    @classmethod
+    def subscribe(cls, screen_id):
+        cls._ensure_started()
+        subscription = ScreenSubscription(screen_id)
+        with cls._lock:
+            cls._subscribers.setdefault(screen_id, set()).add(subscription)
+        return subscription
+
+    @classmethod
+    def unsubscribe(cls, subscription):
+        with cls._lock:
+            subscribers = cls._subscribers.get(subscription.screen_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    cls._subscribers.pop(subscription.screen_id, None)
+
+    @classmethod
+    def subscriber_count(cls, screen_id=None):
+        with cls._lock:
+            if screen_id is not None:
+                return len(cls._subscribers.get(screen_id, ()))
+            return sum(len(s) for s in cls._subscribers.values())
+
+    @classmethod
+    def add_listener(cls, callback):
+        """Register callback(screen_id, event, data, remote) (idempotent)."""
+        with cls._lock:
+            if callback not in cls._listeners:
+                cls._listeners.append(callback)
+
+    @classmethod
+    def publish(cls, screen_id, event, data=None):
+        """Publish an event for one screen, or for every screen with ALL_SCREENS."""
+        cls._ensure_started()
+        cls._dispatch(screen_id, event, data, remote=False)
+        if cls._redis is not None:
+            try:
+                cls._redis.publish(REDIS_CHANNEL, json.dumps({
+                    'origin': cls._origin,
+                    'screen_id': screen_id,
+                    'event': event,
+                    'data': data
+                }))
+            except Exception as e:
+                logger.warning(f"Screen event relay failed: {e}")
+
+    @classmethod
+    def _dispatch(cls, screen_id, event, data, remote):
+        with cls._lock:
+            if screen_id == ALL_SCREENS:
+                subscriptions = [s for subs in cls._subscribers.values() for s in subs]
+            else:
+                subscriptions = list(cls._subscribers.get(screen_id, ()))
+            listeners = list(cls._listeners)
+
+        for subscription in subscriptions:
+            subscription.push(event, data)
+
+        for listener in listeners:
+            try:
+                listener(screen_id, event, data, remote)
+            except Exception as e:
+                logger.error(f"Screen event listener failed: {e}")
+
+    @classmethod
+    def configure_backplane(cls, redis_url):
+        """Relay events between workers through Redis pub/sub, from each process's first use of the bus."""
+        cls._redis_url = redis_url
+
+    @classmethod
+    def _start_backplane(cls):
+        """Connect this process to the backplane. Returns True if started."""
+        if cls._backplane_thread is not None:
+            return True
+        try:
+            import redis as redis_lib
+            client = redis_lib.from_url(cls._redis_url, socket_connect_timeout=2)
+            client.ping()
+        except Exception as e:
+            logger.warning(f"Redis unavailable, screen events stay local to this worker: {e}")
+            return False
+
+        cls._redis = client
+        cls._backplane_thread = threading.Thread(target=cls._listen, args=(client,), daemon=True)
+        cls._backplane_thread.start()
+        logger.info("Screen events using Redis backplane")
+        return True
+
+    @classmethod
+    def backplane_client(cls):
+        """Redis client of the backplane, or None when events stay local."""
+        cls._ensure_started()
+        return cls._redis
+
+    @classmethod
+    def _listen(cls, client):
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REDIS_CHANNEL)
+                for message in pubsub.listen():
+                    cls._handle_relayed(message.get('data'))
+            except Exception as e:
+                logger.warning(f"Screen event backplane disconnected, retrying: {e}")
+                time.sleep(5)
+
+    @classmethod
+    def _handle_relayed(cls, raw):
+        try:
+            payload = json.loads(raw)
+        except (TypeError, ValueError):
+            return
+        if payload.get('origin') == cls._origin:
+            return
+        cls._dispatch(payload.get('screen_id'), payload.get('event'), payload.get('data'), remote=True)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._subscribers.clear()
+
+
+def init_screen_events(app):
+    """
+    Use the Redis backplane when REDIS_URL is configured.
+
+    Nothing is started at import: each worker connects on its first request
+    (or first use of the bus), after gunicorn --preload has forked it.
+    """
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        ScreenEventBus.configure_backplane(redis_url)
+
+    @app.before_request
+    def _start_screen_events():
+        ScreenEventBus._ensure_started()
+
+
+def format_event(event, data=None):
+    return f"event: {event}\ndata: {json.dumps(data or {})}\n\n"
+
+
+def event_stream(screen_id, next_boundary=None):
+    """
+    Generate a Server-Sent Events stream for one screen.
+
+    Args:
+        screen_id: The screen ID
+        next_boundary: Optional callable returning the epoch time at which the
+                       screen's playlist changes by itself (schedule start/end),
+                       so a 'playlist' event can be sent without any write.
+
+    The generator never touches the database: it only waits on its
+    subscription queue, which gevent turns into a cooperative wait.
+    """
+    subscription = ScreenEventBus.subscribe(screen_id)
+    started = time.time()
+    notified_boundary = None
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        yield format_event('ready', {'screen_id': screen_id})
+
+        while time.time() - started < SSE_MAX_DURATION:
+            timeout = SSE_KEEPALIVE
+            boundary = next_boundary() if next_boundary else None
+            if boundary is not None and boundary != notified_boundary:
+                wait = boundary - time.time()
+                if wait <= 0:
+                    notified_boundary = boundary
+                    yield format_event(EVENT_PLAYLIST, {'reason': 'schedule'})
+                    continue
+                timeout = min(timeout, wait)
+
+            item = subscription.get(timeout)
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+
+            event, data = item
+            yield format_event(event, data)
+    finally:
+        ScreenEventBus.unsubscribe(subscription)
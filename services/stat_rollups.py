@@ -0,0 +1,189 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Incremental daily rollups of stat_logs for the statistics pages
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import func, select, union_all
+
+from app import db
+from models import StatLog, StatLogDaily, AggregationWatermark
+
+logger = logging.getLogger(__name__)
+
+# Seconds between rollup runs. A stat_logs row is rolled up one to two runs
+# after it is written; until then readers count it from the raw table.
+STAT_ROLLUP_INTERVAL = int(os.environ.get('STAT_ROLLUP_INTERVAL', 60))
+
+# stat_logs ids rolled up per transaction.
+STAT_ROLLUP_BATCH = 50000
+
+WATERMARK = 'stat_log_rollup'
+
+# Rollup column and the matching expression over the raw log, per key.
+ROLLUP_KEYS = {
+    'screen_id': (StatLogDaily.screen_id, StatLog.screen_id),
+    'date': (StatLogDaily.date, func.date(StatLog.played_at)),
+    'category': (StatLogDaily.category, func.coalesce(StatLog.content_category, '')),
+    'content_id': (StatLogDaily.content_id, func.coalesce(StatLog.content_id, 0)),
+}
+
+
+class StatRollup:
+    """
+    Rolls stat_logs up into stat_log_daily, following the id sequence.
+
+    Each run consumes ids up to the highest id seen by the previous run, so
+    transactions that had taken an id then have committed; the counts and
+    the watermark are written in the same transaction. Readers (play_counts)
+    add the rows past the watermark from the raw log, so results are exact
+    whether or not the job has caught up.
+    """
+    _cap = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def refresh(cls):
+        """Roll up settled stat_logs rows. Returns the number of rows consumed."""
+        with cls._lock:
+            cap, cls._cap = cls._cap, db.session.query(func.max(StatLog.id)).scalar() or 0
+            if cap is None:
+                return 0
+
+            last_id = AggregationWatermark.get_last_id(WATERMARK)
+            consumed = 0
+            while last_id < cap:
+                upper = min(last_id + STAT_ROLLUP_BATCH, cap)
+                try:
+                    rows = _raw_counts(tuple(ROLLUP_KEYS), StatLog.id > last_id, StatLog.id <= upper)
+                    StatLogDaily.add_plays(rows)
+                    AggregationWatermark.advance(WATERMARK, last_id=upper)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Stat rollup failed after id {last_id}: {e}")
+                    break
+                consumed += sum(plays for plays, _ in rows.values())
+                last_id = upper
+            return consumed
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._cap = None
+
+
+def play_counts(keys, screen_ids, start=None):
+    """
+    Plays of some screens grouped by rollup keys, rollups plus raw tail.
+
+    The rollups, the watermark and the raw rows past it are read by one
+    statement, so a refresh committing meanwhile cannot leave rows counted
+    in neither part (or in both).
+
+    Args:
+        keys: subset of ROLLUP_KEYS, in the order of the returned key tuples
+        screen_ids: screens to count
+        start: midnight of the first day to count, or None for all history
+
+    Returns:
+        dict: {key tuple: (plays, total_duration)}; NULL categories and
+        content ids are returned as None
+    """
+    screen_ids = list(screen_ids)
+    if not screen_ids:
+        return {}
+
+    columns = [ROLLUP_KEYS[key][0] for key in keys]
+    rolled = select(
+        *columns, func.sum(StatLogDaily.plays), func.sum(StatLogDaily.total_duration)
+    ).where(StatLogDaily.screen_id.in_(screen_ids))
+    if start is not None:
+        rolled = rolled.where(StatLogDaily.date >= start.date())
+    rolled = rolled.group_by(*columns)
+
+    watermark = select(func.coalesce(func.max(AggregationWatermark.last_id), 0)).where(
+        AggregationWatermark.name == WATERMARK
+    ).scalar_subquery()
+    filters = [StatLog.screen_id.in_(screen_ids), StatLog.id > watermark]
+    if start is not None:
+        filters.append(StatLog.played_at >= start)
+
+    # Each part has at most one row per group; _merge adds them up
+    counts = {}
+    _merge(counts, keys, db.session.execute(union_all(rolled, _raw_select(keys, *filters))).all())
+
+    return {
+        tuple(_output(key, value) for key, value in zip(keys, group)): totals
+        for group, totals in counts.items()
+    }
+
+
+def total_plays(screen_ids, start=None):
+    return sum(plays for plays, _ in play_counts((), screen_ids, start).values())
+
+
+def daily_and_category_plays(screen_ids, start):
+    """Returns ([(date, plays)] sorted by date, [(category, plays)])."""
+    daily, categories = {}, {}
+    for (day, category), (plays, _) in play_counts(('date', 'category'), screen_ids, start).items():
+        daily[day] = daily.get(day, 0) + plays
+        categories[category] = categories.get(category, 0) + plays
+    return sorted(daily.items()), list(categories.items())
+
+
+def _raw_select(keys, *filters):
+    expressions = [ROLLUP_KEYS[key][1] for key in keys]
+    return select(
+        *expressions, func.count(StatLog.id), func.sum(func.coalesce(StatLog.duration_seconds, 0))
+    ).where(*filters).group_by(*expressions)
+
+
+def _raw_counts(keys, *filters):
+    counts = {}
+    _merge(counts, keys, db.session.execute(_raw_select(keys, *filters)).all())
+    return counts
+
+
+def _merge(counts, keys, rows):
+    for row in rows:
+        plays, duration = row[-2], row[-1]
+        if not plays:
+            continue
+        group = tuple(_normalize(key, value) for key, value in zip(keys, row[:-2]))
+        current = counts.get(group, (0, 0.0))
+        counts[group] = (current[0] + int(plays), current[1] + float(duration or 0))
+
+
+def _normalize(key, value):
+    # SQLite returns DATE() as text
+    if key == 'date' and isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+def _output(key, value):
+    if key in ('category', 'content_id') and not value:
+        return None
+    return value
+
+
+def rollup_horizon():
+    """stat_logs played at or after this time are not all rolled up yet and must be kept."""
+    # Plays can be backdated, so this is the oldest played_at past the id watermark
+    oldest = db.session.query(func.min(StatLog.played_at)).filter(
+        StatLog.id > AggregationWatermark.get_last_id(WATERMARK)
+    ).scalar()
+    if isinstance(oldest, str):
+        oldest = datetime.fromisoformat(oldest)
+    return oldest or datetime.max
+
+
+def refresh_stat_rollups():
+    StatRollup.refresh()
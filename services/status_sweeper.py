@@ -0,0 +1,229 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Timing-wheel sweeper applying AdContent/Broadcast schedule transitions
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, or_, select, update
+
+from app import db
+from models.ad_content import AdContent
+from models.broadcast import Broadcast
+from services.ad_targeting_index import AdTargetingIndex, EVENT_AD_INDEX
+from services.screen_events import ScreenEventBus, WORKERS, ALL_SCREENS, EVENT_PLAYLIST
+
+logger = logging.getLogger(__name__)
+
+# Boundaries further away than this are loaded on a later reload.
+SWEEP_HORIZON = int(os.environ.get('STATUS_SWEEP_HORIZON', 900))
+
+# Wheel slot width in seconds: transitions apply at most this late.
+SWEEP_RESOLUTION = 1
+
+BOUNDARY_AD = 'ad'
+BOUNDARY_BROADCAST = 'broadcast'
+
+# Statuses update_status() never changes
+FROZEN_STATUSES = (AdContent.STATUS_PAUSED, AdContent.STATUS_CANCELLED)
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel: boundaries are bucketed into slots of `resolution`
+    seconds, and only slots that hold something are tracked (min-heap of slot
+    numbers), so advancing the wheel is O(1) when nothing is due.
+    """
+
+    def __init__(self, resolution=SWEEP_RESOLUTION):
+        self.resolution = resolution
+        self._slots = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self._slots)
+
+    def schedule(self, when, kind):
+        """
+        Schedule `kind` at epoch time `when`. Callers add one resolution to
+        boundaries that must have strictly passed (end dates are inclusive).
+        """
+        slot = int(when // self.resolution)
+        kinds = self._slots.get(slot)
+        if kinds is None:
+            kinds = self._slots[slot] = set()
+            heapq.heappush(self._heap, slot)
+        kinds.add(kind)
+
+    def pop_due(self, now):
+        """Remove and return the kinds of every slot at or before `now`."""
+        due = set()
+        current = int(now // self.resolution)
+        while self._heap and self._heap[0] <= current:
+            due |= self._slots.pop(heapq.heappop(self._heap))
+        return due
+
+    def next_due(self):
+        return self._heap[0] * self.resolution if self._heap else None
+
+    def clear(self):
+        self._slots = {}
+        self._heap = []
+
+
+def _ad_target_status():
+    """SQL mirror of AdContent.update_status() for period ads."""
+    now = datetime.utcnow()
+    return case(
+        (and_(AdContent.end_date != None, AdContent.end_date < now), AdContent.STATUS_EXPIRED),
+        (and_(AdContent.start_date != None, AdContent.start_date <= now), AdContent.STATUS_ACTIVE),
+        (AdContent.start_date != None, AdContent.STATUS_SCHEDULED),
+        else_=AdContent.status
+    )
+
+
+def apply_ad_status_transitions():
+    """
+    Apply every due scheduled/active/expired transition with one UPDATE.
+
+    Returns:
+        list: IDs of the ads whose status changed
+    """
+    target_status = _ad_target_status()
+    due = and_(
+        AdContent.schedule_type == AdContent.SCHEDULE_PERIOD,
+        AdContent.status.notin_(FROZEN_STATUSES),
+        AdContent.status != target_status
+    )
+
+    ad_ids = db.session.execute(select(AdContent.id).where(due)).scalars().all()
+    if not ad_ids:
+        return []
+
+    db.session.execute(
+        update(AdContent).where(AdContent.id.in_(ad_ids), due).values(status=target_status),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+
+    # Core UPDATE bypasses the ORM hooks: refresh the targeting index here.
+    AdTargetingIndex.mark_dirty(ad_ids)
+    ScreenEventBus.publish(WORKERS, EVENT_AD_INDEX, {'ad_ids': sorted(ad_ids), 'reason': 'status'})
+    logger.info(f"Ad status transitions applied: {len(ad_ids)} ad(s)")
+    return ad_ids
+
+
+class StatusSweeper:
+    """
+    Applies schedule transitions at the moment they occur.
+
+    Upcoming AdContent start_date/end_date and Broadcast start/end datetimes
+    within SWEEP_HORIZON are loaded into a timing wheel; the scheduler ticks
+    it every second, which costs no query until a boundary is due. A due ad
+    boundary runs apply_ad_status_transitions(); a due broadcast boundary runs
+    the overlay reconciler. The wheel is reloaded when the horizon is reached
+    or when ads/broadcasts change.
+    """
+    _wheel = TimingWheel()
+    _loaded_until = None
+    _reload = True
+    _lock = threading.Lock()
+
+    @classmethod
+    def mark_reload(cls):
+        with cls._lock:
+            cls._reload = True
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._wheel.clear()
+            cls._loaded_until = None
+            cls._reload = True
+
+    @classmethod
+    def tick(cls, now=None):
+        """Scheduler job: apply due transitions. Returns the boundary kinds handled."""
+        now = now if now is not None else time.time()
+
+        with cls._lock:
+            reload = cls._reload or cls._loaded_until is None or now >= cls._loaded_until
+            cls._reload = False
+
+        if reload:
+            cls._load(now)
+            # Catch up on anything missed while the wheel was not loaded
+            due = {BOUNDARY_AD, BOUNDARY_BROADCAST}
+        else:
+            with cls._lock:
+                due = cls._wheel.pop_due(now)
+
+        if BOUNDARY_AD in due:
+            apply_ad_status_transitions()
+        if BOUNDARY_BROADCAST in due:
+            from services.scheduler import Scheduler
+            from services.overlay_service import reconcile_broadcast_overlays
+            if not (Scheduler.is_running() and Scheduler.trigger('reconcile_broadcast_overlays')):
+                reconcile_broadcast_overlays()
+        return due
+
+    @classmethod
+    def _load(cls, now):
+        start = datetime.utcfromtimestamp(now)
+        end = start + timedelta(seconds=SWEEP_HORIZON)
+
+        wheel = TimingWheel()
+        for column in (AdContent.start_date, AdContent.end_date):
+            rows = db.session.query(column).filter(
+                AdContent.schedule_type == AdContent.SCHEDULE_PERIOD,
+                AdContent.status.notin_(FROZEN_STATUSES),
+                column > start,
+                column <= end
+            ).distinct()
+            for (boundary,) in rows:
+                wheel.schedule(_epoch(boundary) + SWEEP_RESOLUTION, BOUNDARY_AD)
+
+        rows = db.session.query(Broadcast.start_datetime, Broadcast.end_datetime).filter(
+            Broadcast.is_active == True,
+            or_(
+                and_(Broadcast.start_datetime > start, Broadcast.start_datetime <= end),
+                and_(Broadcast.end_datetime > start, Broadcast.end_datetime <= end)
+            )
+        )
+        for boundaries in rows:
+            for boundary in boundaries:
+                if boundary and start < boundary <= end:
+                    wheel.schedule(_epoch(boundary) + SWEEP_RESOLUTION, BOUNDARY_BROADCAST)
+
+        with cls._lock:
+            cls._wheel = wheel
+            cls._loaded_until = now + SWEEP_HORIZON
+        logger.debug(f"Status sweeper loaded {len(wheel)} boundary slot(s)")
+
+
+def _epoch(naive_utc):
+    return (naive_utc - datetime(1970, 1, 1)).total_seconds()
+
+
+def _on_screen_event(screen_id, event_name, data, remote):
+    if screen_id == WORKERS and event_name == EVENT_AD_INDEX:
+        if (data or {}).get('reason') != 'status':
+            StatusSweeper.mark_reload()
+    elif screen_id == ALL_SCREENS and event_name == EVENT_PLAYLIST:
+        # Broadcast, ad or organization change somewhere in the fleet
+        StatusSweeper.mark_reload()
+
+
+def sweep_status_transitions():
+    StatusSweeper.tick()
+
+
+def register_status_sweeper_listeners():
+    ScreenEventBus.add_listener(_on_screen_event)
@@ -0,0 +1,242 @@
+"""
+ * Nom de l'application : Shabaka AdScreen
+ * Description : Heartbeat compaction into status intervals and screen uptime reports
+ * Produit de : MOA Digital Agency, www.myoneart.com
+ * Fait par : Aisance KALONJI, www.aisancekalonji.com
+ * Auditer par : La CyberConfiance, www.cyberconfiance.com
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, tuple_
+
+from app import db
+from models import HeartbeatLog, ScreenStatusInterval, AggregationWatermark
+
+logger = logging.getLogger(__name__)
+
+# Seconds between compaction runs.
+HEARTBEAT_COMPACTION_INTERVAL = int(os.environ.get('HEARTBEAT_COMPACTION_INTERVAL', 60))
+
+# Beats younger than this may still sit in a worker's HeartbeatBuffer.
+HEARTBEAT_COMPACTION_LAG = timedelta(seconds=int(os.environ.get('HEARTBEAT_COMPACTION_LAG', 120)))
+
+# A screen that has not beaten for longer than this was down (screens beat every 30s).
+HEARTBEAT_GAP = timedelta(seconds=int(os.environ.get('HEARTBEAT_GAP_SECONDS', 90)))
+
+# Beats read per query while compacting.
+HEARTBEAT_COMPACTION_BATCH = 20000
+
+# Beat statuses that do not count as available.
+DOWN_STATUSES = {'offline'}
+
+WATERMARK = 'heartbeat_compaction'
+
+
+def fold_beat(current, screen_id, status, timestamp):
+    """
+    Apply one beat to the screen's latest interval.
+
+    A beat within HEARTBEAT_GAP of the interval extends it; a different
+    status closes it at the beat and starts a new interval there, so
+    intervals stay contiguous while the screen keeps beating. Beats not after
+    the interval's end were already folded, which makes replays harmless.
+
+    Returns:
+        ScreenStatusInterval: the screen's latest interval (new and unsaved
+        if this beat started one)
+    """
+    if current is not None and timestamp <= current.ended_at:
+        return current
+    if current is not None and timestamp - current.ended_at <= HEARTBEAT_GAP:
+        current.ended_at = timestamp
+        if current.status == status:
+            current.beats = (current.beats or 0) + 1
+            return current
+    return ScreenStatusInterval(screen_id=screen_id, status=status, started_at=timestamp,
+                                ended_at=timestamp, beats=1)
+
+
+def compact_heartbeats(now=None):
+    """
+    Fold heartbeats newer than the watermark into screen_status_intervals.
+
+    Returns:
+        int: number of beats read
+    """
+    now = now or datetime.utcnow()
+    upto = now - HEARTBEAT_COMPACTION_LAG
+    since = AggregationWatermark.get(WATERMARK)
+
+    latest = {}
+    read = 0
+    after = None
+    try:
+        while True:
+            query = db.session.query(
+                HeartbeatLog.screen_id, HeartbeatLog.status, HeartbeatLog.timestamp, HeartbeatLog.id
+            ).filter(HeartbeatLog.timestamp <= upto)
+            if since is not None:
+                query = query.filter(HeartbeatLog.timestamp > since)
+            if after is not None:
+                query = query.filter(tuple_(HeartbeatLog.timestamp, HeartbeatLog.id) > after)
+            beats = query.order_by(HeartbeatLog.timestamp, HeartbeatLog.id).limit(HEARTBEAT_COMPACTION_BATCH).all()
+            if not beats:
+                break
+
+            missing = {beat.screen_id for beat in beats} - set(latest)
+            latest.update(_latest_intervals(missing))
+            for beat in beats:
+                current = latest.get(beat.screen_id)
+                folded = fold_beat(current, beat.screen_id, beat.status, beat.timestamp)
+                if folded is not current:
+                    db.session.add(folded)
+                    latest[beat.screen_id] = folded
+            db.session.commit()
+
+            read += len(beats)
+            after = (beats[-1].timestamp, beats[-1].id)
+            if len(beats) < HEARTBEAT_COMPACTION_BATCH:
+                break
+
+        AggregationWatermark.advance(WATERMARK, upto)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Heartbeat compaction failed after {read} beat(s): {e}")
+        return read
+
+    if read:
+        logger.info(f"Compacted {read} heartbeat(s) of {len(latest)} screen(s)")
+    return read
+
+
+def _latest_intervals(screen_ids):
+    if not screen_ids:
+        return {}
+    newest = db.session.query(func.max(ScreenStatusInterval.id)).filter(
+        ScreenStatusInterval.screen_id.in_(screen_ids)
+    ).group_by(ScreenStatusInterval.screen_id)
+    intervals = ScreenStatusInterval.query.filter(ScreenStatusInterval.id.in_(newest)).all()
+    return {interval.screen_id: interval for interval in intervals}
+
+
+def compaction_horizon():
+    """Heartbeats at or after this time are not compacted yet and must be kept."""
+    return AggregationWatermark.get(WATERMARK) or datetime.min
+
+
+def screen_intervals(screen_id, start, end):
+    """
+    Status intervals of a screen overlapping [start, end), compacted ones
+    plus the not yet compacted beats folded in memory.
+    """
+    intervals = ScreenStatusInterval.query.filter(
+        ScreenStatusInterval.screen_id == screen_id,
+        ScreenStatusInterval.ended_at >= start - HEARTBEAT_GAP,
+        ScreenStatusInterval.started_at < end
+    ).order_by(ScreenStatusInterval.started_at).all()
+    # Detached copies: folding the tail must not touch the stored rows
+    intervals = [ScreenStatusInterval(screen_id=i.screen_id, status=i.status, started_at=i.started_at,
+                                      ended_at=i.ended_at, beats=i.beats) for i in intervals]
+
+    since = AggregationWatermark.get(WATERMARK)
+    tail = db.session.query(HeartbeatLog.status, HeartbeatLog.timestamp).filter(
+        HeartbeatLog.screen_id == screen_id,
+        HeartbeatLog.timestamp >= max(since or datetime.min, start - HEARTBEAT_GAP),
+        HeartbeatLog.timestamp < end
+    ).order_by(HeartbeatLog.timestamp, HeartbeatLog.id).all()
+
+    current = intervals[-1] if intervals else None
+    for status, timestamp in tail:
+        folded = fold_beat(current, screen_id, status, timestamp)
+        if folded is not current:
+            intervals.append(folded)
+            current = folded
+    return intervals
+
+
+def screen_uptime(screen, start, end, period='day', now=None):
+    """
+    Availability of a screen per day or week (Monday-based) and its outages.
+
+    A screen is available while it beats with a status outside DOWN_STATUSES.
+    Time before the screen was created or after now is not counted; the last
+    interval counts up to now until its next beat is overdue.
+    """
+    now = now or datetime.utcnow()
+    end = min(end, now)
+    if screen.created_at:
+        start = max(start, screen.created_at)
+
+    up = []
+    for interval in screen_intervals(screen.id, start, end):
+        if interval.status in DOWN_STATUSES:
+            continue
+        interval_end = interval.ended_at
+        if now - interval_end <= HEARTBEAT_GAP:
+            interval_end = now
+        if up and interval.started_at <= up[-1][1]:
+            up[-1][1] = max(up[-1][1], interval_end)
+        else:
+            up.append([interval.started_at, interval_end])
+
+    buckets = []
+    bucket_start = _bucket_start(start, period)
+    while bucket_start < end:
+        bucket_end = bucket_start + timedelta(days=7 if period == 'week' else 1)
+        span_start, span_end = max(bucket_start, start), min(bucket_end, end)
+        buckets.append({
+            'start': bucket_start.isoformat(),
+            'end': bucket_end.isoformat(),
+            'availability': _availability(up, span_start, span_end),
+        })
+        bucket_start = bucket_end
+
+    return {
+        'screen_id': screen.id,
+        'period': period,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'availability': _availability(up, start, end),
+        'buckets': buckets,
+        'outages': _outages(up, start, end),
+    }
+
+
+def _bucket_start(moment, period):
+    day = datetime(moment.year, moment.month, moment.day)
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def _availability(up, start, end):
+    """Percentage of [start, end) covered by up intervals, None for an empty span."""
+    span = (end - start).total_seconds()
+    if span <= 0:
+        return None
+    covered = sum(
+        max((min(up_end, end) - max(up_start, start)).total_seconds(), 0)
+        for up_start, up_end in up
+    )
+    return round(covered * 100 / span, 2)
+
+
+def _outages(up, start, end):
+    """Stretches of [start, end) longer than HEARTBEAT_GAP without an up interval."""
+    outages = []
+    cursor = start
+    for up_start, up_end in up + [[end, end]]:
+        if up_start - cursor > HEARTBEAT_GAP:
+            outage_end = min(up_start, end)
+            outages.append({
+                'start': cursor.isoformat(),
+                'end': outage_end.isoformat(),
+                'duration_seconds': int((outage_end - cursor).total_seconds()),
+            })
+        cursor = max(cursor, up_end)
+        if cursor >= end:
+            break
+    return outages
@@ -1,6 +1,8 @@
 const CACHE_NAME = 'shabaka-player-v1';
 const MEDIA_CACHE_NAME = 'shabaka-media-v1';
 const API_CACHE_NAME = 'shabaka-api-v1';
+// Single cache entry for the last full playlist, whatever the ?since= query
+const PLAYLIST_CACHE_KEY = '/player/api/playlist';
 
 const STATIC_ASSETS = [
     '/player/display',
@@ -52,6 +54,12 @@ self.addEventListener('fetch', (event) => {
         return;
     }
     
+    // Server-Sent Events stream: let the browser talk to the network directly
+    if (event.request.url.includes('/player/api/events')) {
+        return;
+    }
+    
+    // Matches both /log-play and the batched /log-plays
     if (event.request.url.includes('/player/api/heartbeat') || 
         event.request.url.includes('/player/api/log-play')) {
         event.respondWith(handleApiRequest(event.request));
@@ -110,10 +118,12 @@ async function handlePlaylistRequest(request) {
         clearTimeout(timeoutId);
 
         if (networkResponse.ok) {
-            console.log('[SW] Caching playlist response');
-            cache.put(request, networkResponse.clone());
-            
             const playlistData = await networkResponse.clone().json();
+            // Only full documents are usable offline; deltas (?since=) are not cached
+            if (!playlistData.delta) {
+                console.log('[SW] Caching playlist response');
+                cache.put(PLAYLIST_CACHE_KEY, networkResponse.clone());
+            }
             precachePlaylistMedia(playlistData);
         } else if (networkResponse.status >= 500) {
              throw new Error("Server error, trying cache fallback");
@@ -121,7 +131,7 @@ async function handlePlaylistRequest(request) {
         return networkResponse;
     } catch (error) {
         console.log('[SW] Network failed (or timeout/5xx), serving cached playlist');
-        const cachedResponse = await cache.match(request);
+        const cachedResponse = await cache.match(PLAYLIST_CACHE_KEY);
         if (cachedResponse) {
             return cachedResponse;
         }
@@ -161,13 +171,17 @@ async function handleApiRequest(request) {
 }
 
 async function precachePlaylistMedia(playlistData) {
-    if (!playlistData.playlist || !Array.isArray(playlistData.playlist)) {
+    // Full document: playlist is a list; delta: only its changed items are new
+    const items = Array.isArray(playlistData.playlist)
+        ? playlistData.playlist
+        : (playlistData.playlist && playlistData.playlist.changed);
+    if (!Array.isArray(items)) {
         return;
     }
     
     const mediaCache = await caches.open(MEDIA_CACHE_NAME);
     
-    for (const item of playlistData.playlist) {
+    for (const item of items) {
         if (item.url && !item.url.startsWith('http://') && !item.url.startsWith('https://')) {
             try {
                 const cached = await mediaCache.match(item.url);
@@ -261,6 +275,8 @@ self.addEventListener('message', async (event) => {
     }
 });
 
+const SYNC_BATCH_SIZE = 50;
+
 async function syncPendingLogs() {
     try {
         const db = await openOfflineDB();
@@ -274,22 +290,23 @@ async function syncPendingLogs() {
         
         console.log('[SW] Syncing', logs.length, 'pending logs');
         
+        // Entries are either one queued /log-plays batch or a legacy single play
+        let keys = [];
+        let plays = [];
         for (const log of logs) {
-            try {
-                const response = await fetch('/player/api/log-play', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(log)
-                });
-                
-                if (response.ok) {
-                    const deleteTx = db.transaction('pendingLogs', 'readwrite');
-                    const deleteStore = deleteTx.objectStore('pendingLogs');
-                    await idbRequest(deleteStore.delete(log.timestamp));
-                    console.log('[SW] Synced log:', log.timestamp);
+            const entryPlays = Array.isArray(log.plays) ? log.plays : [log];
+            for (const play of entryPlays) {
+                if (!play.played_at) {
+                    play.played_at = new Date(log.timestamp).toISOString();
                 }
-            } catch (error) {
-                console.log('[SW] Failed to sync log:', log.timestamp);
+            }
+            keys.push(log.timestamp);
+            plays = plays.concat(entryPlays);
+            
+            if (plays.length >= SYNC_BATCH_SIZE || log === logs[logs.length - 1]) {
+                await sendPlayBatch(db, keys, plays);
+                keys = [];
+                plays = [];
             }
         }
     } catch (error) {
@@ -297,6 +314,27 @@ async function syncPendingLogs() {
     }
 }
 
+async function sendPlayBatch(db, keys, plays) {
+    try {
+        const response = await fetch('/player/api/log-plays', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ plays: plays })
+        });
+        
+        if (response.ok) {
+            const deleteTx = db.transaction('pendingLogs', 'readwrite');
+            const deleteStore = deleteTx.objectStore('pendingLogs');
+            for (const key of keys) {
+                await idbRequest(deleteStore.delete(key));
+            }
+            console.log('[SW] Synced', plays.length, 'plays');
+        }
+    } catch (error) {
+        console.log('[SW] Failed to sync', plays.length, 'plays');
+    }
+}
+
 async function getCacheStatus() {
     const mediaCache = await caches.open(MEDIA_CACHE_NAME);
     const keys = await mediaCache.keys();
@@ -42,7 +42,10 @@ document.addEventListener("DOMContentLoaded", function () {
   window.addEventListener("beforeunload", () => {
     clearTimer();
     if (player.heartbeatInterval) clearInterval(player.heartbeatInterval);
+    if (player.playFlushInterval) clearInterval(player.playFlushInterval);
     if (player.refreshInterval) clearInterval(player.refreshInterval);
+    flushPlays(true);
+    if (player.eventSource) player.eventSource.close();
   });
 
   document
@@ -82,6 +85,11 @@ const player = {
   timerId: null,
   heartbeatInterval: null,
   refreshInterval: null,
+  // Proof-of-play records waiting to be sent to /player/api/log-plays
+  pendingPlays: [],
+  playFlushInterval: null,
+  eventSource: null,
+  eventsConnected: false,
   controlsTimeout: null,
   currentItemStartTime: null,
   hlsInstance: null,
@@ -95,6 +103,9 @@ const player = {
   qualityCapped: false,
   qualityRecoveryTimer: null,
   lastEtag: null,
+  // Last full playlist document and its version, base for `since=` deltas
+  lastPlaylistDoc: null,
+  playlistVersion: null,
 
   // Robustness settings for 24/7 operation
   watchdogInterval: null,
@@ -106,13 +117,18 @@ const player = {
   networkRetryCount: 0,
   maxNetworkRetries: 10,
   isFetchingPlaylist: false,
+  playlistRefetchPending: false,
 
   CONTROLS_HIDE_DELAY: 10000,
   PLAYLIST_REFRESH_INTERVAL: 5000,
+  // Safety-net polling while the push channel (SSE) is connected
+  PLAYLIST_FALLBACK_INTERVAL: 60000,
   MIN_DISPLAY_TIME: 1000,
   AUTO_RELOAD_HOURS: 24,
   WATCHDOG_INTERVAL: 60000,
   MEMORY_CLEANUP_INTERVAL: 300000,
+  PLAY_BATCH_SIZE: 50,
+  PLAY_FLUSH_INTERVAL: 15000,
 
   imageEl: null,
   videoEl: null,
@@ -629,7 +645,11 @@ function updateInfoDisplay(item) {
 }
 
 async function fetchPlaylist() {
-  if (player.isFetchingPlaylist) return;
+  if (player.isFetchingPlaylist) {
+    // A change was notified mid-fetch: fetch again once this one completes
+    player.playlistRefetchPending = true;
+    return;
+  }
   player.isFetchingPlaylist = true;
 
   try {
@@ -638,7 +658,10 @@ async function fetchPlaylist() {
       headers["If-None-Match"] = player.lastEtag;
     }
 
-    const response = await fetch("/player/api/playlist", { headers });
+    const url = player.playlistVersion && player.lastPlaylistDoc
+      ? `/player/api/playlist?since=${player.playlistVersion}`
+      : "/player/api/playlist";
+    const response = await fetch(url, { headers });
 
     if (response.status === 304) {
       player.isFetchingPlaylist = false;
@@ -653,11 +676,29 @@ async function fetchPlaylist() {
       player.lastEtag = response.headers.get("ETag");
     }
 
-    const data = await response.json();
+    let data = await response.json();
 
     // Reset network retries on success
     resetNetworkRetries();
 
+    if (data.delta) {
+      const merged = player.lastPlaylistDoc
+        ? applyPlaylistDelta(player.lastPlaylistDoc, data)
+        : null;
+      if (!merged) {
+        debug("Playlist delta could not be applied, requesting full resync");
+        resetPlaylistVersion();
+        player.playlistRefetchPending = true;
+        return;
+      }
+      data = merged;
+    }
+
+    if (data.version && !data.offline) {
+      player.lastPlaylistDoc = data;
+      player.playlistVersion = data.version;
+    }
+
     if (data.error && !data.offline) {
       debug("Playlist error: " + data.error);
       player.isFetchingPlaylist = false;
@@ -791,7 +832,88 @@ async function fetchPlaylist() {
     handleNetworkFailure();
   } finally {
     player.isFetchingPlaylist = false;
+    if (player.playlistRefetchPending) {
+      player.playlistRefetchPending = false;
+      setTimeout(fetchPlaylist, 0);
+    }
+  }
+}
+
+function playlistItemKey(item) {
+  // Mirrors services/playlist_delta.py item_key()
+  return item.category ? `${item.category}:${item.id}` : String(item.id);
+}
+
+// Rebuild a full playlist document from the previous one and a server delta.
+// Returns null when the delta references an item we do not have.
+function applyPlaylistDelta(base, delta) {
+  const result = Object.assign({}, delta);
+  delete result.delta;
+  delete result.base_version;
+
+  for (const name of ["playlist", "overlays"]) {
+    const change = delta[name] || { order: [], changed: [] };
+    const byKey = new Map();
+    (base[name] || []).forEach((item) => byKey.set(playlistItemKey(item), item));
+    change.changed.forEach((item) => byKey.set(playlistItemKey(item), item));
+
+    const items = [];
+    for (const key of change.order) {
+      const item = byKey.get(key);
+      if (!item) return null;
+      items.push(item);
+    }
+    result[name] = items;
+  }
+  return result;
+}
+
+function resetPlaylistVersion() {
+  player.lastEtag = null;
+  player.lastPlaylistDoc = null;
+  player.playlistVersion = null;
+}
+
+function setPlaylistRefreshInterval(interval) {
+  if (player.refreshInterval) clearInterval(player.refreshInterval);
+  player.refreshInterval = setInterval(fetchPlaylist, interval);
+}
+
+// Push channel: the server notifies playlist, mode and override broadcast
+// changes, so polling can slow down to a safety net while it is connected.
+function connectScreenEvents() {
+  if (!("EventSource" in window)) {
+    debug("EventSource not supported, using polling only");
+    return;
   }
+
+  const source = new EventSource("/player/api/events");
+  player.eventSource = source;
+
+  source.addEventListener("ready", () => {
+    debug("Push channel connected");
+    player.eventsConnected = true;
+    setPlaylistRefreshInterval(player.PLAYLIST_FALLBACK_INTERVAL);
+    // Catch up on anything missed while disconnected
+    fetchPlaylist();
+  });
+
+  ["playlist", "mode", "broadcast"].forEach((eventName) => {
+    source.addEventListener(eventName, () => {
+      debug(`Push event: ${eventName}`);
+      player.lastActivityTime = Date.now();
+      fetchPlaylist();
+    });
+  });
+
+  source.onerror = () => {
+    // EventSource reconnects by itself; poll at full rate meanwhile
+    if (player.eventsConnected) {
+      debug("Push channel lost, falling back to polling");
+      player.eventsConnected = false;
+      setPlaylistRefreshInterval(player.PLAYLIST_REFRESH_INTERVAL);
+    }
+  };
 }
 
 async function switchToIptvMode() {
@@ -1625,18 +1747,33 @@ function switchToPlaylistMode() {
   player.state = PlayerState.IDLE;
 }
 
-async function logPlay(item) {
+function logPlay(item) {
+  player.pendingPlays.push({
+    content_id: item.id,
+    content_type: item.type,
+    category: item.category,
+    duration: item.duration,
+    booking_id: item.booking_id,
+    played_at: new Date().toISOString(),
+  });
+
+  // Paid plays go out at once so an exhausted booking leaves the playlist quickly
+  if (item.category === "paid" || player.pendingPlays.length >= player.PLAY_BATCH_SIZE) {
+    flushPlays();
+  }
+}
+
+async function flushPlays(unloading = false) {
+  if (player.pendingPlays.length === 0) return;
+  const plays = player.pendingPlays.splice(0, player.PLAY_BATCH_SIZE);
+
   try {
-    const response = await fetch("/player/api/log-play", {
+    // keepalive lets the last batch survive a page unload
+    const response = await fetch("/player/api/log-plays", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({
-        content_id: item.id,
-        content_type: item.type,
-        category: item.category,
-        duration: item.duration,
-        booking_id: item.booking_id,
-      }),
+      body: JSON.stringify({ plays }),
+      keepalive: unloading,
     });
 
     const result = await response.json();
@@ -1645,7 +1782,11 @@ async function logPlay(item) {
       fetchPlaylist();
     }
   } catch (error) {
-    debug("Log play error: " + error.message);
+    debug("Log plays error: " + error.message);
+  }
+
+  if (!unloading && player.pendingPlays.length >= player.PLAY_BATCH_SIZE) {
+    flushPlays();
   }
 }
 
@@ -1940,10 +2081,10 @@ async function startPlayer() {
   player.heartbeatInterval = setInterval(sendHeartbeat, 30000);
   sendHeartbeat();
 
-  player.refreshInterval = setInterval(
-    fetchPlaylist,
-    player.PLAYLIST_REFRESH_INTERVAL,
-  );
+  player.playFlushInterval = setInterval(flushPlays, player.PLAY_FLUSH_INTERVAL);
+
+  setPlaylistRefreshInterval(player.PLAYLIST_REFRESH_INTERVAL);
+  connectScreenEvents();
 
   // Start robustness systems for 24/7 operation
   startWatchdog();
@@ -0,0 +1,124 @@
+import unittest
+import os
+from datetime import datetime, date, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, User
+from models.ad_content import AdContent, AdContentInvoice, AdContentStat
+from services.ad_invoice_generation import ad_settlement, generate_ad_invoices, generate_expired_ad_invoices
+
+
+class TestAdInvoiceGeneration(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+
+            orgs = [
+                Organization(name="Paid Org", email="paid@org.com", country="SN", city="Dakar", is_paid=True),
+                Organization(name="Free Org", email="free@org.com", country="SN", city="Thies", is_paid=False),
+                Organization(name="Opted Out", email="out@org.com", country="SN", city="Dakar",
+                             allow_ad_content=False),
+                Organization(name="Abroad", email="abroad@org.com", country="FR", city="Paris"),
+            ]
+            db.session.add_all(orgs)
+            db.session.commit()
+            self.org_ids = [org.id for org in orgs]
+
+            screens = []
+            for org, count in zip(orgs, (3, 1, 1, 1)):
+                for n in range(count):
+                    screen = Screen(name=f"{org.name} {n}", unique_code=f"AI{org.id}{n}", organization_id=org.id)
+                    screen.set_password("password")
+                    screens.append(screen)
+            inactive = Screen(name="Inactive", unique_code="AIOFF", organization_id=orgs[0].id, is_active=False)
+            inactive.set_password("password")
+            admin = User(username='superadmin', email='admin@test.com', role='superadmin', is_active=True)
+            admin.set_password('password')
+            db.session.add_all(screens + [inactive, admin])
+            db.session.commit()
+            self.screen_ids = [screen.id for screen in screens]
+            self.admin_id = admin.id
+
+            now = datetime.utcnow()
+            ad = AdContent(name="Campaign", reference="PUB-1", file_path="ad.png", target_type=AdContent.TARGET_COUNTRY,
+                           target_country="SN", schedule_type=AdContent.SCHEDULE_PERIOD,
+                           start_date=now - timedelta(days=10), end_date=now - timedelta(days=1),
+                           status=AdContent.STATUS_EXPIRED, total_price=400.0, commission_rate=25.0, currency='XOF')
+            db.session.add(ad)
+            db.session.commit()
+            self.ad_id = ad.id
+
+            stats = [(screens[0], 1, 10, 100.0), (screens[0], 2, 5, 50.0), (screens[1], 1, 1, 10.0),
+                     (screens[3], 1, 7, 70.0), (screens[4], 1, 1000, 1.0)]
+            db.session.add_all([
+                AdContentStat(ad_content_id=ad.id, screen_id=screen.id, organization_id=screen.organization_id,
+                              date=date.today() - timedelta(days=day), impressions=impressions,
+                              total_duration=duration)
+                for screen, day, impressions, duration in stats
+            ])
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_settlement_groups_targeted_screens_by_organization(self):
+        with app.app_context():
+            ad = db.session.get(AdContent, self.ad_id)
+            self.assertEqual(ad_settlement(ad), {
+                self.org_ids[0]: (3, 16, 160.0),
+                self.org_ids[1]: (1, 7, 70.0),
+            })
+
+            ad.target_type = AdContent.TARGET_ORGANIZATION
+            ad.target_organization_id = self.org_ids[1]
+            ad.target_org_type = AdContent.ORG_TYPE_PAID
+            self.assertEqual(ad_settlement(ad), {})
+
+    def test_expired_ads_are_invoiced_once(self):
+        with app.app_context():
+            report = generate_expired_ad_invoices(dry_run=True)
+            self.assertEqual((report['ads'], report['created']), (1, 2))
+            self.assertEqual(AdContentInvoice.query.count(), 0)
+
+            report = generate_expired_ad_invoices()
+            self.assertEqual(report['created'], 2)
+            invoices = {i.organization_id: i for i in AdContentInvoice.query.all()}
+            self.assertEqual(invoices[self.org_ids[0]].gross_amount, 300.0)
+            self.assertEqual(invoices[self.org_ids[0]].commission_amount, 75.0)
+            self.assertEqual(invoices[self.org_ids[0]].total_impressions, 16)
+            self.assertEqual(invoices[self.org_ids[1]].screens_count, 1)
+
+            report = generate_ad_invoices([db.session.get(AdContent, self.ad_id)])
+            self.assertEqual((report['created'], report['skipped_existing']), (0, 2))
+
+    def test_generate_invoices_route(self):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin_id)
+            sess['_fresh'] = True
+            sess['_csrf_token'] = 'token'
+
+        response = self.client.post(f'/admin/ad-content/{self.ad_id}/generate-invoices',
+                                    data={'csrf_token': 'token'})
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            self.assertEqual(AdContentInvoice.query.count(), 2)
+
+        response = self.client.post('/admin/ad-content/generate-expired-invoices', data={'csrf_token': 'token'})
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            self.assertEqual(AdContentInvoice.query.count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+from datetime import datetime, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization
+from models.ad_content import AdContent
+from services.ad_targeting_index import AdTargetingIndex
+
+
+class TestAdTargetingIndex(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+
+        with app.app_context():
+            db.create_all()
+            AdTargetingIndex.clear()
+
+            org = Organization(name="Index Org", email="index@org.com", country="FR", city="Paris")
+            other_org = Organization(name="Other Org", email="other@org.com", country="MA", city="Rabat")
+            db.session.add_all([org, other_org])
+            db.session.commit()
+            self.org_id = org.id
+            self.other_org_id = other_org.id
+
+            screen = Screen(name="Index Screen", unique_code="IDX01", organization_id=org.id, is_active=True)
+            other_screen = Screen(name="Other Screen", unique_code="IDX02", organization_id=other_org.id,
+                                  is_active=True)
+            screen.set_password("password")
+            other_screen.set_password("password")
+            db.session.add_all([screen, other_screen])
+            db.session.commit()
+            self.screen_id = screen.id
+            self.other_screen_id = other_screen.id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            AdTargetingIndex.clear()
+
+    def _ad(self, reference, **kwargs):
+        kwargs.setdefault('status', AdContent.STATUS_ACTIVE)
+        return AdContent(name=reference, reference=reference, file_path=f"{reference}.jpg", **kwargs)
+
+    def _resolved_names(self, screen_id=None):
+        screen = db.session.get(Screen, screen_id or self.screen_id)
+        return sorted(entry.content['name'] for entry in AdTargetingIndex.resolve(screen))
+
+    def test_resolves_every_target_type(self):
+        with app.app_context():
+            multi = self._ad("MULTI", target_type=AdContent.TARGET_SCREENS)
+            multi.set_selected_screen_ids([self.screen_id])
+            db.session.add_all([
+                self._ad("SCREEN", target_type=AdContent.TARGET_SCREEN, target_screen_id=self.screen_id),
+                self._ad("ORG", target_type=AdContent.TARGET_ORGANIZATION, target_organization_id=self.org_id),
+                self._ad("CITY", target_type=AdContent.TARGET_CITY, target_country="FR", target_city="PARIS"),
+                self._ad("COUNTRY", target_type=AdContent.TARGET_COUNTRY, target_country="FR"),
+                self._ad("ELSEWHERE", target_type=AdContent.TARGET_COUNTRY, target_country="MA"),
+                multi,
+            ])
+            db.session.commit()
+
+            self.assertEqual(self._resolved_names(), ['CITY', 'COUNTRY', 'MULTI', 'ORG', 'SCREEN'])
+            self.assertEqual(self._resolved_names(self.other_screen_id), ['ELSEWHERE'])
+
+    def test_committed_changes_update_index_incrementally(self):
+        with app.app_context():
+            ad = self._ad("MOVING", target_type=AdContent.TARGET_SCREEN, target_screen_id=self.screen_id)
+            db.session.add(ad)
+            db.session.commit()
+            self.assertEqual(self._resolved_names(), ['MOVING'])
+
+            ad.target_screen_id = self.other_screen_id
+            db.session.commit()
+            self.assertEqual(self._resolved_names(), [])
+            self.assertEqual(self._resolved_names(self.other_screen_id), ['MOVING'])
+
+            ad.status = AdContent.STATUS_PAUSED
+            db.session.commit()
+            self.assertEqual(self._resolved_names(self.other_screen_id), [])
+
+    def test_resolution_without_queries_once_loaded(self):
+        with app.app_context():
+            db.session.add(self._ad("SCREEN", target_type=AdContent.TARGET_SCREEN, target_screen_id=self.screen_id))
+            db.session.commit()
+            screen = db.session.get(Screen, self.screen_id)
+            _ = screen.organization
+            AdTargetingIndex.resolve(screen)
+
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                entries = AdTargetingIndex.resolve(screen)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+            self.assertEqual(statements, [])
+            self.assertEqual([entry.content['name'] for entry in entries], ['SCREEN'])
+
+    def test_time_window_and_org_type(self):
+        with app.app_context():
+            now = datetime.utcnow()
+            db.session.add_all([
+                self._ad("LATER", target_type=AdContent.TARGET_SCREEN, target_screen_id=self.screen_id,
+                         schedule_type=AdContent.SCHEDULE_PERIOD, status=AdContent.STATUS_SCHEDULED,
+                         start_date=now + timedelta(days=1), end_date=now + timedelta(days=2)),
+                self._ad("FREE_ONLY", target_type=AdContent.TARGET_SCREEN, target_screen_id=self.screen_id,
+                         target_org_type=AdContent.ORG_TYPE_FREE),
+            ])
+            db.session.commit()
+
+            screen = db.session.get(Screen, self.screen_id)
+            entries = {entry.content['name']: entry for entry in AdTargetingIndex.resolve(screen)}
+
+            self.assertFalse(entries['LATER'].is_active_at(now))
+            self.assertTrue(entries['LATER'].is_active_at(now + timedelta(days=1, hours=1)))
+            self.assertEqual(entries['LATER'].effective_status(now + timedelta(days=3)), AdContent.STATUS_EXPIRED)
+            # Organizations are paid by default
+            self.assertFalse(entries['FREE_ONLY'].matches_org(screen.organization))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import unittest
+import os
+from datetime import date, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+
+from app import app, db
+from models import Screen, Organization, Content, Booking, TimePeriod, TimeSlot
+from services.availability_cache import AvailabilityCache, _on_screen_event, EVENT_AVAILABILITY
+from services.availability_service import calculate_availability
+from services.screen_events import WORKERS
+
+START = date.today() + timedelta(days=30)
+
+
+class TestAvailabilityCache(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        AvailabilityCache.clear()
+
+        with app.app_context():
+            db.create_all()
+
+            org = Organization(name="Cache Org", email="cache@org.com")
+            db.session.add(org)
+            db.session.commit()
+
+            screen = Screen(name="Cache Screen", unique_code="AVC01", organization_id=org.id)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+            self.screen_id = screen.id
+
+            db.session.add_all([
+                TimePeriod(screen_id=screen.id, name='Matin', start_hour=6, end_hour=12),
+                TimePeriod(screen_id=screen.id, name='Soir', start_hour=18, end_hour=23),
+                TimeSlot(screen_id=screen.id, content_type='image', duration_seconds=15, price_per_play=1.0),
+            ])
+            content = Content(filename='ad.png', original_filename='ad.png', content_type='image',
+                              file_path='/tmp/ad.png', screen_id=screen.id)
+            db.session.add(content)
+            db.session.commit()
+            self.content_id = content.id
+            self.period_ids = sorted(p.id for p in screen.time_periods)
+
+            db.session.add(self.booking(num_plays=700, start=START, days=7, time_period_id=self.period_ids[0]))
+            db.session.commit()
+
+        self.booking_queries = 0
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM bookings' in statement:
+                self.booking_queries += 1
+
+        self.count_queries = count
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+
+    def tearDown(self):
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', self.count_queries)
+            db.session.remove()
+            db.drop_all()
+        AvailabilityCache.clear()
+
+    def booking(self, num_plays, start, days, status='active', time_period_id=None):
+        return Booking(screen_id=self.screen_id, content_id=self.content_id, slot_duration=15,
+                       num_plays=num_plays, price_per_play=1, total_price=num_plays, status=status,
+                       time_period_id=time_period_id, start_date=start, end_date=start + timedelta(days=days - 1))
+
+    def reserved(self, start=START, days=14):
+        screen = db.session.get(Screen, self.screen_id)
+        result = calculate_availability(screen, start, start + timedelta(days=days - 1))
+        return [[cell['reserved_seconds'] for cell in day['periods']] for day in result['daily_breakdown']]
+
+    def uncached(self, start=START, days=14):
+        AvailabilityCache.clear()
+        return self.reserved(start, days)
+
+    def test_repeated_requests_do_not_read_bookings(self):
+        with app.app_context():
+            first = self.reserved()
+            self.assertEqual(self.booking_queries, 1)
+            self.assertEqual(first[0], [1500.0, 0])
+            self.assertEqual(first[7], [0, 0])
+
+            self.assertEqual(self.reserved(), first)
+            self.assertEqual(self.reserved(START + timedelta(days=3), 5), first[3:8])
+            self.assertEqual(self.booking_queries, 1)
+
+            # Only the days not cached yet are read
+            self.reserved(START + timedelta(days=10), 10)
+            self.assertEqual(self.booking_queries, 2)
+            self.assertEqual(AvailabilityCache.stats(), {'screens': 1, 'days': 20})
+
+    def test_booking_changes_evict_only_their_days(self):
+        with app.app_context():
+            self.reserved()
+            booking = self.booking(num_plays=300, start=START + timedelta(days=5), days=3)
+            db.session.add(booking)
+            db.session.commit()
+            self.assertEqual(AvailabilityCache.stats()['days'], 11)
+
+            after_insert = self.reserved()
+            self.assertEqual(after_insert, self.uncached())
+            self.assertNotEqual(after_insert[5][1], 0)
+
+            booking.status = 'cancelled'
+            db.session.commit()
+            self.assertEqual(AvailabilityCache.stats()['days'], 11)
+            after_cancel = self.reserved()
+            self.assertEqual(after_cancel, self.uncached())
+            self.assertEqual(after_cancel[5][1], 0)
+
+            booking.status = 'active'
+            db.session.commit()
+            self.reserved()
+            db.session.delete(booking)
+            db.session.commit()
+            self.assertEqual(self.reserved(), self.uncached())
+
+            # Unrelated column changes keep the cache
+            booking = Booking.query.first()
+            self.reserved()
+            queries = self.booking_queries
+            booking.payment_status = 'paid'
+            db.session.commit()
+            self.reserved()
+            self.assertEqual(self.booking_queries, queries)
+
+    def test_period_changes_start_the_screen_over(self):
+        with app.app_context():
+            self.reserved()
+            period = db.session.get(TimePeriod, self.period_ids[1])
+            period.end_hour = 22
+            db.session.commit()
+            self.assertEqual(AvailabilityCache.stats()['screens'], 0)
+
+    def test_remote_invalidations_are_applied(self):
+        with app.app_context():
+            self.reserved()
+            _on_screen_event(WORKERS, EVENT_AVAILABILITY, {
+                'ranges': [[self.screen_id, (START + timedelta(days=2)).isoformat(), None]]
+            }, remote=True)
+            self.assertEqual(AvailabilityCache.stats()['days'], 2)
+
+    def test_booking_page_availability_is_cached(self):
+        payload = {'start_date': START.isoformat(), 'end_date': (START + timedelta(days=6)).isoformat(),
+                   'slot_duration': 15}
+        with self.client.session_transaction() as sess:
+            sess['_csrf_token'] = 'token'
+        headers = {'X-CSRF-Token': 'token'}
+
+        first = self.client.post('/book/AVC01/availability', json=payload, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        second = self.client.post('/book/AVC01/availability', json=payload, headers=headers)
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(self.booking_queries, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
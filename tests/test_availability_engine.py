@@ -0,0 +1,111 @@
+import unittest
+import os
+import random
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, TimePeriod, TimeSlot, Booking, Content
+from services.availability_service import (
+    calculate_availability, get_reserved_seconds_for_period, reserved_seconds_matrix
+)
+
+START = date(2030, 1, 1)
+PERIODS = [SimpleNamespace(id=1, start_hour=6, end_hour=12), SimpleNamespace(id=2, start_hour=12, end_hour=18),
+           SimpleNamespace(id=3, start_hour=18, end_hour=23), SimpleNamespace(id=4, start_hour=22, end_hour=2)]
+
+
+def random_bookings(count, seed):
+    rng = random.Random(seed)
+    bookings = []
+    for _ in range(count):
+        start = START + timedelta(days=rng.randint(-30, 380))
+        end = rng.choice([None, start + timedelta(days=rng.randint(-2, 90))])
+        bookings.append(SimpleNamespace(
+            start_date=start, end_date=end, num_plays=rng.randint(0, 500),
+            slot_duration=rng.choice([10, 15, 30]), time_period_id=rng.choice([None, 1, 2, 3, 4, 99]),
+            status='active'))
+    return bookings
+
+
+class TestAvailabilityEngine(unittest.TestCase):
+    def assert_matches_reference(self, bookings, num_days, periods):
+        matrix = reserved_seconds_matrix(bookings, START, num_days, periods, PERIODS)
+        for day in range(num_days):
+            for column, period in enumerate(periods):
+                expected = get_reserved_seconds_for_period(
+                    None, period.id, START + timedelta(days=day), PERIODS, bookings)
+                actual = matrix[day][column]
+                self.assertEqual((actual, type(actual)), (expected, type(expected)), (day, period.id))
+
+    def test_matrix_is_identical_to_per_cell_sums(self):
+        self.assert_matches_reference(random_bookings(300, seed=1), 400, PERIODS)
+        self.assert_matches_reference(random_bookings(50, seed=2), 31, PERIODS[1:2])
+        self.assert_matches_reference([], 5, PERIODS)
+
+    def test_calculate_availability_end_to_end(self):
+        app.config['TESTING'] = True
+        with app.app_context():
+            db.create_all()
+            try:
+                org = Organization(name="Engine Org", email="engine@org.com")
+                db.session.add(org)
+                db.session.commit()
+                screen = Screen(name="Engine Screen", unique_code="ENG01", organization_id=org.id)
+                screen.set_password("password")
+                db.session.add(screen)
+                db.session.commit()
+                db.session.add_all([
+                    TimePeriod(screen_id=screen.id, name='Matin', start_hour=6, end_hour=12),
+                    TimePeriod(screen_id=screen.id, name='Soir', start_hour=18, end_hour=23),
+                    TimeSlot(screen_id=screen.id, content_type='image', duration_seconds=15, price_per_play=1.0),
+                ])
+                content = Content(filename='ad.png', original_filename='ad.png', content_type='image',
+                                  file_path='/tmp/ad.png', screen_id=screen.id)
+                db.session.add(content)
+                db.session.commit()
+                periods = sorted(screen.time_periods, key=lambda p: p.id)
+                db.session.add_all([
+                    Booking(screen_id=screen.id, content_id=content.id, slot_duration=15, num_plays=100,
+                            price_per_play=1, total_price=100, status='active', time_period_id=periods[0].id,
+                            start_date=START, end_date=START + timedelta(days=6)),
+                    Booking(screen_id=screen.id, content_id=content.id, slot_duration=15, num_plays=70,
+                            price_per_play=1, total_price=70, status='pending',
+                            start_date=START + timedelta(days=3), end_date=START + timedelta(days=9)),
+                    Booking(screen_id=screen.id, content_id=content.id, slot_duration=15, num_plays=999,
+                            price_per_play=1, total_price=999, status='cancelled',
+                            start_date=START, end_date=START + timedelta(days=9)),
+                ])
+                db.session.commit()
+                bookings = [b for b in Booking.query.all() if b.status in ('pending', 'active')]
+
+                result = calculate_availability(screen, START, START + timedelta(days=9))
+                self.assertEqual(result['num_days'], 10)
+                total = 0
+                for day, day_info in enumerate(result['daily_breakdown']):
+                    day_total = 0
+                    for cell in day_info['periods']:
+                        reserved = get_reserved_seconds_for_period(
+                            screen.id, cell['period_id'], START + timedelta(days=day), screen.time_periods,
+                            bookings)
+                        self.assertEqual(cell['reserved_seconds'], reserved)
+                        self.assertEqual(cell['available_seconds'], max(0, cell['total_seconds'] - reserved))
+                        self.assertEqual(cell['available_plays'], int(cell['available_seconds'] / 15))
+                        day_total += cell['available_seconds']
+                    self.assertEqual(day_info['total_available_seconds'], day_total)
+                    total += day_total
+                self.assertEqual(result['total_available_seconds'], total)
+                self.assertEqual(result['available_plays'], int(total / 15))
+            finally:
+                db.session.remove()
+                db.drop_all()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+import os
+from datetime import date, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, Content, Booking, TimePeriod, TimeSlot
+from services.availability_cache import AvailabilityCache
+from services.availability_search import search_availability, SORT_PRICE
+from services.availability_service import calculate_availability
+
+TODAY = date.today()
+
+
+class TestAvailabilitySearch(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        AvailabilityCache.clear()
+
+        with app.app_context():
+            db.create_all()
+
+            kinshasa = Organization(name="Kin Org", email="kin@org.com", country='CD', city='Kinshasa', currency='CDF')
+            dakar = Organization(name="Dakar Org", email="dakar@org.com", country='SN', city='Dakar', currency='XOF')
+            db.session.add_all([kinshasa, dakar])
+            db.session.commit()
+
+            specs = [(kinshasa, 'KIN001', 1.0, True), (kinshasa, 'KIN002', 0.5, True),
+                     (kinshasa, 'KIN003', 0.8, False), (dakar, 'DKR001', 0.2, True)]
+            self.screens = {}
+            for org, code, price, images in specs:
+                screen = Screen(name=code, unique_code=code, organization_id=org.id, accepts_images=images)
+                screen.set_password("password")
+                db.session.add(screen)
+                db.session.commit()
+                db.session.add_all([
+                    TimePeriod(screen_id=screen.id, name='Matin', start_hour=6, end_hour=12),
+                    TimePeriod(screen_id=screen.id, name='Soir', start_hour=18, end_hour=23),
+                    TimeSlot(screen_id=screen.id, content_type='image', duration_seconds=15, price_per_play=price),
+                ])
+                db.session.commit()
+                self.screens[code] = screen.id
+
+            # Today and tomorrow: exercises the security buffer on today's periods
+            busy = self.screens['KIN001']
+            content = Content(filename='ad.png', original_filename='ad.png', content_type='image',
+                              file_path='/tmp/ad.png', screen_id=busy)
+            db.session.add(content)
+            db.session.commit()
+            period_id = min(p.id for p in db.session.get(Screen, busy).time_periods)
+            db.session.add_all([
+                Booking(screen_id=busy, content_id=content.id, slot_duration=15, num_plays=5000,
+                        price_per_play=1, total_price=5000, status='active', time_period_id=period_id,
+                        start_date=TODAY, end_date=TODAY + timedelta(days=4)),
+                Booking(screen_id=busy, content_id=content.id, slot_duration=15, num_plays=777,
+                        price_per_play=1, total_price=777, status='pending',
+                        start_date=TODAY + timedelta(days=2), end_date=TODAY + timedelta(days=8)),
+                Booking(screen_id=busy, content_id=content.id, slot_duration=10, num_plays=40,
+                        price_per_play=1, total_price=40, status='active', start_date=TODAY + timedelta(days=1)),
+                Booking(screen_id=self.screens['KIN002'], content_id=content.id, slot_duration=15, num_plays=99999,
+                        price_per_play=1, total_price=99999, status='cancelled',
+                        start_date=TODAY, end_date=TODAY + timedelta(days=6)),
+            ])
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        AvailabilityCache.clear()
+
+    def test_capacity_matches_single_screen_availability(self):
+        end = TODAY + timedelta(days=6)
+        with app.app_context():
+            report = search_availability(TODAY, end)
+            self.assertEqual(report['screens_evaluated'], 3)
+            for result in report['results']:
+                screen = db.session.get(Screen, result['screen_id'])
+                expected = calculate_availability(screen, TODAY, end, slot_duration=15)
+                # Today's remaining seconds move with the clock between the two calls
+                self.assertAlmostEqual(result['available_seconds'], expected['total_available_seconds'],
+                                       delta=1)
+                self.assertAlmostEqual(result['available_plays'], expected['available_plays'], delta=1)
+
+    def test_filters_and_ranking(self):
+        start, end = TODAY + timedelta(days=7), TODAY + timedelta(days=13)
+        with app.app_context():
+            report = search_availability(start, end, country='CD', city='Kinshasa', plays=500)
+            codes = [r['unique_code'] for r in report['results']]
+            # KIN003 does not take images; KIN001 is still partly booked that week
+            self.assertEqual(codes, ['KIN002', 'KIN001'])
+            self.assertEqual(report['results'][0]['estimated_price'], 250.0)
+
+            report = search_availability(start, end, sort=SORT_PRICE)
+            self.assertEqual([r['unique_code'] for r in report['results']], ['DKR001', 'KIN002', 'KIN001'])
+
+            free = report['results'][0]['available_plays']
+            self.assertEqual(search_availability(start, end, plays=free + 1, country='SN')['matches'], 0)
+            self.assertEqual(search_availability(start, end, slot_duration=30)['screens_evaluated'], 0)
+
+    def test_search_endpoint(self):
+        start = (TODAY + timedelta(days=7)).isoformat()
+        end = (TODAY + timedelta(days=13)).isoformat()
+        response = self.client.get(f'/api/availability/search?start_date={start}&end_date={end}'
+                                   f'&country=CD&plays=500&sort=price&limit=1')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['matches'], 2)
+        self.assertEqual([r['unique_code'] for r in data['results']], ['KIN002'])
+        self.assertEqual(data['results'][0]['booking_url'], '/book/KIN002')
+
+        response = self.client.get(f'/api/availability/search?start_date={end}&end_date={start}')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['field'], 'end_date')
+
+    def test_catalog_lists_only_the_selected_country(self):
+        response = self.client.get('/catalog?country=SN')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'DKR001', response.data)
+        self.assertNotIn(b'KIN001', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
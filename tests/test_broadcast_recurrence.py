@@ -0,0 +1,128 @@
+import unittest
+import os
+import random
+from datetime import datetime, date, time, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app
+from models import Broadcast
+from services.broadcast_recurrence import expand_calendar
+
+
+def legacy_next_occurrence(broadcast, from_datetime):
+    """Day-by-day scan the recurrence engine replaced, kept as the reference."""
+    if broadcast.recurrence_end_date and from_datetime.date() > broadcast.recurrence_end_date:
+        return None
+
+    start = broadcast.scheduled_datetime.date()
+    base_time = broadcast.recurrence_time or broadcast.scheduled_datetime.time()
+    check_date = max(from_datetime.date(), start)
+
+    for i in range(366):
+        candidate = datetime.combine(check_date + timedelta(days=i), base_time)
+        if candidate <= from_datetime:
+            continue
+        if broadcast.recurrence_end_date and candidate.date() > broadcast.recurrence_end_date:
+            return None
+
+        d = candidate.date()
+        if broadcast.recurrence_type == Broadcast.RECURRENCE_DAILY:
+            valid = (d - start).days % broadcast.recurrence_interval == 0
+        elif broadcast.recurrence_type == Broadcast.RECURRENCE_WEEKLY:
+            if broadcast.recurrence_days_of_week:
+                valid = d.weekday() in [int(x) for x in broadcast.recurrence_days_of_week.split(',') if x]
+            else:
+                valid = ((d - start).days // 7) % broadcast.recurrence_interval == 0
+        elif broadcast.recurrence_type == Broadcast.RECURRENCE_MONTHLY:
+            months = (d.year - start.year) * 12 + (d.month - start.month)
+            valid = months % broadcast.recurrence_interval == 0 and d.day == start.day
+        else:
+            valid = True
+        if valid:
+            return candidate
+    return None
+
+
+def make_broadcast(recurrence_type, scheduled, interval=1, days=None, end_date=None, recurrence_time=None, **kwargs):
+    return Broadcast(
+        name='recurring',
+        schedule_mode=Broadcast.SCHEDULE_MODE_SCHEDULED,
+        scheduled_datetime=scheduled,
+        recurrence_type=recurrence_type,
+        recurrence_interval=interval,
+        recurrence_days_of_week=days,
+        recurrence_end_date=end_date,
+        recurrence_time=recurrence_time,
+        **kwargs
+    )
+
+
+class TestBroadcastRecurrence(unittest.TestCase):
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def test_matches_legacy_scan(self):
+        rng = random.Random(7)
+        types = [Broadcast.RECURRENCE_DAILY, Broadcast.RECURRENCE_WEEKLY, Broadcast.RECURRENCE_MONTHLY,
+                 Broadcast.RECURRENCE_CUSTOM]
+        for _ in range(400):
+            scheduled = datetime(2024, 1, 1, 8, 30) + timedelta(days=rng.randint(0, 800), minutes=rng.randint(0, 1440))
+            days = None
+            if rng.random() < 0.5:
+                days = ','.join(str(d) for d in sorted(rng.sample(range(7), rng.randint(1, 3))))
+            broadcast = make_broadcast(
+                rng.choice(types), scheduled,
+                interval=rng.randint(1, 14),
+                days=days,
+                end_date=scheduled.date() + timedelta(days=rng.randint(0, 900)) if rng.random() < 0.4 else None,
+                recurrence_time=time(rng.randint(0, 23), rng.choice([0, 15, 30])) if rng.random() < 0.5 else None
+            )
+            from_datetime = scheduled + timedelta(days=rng.randint(-30, 900), minutes=rng.randint(-720, 720))
+
+            self.assertEqual(broadcast.get_next_occurrence(from_datetime),
+                             legacy_next_occurrence(broadcast, from_datetime),
+                             f"{broadcast.recurrence_type} every {broadcast.recurrence_interval} "
+                             f"days={days} from {scheduled} at {from_datetime}")
+
+    def test_monthly_skips_short_months(self):
+        broadcast = make_broadcast(Broadcast.RECURRENCE_MONTHLY, datetime(2025, 1, 31, 9, 0))
+        occurrences = broadcast.get_next_occurrences(3, from_datetime=datetime(2025, 1, 31, 10, 0))
+        self.assertEqual(occurrences, [datetime(2025, 3, 31, 9, 0), datetime(2025, 5, 31, 9, 0),
+                                       datetime(2025, 7, 31, 9, 0)])
+
+    def test_trigger_uses_recurrence_time(self):
+        broadcast = make_broadcast(Broadcast.RECURRENCE_WEEKLY, datetime(2025, 6, 2, 7, 0), days='0,2',
+                                   recurrence_time=time(18, 0))
+        self.assertTrue(broadcast.should_trigger_now(datetime(2025, 6, 4, 18, 0, 1)))
+        self.assertFalse(broadcast.should_trigger_now(datetime(2025, 6, 5, 18, 0, 0)))
+        self.assertFalse(broadcast.should_trigger_now(datetime(2025, 6, 4, 18, 0, 5)))
+
+    def test_expand_calendar(self):
+        daily = make_broadcast(Broadcast.RECURRENCE_DAILY, datetime(2025, 6, 1, 12, 0), interval=2,
+                               schedule_priority=100)
+        daily.id = 1
+        once = make_broadcast(Broadcast.RECURRENCE_NONE, datetime(2025, 6, 3, 12, 0), schedule_priority=300)
+        once.id = 2
+        immediate = Broadcast(name='now', schedule_mode=Broadcast.SCHEDULE_MODE_IMMEDIATE)
+
+        entries = expand_calendar([daily, once, immediate], datetime(2025, 6, 1, 12, 0), datetime(2025, 6, 5, 23, 0))
+
+        self.assertEqual([(when, b.id) for when, b in entries], [
+            (datetime(2025, 6, 1, 12, 0), 1),
+            (datetime(2025, 6, 3, 12, 0), 2),
+            (datetime(2025, 6, 3, 12, 0), 1),
+            (datetime(2025, 6, 5, 12, 0), 1),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import os
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, Broadcast
+from models.broadcast import broadcast_screen_targets
+from services.broadcast_targets import rebuild_broadcast_targets, count_target_screens
+
+
+class TestBroadcastTargets(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+
+        with app.app_context():
+            db.create_all()
+
+            paris = Organization(name="Paris Org", email="paris@org.com", country="FR", city="Paris", is_paid=True)
+            lyon = Organization(name="Lyon Org", email="lyon@org.com", country="FR", city="Lyon", is_paid=False)
+            rabat = Organization(name="Rabat Org", email="rabat@org.com", country="MA", city="Rabat", is_paid=True)
+            db.session.add_all([paris, lyon, rabat])
+            db.session.commit()
+            self.paris_id, self.lyon_id, self.rabat_id = paris.id, lyon.id, rabat.id
+
+            screens = []
+            for code, org in (("BT01", paris), ("BT02", lyon), ("BT03", rabat)):
+                screen = Screen(name=code, unique_code=code, organization_id=org.id, is_active=True)
+                screen.set_password("password")
+                screens.append(screen)
+            db.session.add_all(screens)
+            db.session.commit()
+            self.paris_screen, self.lyon_screen, self.rabat_screen = [s.id for s in screens]
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def _broadcast(self, name, **kwargs):
+        broadcast = Broadcast(name=name, broadcast_type=Broadcast.BROADCAST_TYPE_OVERLAY,
+                              overlay_message=name, is_active=True, **kwargs)
+        db.session.add(broadcast)
+        db.session.commit()
+        return broadcast.id
+
+    def _screens_of(self, broadcast_id):
+        rows = db.session.query(broadcast_screen_targets.c.screen_id).filter(
+            broadcast_screen_targets.c.broadcast_id == broadcast_id
+        ).all()
+        return sorted(row.screen_id for row in rows)
+
+    def _pairs(self):
+        return sorted(db.session.query(broadcast_screen_targets).all())
+
+    def test_fan_out_per_target_type(self):
+        with app.app_context():
+            country = self._broadcast("country", target_type=Broadcast.TARGET_COUNTRY, target_country="FR")
+            city = self._broadcast("city", target_type=Broadcast.TARGET_CITY, target_country="FR",
+                                   target_city="paris")
+            org = self._broadcast("org", target_type=Broadcast.TARGET_ORGANIZATION,
+                                  target_organization_id=self.rabat_id)
+            screen = self._broadcast("screen", target_type=Broadcast.TARGET_SCREEN,
+                                     target_screen_id=self.lyon_screen)
+            free = self._broadcast("free", target_type=Broadcast.TARGET_COUNTRY, target_country="FR",
+                                   target_org_type=Broadcast.ORG_TYPE_FREE)
+
+            self.assertEqual(self._screens_of(country), [self.paris_screen, self.lyon_screen])
+            self.assertEqual(self._screens_of(city), [self.paris_screen])
+            self.assertEqual(self._screens_of(org), [self.rabat_screen])
+            self.assertEqual(self._screens_of(screen), [self.lyon_screen])
+            self.assertEqual(self._screens_of(free), [self.lyon_screen])
+
+            self.assertEqual(count_target_screens([country, city]), {country: 2, city: 1})
+
+    def test_mapping_follows_broadcast_screen_and_org_changes(self):
+        with app.app_context():
+            broadcast_id = self._broadcast("b", target_type=Broadcast.TARGET_COUNTRY, target_country="FR")
+
+            broadcast = db.session.get(Broadcast, broadcast_id)
+            broadcast.target_country = "MA"
+            db.session.commit()
+            self.assertEqual(self._screens_of(broadcast_id), [self.rabat_screen])
+
+            rabat = db.session.get(Organization, self.rabat_id)
+            rabat.country = "FR"
+            db.session.commit()
+            self.assertEqual(self._screens_of(broadcast_id), [])
+
+            lyon_screen = db.session.get(Screen, self.lyon_screen)
+            lyon_screen.organization_id = self.paris_id
+            broadcast.target_country = "FR"
+            broadcast.target_type = Broadcast.TARGET_ORGANIZATION
+            broadcast.target_organization_id = self.paris_id
+            db.session.commit()
+            self.assertEqual(self._screens_of(broadcast_id), [self.paris_screen, self.lyon_screen])
+
+            new_screen = Screen(name="BT04", unique_code="BT04", organization_id=self.paris_id, is_active=True)
+            new_screen.set_password("password")
+            db.session.add(new_screen)
+            db.session.commit()
+            self.assertIn(new_screen.id, self._screens_of(broadcast_id))
+
+            db.session.delete(broadcast)
+            db.session.commit()
+            self.assertEqual(self._screens_of(broadcast_id), [])
+
+    def test_rebuild_matches_incremental_mapping(self):
+        with app.app_context():
+            self._broadcast("country", target_type=Broadcast.TARGET_COUNTRY, target_country="FR",
+                            target_org_type=Broadcast.ORG_TYPE_PAID)
+            self._broadcast("city", target_type=Broadcast.TARGET_CITY, target_country="MA", target_city="RABAT")
+            incremental = self._pairs()
+
+            rebuild_broadcast_targets()
+            self.assertEqual(self._pairs(), incremental)
+
+    def test_active_broadcasts_query_uses_time_window_and_flags(self):
+        with app.app_context():
+            active = self._broadcast("active", target_type=Broadcast.TARGET_COUNTRY, target_country="FR")
+            paused = self._broadcast("paused", target_type=Broadcast.TARGET_COUNTRY, target_country="FR")
+            db.session.get(Broadcast, paused).is_active = False
+            db.session.commit()
+
+            screen = db.session.get(Screen, self.paris_screen)
+            found = [b.id for b in Broadcast.get_active_broadcasts_query(screen).all()]
+            self.assertEqual(found, [active])
+
+            screen.is_active = False
+            db.session.commit()
+            self.assertEqual(Broadcast.get_active_broadcasts_query(screen).all(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
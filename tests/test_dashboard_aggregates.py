@@ -0,0 +1,175 @@
+import unittest
+import os
+from datetime import datetime, timedelta
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, User, Content, Booking
+from services import dashboard_aggregates
+from services.dashboard_aggregates import DashboardAggregates
+
+
+class TestDashboardAggregates(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        DashboardAggregates.clear()
+
+        with app.app_context():
+            db.create_all()
+
+            paris = Organization(name="Paris Org", email="paris@org.com", country="FR", city="Paris",
+                                 currency='EUR', commission_rate=10.0)
+            dakar = Organization(name="Dakar Org", email="dakar@org.com", country="SN", city="Dakar",
+                                 currency='XOF', commission_rate=20.0)
+            db.session.add_all([paris, dakar])
+            db.session.commit()
+
+            screens = [Screen(name=f"Screen {org.name}", unique_code=f"DA{org.id}", organization_id=org.id)
+                       for org in (paris, dakar)]
+            for screen in screens:
+                screen.set_password("password")
+            admin = User(username='superadmin', email='admin@test.com', role='superadmin', is_active=True)
+            admin.set_password('password')
+            db.session.add_all(screens + [admin])
+            db.session.commit()
+            self.screen_ids = [screen.id for screen in screens]
+            self.admin_id = admin.id
+
+            content = Content(filename='ad.png', original_filename='ad.png', content_type='image',
+                              file_path='/tmp/ad.png', screen_id=screens[0].id, status='approved')
+            db.session.add(content)
+            db.session.commit()
+            self.content_id = content.id
+
+            now = datetime.utcnow()
+            self.add_booking(self.screen_ids[0], 100.0, 'paid', now - timedelta(days=60))
+            self.add_booking(self.screen_ids[0], 50.0, 'paid', now - timedelta(days=3))
+            self.add_booking(self.screen_ids[1], 1000.0, 'paid', now)
+            self.add_booking(self.screen_ids[1], 999.0, 'pending', now)
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        DashboardAggregates.clear()
+
+    def add_booking(self, screen_id, price, payment_status, created_at=None):
+        booking = Booking(screen_id=screen_id, content_id=self.content_id, slot_duration=10, num_plays=10,
+                          price_per_play=price / 10, total_price=price, payment_status=payment_status,
+                          created_at=created_at or datetime.utcnow())
+        db.session.add(booking)
+        db.session.commit()
+        return booking
+
+    def summary(self, stats):
+        return {
+            'totals': (stats['total_revenue'], stats['weekly_revenue'], stats['monthly_revenue'],
+                       round(stats['total_platform_commission'], 6), round(stats['weekly_commission'], 6)),
+            'currencies': (stats['revenues_by_currency'], stats['weekly_rev_dict'], stats['monthly_rev_dict']),
+            'top': [(o['name'], o['revenue'], o['commission']) for o in stats['top_orgs_data']],
+            'countries': sorted(
+                (c['country_code'], c['org_count'], c['screen_count'],
+                 tuple((x['currency_code'], x['total'], x['daily_total'], x['weekly_total'], x['monthly_total'])
+                       for x in c['currencies']))
+                for c in stats['country_stats']),
+        }
+
+    def test_initial_aggregates(self):
+        with app.app_context():
+            stats = DashboardAggregates.stats()
+
+        self.assertEqual((stats['total_orgs'], stats['total_screens']), (2, 2))
+        self.assertEqual(stats['total_revenue'], 1150.0)
+        self.assertEqual(stats['weekly_revenue'], 1050.0)
+        self.assertEqual(stats['revenues_by_currency'], {'EUR': 150.0, 'XOF': 1000.0})
+        self.assertAlmostEqual(stats['total_platform_commission'], 215.0)
+        self.assertEqual([o['name'] for o in stats['top_orgs_data']], ['Dakar Org', 'Paris Org'])
+        self.assertEqual(stats['top_orgs_data'][0]['commission'], 200.0)
+
+    def test_committed_booking_changes_match_a_recount(self):
+        with app.app_context():
+            DashboardAggregates.stats()
+
+            self.add_booking(self.screen_ids[0], 25.0, 'paid')
+            pending = Booking.query.filter_by(payment_status='pending').one()
+            pending.payment_status = 'paid'
+            db.session.commit()
+            old = Booking.query.filter_by(total_price=100.0).one()
+            old.total_price = 80.0
+            db.session.commit()
+            db.session.delete(Booking.query.filter_by(total_price=50.0).one())
+            db.session.commit()
+
+            # Rolled back changes are not applied
+            self.add_booking(self.screen_ids[0], 10.0, 'pending').payment_status = 'paid'
+            db.session.flush()
+            db.session.rollback()
+
+            incremental = self.summary(DashboardAggregates.stats())
+            recounted = self.summary(DashboardAggregates.stats(force_refresh=True))
+
+        self.assertEqual(incremental, recounted)
+        self.assertEqual(incremental['totals'][0], 80.0 + 25.0 + 1000.0 + 999.0)
+
+    def test_recount_does_not_replay_deltas_it_already_read(self):
+        read_revenue = dashboard_aggregates._read_revenue
+
+        def recount_racing_a_payment(snapshot, paid_before_read):
+            def read(window_start):
+                # A booking is paid while the recount runs, in transaction 105
+                if paid_before_read:
+                    self.add_booking(self.screen_ids[0], 25.0, 'paid')
+                totals, daily, _ = read_revenue(window_start)
+                if not paid_before_read:
+                    self.add_booking(self.screen_ids[0], 25.0, 'paid')
+                return totals, daily, snapshot
+            return read
+
+        with app.app_context(), mock.patch.object(dashboard_aggregates, '_transaction_id', return_value=105):
+            DashboardAggregates.stats()
+            # Committed before the snapshot: the recount holds it already
+            with mock.patch.object(dashboard_aggregates, '_read_revenue',
+                                   recount_racing_a_payment((100, 110, set()), paid_before_read=True)):
+                self.assertEqual(DashboardAggregates.stats(force_refresh=True)['total_revenue'], 1175.0)
+
+            # Still in progress when the snapshot was taken: replayed on top of it
+            with mock.patch.object(dashboard_aggregates, '_read_revenue',
+                                   recount_racing_a_payment((100, 110, {105}), paid_before_read=False)):
+                self.assertEqual(DashboardAggregates.stats(force_refresh=True)['total_revenue'], 1200.0)
+            self.assertEqual(DashboardAggregates.stats(force_refresh=True)['total_revenue'], 1200.0)
+
+        self.assertEqual(dashboard_aggregates._parse_snapshot('100:110:102,105'), (100, 110, {102, 105}))
+        self.assertEqual(dashboard_aggregates._parse_snapshot('100:100:'), (100, 100, set()))
+
+    def test_booking_on_new_screen_is_applied_once_the_directory_reloads(self):
+        with app.app_context():
+            DashboardAggregates.stats()
+
+            screen = Screen(name="New Screen", unique_code="DANEW", organization_id=1)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+            self.add_booking(screen.id, 30.0, 'paid')
+
+            stats = DashboardAggregates.stats()
+            self.assertEqual(stats['total_revenue'], 1180.0)
+            self.assertEqual(stats['total_screens'], 3)
+
+    def test_dashboard_renders(self):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.admin_id)
+            sess['_fresh'] = True
+
+        self.assertEqual(self.client.get('/admin/dashboard').status_code, 200)
+        self.assertEqual(self.client.get('/admin/dashboard?refresh=true').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+import unittest
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Organization, Screen
+from services import ffmpeg_supervisor
+from services.ffmpeg_supervisor import (
+    FFmpegSupervisor, SupervisorClient, SupervisorError, SupervisorUnavailable, channel_key
+)
+from services.hls_converter import HLSConverter
+
+SOURCE = 'http://8.8.8.8/live/channel1.ts'
+OTHER_SOURCE = 'http://8.8.4.4/live/channel2.ts'
+
+# Stands in for ffmpeg: writes a playlist with one segment next to its last
+# argument and keeps running, or exits at once when told to crash, or
+# ignores SIGTERM when told to be stubborn
+FAKE_FFMPEG = """#!{python}
+import os, signal, sys, time
+if 'crash' in ' '.join(sys.argv):
+    sys.stderr.write('Connection refused\\n')
+    sys.exit(1)
+if 'stubborn' in ' '.join(sys.argv):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+manifest = sys.argv[-1]
+output_dir = os.path.dirname(manifest)
+with open(os.path.join(output_dir, 'segment000.ts'), 'wb') as f:
+    f.write(b'ts')
+with open(manifest, 'w') as f:
+    f.write('#EXTM3U\\n#EXTINF:2.0,\\nsegment000.ts\\n')
+time.sleep(60)
+"""
+
+
+class SupervisorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='sup')
+        self.root = os.path.join(self.tmp, 'hls')
+        self.socket_path = os.path.join(self.tmp, 's.sock')
+        ffmpeg_bin = os.path.join(self.tmp, 'ffmpeg')
+        with open(ffmpeg_bin, 'w') as f:
+            f.write(FAKE_FFMPEG.format(python=sys.executable))
+        os.chmod(ffmpeg_bin, os.stat(ffmpeg_bin).st_mode | stat.S_IEXEC)
+
+        self.supervisor = FFmpegSupervisor(self.socket_path, self.root, ffmpeg_bin=ffmpeg_bin, max_jobs=2)
+        self.thread = threading.Thread(target=self.supervisor.serve_forever, daemon=True)
+        self.thread.start()
+        self.client = SupervisorClient(self.socket_path, autostart=False, root=self.root)
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self.socket_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.supervisor.shutdown()
+        self.thread.join(timeout=5)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class TestFFmpegSupervisor(SupervisorTestCase):
+    def test_start_is_idempotent_and_waits_for_the_manifest(self):
+        first = self.client.start('SCR001', SOURCE)
+        self.assertFalse(first['reused'])
+        second = self.client.start('SCR001', SOURCE)
+        self.assertTrue(second['reused'])
+        self.assertEqual(second['job']['pid'], first['job']['pid'])
+
+        result = self.client.wait('SCR001', timeout=10)
+        self.assertTrue(result['ready'])
+        self.assertEqual(result['job']['state'], 'ready')
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'SCR001', 'segment000.ts')))
+
+        # A new channel replaces the encoder
+        replaced = self.client.start('SCR001', OTHER_SOURCE)
+        self.assertFalse(replaced['reused'])
+        self.assertNotEqual(replaced['job']['pid'], first['job']['pid'])
+        self.assertEqual(self.client.status('SCR001')['source_url'], OTHER_SOURCE)
+
+        self.assertTrue(self.client.stop('SCR001'))
+        self.assertFalse(self.client.stop('SCR001'))
+        self.assertIsNone(self.client.status('SCR001'))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'SCR001')))
+
+    def test_encoder_limit_and_validation(self):
+        self.client.start('SCR001', SOURCE)
+        self.client.start('SCR002', SOURCE)
+        with self.assertRaises(SupervisorError) as ctx:
+            self.client.start('SCR003', SOURCE)
+        self.assertEqual(ctx.exception.code, 'busy')
+        # Existing jobs may still switch channel
+        self.assertFalse(self.client.start('SCR002', OTHER_SOURCE)['reused'])
+        self.assertEqual(len(self.client.status()['jobs']), 2)
+
+        for key, url in (('../etc', SOURCE), ('SCR004', 'file:///etc/passwd'), ('SCR004', '-i')):
+            with self.assertRaises(SupervisorError) as ctx:
+                self.client.start(key, url)
+            self.assertEqual(ctx.exception.code, 'invalid')
+
+    def test_crashing_encoders_back_off_then_fail(self):
+        events = []
+        listener = threading.Thread(target=lambda: events.extend(
+            e['event'] for e in self.client.events() if e['event'] != 'stopped'
+        ), daemon=True)
+        listener.start()
+        time.sleep(0.2)
+
+        with mock.patch.object(ffmpeg_supervisor, 'FFMPEG_MAX_RESTARTS', 1):
+            self.client.start('SCR001', 'http://8.8.8.8/crash.ts')
+            result = self.client.wait('SCR001', timeout=10)
+
+        self.assertFalse(result['ready'])
+        job = result['job']
+        self.assertEqual(job['state'], 'failed')
+        self.assertEqual(job['restarts'], 1)
+        self.assertEqual(job['last_exit'], 1)
+        # Events reach subscribers from their own thread, shortly after
+        deadline = time.monotonic() + 5
+        while len(events) < 6 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(events, ['started', 'exited', 'restarting', 'started', 'exited', 'failed'])
+
+        # A failed job does not hold an encoder slot, and a new start retries it
+        self.assertFalse(self.client.start('SCR001', 'http://8.8.8.8/crash.ts')['reused'])
+
+    def test_stopping_an_encoder_does_not_block_other_requests(self):
+        stubborn = 'http://8.8.8.8/stubborn.ts'
+        first = self.client.start('SCR001', stubborn)
+        self.assertTrue(self.client.wait('SCR001', timeout=10)['ready'])
+
+        started = time.monotonic()
+        # Replacing the encoder returns at once; the new one waits for the old to die
+        replaced = self.client.start('SCR001', OTHER_SOURCE)
+        self.assertEqual(self.client.status('SCR001')['state'], 'starting')
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertIsNone(replaced['job']['pid'])
+
+        result = self.client.wait('SCR001', timeout=10)
+        self.assertTrue(result['ready'])
+        self.assertNotEqual(result['job']['pid'], first['job']['pid'])
+        with self.assertRaises(ProcessLookupError):
+            os.kill(first['job']['pid'], 0)
+
+        self.client.start('SCR002', stubborn)
+        started = time.monotonic()
+        self.assertTrue(self.client.stop('SCR002'))
+        self.assertEqual(len(self.client.status()['jobs']), 1)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'SCR002')))
+
+    def test_subscriber_that_stops_reading_is_dropped(self):
+        self.client.start('SCR001', SOURCE)
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(stalled.close)
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        with mock.patch.object(ffmpeg_supervisor, 'SUPERVISOR_EVENT_BACKLOG', 8):
+            stalled.connect(self.socket_path)
+            stalled.sendall(b'{"op": "events"}\n')
+            deadline = time.monotonic() + 5
+            while not self.supervisor._subscribers and time.monotonic() < deadline:
+                time.sleep(0.05)
+        self.assertEqual(len(self.supervisor._subscribers), 1)
+
+        # Far more than the socket buffers hold; the subscriber never reads
+        emitter = threading.Thread(target=self._emit_many, args=(200,), daemon=True)
+        emitter.start()
+        emitter.join(timeout=5)
+        self.assertFalse(emitter.is_alive())
+        self.assertEqual(self.supervisor._subscribers, {})
+        self.assertEqual(self.client.status('SCR001')['source_url'], SOURCE)
+
+    def _emit_many(self, count):
+        with self.supervisor._cond:
+            job = self.supervisor.jobs['SCR001']
+            for _ in range(count):
+                self.supervisor._emit('ready', job, padding='x' * 16384)
+
+    def test_screens_on_a_channel_share_one_encoder(self):
+        key = channel_key(SOURCE)
+        for screen in ('SCR001', 'SCR002', 'SCR003'):
+            response = self.client.subscribe(screen, SOURCE)
+            self.assertEqual(response['key'], key)
+        self.assertEqual(len(self.client.status()['jobs']), 1)
+        job = self.client.status(screen='SCR002')
+        self.assertEqual(job['subscribers'], ['SCR001', 'SCR002', 'SCR003'])
+        self.assertTrue(response['reused'])
+
+        # Switching channel leaves the old one, which keeps its other screens
+        self.assertEqual(self.client.subscribe('SCR003', OTHER_SOURCE)['key'], channel_key(OTHER_SOURCE))
+        self.assertEqual(self.client.status(key)['subscribers'], ['SCR001', 'SCR002'])
+        # Distinct channels count against the limit, not screens
+        with self.assertRaises(SupervisorError):
+            self.client.subscribe('SCR004', 'http://8.8.8.8/third.ts')
+        self.client.subscribe('SCR004', SOURCE)
+
+        self.assertEqual(self.client.unsubscribe('SCR001'), {'unsubscribed': True, 'stopped': False})
+        self.assertEqual(self.client.unsubscribe('SCR001'), {'unsubscribed': False, 'stopped': False})
+        self.client.unsubscribe('SCR002')
+        self.assertEqual(self.client.unsubscribe('SCR004'), {'unsubscribed': True, 'stopped': True})
+        self.assertIsNone(self.client.status(key))
+        self.assertFalse(os.path.exists(os.path.join(self.root, key)))
+
+    def test_lapsed_subscriptions_stop_idle_channels(self):
+        self.client.subscribe('SCR001', SOURCE)
+        self.client.subscribe('SCR002', SOURCE)
+        # SCR001 renews, SCR002 stopped asking
+        self.supervisor.jobs[channel_key(SOURCE)].subscribers['SCR002'] -= 600
+        self.supervisor.tick()
+        self.assertEqual(self.client.status(screen='SCR001')['subscribers'], ['SCR001'])
+        self.assertIsNone(self.client.status(screen='SCR002'))
+
+        with mock.patch.object(ffmpeg_supervisor, 'FFMPEG_SUBSCRIPTION_TTL', -1):
+            self.supervisor.tick()
+        self.assertEqual(self.client.status()['jobs'], [])
+
+    def test_client_without_supervisor(self):
+        client = SupervisorClient(os.path.join(self.tmp, 'none.sock'), autostart=False)
+        with self.assertRaises(SupervisorUnavailable):
+            client.status()
+
+    def test_hls_converter_uses_the_supervisor(self):
+        with mock.patch.object(HLSConverter, '_client', self.client), \
+                mock.patch.object(HLSConverter, 'HLS_TEMP_DIR', self.supervisor.root):
+            manifest = HLSConverter.convert_mpegts_to_hls_file(SOURCE, 'SCR001')
+            self.assertTrue(manifest.endswith(os.path.join(channel_key(SOURCE), 'stream.m3u8')))
+            self.assertTrue(HLSConverter.is_running('SCR001'))
+            self.assertEqual(HLSConverter.get_current_url('SCR001'), SOURCE)
+            self.assertEqual(HLSConverter.list_available_segments(SOURCE), ['segment000.ts'])
+            self.assertIsNone(HLSConverter.get_segment_path(SOURCE, '../s.sock'))
+
+            with self.assertRaises(ValueError):
+                HLSConverter.convert_mpegts_to_hls_file('http://127.0.0.1/live.ts', 'SCR001')
+
+            HLSConverter.stop_stream('SCR001')
+            self.assertFalse(HLSConverter.is_running('SCR001'))
+            self.assertIsNone(HLSConverter.get_current_url('SCR001'))
+
+
+
+class TestSharedChannelRoutes(SupervisorTestCase):
+    def setUp(self):
+        super().setUp()
+        app.config['TESTING'] = True
+        self.app_client = app.test_client()
+        self.patches = [mock.patch.object(HLSConverter, '_client', self.client),
+                        mock.patch.object(HLSConverter, 'HLS_TEMP_DIR', self.supervisor.root)]
+        for patch in self.patches:
+            patch.start()
+
+        with app.app_context():
+            db.create_all()
+            org = Organization(name="Venue Chain", email="venue@org.com")
+            db.session.add(org)
+            db.session.commit()
+            self.screen_ids = {}
+            for code in ('TV0001', 'TV0002'):
+                screen = Screen(name=code, unique_code=code, organization_id=org.id,
+                                current_mode='iptv', current_iptv_channel=SOURCE)
+                screen.set_password("password")
+                db.session.add(screen)
+                db.session.commit()
+                self.screen_ids[code] = screen.id
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        super().tearDown()
+
+    def get_as(self, code, url):
+        with self.app_client.session_transaction() as sess:
+            sess['screen_id'] = self.screen_ids[code]
+        return self.app_client.get(url)
+
+    def test_screens_on_a_channel_share_its_output(self):
+        for code in ('TV0001', 'TV0002'):
+            response = self.get_as(code, f'/player/tv-stream/{code}')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(f'/player/tv-segment/{code}/segment000.ts', response.get_data(as_text=True))
+
+            response = self.get_as(code, f'/player/tv-segment/{code}/segment000.ts')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, b'ts')
+            response.close()
+
+        jobs = self.client.status()['jobs']
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['subscribers'], ['TV0001', 'TV0002'])
+
+        with self.app_client.session_transaction() as sess:
+            sess['screen_id'] = self.screen_ids['TV0001']
+            sess['_csrf_token'] = 'token'
+        response = self.app_client.post('/player/tv-stop/TV0001', headers={'X-CSRF-Token': 'token'})
+        self.assertEqual(response.status_code, 200)
+        # The other screen keeps watching
+        self.assertEqual(self.client.status()['jobs'][0]['subscribers'], ['TV0002'])
+        self.assertEqual(self.get_as('TV0002', '/player/tv-segment/TV0002/segment000.ts').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
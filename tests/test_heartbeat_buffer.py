@@ -0,0 +1,109 @@
+import unittest
+import os
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization, HeartbeatLog
+from services import heartbeat_buffer
+from services.heartbeat_buffer import HeartbeatBuffer
+from services.jwt_service import generate_tokens
+from services.scheduler import Scheduler
+
+
+class TestHeartbeatBuffer(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            HeartbeatBuffer.clear()
+
+            org = Organization(name="Beat Org", email="beat@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screens = []
+            for code in ("HB01", "HB02"):
+                screen = Screen(name=code, unique_code=code, organization_id=org.id, is_active=True)
+                screen.set_password("password")
+                screens.append(screen)
+            db.session.add_all(screens)
+            db.session.commit()
+            self.screen_ids = [s.id for s in screens]
+
+            access_token = generate_tokens(screen_id=self.screen_ids[0])["access_token"]
+        self.headers = {'Authorization': f'Bearer {access_token}'}
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            HeartbeatBuffer.clear()
+
+    def test_flush_batches_inserts_and_updates(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lstrip().split(None, 1)[0].upper())
+
+        first, second = self.screen_ids
+        with app.app_context(), mock.patch.object(Scheduler, 'is_running', return_value=True):
+            for screen_id, status in ((first, 'online'), (second, 'online'), (first, 'playing')):
+                self.assertTrue(HeartbeatBuffer.accept(screen_id, status))
+            self.assertEqual(HeartbeatLog.query.count(), 0)
+            self.assertEqual(HeartbeatBuffer.stats()['buffered'], 3)
+
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                self.assertEqual(HeartbeatBuffer.flush(), 3)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+            self.assertEqual(statements.count('INSERT'), 1)
+            self.assertEqual(statements.count('UPDATE'), 1)
+            self.assertEqual(HeartbeatLog.query.count(), 3)
+            screen = db.session.get(Screen, first)
+            self.assertEqual(screen.status, 'playing')
+            self.assertIsNotNone(screen.last_heartbeat)
+
+            stats = HeartbeatBuffer.stats()
+            self.assertEqual((stats['buffered'], stats['flushed'], stats['flushes']), (0, 3, 1))
+
+    def test_buffer_is_bounded(self):
+        with app.app_context(), mock.patch.object(Scheduler, 'is_running', return_value=True), \
+                mock.patch.object(heartbeat_buffer, 'HEARTBEAT_BUFFER_SIZE', 2):
+            for _ in range(5):
+                HeartbeatBuffer.accept(self.screen_ids[0], 'online')
+
+            stats = HeartbeatBuffer.stats()
+            self.assertEqual((stats['accepted'], stats['dropped'], stats['buffered']), (2, 3, 2))
+            self.assertFalse(HeartbeatBuffer.accept(9999, 'online'))
+
+    def test_endpoint_writes_through_without_scheduler(self):
+        response = self.client.post('/mobile/api/v1/screen/heartbeat', json={'status': 'playing'},
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        with app.app_context():
+            self.assertEqual(HeartbeatLog.query.filter_by(screen_id=self.screen_ids[0]).count(), 1)
+            self.assertEqual(db.session.get(Screen, self.screen_ids[0]).status, 'playing')
+
+            orphan = generate_tokens(screen_id=9999)["access_token"]
+        response = self.client.post('/mobile/api/v1/screen/heartbeat', json={},
+                                    headers={'Authorization': f'Bearer {orphan}'})
+        self.assertEqual(response.status_code, 404)
+
+        health = self.client.get('/mobile/api/v1/health').get_json()
+        self.assertEqual(health['heartbeats']['flushed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
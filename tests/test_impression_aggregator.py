@@ -0,0 +1,117 @@
+import unittest
+import os
+import json
+import tempfile
+from datetime import date
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization
+from models.ad_content import AdContent, AdContentStat
+from services import impression_aggregator
+from services.impression_aggregator import ImpressionAggregator
+from services.scheduler import Scheduler
+
+
+class TestImpressionAggregator(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(impression_aggregator, 'IMPRESSION_SPOOL_DIR', self.spool_dir.name),
+            mock.patch.object(Scheduler, 'is_running', return_value=True),
+        ]
+        for patch in self.patches:
+            patch.start()
+        ImpressionAggregator.clear()
+
+        with app.app_context():
+            db.create_all()
+            org = Organization(name="Imp Org", email="imp@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+            screen = Screen(name="Imp", unique_code="IMP01", organization_id=org.id, is_active=True)
+            screen.set_password("password")
+            ad = AdContent(name="Ad", reference="IMPAD", file_path="ad.jpg", status=AdContent.STATUS_ACTIVE)
+            db.session.add_all([screen, ad])
+            db.session.commit()
+            self.screen_id, self.org_id, self.ad_id = screen.id, org.id, ad.id
+        self.today = date.today()
+
+    def tearDown(self):
+        ImpressionAggregator.clear()
+        for patch in self.patches:
+            patch.stop()
+        self.spool_dir.cleanup()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def _spool_files(self):
+        return sorted(os.listdir(self.spool_dir.name))
+
+    def _record(self, count, duration):
+        ImpressionAggregator.record(self.screen_id, self.org_id, {(self.ad_id, self.today): (count, duration)})
+
+    def test_flush_upserts_aggregated_rows(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lstrip()[:25].upper())
+
+        with app.app_context():
+            self._record(1, 10.0)
+            self._record(2, 20.0)
+            self.assertEqual(AdContentStat.query.count(), 0)
+            self.assertEqual(self._spool_files(), [f'{os.getpid()}.spool'])
+
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                self.assertEqual(ImpressionAggregator.flush(), 1)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+            self.assertEqual(sum(s.startswith('INSERT INTO AD_CONTENT_ST') for s in statements), 1)
+            self.assertEqual(self._spool_files(), [])
+
+            # Second flush lands on the same (ad, screen, day) row
+            self._record(4, 40.0)
+            ImpressionAggregator.flush()
+
+            stat = AdContentStat.query.one()
+            self.assertEqual((stat.impressions, stat.total_duration), (7, 70.0))
+            ad = db.session.get(AdContent, self.ad_id)
+            self.assertEqual((ad.total_impressions, ad.total_duration_played), (7, 70.0))
+
+    def test_replays_spool_of_dead_process(self):
+        dead_pid = 2 ** 22 + 1
+        with open(os.path.join(self.spool_dir.name, f'{dead_pid}.spool'), 'w') as handle:
+            handle.write(json.dumps([self.ad_id, self.screen_id, self.org_id, self.today.isoformat(), 3, 30.0]) + '\n')
+            handle.write(json.dumps([self.ad_id, self.screen_id, self.org_id, self.today.isoformat(), 2, 20.0]) + '\n')
+            handle.write('[1, 2, ')  # torn write
+
+        with app.app_context():
+            self.assertEqual(ImpressionAggregator.flush(), 1)
+            self.assertEqual(AdContentStat.query.one().impressions, 5)
+            self.assertEqual(self._spool_files(), [])
+
+    def test_failed_flush_keeps_impressions(self):
+        with app.app_context():
+            self._record(1, 10.0)
+            with mock.patch.object(AdContentStat, 'upsert_impressions', side_effect=RuntimeError('db down')):
+                self.assertEqual(ImpressionAggregator.flush(), 0)
+
+            self.assertEqual(ImpressionAggregator.pending(), 1)
+            self.assertEqual(self._spool_files(), [f'{os.getpid()}.spool'])
+
+            ImpressionAggregator.flush()
+            self.assertEqual(AdContentStat.query.one().impressions, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
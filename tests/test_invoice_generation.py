@@ -0,0 +1,131 @@
+import unittest
+import os
+from datetime import datetime, date, timedelta
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, Content, Booking, Invoice, SiteSetting
+from routes import billing_routes
+from routes.billing_routes import generate_invoice_for_week
+from services.invoice_generation import generate_weekly_invoices
+
+WEEK_START = date(2026, 10, 5)
+WEEK_END = date(2026, 10, 11)
+
+
+class TestInvoiceGeneration(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            SiteSetting.set('platform_vat_rate', 20, 'float')
+
+            orgs = [
+                Organization(name="Billed Org", email="billed@org.com", currency='EUR', commission_rate=10.0),
+                Organization(name="Validated Org", email="validated@org.com", currency='XOF', commission_rate=15.0),
+                Organization(name="Idle Org", email="idle@org.com"),
+                Organization(name="Inactive Org", email="inactive@org.com", is_active=False),
+            ]
+            db.session.add_all(orgs)
+            db.session.commit()
+            self.org_ids = [org.id for org in orgs]
+
+            screens = [Screen(name=f"Screen {org.id}", unique_code=f"INV{org.id}", organization_id=org.id)
+                       for org in orgs]
+            for screen in screens:
+                screen.set_password("password")
+            db.session.add_all(screens)
+            db.session.commit()
+
+            content = Content(filename='ad.png', original_filename='ad.png', content_type='image',
+                              file_path='/tmp/ad.png', screen_id=screens[0].id, status='approved')
+            db.session.add(content)
+            db.session.commit()
+
+            in_week = datetime.combine(WEEK_START, datetime.min.time()) + timedelta(days=2)
+            bookings = [
+                (screens[0], 100.0, 'paid', in_week),
+                (screens[0], 23.45, 'paid', datetime.combine(WEEK_END, datetime.max.time())),
+                (screens[0], 500.0, 'pending', in_week),
+                (screens[0], 70.0, 'paid', in_week + timedelta(days=7)),
+                (screens[1], 200.0, 'paid', in_week),
+                (screens[3], 300.0, 'paid', in_week),
+            ]
+            db.session.add_all([
+                Booking(screen_id=screen.id, content_id=content.id, slot_duration=10, num_plays=10,
+                        price_per_play=price / 10, total_price=price, payment_status=status, created_at=created)
+                for screen, price, status, created in bookings
+            ])
+            db.session.add(Invoice(invoice_number='FAC-VALIDATED', organization_id=orgs[1].id,
+                                   week_start_date=WEEK_START, week_end_date=WEEK_END, gross_revenue=1.0,
+                                   commission_rate=15.0, status=Invoice.STATUS_VALIDATED))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def columns(self, invoice):
+        return {key: getattr(invoice, key) for key in (
+            'gross_revenue', 'commission_rate', 'commission_amount', 'net_revenue', 'currency', 'bookings_count',
+            'vat_rate', 'vat_amount', 'commission_with_vat', 'status')}
+
+    def test_bulk_generation_matches_per_organization_generation(self):
+        with app.app_context():
+            report = generate_weekly_invoices(WEEK_START, WEEK_END, dry_run=True)
+            self.assertEqual((report['created'], report['skipped_existing']), (1, 1))
+            self.assertEqual(Invoice.query.count(), 1)
+            self.assertEqual(set(report['timings']), {'aggregate_ms', 'build_ms', 'write_ms', 'total_ms'})
+
+            report = generate_weekly_invoices(WEEK_START, WEEK_END)
+            self.assertEqual(report['created'], 1)
+            bulk = self.columns(Invoice.query.filter_by(organization_id=self.org_ids[0]).one())
+
+            db.session.delete(Invoice.query.filter_by(organization_id=self.org_ids[0]).one())
+            db.session.commit()
+            single = self.columns(generate_invoice_for_week(self.org_ids[0], WEEK_START, WEEK_END))
+
+        self.assertEqual(bulk, single)
+        self.assertEqual(bulk['gross_revenue'], 123.45)
+        self.assertEqual(bulk['bookings_count'], 2)
+        self.assertEqual(bulk['commission_with_vat'], round(12.35 * 1.2, 2))
+
+    def test_refresh_existing_leaves_validated_invoices(self):
+        with app.app_context():
+            generate_weekly_invoices(WEEK_START, WEEK_END)
+            invoice = Invoice.query.filter_by(organization_id=self.org_ids[0]).one()
+            invoice.gross_revenue = 0
+            db.session.commit()
+
+            report = generate_weekly_invoices(WEEK_START, WEEK_END, refresh_existing=True)
+            self.assertEqual((report['created'], report['updated'], report['skipped_existing']), (0, 1, 1))
+            db.session.expire_all()
+            self.assertEqual(Invoice.query.filter_by(organization_id=self.org_ids[0]).one().gross_revenue, 123.45)
+            self.assertEqual(Invoice.query.filter_by(organization_id=self.org_ids[1]).one().gross_revenue, 1.0)
+
+    def test_cron_endpoint_dry_run(self):
+        with mock.patch.dict(os.environ, {'CRON_SECRET': 'cron'}), \
+                mock.patch.object(billing_routes, 'is_invoice_generation_time', return_value=True), \
+                mock.patch.object(billing_routes, 'get_last_week', return_value=(WEEK_START, WEEK_END)):
+            response = self.client.post('/org/billing/cron/generate-invoices?dry_run=true',
+                                        headers={'X-Cron-Secret': 'cron'})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['invoices_generated'], 1)
+        self.assertTrue(data['report']['dry_run'])
+        with app.app_context():
+            self.assertEqual(Invoice.query.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
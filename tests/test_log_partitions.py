@@ -0,0 +1,109 @@
+import unittest
+import os
+from datetime import datetime, timedelta
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import inspect
+from app import app, db
+from models import Screen, Organization, StatLog, HeartbeatLog
+from services import log_partitions
+from services.log_partitions import LogPartitions, LogTable
+from services.stat_rollups import StatRollup
+from services.uptime_service import compact_heartbeats
+
+
+class TestLogPartitions(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+
+        with app.app_context():
+            db.create_all()
+
+            org = Organization(name="Log Org", email="log@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screen = Screen(name="Log Screen", unique_code="LOG01", organization_id=org.id)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+            self.screen_id = screen.id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        StatRollup.reset()
+
+    def test_partition_bounds_and_names(self):
+        monthly = LogTable('stat_logs', 'played_at', 'month', 30)
+        start = monthly.period_start(datetime(2026, 12, 17, 13, 5))
+        self.assertEqual(start, datetime(2026, 12, 1))
+        self.assertEqual(monthly.next_period(start), datetime(2027, 1, 1))
+        self.assertEqual(monthly.partition_name(start), 'stat_logs_p2026_12')
+        self.assertEqual(monthly.partition_start('stat_logs_p2026_12'), start)
+        self.assertIsNone(monthly.partition_start('stat_logs_default'))
+        # Whole partitions are kept: the window starts at the partition boundary
+        self.assertEqual(monthly.retention_start(30, now=datetime(2026, 12, 17)), datetime(2026, 11, 1))
+
+        self.assertIsNone(LogTable('stat_logs', 'played_at', 'month', None).retention_start())
+
+        daily = LogTable('heartbeat_logs', 'timestamp', 'day', 2)
+        start = daily.period_start(datetime(2026, 12, 31, 23, 59))
+        self.assertEqual(daily.partition_name(start), 'heartbeat_logs_p2026_12_31')
+        self.assertEqual(daily.next_period(start), datetime(2027, 1, 1))
+        self.assertEqual(daily.retention_start(now=datetime(2027, 1, 2, 8)), datetime(2026, 12, 31))
+
+    def test_ensure_adds_heartbeat_indexes_without_partitioning(self):
+        with app.app_context():
+            db.session.execute(db.text('DROP INDEX idx_heartbeat_logs_screen_timestamp'))
+            db.session.commit()
+
+            LogPartitions.ensure()
+
+            indexes = {index['name'] for index in inspect(db.engine).get_indexes('heartbeat_logs')}
+            self.assertIn('idx_heartbeat_logs_screen_timestamp', indexes)
+            self.assertEqual(LogPartitions.partitions('heartbeat_logs'), [])
+
+    def test_fallback_purges_expired_rows_in_batches(self):
+        now = datetime.utcnow()
+        with app.app_context():
+            db.session.add_all(
+                [StatLog(screen_id=self.screen_id, content_type='image', played_at=now - timedelta(days=90))
+                 for _ in range(5)] +
+                [StatLog(screen_id=self.screen_id, content_type='image', played_at=now)] +
+                [HeartbeatLog(screen_id=self.screen_id, status='online', timestamp=now - timedelta(days=90)),
+                 HeartbeatLog(screen_id=self.screen_id, status='online', timestamp=now)]
+            )
+            db.session.commit()
+
+            # No stat_logs retention unless STAT_LOG_RETENTION_DAYS is set
+            LogPartitions.maintain()
+            self.assertEqual(StatLog.query.count(), 6)
+            # Plays not rolled up into stat_log_daily yet are kept
+            self.assertEqual(StatLog.cleanup_old_logs(days_to_keep=30), 0)
+
+            StatRollup.reset()
+            StatRollup.refresh()
+            StatRollup.refresh()
+            with mock.patch.object(log_partitions, 'LOG_PURGE_BATCH', 2):
+                self.assertEqual(StatLog.cleanup_old_logs(days_to_keep=30), 5)
+                LogPartitions.maintain()
+
+            self.assertEqual(StatLog.query.count(), 1)
+            # Heartbeats not compacted into status intervals yet are kept
+            self.assertEqual(HeartbeatLog.query.count(), 2)
+
+            compact_heartbeats(now=now)
+            LogPartitions.maintain()
+            self.assertEqual(HeartbeatLog.query.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import os
+from datetime import datetime, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization, Broadcast, ScreenOverlay
+from services.jwt_service import generate_tokens
+from services.overlay_service import reconcile_broadcast_overlays
+from services.playlist_snapshot import PlaylistSnapshotStore
+from services.scheduler import Scheduler, ScheduledJob
+
+
+class TestOverlayReconciler(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            PlaylistSnapshotStore.clear()
+
+            org = Organization(name="Overlay Org", email="overlay@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screens = []
+            for code in ("OV01", "OV02"):
+                screen = Screen(name=code, unique_code=code, organization_id=org.id, is_active=True)
+                screen.set_password("password")
+                screens.append(screen)
+            db.session.add_all(screens)
+            db.session.commit()
+            self.screen_ids = [s.id for s in screens]
+
+            local = ScreenOverlay(screen_id=self.screen_ids[0], message="local", position='footer', is_active=True)
+            db.session.add(local)
+            db.session.commit()
+            self.local_id = local.id
+
+            access_token = generate_tokens(screen_id=self.screen_ids[0])["access_token"]
+        self.headers = {'Authorization': f'Bearer {access_token}'}
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            PlaylistSnapshotStore.clear()
+
+    def _add_broadcast(self, **kwargs):
+        with app.app_context():
+            broadcast = Broadcast(name="News", broadcast_type=Broadcast.BROADCAST_TYPE_OVERLAY,
+                                  overlay_message="Breaking", overlay_position='footer',
+                                  target_type=Broadcast.TARGET_COUNTRY, target_country="FR",
+                                  is_active=True, **kwargs)
+            db.session.add(broadcast)
+            db.session.commit()
+            return broadcast.id
+
+    def test_materializes_overlays_for_all_target_screens(self):
+        broadcast_id = self._add_broadcast()
+
+        with app.app_context():
+            self.assertEqual(reconcile_broadcast_overlays(), (2, 0))
+            self.assertEqual(reconcile_broadcast_overlays(), (0, 0))
+
+            overlays = ScreenOverlay.query.filter_by(source_broadcast_id=broadcast_id).all()
+            self.assertEqual(sorted(o.screen_id for o in overlays), self.screen_ids)
+
+            local = db.session.get(ScreenOverlay, self.local_id)
+            self.assertTrue(local.is_paused)
+            self.assertEqual(local.paused_by_broadcast_id, broadcast_id)
+
+    def test_expiry_resumes_paused_overlays(self):
+        broadcast_id = self._add_broadcast(end_datetime=datetime.utcnow() + timedelta(hours=1))
+
+        with app.app_context():
+            reconcile_broadcast_overlays()
+            later = datetime.utcnow() + timedelta(hours=2)
+            self.assertEqual(reconcile_broadcast_overlays(now=later), (0, 2))
+
+            self.assertFalse(db.session.get(ScreenOverlay, self.local_id).is_paused)
+            active = ScreenOverlay.query.filter_by(source_broadcast_id=broadcast_id, is_active=True).count()
+            self.assertEqual(active, 0)
+
+    def test_playlist_read_path_does_not_write(self):
+        self._add_broadcast()
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lstrip().split(None, 1)[0].upper())
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                response = self.client.get('/mobile/api/v1/screen/playlist', headers=self.headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse({'INSERT', 'UPDATE', 'DELETE'} & set(statements))
+        # Not materialized yet: served straight from the broadcast
+        messages = [o['message'] for o in response.get_json()['overlays']]
+        self.assertIn('Breaking', messages)
+
+    def test_scheduler_runs_jobs_in_app_context(self):
+        calls = []
+        job = ScheduledJob('probe', lambda: calls.append(db.session.query(Screen).count()), interval=60)
+        Scheduler._app = app
+
+        Scheduler.run_job(job)
+
+        self.assertEqual(calls, [2])
+        self.assertIsNone(job.last_error)
+        self.assertIsNotNone(job.last_run)
+
+
+if __name__ == '__main__':
+    unittest.main()
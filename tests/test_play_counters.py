@@ -0,0 +1,167 @@
+import unittest
+import os
+import threading
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization, Content, Booking, StatLog
+from services.play_counters import PlayCounters, MemoryCounterBackend
+
+
+class TestPlayCounters(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            PlayCounters.reset()
+
+            org = Organization(name="Count Org", email="count@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screens = []
+            for code in ("PC01", "PC02"):
+                screen = Screen(name=code, unique_code=code, organization_id=org.id, is_active=True)
+                screen.set_password("password")
+                screens.append(screen)
+            db.session.add_all(screens)
+            db.session.commit()
+            self.screen_ids = [s.id for s in screens]
+
+            self.booking_id = self._add_booking(num_plays=3)
+
+        with self.client.session_transaction() as sess:
+            sess['screen_id'] = self.screen_ids[0]
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            PlayCounters.reset()
+
+    def _add_booking(self, num_plays, **kwargs):
+        content = Content(filename="paid.jpg", content_type="image", file_path="paid.jpg",
+                          status="approved", screen_id=self.screen_ids[0])
+        db.session.add(content)
+        db.session.commit()
+        booking = Booking(slot_duration=10, num_plays=num_plays, price_per_play=1.0, total_price=1.0,
+                          status='active', screen_id=self.screen_ids[0], content_id=content.id, **kwargs)
+        db.session.add(booking)
+        db.session.commit()
+        return booking.id
+
+    def test_counts_without_touching_bookings_until_reconciled(self):
+        backend = MemoryCounterBackend()
+        PlayCounters.use_backend(backend)
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lstrip()[:15].upper())
+
+        with app.app_context():
+            self.assertEqual(PlayCounters.count(self.screen_ids[0], {self.booking_id: 1}), [])
+
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                self.assertEqual(PlayCounters.count(self.screen_ids[0], {self.booking_id: 1}), [])
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+            self.assertEqual(statements, [])
+
+            self.assertEqual(PlayCounters.reconcile(), 2)
+            booking = db.session.get(Booking, self.booking_id)
+            self.assertEqual((booking.plays_completed, booking.status), (2, 'active'))
+
+            # Over the limit: only the last play is counted, and the booking is exhausted
+            self.assertEqual(PlayCounters.count(self.screen_ids[0], {self.booking_id: 4}), [self.booking_id])
+            self.assertEqual(backend.get(self.booking_id)['count'], 3)
+            PlayCounters.reconcile([self.booking_id])
+            db.session.expire_all()
+            booking = db.session.get(Booking, self.booking_id)
+            self.assertEqual((booking.plays_completed, booking.status), (3, 'completed'))
+
+            # Another screen cannot count plays on this booking
+            other = self._add_booking(num_plays=5)
+            self.assertEqual(PlayCounters.count(self.screen_ids[1], {other: 1}), [])
+            self.assertEqual(backend.get(other)['count'], 0)
+
+    def test_concurrent_claims_never_overplay(self):
+        backend = MemoryCounterBackend()
+        backend.seed(1, 7, count=0, limit=100)
+        granted = []
+
+        def play():
+            for _ in range(10):
+                granted.append(backend.claim(1, 7, 1)[0])
+
+        threads = [threading.Thread(target=play) for _ in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(granted), 100)
+        self.assertEqual(backend.take_pending(), {1: 100})
+
+    def test_reconcile_refreshes_limit(self):
+        backend = MemoryCounterBackend()
+        PlayCounters.use_backend(backend)
+        with app.app_context():
+            PlayCounters.count(self.screen_ids[0], {self.booking_id: 1})
+            db.session.get(Booking, self.booking_id).num_plays = 5
+            db.session.commit()
+
+            PlayCounters.reconcile()
+            self.assertEqual(backend.get(self.booking_id)['limit'], 5)
+            self.assertEqual(PlayCounters.count(self.screen_ids[0], {self.booking_id: 3}), [])
+            self.assertEqual(PlayCounters.count(self.screen_ids[0], {self.booking_id: 1}), [self.booking_id])
+
+    def test_failed_commit_releases_the_claimed_plays(self):
+        backend = MemoryCounterBackend()
+        PlayCounters.use_backend(backend)
+        body = {'plays': [
+            {'content_id': 1, 'content_type': 'image', 'category': 'paid', 'booking_id': self.booking_id}
+        ] * 2}
+
+        with mock.patch.object(db.session, 'commit', side_effect=RuntimeError('database is gone')):
+            response = self.client.post('/player/api/log-plays', json=body)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(backend.get(self.booking_id)['count'], 0)
+
+        # The player's retry is counted once, and the booking is not exhausted early
+        response = self.client.post('/player/api/log-plays', json=body)
+        self.assertEqual(response.get_json()['exhausted_booking_ids'], [])
+        self.assertEqual(backend.get(self.booking_id)['count'], 2)
+
+        with mock.patch.object(db.session, 'commit', side_effect=RuntimeError('database is gone')):
+            response = self.client.post('/player/api/log-play', json=body['plays'][0])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(backend.get(self.booking_id)['count'], 2)
+
+        with app.app_context():
+            self.assertEqual(PlayCounters.reconcile(), 2)
+            self.assertEqual(db.session.get(Booking, self.booking_id).plays_completed, 2)
+            self.assertEqual(StatLog.query.count(), 2)
+
+    def test_database_mode_caps_at_limit(self):
+        response = self.client.post('/player/api/log-plays', json={'plays': [
+            {'content_id': 1, 'content_type': 'image', 'category': 'paid', 'booking_id': self.booking_id}
+        ] * 5})
+        self.assertEqual(response.get_json()['exhausted_booking_ids'], [self.booking_id])
+
+        with app.app_context():
+            booking = db.session.get(Booking, self.booking_id)
+            self.assertEqual((booking.plays_completed, booking.status), (3, 'completed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
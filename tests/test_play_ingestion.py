@@ -0,0 +1,134 @@
+import unittest
+import os
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization, Content, Booking, StatLog
+from models.ad_content import AdContent, AdContentStat
+from services.jwt_service import generate_tokens
+from services.play_ingestion import PLAY_BATCH_MAX
+
+
+class TestPlayIngestion(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+
+            org = Organization(name="Play Org", email="play@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screens = []
+            for code in ("PL01", "PL02"):
+                screen = Screen(name=code, unique_code=code, organization_id=org.id, is_active=True)
+                screen.set_password("password")
+                screens.append(screen)
+            db.session.add_all(screens)
+            db.session.commit()
+            self.screen_ids = [s.id for s in screens]
+
+            self.booking_ids = []
+            for screen_id in self.screen_ids:
+                content = Content(filename="paid.jpg", content_type="image", file_path="paid.jpg",
+                                  status="approved", screen_id=screen_id)
+                db.session.add(content)
+                db.session.commit()
+                booking = Booking(slot_duration=10, num_plays=3, price_per_play=1.0, total_price=3.0,
+                                  status='active', screen_id=screen_id, content_id=content.id)
+                db.session.add(booking)
+                db.session.commit()
+                self.booking_ids.append(booking.id)
+
+            ad = AdContent(name="Ad", reference="PLAYAD", file_path="ad.jpg", status=AdContent.STATUS_ACTIVE)
+            db.session.add(ad)
+            db.session.commit()
+            self.ad_id = ad.id
+
+            access_token = generate_tokens(screen_id=self.screen_ids[0])["access_token"]
+        self.headers = {'Authorization': f'Bearer {access_token}'}
+
+        with self.client.session_transaction() as sess:
+            sess['screen_id'] = self.screen_ids[0]
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def _paid(self, booking_id):
+        return {'content_id': 1, 'content_type': 'image', 'category': 'paid', 'duration': 10,
+                'booking_id': booking_id}
+
+    def _ad(self):
+        return {'content_id': f'ad_{self.ad_id}', 'content_type': 'image', 'category': 'ad_content',
+                'duration': 15, 'played_at': '2020-01-01T00:00:00Z'}
+
+    def test_batch_groups_increments(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lstrip()[:20].upper())
+
+        plays = [self._paid(self.booking_ids[0]), self._paid(self.booking_ids[0]), self._ad(), self._ad(),
+                 {'content_id': 3, 'content_type': 'image', 'category': 'filler'},
+                 {'category': 'filler'}]
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                response = self.client.post('/player/api/log-plays', json={'plays': plays})
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+            data = response.get_json()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((data['accepted'], data['rejected'], data['exhausted']), (5, 1, False))
+            self.assertEqual(sum(s.startswith('UPDATE BOOKINGS') for s in statements), 1)
+            self.assertEqual(sum(s.startswith('INSERT INTO STAT_LO') for s in statements), 1)
+
+            self.assertEqual(StatLog.query.count(), 5)
+            self.assertEqual(db.session.get(Booking, self.booking_ids[0]).plays_completed, 2)
+
+            stat = AdContentStat.query.one()
+            self.assertEqual((stat.impressions, stat.total_duration), (2, 30.0))
+            ad = db.session.get(AdContent, self.ad_id)
+            self.assertEqual((ad.total_impressions, ad.total_duration_played), (2, 30.0))
+            # Queued plays keep their play time, bounded to the backdating window
+            self.assertNotEqual(stat.date.year, 2020)
+
+    def test_exhausted_bookings_are_reported(self):
+        plays = [self._paid(self.booking_ids[0])] * 3 + [self._paid(self.booking_ids[1])]
+        response = self.client.post('/mobile/api/v1/screen/log-plays', json={'plays': plays},
+                                    headers=self.headers)
+
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['exhausted_booking_ids'], [self.booking_ids[0]])
+
+        with app.app_context():
+            booking = db.session.get(Booking, self.booking_ids[0])
+            self.assertEqual((booking.plays_completed, booking.status), (3, 'completed'))
+            # Another screen's booking is never counted
+            self.assertEqual(db.session.get(Booking, self.booking_ids[1]).plays_completed, 0)
+
+    def test_batch_size_is_bounded(self):
+        response = self.client.post('/mobile/api/v1/screen/log-plays',
+                                    json={'plays': [self._ad()] * (PLAY_BATCH_MAX + 1)}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['field'], 'plays')
+
+        response = self.client.post('/player/api/log-plays', json={'plays': []})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, Filler
+from services.jwt_service import generate_tokens
+from services.playlist_delta import compute_delta, item_key
+from services.playlist_snapshot import PlaylistSnapshotStore
+
+
+def apply_delta(base, delta):
+    """Python mirror of applyPlaylistDelta() in static/js/player.js."""
+    result = {k: v for k, v in delta.items() if k not in ('delta', 'base_version')}
+    for name in ('playlist', 'overlays'):
+        by_key = {item_key(item): item for item in base.get(name, [])}
+        by_key.update({item_key(item): item for item in delta[name]['changed']})
+        result[name] = [by_key[key] for key in delta[name]['order']]
+    return result
+
+
+def filler_item(item_id, name, duration=10):
+    return {'id': item_id, 'category': 'filler', 'name': name, 'duration': duration}
+
+
+class TestComputeDelta(unittest.TestCase):
+    def test_added_changed_removed(self):
+        base = {'mode': 'playlist', 'overlays': [],
+                'playlist': [filler_item(1, 'a'), filler_item(2, 'b'), filler_item(3, 'c')]}
+        new = {'mode': 'playlist', 'overlays': [],
+               'playlist': [filler_item(1, 'a'), filler_item(2, 'b', duration=20), filler_item(4, 'd')]}
+
+        delta = compute_delta(base, new)
+
+        self.assertTrue(delta['delta'])
+        self.assertEqual(delta['playlist']['order'], ['filler:1', 'filler:2', 'filler:4'])
+        self.assertEqual([i['id'] for i in delta['playlist']['changed']], [2, 4])
+        self.assertEqual(delta['playlist']['removed'], ['filler:3'])
+        self.assertEqual(apply_delta(base, delta), new)
+
+    def test_full_document_when_everything_changed(self):
+        base = {'playlist': [filler_item(1, 'a')], 'overlays': []}
+        new = {'playlist': [filler_item(2, 'b')], 'overlays': []}
+        self.assertIsNone(compute_delta(base, new))
+
+
+class TestPlaylistDeltaEndpoints(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            PlaylistSnapshotStore.clear()
+
+            org = Organization(name="Delta Org", email="delta@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screen = Screen(name="Delta Screen", unique_code="DELTA01", organization_id=org.id, is_active=True)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+            self.screen_id = screen.id
+
+            for i in range(5):
+                db.session.add(Filler(filename=f"f{i}.jpg", content_type="image", file_path=f"static/f{i}.jpg",
+                                      screen_id=self.screen_id))
+            db.session.commit()
+
+            access_token = generate_tokens(screen_id=self.screen_id)["access_token"]
+        self.headers = {'Authorization': f'Bearer {access_token}'}
+
+        with self.client.session_transaction() as sess:
+            sess['screen_id'] = self.screen_id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            PlaylistSnapshotStore.clear()
+
+    def _add_filler(self, name):
+        with app.app_context():
+            db.session.add(Filler(filename=name, content_type="image", file_path=f"static/{name}",
+                                  screen_id=self.screen_id))
+            db.session.commit()
+
+    def test_player_delta_since_previous_version(self):
+        full = self.client.get('/player/api/playlist').get_json()
+        self.assertNotIn('delta', full)
+        version = full['version']
+
+        self._add_filler("new.jpg")
+
+        response = self.client.get(f'/player/api/playlist?since={version}')
+        self.assertEqual(response.status_code, 200)
+        delta = response.get_json()
+        self.assertTrue(delta['delta'])
+        self.assertEqual(delta['base_version'], version)
+        self.assertEqual([item['name'] for item in delta['playlist']['changed']], ['new.jpg'])
+
+        current = self.client.get('/player/api/playlist').get_json()
+        self.assertEqual(delta['version'], current['version'])
+        self.assertEqual(apply_delta(full, delta)['playlist'], current['playlist'])
+
+    def test_unknown_version_gets_full_resync(self):
+        response = self.client.get('/player/api/playlist?since=12345')
+        data = response.get_json()
+        self.assertNotIn('delta', data)
+        self.assertIsInstance(data['playlist'], list)
+
+    def test_mobile_delta_and_not_modified(self):
+        first = self.client.get('/mobile/api/v1/screen/playlist', headers=self.headers)
+        self.assertEqual(first.status_code, 200)
+        version = first.get_json()['version']
+
+        not_modified = self.client.get('/mobile/api/v1/screen/playlist',
+                                       headers=dict(self.headers, **{'If-None-Match': first.headers['ETag']}))
+        self.assertEqual(not_modified.status_code, 304)
+
+        self._add_filler("mobile.jpg")
+
+        delta = self.client.get(f'/mobile/api/v1/screen/playlist?since={version}', headers=self.headers).get_json()
+        self.assertTrue(delta['delta'])
+        self.assertEqual([item['name'] for item in delta['playlist']['changed']], ['mobile.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
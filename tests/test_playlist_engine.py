@@ -0,0 +1,152 @@
+import unittest
+import os
+from datetime import datetime, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization, Filler, Broadcast
+from models.ad_content import AdContent
+from services.jwt_service import generate_tokens
+from services.playlist_snapshot import PlaylistSnapshotStore
+from services.ad_targeting_index import AdTargetingIndex
+from services import playlist_service
+
+
+class TestPlaylistEngine(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            PlaylistSnapshotStore.clear()
+            AdTargetingIndex.clear()
+
+            org = Organization(name="Engine Org", email="engine@org.com", country="FR", city="Paris")
+            other_org = Organization(name="Other Org", email="other@org.com", country="MA", city="Rabat")
+            db.session.add_all([org, other_org])
+            db.session.commit()
+            self.other_org_id = other_org.id
+
+            screen = Screen(name="Engine Screen", unique_code="ENG01", organization_id=org.id, is_active=True)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+            self.screen_id = screen.id
+
+            db.session.add_all([
+                Filler(filename="filler.jpg", content_type="image", file_path="static/filler.jpg",
+                       screen_id=self.screen_id),
+                AdContent(name="Targeted Ad", reference="ENGREF0", file_path="ad.jpg",
+                          status=AdContent.STATUS_ACTIVE,
+                          target_type=AdContent.TARGET_SCREEN, target_screen_id=self.screen_id),
+                Broadcast(name="Targeted Broadcast", broadcast_type=Broadcast.BROADCAST_TYPE_CONTENT,
+                          target_type=Broadcast.TARGET_SCREEN, target_screen_id=self.screen_id,
+                          content_type='image', content_file_path='static/b.jpg', is_active=True),
+            ])
+            db.session.commit()
+
+            access_token = generate_tokens(screen_id=self.screen_id)["access_token"]
+        self.headers = {'Authorization': f'Bearer {access_token}'}
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            PlaylistSnapshotStore.clear()
+            AdTargetingIndex.clear()
+
+    def _add_untargeted_catalogue(self, count):
+        with app.app_context():
+            for i in range(count):
+                db.session.add(AdContent(name=f"Other Ad {i}", reference=f"OTHER{i}", file_path="other.jpg",
+                                         status=AdContent.STATUS_ACTIVE,
+                                         target_type=AdContent.TARGET_ORGANIZATION,
+                                         target_organization_id=self.other_org_id))
+                db.session.add(Broadcast(name=f"Other Broadcast {i}",
+                                         broadcast_type=Broadcast.BROADCAST_TYPE_CONTENT,
+                                         target_type=Broadcast.TARGET_COUNTRY, target_country='MA',
+                                         content_type='image', content_file_path='static/o.jpg', is_active=True))
+            db.session.commit()
+
+    def _count_queries(self, func):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            result = func()
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return result, statements
+
+    def _mobile_playlist(self):
+        return self.client.get('/mobile/api/v1/screen/playlist', headers=self.headers)
+
+    def _compile_mobile_playlist(self):
+        # Bypass the snapshot so the request measures a full compilation
+        PlaylistSnapshotStore.clear()
+        return self._mobile_playlist()
+
+    def test_mobile_and_player_share_the_same_playlist(self):
+        mobile = self._mobile_playlist()
+        self.assertEqual(mobile.status_code, 200)
+
+        with self.client.session_transaction() as sess:
+            sess['screen_id'] = self.screen_id
+        player = self.client.get('/player/api/playlist')
+        self.assertEqual(player.status_code, 200)
+
+        self.assertEqual(mobile.get_json()['playlist'], player.get_json()['playlist'])
+        names = [item['name'] for item in mobile.get_json()['playlist']]
+        self.assertIn('Targeted Ad', names)
+        self.assertIn('Targeted Broadcast', names)
+        self.assertIn('filler.jpg', names)
+
+        with app.app_context():
+            service_names = [item['name'] for item in playlist_service.build_playlist(self.screen_id)]
+        self.assertEqual(service_names, names)
+
+    def test_mobile_query_count_independent_of_catalogue_size(self):
+        self._compile_mobile_playlist()  # warm-up (ad targeting index load)
+        response, baseline = self._count_queries(self._compile_mobile_playlist)
+        self.assertEqual(response.status_code, 200)
+
+        self._add_untargeted_catalogue(50)
+        self._compile_mobile_playlist()  # one-off incremental ad index refresh
+
+        response, statements = self._count_queries(self._compile_mobile_playlist)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), len(baseline))
+        names = [item['name'] for item in response.get_json()['playlist']]
+        self.assertNotIn('Other Ad 0', names)
+        self.assertNotIn('Other Broadcast 0', names)
+
+    def test_expired_ad_is_excluded(self):
+        with app.app_context():
+            db.session.add(AdContent(name="Expired Ad", reference="ENGEXP", file_path="exp.jpg",
+                                     status=AdContent.STATUS_ACTIVE,
+                                     target_type=AdContent.TARGET_SCREEN, target_screen_id=self.screen_id,
+                                     schedule_type=AdContent.SCHEDULE_PERIOD,
+                                     start_date=datetime.utcnow() - timedelta(days=3),
+                                     end_date=datetime.utcnow() - timedelta(days=1)))
+            db.session.commit()
+
+        response = self._mobile_playlist()
+        names = [item['name'] for item in response.get_json()['playlist']]
+        self.assertNotIn('Expired Ad', names)
+        self.assertIn('Targeted Ad', names)
+
+
+if __name__ == '__main__':
+    unittest.main()
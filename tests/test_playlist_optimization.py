@@ -12,6 +12,7 @@ os.environ['INIT_DB_MODE'] = 'false'
 from app import app, db
 from models import Screen, Organization, AdContent, User, SiteSetting
 from sqlalchemy import text
+from services.status_sweeper import apply_ad_status_transitions
 
 class TestPlaylistOptimization(unittest.TestCase):
     def setUp(self):
@@ -113,8 +114,12 @@ class TestPlaylistOptimization(unittest.TestCase):
         self.assertNotIn("Ad5", ad_names)
         self.assertIn("Ad6", ad_names)
 
-        # Verify Ad6 status update
+        # Reads never write: Ad6 is served on its effective status and the
+        # status sweeper persists the transition
         with app.app_context():
+            self.assertEqual(db.session.get(AdContent, ad6_id).status, AdContent.STATUS_SCHEDULED)
+            apply_ad_status_transitions()
+            db.session.expire_all()
             ad6_db = db.session.get(AdContent, ad6_id)
             self.assertEqual(ad6_db.status, AdContent.STATUS_ACTIVE)
 
@@ -0,0 +1,122 @@
+import unittest
+import os
+from datetime import datetime
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization, Filler
+from services.playlist_snapshot import PlaylistSnapshotStore
+
+
+class TestPlaylistSnapshot(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            PlaylistSnapshotStore.clear()
+
+            org = Organization(name="Snap Org", email="snap@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screen = Screen(name="Snap Screen", unique_code="SNAP01", organization_id=org.id, is_active=True)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+            self.screen_id = screen.id
+
+            db.session.add(Filler(filename="f1.jpg", content_type="image", file_path="static/f1.jpg",
+                                  screen_id=self.screen_id))
+            db.session.commit()
+
+        with self.client.session_transaction() as sess:
+            sess['screen_id'] = self.screen_id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            PlaylistSnapshotStore.clear()
+
+    def _count_queries(self, func):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            result = func()
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return result, statements
+
+    def test_repeat_polls_served_from_snapshot(self):
+        first = self.client.get('/player/api/playlist')
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+
+        second, statements = self._count_queries(lambda: self.client.get('/player/api/playlist'))
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.headers['ETag'], etag)
+        self.assertEqual(statements, [])
+
+        not_modified = self.client.get('/player/api/playlist', headers={'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_filler_change_invalidates_snapshot(self):
+        first = self.client.get('/player/api/playlist')
+        etag = first.headers['ETag']
+
+        with app.app_context():
+            db.session.add(Filler(filename="f2.jpg", content_type="image", file_path="static/f2.jpg",
+                                  screen_id=self.screen_id))
+            db.session.commit()
+
+        second = self.client.get('/player/api/playlist', headers={'If-None-Match': etag})
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second.headers['ETag'], etag)
+        names = [item['name'] for item in second.get_json()['playlist']]
+        self.assertIn('f2.jpg', names)
+
+    def test_same_content_has_the_same_etag_on_every_worker(self):
+        first = self.client.get('/player/api/playlist')
+        etag = first.headers['ETag']
+        version = first.get_json()['version']
+
+        # A fresh store stands in for another gunicorn worker
+        PlaylistSnapshotStore.clear()
+        not_modified = self.client.get('/player/api/playlist', headers={'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+
+        PlaylistSnapshotStore.clear()
+        again = self.client.get(f'/player/api/playlist?since={version}')
+        self.assertEqual(again.headers['ETag'], etag)
+        self.assertEqual(again.get_json()['version'], version)
+
+    def test_heartbeat_does_not_invalidate_snapshot(self):
+        first = self.client.get('/player/api/playlist')
+        etag = first.headers['ETag']
+
+        with app.app_context():
+            screen = db.session.get(Screen, self.screen_id)
+            screen.last_heartbeat = datetime.utcnow()
+            screen.status = 'online'
+            db.session.commit()
+
+        second = self.client.get('/player/api/playlist', headers={'If-None-Match': etag})
+        self.assertEqual(second.status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import os
+import shutil
+import tempfile
+from datetime import date
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, Content, Booking
+from services import render_service
+from services.render_service import RenderService, receipt_job, receipt_files, prune_render_cache
+
+
+class TestRenderService(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.cache_dir = tempfile.mkdtemp()
+        self.patches = [mock.patch.object(render_service, 'RENDER_CACHE_DIR', self.cache_dir),
+                        mock.patch.object(render_service, 'RENDER_WORKERS', 0)]
+        for patch in self.patches:
+            patch.start()
+
+        with app.app_context():
+            db.create_all()
+
+            org = Organization(name="Render Org", email="render@org.com", currency='EUR')
+            db.session.add(org)
+            db.session.commit()
+
+            screen = Screen(name="Render Screen", unique_code="RND01", organization_id=org.id)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+
+            content = Content(filename='ad.png', original_filename='ad.png', content_type='image',
+                              file_path='/tmp/ad.png', screen_id=screen.id, status='approved',
+                              client_name='Client', client_email='client@test.com')
+            db.session.add(content)
+            db.session.commit()
+
+            bookings = [
+                Booking(screen_id=screen.id, content_id=content.id, slot_duration=10, num_plays=n,
+                        price_per_play=1.5, total_price=1.5 * n, payment_status='paid',
+                        reservation_number=f'RES{n:05d}', start_date=date(2026, 10, 1))
+                for n in (10, 20, 30)
+            ]
+            db.session.add_all(bookings)
+            db.session.commit()
+            self.booking_ids = [booking.id for booking in bookings]
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        for patch in self.patches:
+            patch.stop()
+        RenderService.shutdown()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_renders_are_cached_by_content(self):
+        with app.app_context():
+            booking = db.session.get(Booking, self.booking_ids[0])
+            job = receipt_job(booking, 'pdf', qr_url='http://localhost/book/RND01')
+
+            with mock.patch.object(render_service, '_render_job', wraps=render_service._render_job) as render:
+                path = RenderService.render(*job)
+                self.assertEqual(RenderService.render(*job), path)
+                self.assertEqual(render.call_count, 1)
+
+                with open(path, 'rb') as f:
+                    self.assertTrue(f.read().startswith(b'%PDF'))
+
+                # Changed inputs render a new file
+                booking.num_plays = 11
+                self.assertNotEqual(RenderService.render(*receipt_job(booking, 'pdf')), path)
+                self.assertEqual(render.call_count, 2)
+
+            os.utime(path, (0, 0))
+            self.assertEqual(prune_render_cache(), 1)
+            self.assertFalse(os.path.exists(path))
+
+    def test_bulk_rendering_uses_the_process_pool(self):
+        with app.app_context(), mock.patch.object(render_service, 'RENDER_WORKERS', 2):
+            bookings = Booking.query.filter(Booking.id.in_(self.booking_ids)).all()
+            paths = receipt_files(bookings, 'png', qr_url_for=lambda b: f'http://localhost/{b.id}')
+
+        self.assertEqual(len(set(paths)), 3)
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.assertTrue(f.read().startswith(b'\x89PNG'))
+
+    def test_receipt_download_is_served_from_cache(self):
+        for _ in range(2):
+            response = self.client.get('/book/receipt/RES00010')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'image/png')
+            self.assertTrue(response.data.startswith(b'\x89PNG'))
+            response.close()
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(self.cache_dir)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
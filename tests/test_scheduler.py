@@ -0,0 +1,66 @@
+import unittest
+import os
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app
+from services import scheduler
+from services.scheduler import Scheduler
+from services.screen_events import ScreenEventBus
+
+
+class FakeRedis:
+    """The few string commands of the leader lease."""
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode()
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def expire(self, key, ttl):
+        return key in self.values
+
+
+class TestSchedulerLeadership(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.patches = [
+            mock.patch.object(ScreenEventBus, 'backplane_client', return_value=self.redis),
+            # No loop thread: the test calls is_leader itself
+            mock.patch.object(scheduler.threading, 'Thread'),
+            mock.patch.object(Scheduler, '_thread', None),
+            mock.patch.object(Scheduler, '_origin', None),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+
+    def test_each_worker_starts_with_its_own_lease(self):
+        Scheduler.start(app)
+        self.assertTrue(Scheduler.is_leader())
+        self.assertTrue(Scheduler.is_leader())
+
+        # A worker forked from the same preloaded app starts its own scheduler
+        Scheduler._thread = None
+        with mock.patch.object(scheduler.os, 'getpid', return_value=os.getpid() + 1):
+            Scheduler.start(app)
+        self.assertFalse(Scheduler.is_leader())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import os
+import json
+from unittest import mock
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, Filler
+from services.playlist_snapshot import PlaylistSnapshotStore
+from services.screen_events import (
+    ScreenEventBus, event_stream, EVENT_PLAYLIST, EVENT_MODE, ALL_SCREENS
+)
+
+
+def read_event(stream):
+    """Return the next (event, data) pair, skipping retry and keep-alive lines."""
+    for chunk in stream:
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('utf-8')
+        if not chunk.startswith('event: '):
+            continue
+        name_line, data_line = chunk.strip().split('\n')
+        return name_line[len('event: '):], json.loads(data_line[len('data: '):])
+    return None
+
+
+class TestScreenEventBus(unittest.TestCase):
+    def tearDown(self):
+        ScreenEventBus.reset()
+
+    def test_publish_reaches_only_that_screen(self):
+        first = ScreenEventBus.subscribe(1)
+        second = ScreenEventBus.subscribe(2)
+
+        ScreenEventBus.publish(1, EVENT_PLAYLIST)
+
+        self.assertEqual(first.get(timeout=0), (EVENT_PLAYLIST, None))
+        self.assertIsNone(second.get(timeout=0))
+
+    def test_publish_to_all_screens(self):
+        first = ScreenEventBus.subscribe(1)
+        second = ScreenEventBus.subscribe(2)
+
+        ScreenEventBus.publish(ALL_SCREENS, EVENT_PLAYLIST)
+
+        self.assertIsNotNone(first.get(timeout=0))
+        self.assertIsNotNone(second.get(timeout=0))
+
+    def test_relayed_event_is_delivered_and_own_echo_ignored(self):
+        subscription = ScreenEventBus.subscribe(3)
+        ScreenEventBus._handle_relayed(json.dumps({
+            'origin': ScreenEventBus.origin(), 'screen_id': 3, 'event': EVENT_PLAYLIST, 'data': None
+        }))
+        self.assertIsNone(subscription.get(timeout=0))
+
+        ScreenEventBus._handle_relayed(json.dumps({
+            'origin': 'other-worker', 'screen_id': 3, 'event': EVENT_MODE, 'data': None
+        }))
+        self.assertEqual(subscription.get(timeout=0), (EVENT_MODE, None))
+
+    def test_forked_worker_gets_its_own_origin_and_backplane(self):
+        parent = ScreenEventBus.origin()
+        with mock.patch.object(ScreenEventBus, '_redis_url', 'redis://localhost:6379/0'), \
+                mock.patch.object(ScreenEventBus, '_start_backplane') as start_backplane, \
+                mock.patch('services.screen_events.os.getpid', return_value=os.getpid() + 1):
+            child = ScreenEventBus.origin()
+            start_backplane.assert_called_once_with()
+            self.assertNotEqual(child, parent)
+
+            # The parent's origin is now a sibling worker's
+            subscription = ScreenEventBus.subscribe(5)
+            ScreenEventBus._handle_relayed(json.dumps({
+                'origin': parent, 'screen_id': 5, 'event': EVENT_PLAYLIST, 'data': None
+            }))
+            self.assertEqual(subscription.get(timeout=0), (EVENT_PLAYLIST, None))
+
+    def test_stream_unsubscribes_when_closed(self):
+        stream = event_stream(4)
+        self.assertEqual(read_event(stream), ('ready', {'screen_id': 4}))
+        self.assertEqual(ScreenEventBus.subscriber_count(4), 1)
+        stream.close()
+        self.assertEqual(ScreenEventBus.subscriber_count(4), 0)
+
+
+class TestScreenEventsEndpoint(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            PlaylistSnapshotStore.clear()
+
+            org = Organization(name="Push Org", email="push@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screen = Screen(name="Push Screen", unique_code="PUSH01", organization_id=org.id, is_active=True)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+            self.screen_id = screen.id
+
+        with self.client.session_transaction() as sess:
+            sess['screen_id'] = self.screen_id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            PlaylistSnapshotStore.clear()
+        ScreenEventBus.reset()
+
+    def test_requires_session(self):
+        anonymous = app.test_client()
+        response = anonymous.get('/player/api/events')
+        self.assertEqual(response.status_code, 401)
+
+    def test_filler_change_pushes_playlist_event(self):
+        response = self.client.get('/player/api/events', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        stream = iter(response.response)
+        self.assertEqual(read_event(stream)[0], 'ready')
+
+        with app.app_context():
+            db.session.add(Filler(filename="push.jpg", content_type="image", file_path="static/push.jpg",
+                                  screen_id=self.screen_id))
+            db.session.commit()
+
+        self.assertEqual(read_event(stream)[0], EVENT_PLAYLIST)
+        response.close()
+
+    def test_mode_change_pushes_mode_event(self):
+        response = self.client.get('/player/api/events', buffered=False)
+        stream = iter(response.response)
+        read_event(stream)
+
+        with app.app_context():
+            screen = db.session.get(Screen, self.screen_id)
+            screen.iptv_enabled = True
+            db.session.commit()
+
+        events = [read_event(stream)[0], read_event(stream)[0]]
+        self.assertIn(EVENT_PLAYLIST, events)
+        self.assertIn(EVENT_MODE, events)
+        response.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
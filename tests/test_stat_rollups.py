@@ -0,0 +1,145 @@
+import unittest
+import os
+from datetime import datetime, date, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization, User, Content, StatLog, StatLogDaily, AggregationWatermark
+from services.stat_rollups import StatRollup, play_counts, daily_and_category_plays, WATERMARK
+
+
+class TestStatRollups(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        StatRollup.reset()
+
+        with app.app_context():
+            db.create_all()
+
+            org = Organization(name="Rollup Org", email="rollup@org.com", country="FR", city="Paris", is_paid=True)
+            db.session.add(org)
+            db.session.commit()
+
+            screen = Screen(name="Rollup Screen", unique_code="RU01", organization_id=org.id)
+            screen.set_password("password")
+            user = User(username='rollup', email='rollup@test.com', role='org',
+                        organization_id=org.id, is_active=True)
+            user.set_password('password')
+            db.session.add_all([screen, user])
+            db.session.commit()
+            self.screen_id = screen.id
+            self.user_id = user.id
+
+            content = Content(filename='ad.png', original_filename='ad.png', content_type='image',
+                              file_path='/tmp/ad.png', screen_id=screen.id, status='approved')
+            db.session.add(content)
+            db.session.commit()
+            self.content_id = content.id
+
+            self.today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+            self.add_plays([
+                (self.today - timedelta(days=2), 'paid', self.content_id, 10.0),
+                (self.today - timedelta(days=2), 'paid', self.content_id, 10.0),
+                (self.today - timedelta(days=1), None, None, None),
+            ])
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        StatRollup.reset()
+
+    def add_plays(self, plays):
+        db.session.add_all([
+            StatLog(screen_id=self.screen_id, content_type='image', content_category=category,
+                    content_id=content_id, duration_seconds=duration, played_at=played_at)
+            for played_at, category, content_id, duration in plays
+        ])
+        db.session.commit()
+
+    def test_refresh_consumes_ids_settled_by_the_previous_run(self):
+        with app.app_context():
+            # The first run only records the current highest id
+            self.assertEqual(StatRollup.refresh(), 0)
+            self.add_plays([(self.today, 'filler', None, 5.0)])
+
+            self.assertEqual(StatRollup.refresh(), 3)
+            rows = {(r.date, r.category, r.content_id): (r.plays, r.total_duration)
+                    for r in StatLogDaily.query.all()}
+            self.assertEqual(rows, {
+                ((self.today - timedelta(days=2)).date(), 'paid', self.content_id): (2, 20.0),
+                ((self.today - timedelta(days=1)).date(), '', 0): (1, 0.0),
+            })
+            self.assertEqual(AggregationWatermark.get_last_id(WATERMARK), 3)
+
+            self.assertEqual(StatRollup.refresh(), 1)
+            self.assertEqual(StatRollup.refresh(), 0)
+
+    def test_reads_merge_rollups_with_raw_tail(self):
+        week_ago = self.today - timedelta(days=7)
+        with app.app_context():
+            before = play_counts(('date', 'category', 'content_id'), [self.screen_id], week_ago)
+
+            StatRollup.refresh()
+            StatRollup.refresh()
+            self.add_plays([(self.today, 'paid', self.content_id, 10.0)])
+
+            after = play_counts(('date', 'category', 'content_id'), [self.screen_id], week_ago)
+            expected = dict(before)
+            expected[(self.today.date(), 'paid', self.content_id)] = (1, 10.0)
+            self.assertEqual(after, expected)
+
+            daily, categories = daily_and_category_plays([self.screen_id], week_ago)
+            self.assertEqual(daily, [((self.today - timedelta(days=2)).date(), 2),
+                                     ((self.today - timedelta(days=1)).date(), 1),
+                                     (self.today.date(), 1)])
+            self.assertEqual(dict(categories), {'paid': 3, None: 1})
+
+    def test_rollups_and_raw_tail_are_read_in_one_statement(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            StatRollup.refresh()
+            StatRollup.refresh()
+            self.add_plays([(self.today, 'paid', self.content_id, 10.0)])
+            # A refresh committing between separate reads would lose rows
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                counts = play_counts((), [self.screen_id])
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+            self.assertEqual(counts[()][0], StatLog.query.count())
+        self.assertEqual(len(statements), 1)
+
+    def test_stats_endpoints_read_rollups(self):
+        with app.app_context():
+            StatRollup.refresh()
+            StatRollup.refresh()
+
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.user_id)
+            sess['_fresh'] = True
+
+        response = self.client.get(f'/api/screen/{self.screen_id}/stats')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([d['date'] for d in data['daily_plays']],
+                         [str((self.today - timedelta(days=n)).date()) for n in (2, 1)])
+        self.assertEqual(sum(c['count'] for c in data['category_stats']), 3)
+
+        response = self.client.get('/org/stats')
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import os
+import time
+from datetime import datetime, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from sqlalchemy import event
+from app import app, db
+from models import Screen, Organization
+from models.ad_content import AdContent
+from services.ad_targeting_index import AdTargetingIndex
+from services.jwt_service import generate_tokens
+from services.playlist_snapshot import PlaylistSnapshotStore
+from services.status_sweeper import (
+    TimingWheel, StatusSweeper, apply_ad_status_transitions, BOUNDARY_AD, BOUNDARY_BROADCAST
+)
+
+
+class TestTimingWheel(unittest.TestCase):
+    def test_pops_due_slots_in_order(self):
+        wheel = TimingWheel()
+        wheel.schedule(100.5, 'a')
+        wheel.schedule(100.9, 'b')
+        wheel.schedule(105, 'c')
+
+        self.assertEqual(wheel.next_due(), 100)
+        self.assertEqual(wheel.pop_due(99.9), set())
+        self.assertEqual(wheel.pop_due(100), {'a', 'b'})
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.pop_due(200), {'c'})
+        self.assertIsNone(wheel.next_due())
+
+
+class TestStatusSweeper(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+            AdTargetingIndex.clear()
+            StatusSweeper.clear()
+            PlaylistSnapshotStore.clear()
+
+            org = Organization(name="Sweep Org", email="sweep@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+            screen = Screen(name="Sweep Screen", unique_code="SWP01", organization_id=org.id, is_active=True)
+            screen.set_password("password")
+            db.session.add(screen)
+            db.session.commit()
+            self.screen_id = screen.id
+
+            now = datetime.utcnow()
+            self.ad_ids = {}
+            for reference, status, start, end in (
+                ("STARTED", AdContent.STATUS_SCHEDULED, now - timedelta(hours=1), now + timedelta(days=1)),
+                ("ENDED", AdContent.STATUS_ACTIVE, now - timedelta(days=2), now - timedelta(hours=1)),
+                ("PAUSED", AdContent.STATUS_PAUSED, now - timedelta(days=2), now - timedelta(hours=1)),
+                ("LATER", AdContent.STATUS_SCHEDULED, now + timedelta(seconds=30), now + timedelta(days=1)),
+            ):
+                ad = AdContent(name=reference, reference=reference, file_path=f"{reference}.jpg", status=status,
+                               target_type=AdContent.TARGET_SCREEN, target_screen_id=self.screen_id,
+                               schedule_type=AdContent.SCHEDULE_PERIOD, start_date=start, end_date=end)
+                db.session.add(ad)
+                db.session.commit()
+                self.ad_ids[reference] = ad.id
+
+            access_token = generate_tokens(screen_id=self.screen_id)["access_token"]
+        self.headers = {'Authorization': f'Bearer {access_token}'}
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            AdTargetingIndex.clear()
+            StatusSweeper.clear()
+            PlaylistSnapshotStore.clear()
+
+    def _statuses(self):
+        db.session.expire_all()
+        return {ad.reference: ad.status for ad in AdContent.query.all()}
+
+    def test_transitions_applied_with_one_update(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lstrip().split(None, 1)[0].upper())
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                changed = apply_ad_status_transitions()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+            self.assertEqual(sorted(changed), sorted([self.ad_ids['STARTED'], self.ad_ids['ENDED']]))
+            self.assertEqual(statements.count('UPDATE'), 1)
+            self.assertEqual(self._statuses(), {
+                'STARTED': AdContent.STATUS_ACTIVE,
+                'ENDED': AdContent.STATUS_EXPIRED,
+                'PAUSED': AdContent.STATUS_PAUSED,
+                'LATER': AdContent.STATUS_SCHEDULED,
+            })
+
+            screen = db.session.get(Screen, self.screen_id)
+            indexed = {entry.id: entry.status for entry in AdTargetingIndex.resolve(screen)}
+            self.assertEqual(indexed[self.ad_ids['STARTED']], AdContent.STATUS_ACTIVE)
+            self.assertNotIn(self.ad_ids['ENDED'], indexed)
+
+            self.assertEqual(apply_ad_status_transitions(), [])
+
+    def test_wheel_fires_at_boundaries(self):
+        now = time.time()
+        with app.app_context():
+            # First tick loads the wheel and catches up on past transitions
+            self.assertEqual(StatusSweeper.tick(now), {BOUNDARY_AD, BOUNDARY_BROADCAST})
+            self.assertEqual(self._statuses()['STARTED'], AdContent.STATUS_ACTIVE)
+
+            self.assertEqual(StatusSweeper.tick(now + 1), set())
+            self.assertEqual(StatusSweeper.tick(now + 32), {BOUNDARY_AD})
+            self.assertEqual(StatusSweeper.tick(now + 33), set())
+
+    def test_playlist_reads_never_write(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lstrip().split(None, 1)[0].upper())
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                response = self.client.get('/mobile/api/v1/screen/playlist', headers=self.headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('UPDATE', statements)
+            names = [item['name'] for item in response.get_json()['playlist']]
+            self.assertIn('STARTED', names)
+            self.assertNotIn('ENDED', names)
+            self.assertEqual(self._statuses()['STARTED'], AdContent.STATUS_SCHEDULED)
+
+
+if __name__ == '__main__':
+    unittest.main()
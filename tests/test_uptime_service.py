@@ -0,0 +1,109 @@
+import unittest
+import os
+from datetime import datetime, timedelta
+
+# Set environment variables BEFORE importing app
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret'
+os.environ['INIT_DB_MODE'] = 'false'
+
+from app import app, db
+from models import Screen, Organization, User, HeartbeatLog, ScreenStatusInterval, AggregationWatermark
+from services.uptime_service import compact_heartbeats, screen_uptime, WATERMARK
+
+BASE = datetime(2026, 10, 12)
+
+
+class TestUptimeService(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+        with app.app_context():
+            db.create_all()
+
+            org = Organization(name="Uptime Org", email="uptime@org.com", country="FR", city="Paris")
+            db.session.add(org)
+            db.session.commit()
+
+            screen = Screen(name="Uptime Screen", unique_code="UP01", organization_id=org.id,
+                            created_at=BASE - timedelta(days=1))
+            screen.set_password("password")
+            user = User(username='uptime', email='uptime@test.com', role='org',
+                        organization_id=org.id, is_active=True)
+            user.set_password('password')
+            db.session.add_all([screen, user])
+            db.session.commit()
+            self.screen_id = screen.id
+            self.user_id = user.id
+
+            beats = [(0, 'online'), (30, 'online'), (60, 'online'), (90, 'playing'), (120, 'playing'),
+                     (600, 'online'), (630, 'online'), (660, 'offline')]
+            db.session.add_all([
+                HeartbeatLog(screen_id=screen.id, status=status, timestamp=BASE + timedelta(seconds=offset))
+                for offset, status in beats
+            ])
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def intervals(self):
+        return [(i.status, int((i.started_at - BASE).total_seconds()), int((i.ended_at - BASE).total_seconds()),
+                 i.beats)
+                for i in ScreenStatusInterval.query.order_by(ScreenStatusInterval.started_at).all()]
+
+    def test_compaction_builds_contiguous_intervals_and_replays_safely(self):
+        expected = [('online', 0, 90, 3), ('playing', 90, 120, 2), ('online', 600, 660, 2), ('offline', 660, 660, 1)]
+        with app.app_context():
+            self.assertEqual(compact_heartbeats(now=BASE + timedelta(hours=1)), 8)
+            self.assertEqual(self.intervals(), expected)
+            self.assertEqual(AggregationWatermark.get(WATERMARK), BASE + timedelta(minutes=58))
+
+            # Nothing new past the watermark
+            self.assertEqual(compact_heartbeats(now=BASE + timedelta(hours=1)), 0)
+
+            # A crash before the watermark moved replays the same beats
+            db.session.delete(db.session.get(AggregationWatermark, WATERMARK))
+            db.session.commit()
+            compact_heartbeats(now=BASE + timedelta(hours=1))
+            self.assertEqual(self.intervals(), expected)
+
+    def test_uptime_merges_uncompacted_beats(self):
+        now = BASE + timedelta(hours=1)
+        with app.app_context():
+            compact_heartbeats(now=now)
+            screen = db.session.get(Screen, self.screen_id)
+
+            report = screen_uptime(screen, BASE, now, now=now)
+            self.assertEqual(report['availability'], 5.0)
+            self.assertEqual([o['duration_seconds'] for o in report['outages']], [480, 2940])
+
+            # Past the watermark: read from the raw log, counts up to now
+            db.session.add(HeartbeatLog(screen_id=self.screen_id, status='online', timestamp=now - timedelta(seconds=10)))
+            db.session.commit()
+            report = screen_uptime(screen, BASE, now, now=now)
+            self.assertEqual(report['availability'], round(190 * 100 / 3600, 2))
+            self.assertEqual(report['outages'][-1]['end'], (now - timedelta(seconds=10)).isoformat())
+            self.assertEqual(len(report['buckets']), 1)
+
+    def test_uptime_endpoint(self):
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = str(self.user_id)
+            sess['_fresh'] = True
+
+        response = self.client.get(f'/api/screen/{self.screen_id}/uptime?period=week&days=14')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['period'], 'week')
+        self.assertTrue(data['buckets'])
+
+        response = self.client.get(f'/api/screen/{self.screen_id}/uptime?period=month')
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()